@@ -31,6 +31,15 @@ CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 NAMES_FILE = os.path.join(CURRENT_DIR, NAMES_FILENAME)
 NEW_NAMES_FILE = os.path.join(CURRENT_DIR, NEW_NAMES_FILENAME)
 
+# how long to trust a cached name --> zonefile hash mapping before asking blockstackd again
+NAME_CACHE_TIMEOUT = 10 * 60
+# how long to keep a profile resolved from a given zonefile (zonefiles themselves never expire)
+PROFILE_CACHE_TIMEOUT = 12 * 60 * 60
+# max entries in the in-process cache (used when memcached is not enabled)
+LRU_CACHE_SIZE = 10000
+# max names to resolve at once in a multi-name lookup
+BULK_RESOLVE_THREADS = 32
+
 try:
     from config_local import *
 except:
@@ -9,13 +9,17 @@
 
 import re
 import json
+import base64
+import hashlib
 import collections
+import threading
 import pylibmc
 import logging
 import xmlrpclib
 
 from flask import Flask, make_response, jsonify, abort, request
 from time import time
+from multiprocessing.pool import ThreadPool
 from basicrpc import Proxy
 
 from blockstack_proofs import profile_to_proofs, profile_v3_to_proofs
@@ -36,6 +40,8 @@ from .config import BLOCKSTACKD_IP, BLOCKSTACKD_PORT
 from .config import DHT_MIRROR_IP, DHT_MIRROR_PORT
 from .config import DEFAULT_NAMESPACE
 from .config import NAMES_FILE
+from .config import NAME_CACHE_TIMEOUT, PROFILE_CACHE_TIMEOUT, LRU_CACHE_SIZE
+from .config import BULK_RESOLVE_THREADS
 
 import requests
 requests.packages.urllib3.disable_warnings()
@@ -63,7 +69,84 @@ def get_mc_client():
 
     return mc
 
-mc = get_mc_client()
+class ThreadSafeCache(object):
+    """ Serializes access to a cache client that
+        isn't thread-safe (like pylibmc's)
+    """
+
+    def __init__(self, client):
+
+        self.client = client
+        self.lock = threading.Lock()
+
+    def get(self, key):
+
+        with self.lock:
+            return self.client.get(key)
+
+    def set(self, key, value, expires=0):
+
+        with self.lock:
+            return self.client.set(key, value, expires)
+
+mc = ThreadSafeCache(get_mc_client())
+
+
+class LRUCache(object):
+    """ In-process cache with the same get/set interface as the
+        memcached client, for when memcached isn't deployed
+    """
+
+    def __init__(self, max_size=LRU_CACHE_SIZE):
+
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires != 0 and expires <= time():
+                return None
+
+            # most recently used goes last
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, expires=0):
+        """ like memcached, expires is either 0 (never), a number of
+            seconds (up to 30 days), or an absolute timestamp
+        """
+
+        if expires != 0 and expires <= 30 * 24 * 60 * 60:
+            expires = time() + expires
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return True
+
+
+def get_profile_cache():
+    """ Return the cache for name and profile lookups:
+        memcached if it is enabled, or an in-process LRU otherwise
+    """
+
+    if MEMCACHED_ENABLED:
+        return mc
+
+    return LRUCache(LRU_CACHE_SIZE)
+
+profile_cache = get_profile_cache()
 
 
 def validName(name):
@@ -224,10 +307,41 @@ def resolve_zone_file_to_profile(zone_file, address_or_public_key):
     return profile, None
 
 
-def format_profile(profile, username, address, refresh=False):
+def resolve_zone_file_to_profile_cached(zone_file, address, zonefile_hash,
+                                        refresh=False):
+    """ resolve_zone_file_to_profile(), remembering the profile resolved
+        from this zonefile (by hash) for this owner address
+    """
+
+    if zonefile_hash is None:
+        return resolve_zone_file_to_profile(zone_file, address)
+
+    cache_key = "profile_" + str(zonefile_hash) + "_" + str(address)
+
+    if not refresh:
+        profile_cache_reply = profile_cache.get(cache_key)
+
+        if profile_cache_reply is not None:
+            log.debug("Cache hit profile: %s" % zonefile_hash)
+            return json.loads(profile_cache_reply)
+
+    resolved = resolve_zone_file_to_profile(zone_file, address)
+
+    if isinstance(resolved, tuple) and resolved[0] is not None:
+        log.debug("Cache set profile: %s" % zonefile_hash)
+        profile_cache.set(cache_key, json.dumps(resolved),
+                          int(time() + PROFILE_CACHE_TIMEOUT))
+
+    return resolved
+
+
+def format_profile(profile, username, address, refresh=False,
+                   zonefile_hash=None):
     """ Process profile data and
         1) Insert verifications
         2) Check if profile data is valid JSON
+        If zonefile_hash is given, the profile resolved from the
+        zonefile is cached under it.
     """
 
     data = {}
@@ -243,7 +357,9 @@ def format_profile(profile, username, address, refresh=False):
         return data
 
     try:
-        profile, error = resolve_zone_file_to_profile(profile, address)
+        profile, error = resolve_zone_file_to_profile_cached(profile, address,
+                                                             zonefile_hash,
+                                                             refresh=refresh)
     except:
         if 'message' in profile:
             data['profile'] = json.loads(profile)
@@ -280,57 +396,249 @@ def format_profile(profile, username, address, refresh=False):
     return data
 
 
+def get_zonefile_hash(zonefile_data):
+    """ Hash of a zonefile, as blockstackd calculates it (hash160)
+    """
+
+    return hashlib.new('ripemd160', hashlib.sha256(zonefile_data).digest()).hexdigest()
+
+
+def get_name_info(fqu, refresh=False):
+    """ Get a name's zonefile hash and owner address, from the
+        cache if possible or else from blockstack-server.
+        Return (name_info, None) on success
+        Return (None, HTTP status code) on error
+    """
+
+    if not refresh:
+        name_cache_reply = profile_cache.get("name_" + str(fqu))
+
+        if name_cache_reply is not None:
+            log.debug("Cache hit name: %s" % fqu)
+            return json.loads(name_cache_reply), None
+
+    try:
+        bs_client = Proxy(BLOCKSTACKD_IP, BLOCKSTACKD_PORT, timeout=10)
+        bs_resp = bs_client.get_name_blockchain_record(fqu)
+        bs_resp = bs_resp[0]
+
+    except:
+        return None, 500
+
+    if bs_resp is None or 'error' in bs_resp:
+        return None, 404
+
+    name_info = {}
+    name_info['value_hash'] = bs_resp.get('value_hash', None)
+    name_info['owner_address'] = bs_resp['address']
+
+    log.debug("Cache set name: %s" % fqu)
+    profile_cache.set("name_" + str(fqu), json.dumps(name_info),
+                      int(time() + NAME_CACHE_TIMEOUT))
+
+    return name_info, None
+
+
+def get_cached_zonefile(zonefile_hash):
+    """ Get a zonefile from the cache, by hash.
+        Return None if not cached
+    """
+
+    dht_cache_reply = profile_cache.get("zonefile_" + str(zonefile_hash))
+    if dht_cache_reply is None:
+        return None
+
+    log.debug("Cache hit zonefile: %s" % zonefile_hash)
+    return json.loads(dht_cache_reply)
+
+
+def cache_zonefile(zonefile_hash, dht_response):
+    """ Cache a zonefile by hash, for MEMCACHED_TIMEOUT seconds.
+        Only cache it if it really has that hash, since it
+        came from a DHT mirror we don't control.
+    """
+
+    if not isinstance(dht_response, basestring):
+        return
+
+    zonefile_data = dht_response
+    if isinstance(zonefile_data, unicode):
+        zonefile_data = zonefile_data.encode('utf-8')
+
+    if get_zonefile_hash(zonefile_data) != zonefile_hash:
+        log.debug("Zonefile does not match hash %s; not caching" % zonefile_hash)
+        return
+
+    log.debug("Cache set zonefile: %s" % zonefile_hash)
+    profile_cache.set("zonefile_" + str(zonefile_hash),
+                      json.dumps(dht_response),
+                      int(time() + MEMCACHED_TIMEOUT))
+
+
+def get_zonefile(zonefile_hash):
+    """ Get a name's zonefile by hash, from the cache if possible
+    """
+
+    if zonefile_hash is None:
+        return {"error": "Not found"}
+
+    dht_response = get_cached_zonefile(zonefile_hash)
+
+    if dht_response is None:
+        dht_response = fetch_from_dht(zonefile_hash)
+        cache_zonefile(zonefile_hash, dht_response)
+
+    return dht_response
+
+
 def get_profile(username, refresh=False, namespace=DEFAULT_NAMESPACE):
     """ Given a fully-qualified username (username.namespace)
         get the data associated with that fqu.
         Return cached entries, if possible.
-    """
 
-    global MEMCACHED_ENABLED
-    global mc
+        Names are cached as name --> zonefile hash (for NAME_CACHE_TIMEOUT),
+        and zonefiles and profiles are cached by zonefile hash, so a name
+        whose zonefile hash did not change is not re-fetched while cached.
+    """
 
     username = username.lower()
+    fqu = username + "." + namespace
 
-    if MEMCACHED_ENABLED and not refresh:
-        log.debug("Memcache get DHT: %s" % username)
-        dht_cache_reply = mc.get("dht_" + str(username))
-    else:
-        log.debug("Memcache disabled: %s" % username)
-        dht_cache_reply = None
+    name_info, error_code = get_name_info(fqu, refresh=refresh)
+
+    if error_code == 500:
+        abort(500, "Connection to blockstack-server %s:%s timed out" % (BLOCKSTACKD_IP, BLOCKSTACKD_PORT))
+
+    elif error_code is not None:
+        abort(error_code)
+
+    zonefile_hash = name_info['value_hash']
+    dht_response = get_zonefile(zonefile_hash)
+
+    data = format_profile(dht_response, username, name_info['owner_address'],
+                          refresh=refresh, zonefile_hash=zonefile_hash)
+
+    return data
 
-    if dht_cache_reply is None:
+
+def fetch_zonefiles_by_names(fqus):
+    """ Fetch the current zonefiles of a list of names from
+        blockstack-server, at most 100 names per request.
+        Return {fqu: zonefile} for the names it had zonefiles for.
+    """
+
+    zonefiles = {}
+
+    for i in xrange(0, len(fqus), 100):
+
+        batch = fqus[i:i+100]
 
         try:
             bs_client = Proxy(BLOCKSTACKD_IP, BLOCKSTACKD_PORT, timeout=10)
-            bs_resp = bs_client.get_name_blockchain_record(username + "." + namespace)
+            bs_resp = bs_client.get_zonefiles_by_names(batch)
             bs_resp = bs_resp[0]
 
-        except:
-            abort(500, "Connection to blockstack-server %s:%s timed out" % (BLOCKSTACKD_IP, BLOCKSTACKD_PORT))
+        except Exception as e:
+            log.debug("Failed to fetch zonefiles for %s names: %s" % (len(batch), e))
+            continue
 
         if bs_resp is None or 'error' in bs_resp:
-            abort(404)
+            continue
 
-        if 'value_hash' in bs_resp:
-            profile_hash = bs_resp['value_hash']
-            dht_response = fetch_from_dht(profile_hash)
+        for fqu, zonefile_b64 in bs_resp['zonefiles'].items():
+            zonefiles[fqu] = base64.b64decode(zonefile_b64)
 
-            dht_data = {}
-            dht_data['dht_response'] = dht_response
-            dht_data['owner_address'] = bs_resp['address']
+    return zonefiles
 
-            if MEMCACHED_ENABLED or refresh:
-                log.debug("Memcache set DHT: %s" % username)
-                mc.set("dht_" + str(username), json.dumps(dht_data),
-                       int(time() + MEMCACHED_TIMEOUT))
-        else:
-            dht_data = {"error": "Not found"}
-    else:
-        dht_data = json.loads(dht_cache_reply)
 
-    data = format_profile(dht_data['dht_response'], username, dht_data['owner_address'])
+def get_profiles(usernames, refresh=False, namespace=DEFAULT_NAMESPACE):
+    """ Get the data associated with many usernames at once.
+        Name records are looked up concurrently, all uncached zonefiles
+        are fetched with one get_zonefiles_by_names request (per 100 names),
+        and profiles are fetched from storage concurrently.
 
-    return data
+        Return {username: data} for all usernames, where the data
+        for a username that could not be resolved has an 'error'.
+    """
+
+    given_usernames = usernames
+    usernames = list(set([username.lower() for username in given_usernames]))
+    fqus = dict([(username, username + "." + namespace) for username in usernames])
+
+    if len(usernames) == 0:
+        return {}
+
+    pool = ThreadPool(min(len(usernames), BULK_RESOLVE_THREADS))
+
+    try:
+        name_infos = dict(zip(usernames, pool.map(
+            lambda username: get_name_info(fqus[username], refresh=refresh),
+            usernames)))
+
+        reply = {}
+        dht_responses = {}
+        missing = []
+
+        for username in usernames:
+
+            name_info, error_code = name_infos[username]
+
+            if error_code == 500:
+                reply[username] = {'error': "Connection to blockstack-server timed out"}
+
+            elif error_code is not None:
+                reply[username] = {'error': "Not found"}
+
+            elif name_info['value_hash'] is None:
+                dht_responses[username] = {"error": "Not found"}
+
+            else:
+                dht_response = get_cached_zonefile(name_info['value_hash'])
+
+                if dht_response is None:
+                    missing.append(username)
+                else:
+                    dht_responses[username] = dht_response
+
+        if len(missing) > 0:
+            zonefiles = fetch_zonefiles_by_names([fqus[username] for username in missing])
+
+            for username in missing:
+
+                zonefile_hash = name_infos[username][0]['value_hash']
+                zonefile = zonefiles.get(fqus[username], None)
+
+                # the name may have changed since we looked up its zonefile hash
+                if zonefile is not None and get_zonefile_hash(zonefile) == zonefile_hash:
+                    cache_zonefile(zonefile_hash, zonefile)
+                    dht_responses[username] = zonefile
+
+        def resolve(username):
+
+            name_info = name_infos[username][0]
+            dht_response = dht_responses.get(username, None)
+
+            try:
+                if dht_response is None:
+                    dht_response = get_zonefile(name_info['value_hash'])
+
+                return format_profile(dht_response, username,
+                                      name_info['owner_address'],
+                                      refresh=refresh,
+                                      zonefile_hash=name_info['value_hash'])
+
+            except Exception as e:
+                log.debug("Failed to resolve %s: %s" % (username, e))
+                return {'error': "Failed to resolve profile"}
+
+        resolvable = [username for username in usernames if username not in reply]
+        reply.update(dict(zip(resolvable, pool.map(resolve, resolvable))))
+
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict([(username, reply[username.lower()]) for username in given_usernames])
 
 
 def get_all_users():
@@ -386,17 +694,10 @@ def get_users(usernames):
         reply['error'] = "Invalid input format"
         return reply
 
-    for username in usernames:
-
-        try:
-            profile = get_profile(username, refresh=refresh)
-
-            if 'error' in profile:
-                pass
-            else:
-                reply[username] = profile
-        except:
-            pass
+    # as before, names that failed are left out of the reply
+    for username, profile in get_profiles(usernames, refresh=refresh).items():
+        if 'error' not in profile:
+            reply[username] = profile
 
     return reply
 
@@ -12,6 +12,7 @@ import os
 import sys
 import requests
 import json
+import time
 import unittest
 
 # Hack around absolute paths
@@ -20,7 +21,7 @@ parent_dir = os.path.abspath(current_dir + "/../")
 
 sys.path.insert(0, parent_dir)
 
-from resolver.server import app
+from resolver.server import app, LRUCache
 
 VERSION = '2'
 
@@ -104,6 +105,53 @@ class ResolverTestCase(unittest.TestCase):
             self.assertIn('error', reply, msg="resolver didn't give error on unregistered profile")
 
 
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        """ Check cache hits and misses
+        """
+        cache = LRUCache(max_size=2)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.set('a', 1))
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_eviction(self):
+        """ Check that the least recently used entry is evicted
+        """
+        cache = LRUCache(max_size=2)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expiry(self):
+        """ Check relative and absolute expiry times
+        """
+        cache = LRUCache(max_size=10)
+
+        cache.set('relative', 1, 60)
+        cache.set('absolute', 2, int(time.time() + 60))
+        cache.set('expired', 3, int(time.time() - 1))
+        cache.set('forever', 4, 0)
+
+        self.assertEqual(cache.get('relative'), 1)
+        self.assertEqual(cache.get('absolute'), 2)
+        self.assertIsNone(cache.get('expired'))
+        self.assertEqual(cache.get('forever'), 4)
+
+        # expired entries are dropped
+        self.assertNotIn('expired', cache.entries)
+
+
 if __name__ == '__main__':
 
     unittest.main()
\ No newline at end of file
@@ -25,6 +25,8 @@ This file is part of Search.
 
 import sys
 import json
+import time
+import hashlib
 import requests
 
 from proofchecker import profile_to_proofs
@@ -35,28 +37,30 @@ from pybitcoin import is_b58check_address
 
 from .db import search_db
 from .db import namespace
-from .db import twitter_index, facebook_index
-from .db import github_index, domain_index
+from .db import proofs_index
 from .db import proofs_cache
 
-from .config import SUPPORTED_PROOFS
+from .config import SUPPORTED_PROOFS, PROOFS_CACHE_TTL
+from .utils import get_json, config_log
+
+log = config_log(__name__)
+
+# services whose proofs are only indexed if the profile has a valid bitcoin address
+PROOFS_REQUIRE_BTC_ADDRESS = ['github', 'domain']
+
+TEST_DOMAIN_VERIFICATIONS = ['muneeb', 'blockstack', 'ryan']
 
 
 def flush_collection():
 
-    search_db.drop_collection('twitter_index')
-    search_db.drop_collection('facebook_index')
-    search_db.drop_collection('github_index')
-    search_db.drop_collection('domain_index')
+    search_db.drop_collection('proofs_index')
 
 
 def optimize_db():
 
-    twitter_index.ensure_index('twitter_handle')
-    facebook_index.ensure_index('facebook_username')
-    github_index.ensure_index('github_username')
-    domain_index.ensure_index('domain_url')
-    proofs_cache.ensure_index('username')
+    proofs_index.ensure_index([('service', 1), ('identifier', 1)])
+    proofs_index.ensure_index('username')
+    proofs_cache.ensure_index('key')
 
 
 def get_btc_address(profile):
@@ -82,213 +86,203 @@ def get_btc_address(profile):
         return None
 
 
-def get_proofs(username, profile):
+def content_hash(*args):
+    """ hash of the (JSON-serializable) args
+    """
 
-    check_proofs = proofs_cache.find_one({"username": username})
+    return hashlib.sha256(json.dumps(args, sort_keys=True)).hexdigest()
 
-    if check_proofs is None:
 
-        try:
-            proofs = profile_to_proofs(profile, username)
-        except:
-            proofs = []
+def get_cached_proof(key, verify):
+    """ look up a proof verification result by key,
+        or call verify() and cache its result.
+        only valid proofs are cached, and only for PROOFS_CACHE_TTL seconds,
+        since a proof can be taken down (or fail to load) at any time.
+        if verify() raises, nothing is cached.
+    """
 
-        new_entry = {}
-        new_entry['username'] = username
-        new_entry['proofs'] = proofs
-        proofs_cache.save(new_entry)
-    else:
-        print "hitting cache!"
-        proofs = check_proofs['proofs']
+    check_proof = proofs_cache.find_one({"key": key})
 
-    return proofs
+    if check_proof is not None and \
+       time.time() - check_proof.get('cached_at', 0) < PROOFS_CACHE_TTL:
+        return check_proof['proof']
 
+    proof = verify()
 
-def create_twitter_index():
+    if proof.get('valid'):
+        proofs_cache.update_one({"key": key},
+                                {"$set": {"key": key, "proof": proof,
+                                          "cached_at": time.time()}},
+                                upsert=True)
 
-    counter = 0
+    elif check_proof is not None:
+        proofs_cache.delete_one({"key": key})
 
-    for entry in namespace.find(no_cursor_timeout=True):
+    return proof
 
-        profile = json.loads(entry['profile'])
 
-        if 'twitter' in profile:
+def get_service_proof(username, service, claim):
+    """ verify a profile's proof for one service (twitter, facebook, github),
+        where claim is the profile's entry for that service.
+        a valid result is cached by proof URL and by the hash of the claim,
+        so a proof is only re-verified when it changes or its cache entry expires.
 
-            try:
-                twitter_handle = profile['twitter']
-            except:
-                continue
-
-            if 'proof' not in twitter_handle:
-                continue
+        returns {'service', 'identifier', 'valid'}, or None if the claim has no proof
+    """
 
-            proofs = get_proofs(entry['username'], profile)
-
-            for proof in proofs:
-                if 'service' in proof and proof['service'] == 'twitter':
-                    if proof['valid']:
-                        #print proof
-                        new_entry = {}
-                        new_entry['username'] = entry['username']
-                        new_entry['twitter_handle'] = proof['identifier'].lower()
-                        new_entry['profile'] = profile
-
-                        check_entry = twitter_index.find_one({"username": entry['username']})
+    try:
+        proof_url = claim['proof'].get('url', claim['proof'].get('id'))
+    except:
+        return None
 
-                        if check_entry is not None:
-                            print "already in index"
-                        else:
-                            print new_entry
-                            twitter_payment.save(new_entry)
+    def verify():
 
-                            counter += 1
-                            print counter
+        try:
+            proofs = profile_to_proofs({service: claim}, username)
+        except:
+            proofs = []
 
+        for proof in proofs:
+            if proof.get('service') == service:
+                return {'service': service,
+                        'identifier': proof['identifier'].lower(),
+                        'valid': proof['valid']}
 
-def create_facebook__index():
+        return {'service': service, 'identifier': None, 'valid': False}
 
-    counter = 0
+    key = "%s:%s" % (proof_url, content_hash(username, service, claim))
+    return get_cached_proof(key, verify)
 
-    for entry in namespace.find(no_cursor_timeout=True):
 
-        profile = json.loads(entry['profile'])
+def get_domain_proof(username, website_url):
+    """ verify a profile's website proof (a TXT record on the domain).
+        a valid result is cached by domain and by the hash of the TXT record.
 
-        if 'facebook' in profile:
+        returns {'service', 'identifier', 'valid'}
+    """
 
-            try:
-                facebook_username = profile['facebook']
-            except:
-                continue
+    domain = website_url.lstrip('https')
+    domain = domain.lstrip('://')
+    domain = domain.lstrip('www')
+    domain = domain.lstrip('.')
 
-            if 'proof' not in facebook_username:
-                continue
+    proof_txt = get_proof_from_txt_record(domain)
 
-            proofs = get_proofs(entry['username'], profile)
+    def verify():
 
-            for proof in proofs:
-                if 'service' in proof and proof['service'] == 'facebook':
-                    if proof['valid']:
-                        #print proof
-                        new_entry = {}
-                        new_entry['username'] = entry['username']
-                        new_entry['facebook_username'] = proof['identifier'].lower()
-                        new_entry['profile'] = profile
+        validProof = contains_valid_proof_statement(proof_txt, username)
 
-                        check_entry = facebook_payment.find_one({"username": entry['username']})
+        return {'service': 'domain',
+                'identifier': domain,
+                'valid': bool(validProof)}
 
-                        if check_entry is not None:
-                            print "already in index"
-                        else:
-                            print new_entry
-                            facebook_payment.save(new_entry)
+    key = "%s:%s" % (domain, content_hash(username, proof_txt))
+    return get_cached_proof(key, verify)
 
-                            counter += 1
-                            print counter
 
+def get_valid_proofs(username, profile):
+    """ find the (service, identifier) pairs a profile has valid proofs for
+    """
 
-def create_github_proofs_index():
+    valid_proofs = set()
+    btc_address = get_btc_address(profile)
 
-    counter = 0
+    for service in SUPPORTED_PROOFS:
 
-    for entry in namespace.find(no_cursor_timeout=True):
-
-        profile = json.loads(entry['profile'])
-
-        btc_address = get_btc_address(profile)
-
-        # if no valid btc address, ignore
-        if btc_address is None:
+        if service in PROOFS_REQUIRE_BTC_ADDRESS and btc_address is None:
             continue
 
-        if 'github' in profile:
+        if service == 'domain':
 
-            try:
-                github_username = profile['github']
-            except:
+            if username not in TEST_DOMAIN_VERIFICATIONS or 'website' not in profile:
                 continue
 
-            if 'proof' not in github_username:
+            try:
+                proof = get_domain_proof(username, profile['website'])
+            except Exception as e:
+                log.debug("Failed to check domain proof for %s: %s" % (username, e))
                 continue
 
-            proofs = get_proofs(entry['username'], profile)
+        else:
 
-            for proof in proofs:
-                if 'service' in proof and proof['service'] == 'github':
-                    if proof['valid']:
-                        #print proof
-                        new_entry = {}
-                        new_entry['username'] = entry['username']
-                        new_entry['github_username'] = proof['identifier'].lower()
-                        new_entry['profile'] = profile
+            if service not in profile:
+                continue
 
-                        check_entry = github_payment.find_one({"username": entry['username']})
+            claim = profile[service]
 
-                        if check_entry is not None:
-                            print "already in index"
-                        else:
-                            print new_entry
-                            github_payment.save(new_entry)
+            if not isinstance(claim, dict) or 'proof' not in claim:
+                continue
 
-                            counter += 1
-                            print counter
+            proof = get_service_proof(username, service, claim)
 
+        if proof is not None and proof['valid']:
+            valid_proofs.add((proof['service'], proof['identifier']))
 
-def create_domain_proofs_index():
+    return valid_proofs
 
-    TEST_DOMAIN_VERIFICATIONS = ['muneeb', 'blockstack', 'ryan']
 
-    counter = 0
+def update_proofs_index(username, profile, valid_proofs):
+    """ make the index entries for a username match its valid proofs
+    """
 
-    for entry in namespace.find(no_cursor_timeout=True):
+    indexed_proofs = set()
 
-        if entry['username'] not in TEST_DOMAIN_VERIFICATIONS:
-            continue
+    for entry in proofs_index.find({"username": username}):
+        indexed_proofs.add((entry['service'], entry['identifier']))
 
-        profile = json.loads(entry['profile'])
+    for (service, identifier) in indexed_proofs - valid_proofs:
+        proofs_index.delete_many({"service": service,
+                                  "identifier": identifier,
+                                  "username": username})
 
-        btc_address = get_btc_address(profile)
+    for (service, identifier) in valid_proofs:
 
-        # if no valid btc address, ignore
-        if btc_address is None:
-            continue
+        new_entry = {}
+        new_entry['service'] = service
+        new_entry['identifier'] = identifier
+        new_entry['username'] = username
+        new_entry['profile'] = profile
 
-        if 'website' in profile:
+        proofs_index.update_one({"service": service,
+                                 "identifier": identifier,
+                                 "username": username},
+                                {"$set": new_entry},
+                                upsert=True)
 
-            try:
-                website_url = profile['website']
-            except:
-                continue
 
-            print website_url
+def create_proofs_index():
+    """ build (or bring up to date) the index from (proof service, identifier)
+        to usernames, in one pass over the namespace
+    """
 
-            domain = website_url.lstrip('https')
-            domain = domain.lstrip('://')
-            domain = domain.lstrip('www')
-            domain = domain.lstrip('.')
+    counter = 0
+    seen_usernames = set()
 
-            print domain
+    for entry in namespace.find(no_cursor_timeout=True):
 
-            proof_txt = get_proof_from_txt_record(domain)
+        username = entry['username']
+        seen_usernames.add(username)
 
-            validProof = contains_valid_proof_statement(proof_txt, entry['username'])
+        profile = get_json(entry['profile'])
 
-            if validProof:
+        if not isinstance(profile, dict):
+            continue
+
+        valid_proofs = get_valid_proofs(username, profile)
+        update_proofs_index(username, profile, valid_proofs)
 
-                new_entry = {}
-                new_entry['username'] = entry['username']
-                new_entry['domain_url'] = domain
-                new_entry['profile'] = profile
+        counter += 1
+        if counter % 1000 == 0:
+            log.debug("Processed entries: %s" % counter)
 
-                check_entry = domain_payment.find_one({"username": entry['username']})
+    # drop names that are no longer in the namespace
+    for username in proofs_index.distinct('username'):
+        if username not in seen_usernames:
+            proofs_index.delete_many({"username": username})
 
-                if check_entry is not None:
-                    print "already in index"
-                else:
-                    print new_entry
-                    domain_payment.save(new_entry)
+    optimize_db()
 
-                    counter += 1
-                    print counter
+    log.debug("Created proofs index from %s entries" % counter)
 
 
 def validProofQuery(query):
@@ -332,25 +326,14 @@ def search_proofs(query):
     except:
         return data
 
-    if query_type == 'twitter':
-
-        check_entry = twitter_payment.find({"twitter_handle": query_keyword})
-        return format_results(check_entry)
-
-    elif query_type == 'facebook':
-
-        check_entry = facebook_payment.find({"facebook_username": query_keyword})
-        return format_results(check_entry)
-
-    elif query_type == 'github':
+    if query_type not in SUPPORTED_PROOFS:
+        return data
 
-        check_entry = github_payment.find({"github_username": query_keyword})
-        return format_results(check_entry)
+    check_entry = proofs_index.find({"service": query_type,
+                                     "identifier": query_keyword})
 
-    elif query_type == 'domain':
+    return format_results(check_entry)
 
-        check_entry = domain_payment.find({"domain_url": query_keyword})
-        return format_results(check_entry)
 
 if __name__ == "__main__":
 
@@ -366,17 +349,8 @@ if __name__ == "__main__":
     elif(option == '--optimize'):
         optimize_db()
 
-    elif(option == '--create_twitter'):
-        create_twitter_proofs_index()
-
-    elif(option == '--create_facebook'):
-        create_facebook_proofs_index()
-
-    elif(option == '--create_github'):
-        create_github_proofs_index()
-
-    elif(option == '--create_domain'):
-        create_domain_proofs_index()
+    elif(option == '--create_index'):
+        create_proofs_index()
 
     else:
         print "Usage error"
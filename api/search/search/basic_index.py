@@ -30,7 +30,7 @@ import requests
 from pymongo import MongoClient
 
 from .utils import validUsername
-from .utils import get_json, config_log
+from .utils import get_json, config_log, read_profile_data
 
 from .config import BLOCKCHAIN_DATA_FILE, PROFILE_DATA_FILE
 
@@ -46,19 +46,15 @@ log = config_log(__name__)
 
 def fetch_profile_data_from_file():
     """ takes profile data from file and saves in the profile_data DB
+        (the file is read one entry at a time)
     """
 
-    profile_data_file = open(PROFILE_DATA_FILE, 'r')
-
-    profiles = profile_data_file.read()
-    profiles = json.loads(profiles)
-
     counter = 0
 
     log.debug("-" * 5)
     log.debug("Fetching profile data from file")
 
-    for entry in profiles:
+    for entry in read_profile_data(PROFILE_DATA_FILE):
 
         new_entry = {}
         new_entry['key'] = entry['fqu']
@@ -71,8 +67,6 @@ def fetch_profile_data_from_file():
         if counter % 1000 == 0:
             log.debug("Processed entries: %s" % counter)
 
-    profile_data_file.close()
-
     profile_data.ensure_index('key')
 
     return
@@ -34,12 +34,17 @@ DEFAULT_PORT = 5000
 DEFAULT_HOST = '127.0.0.1'
 
 BULK_INSERT_LIMIT = 1000
+PROFILE_CRAWL_THREADS = 10      # number of names to fetch profiles for at once
 DEFAULT_LIMIT = 50
 MEMCACHED_TIMEOUT = 6 * 60 * 60
 
+# how often (in seconds) to check the search cache for a new
+# name/twitter/username list to load into the prefix index
+SEARCH_INDEX_REFRESH_INTERVAL = 60
+
 
 BLOCKCHAIN_DATA_FILENAME = "data/blockchain_data.json"
-PROFILE_DATA_FILENAME = "data/profile_data.json"
+PROFILE_DATA_FILENAME = "data/profile_data.jsonl"     # one JSON object per line
 
 current_dir = os.path.abspath(os.path.dirname(__file__))
 parent_dir = os.path.abspath(current_dir + "/../")
@@ -47,6 +52,7 @@ BLOCKCHAIN_DATA_FILE = os.path.join(parent_dir, BLOCKCHAIN_DATA_FILENAME)
 PROFILE_DATA_FILE = os.path.join(parent_dir, PROFILE_DATA_FILENAME)
 
 SUPPORTED_PROOFS = ['twitter', 'facebook', 'github', 'domain']
+PROOFS_CACHE_TTL = 24 * 60 * 60     # re-verify a cached valid proof after this many seconds
 
 try:
     # to overrite things like MEMCACHED_ENABLED
@@ -37,11 +37,12 @@ search_profiles = search_db.profiles
 people_cache = search_cache.people_cache
 twitter_cache = search_cache.twitter_cache
 username_cache = search_cache.username_cache
-proofs_cache = search_cache.proofs_cache
 
 # these are used by attribute_search
-twitter_index = search_db.twitter_index
-facebook_index = search_db.facebook_index
-github_index = search_db.github_index
-domain_index = search_db.domain_index
+proofs_index = search_db.proofs_index
 payment_index = search_db.payment_index
+
+# proof verification results; kept in their own db so that
+# flushing the search db/cache doesn't cause proofs to be re-verified
+proofs_db = client['proofs_db']
+proofs_cache = proofs_db.proofs_cache
@@ -23,16 +23,20 @@ This file is part of Blockstack.
     along with Blockstack. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import sys
 import json
+import threading
+import Queue
 
 from .utils import validUsername
-from .utils import get_json, config_log
+from .utils import get_json, config_log, read_profile_data
 
 from .config import BLOCKCHAIN_DATA_FILE, PROFILE_DATA_FILE
+from .config import PROFILE_CRAWL_THREADS
 
-from blockstack_client.proxy import get_all_names
-from blockstack_client.profile import get_name_profile
+from blockstack_client.proxy import get_all_names, get_name_blockchain_record
+from blockstack_client.profile import get_profile
 
 log = config_log(__name__)
 
@@ -52,13 +56,54 @@ def fetch_namespace():
     return
 
 
-def fetch_profiles():
+def fetch_profile_entry(fqu, known_zonefile_hashes):
+    """
+        Fetch the profile for a name.
+        Return the profile data entry on success
+        Return False if the name's zonefile hash is in known_zonefile_hashes
+        (i.e. we already have its current profile)
+        Return None on error
+    """
+
+    try:
+        name_record = get_name_blockchain_record(fqu)
+        if name_record is None or 'error' in name_record:
+            return None
+
+        zonefile_hash = name_record.get('value_hash', None)
+        if zonefile_hash is not None and known_zonefile_hashes.get(fqu) == zonefile_hash:
+            return False
+
+        profile = get_profile(fqu, name_record=name_record, use_legacy=True)[0]
+        if profile is None:
+            return None
+
+    except Exception as e:
+        log.debug("Failed to fetch profile for %s: %s" % (fqu, e))
+        return None
+
+    entry = {}
+    entry['fqu'] = fqu
+    entry['zonefile_hash'] = zonefile_hash
+    entry['profile'] = profile
+
+    return entry
+
+
+def fetch_profiles(incremental=False, num_threads=PROFILE_CRAWL_THREADS):
     """
         Fetch profile data using Blockstack Core and save the data.
-        Data is saved in: data/profile_data.json
-        Format of the data is <fqu, profile>
+        Data is saved in: data/profile_data.jsonl
+        Each line is a JSON object with <fqu, zonefile_hash, profile>
         * fqu: fully-qualified name
+        * zonefile_hash: hash of the zonefile the profile was found through
         * profile: json profile data
+
+        Profiles are fetched by a pool of num_threads workers, and written
+        out as they arrive.  If incremental is True, then only the profiles
+        of names whose zonefile hash changed since the last fetch are fetched;
+        the others, and the ones we fail to fetch this time, are carried over
+        from the existing data file.
     """
 
     fin = open(BLOCKCHAIN_DATA_FILE, 'r')
@@ -67,29 +112,72 @@ def fetch_profiles():
 
     all_names = json.loads(file)
 
-    all_profiles = []
+    known_zonefile_hashes = {}
+    if incremental:
+        for entry in read_profile_data(PROFILE_DATA_FILE):
+            known_zonefile_hashes[entry['fqu']] = entry.get('zonefile_hash')
 
-    counter = 0
+        log.debug("Have profiles for %s names" % len(known_zonefile_hashes))
+
+    tmp_path = PROFILE_DATA_FILE + ".tmp"
+    fout = open(tmp_path, 'w')
+
+    name_queue = Queue.Queue(maxsize=num_threads * 10)
+    lock = threading.Lock()
+    carry_over = set()
+    counts = {'processed': 0, 'fetched': 0, 'failed': 0}
+
+    def worker():
+        while True:
+            fqu = name_queue.get()
+            if fqu is None:
+                break
+
+            entry = fetch_profile_entry(fqu, known_zonefile_hashes)
+
+            with lock:
+                if entry is False:
+                    carry_over.add(fqu)
+
+                elif entry is None:
+                    # keep the last good profile, if we have one
+                    counts['failed'] += 1
+                    if fqu in known_zonefile_hashes:
+                        carry_over.add(fqu)
+
+                else:
+                    fout.write(json.dumps(entry) + "\n")
+                    counts['fetched'] += 1
+
+                counts['processed'] += 1
+                if counts['processed'] % 100 == 0:
+                    log.debug("Processed %s names (%s fetched)" % (counts['processed'], counts['fetched']))
+
+    workers = [threading.Thread(target=worker) for i in xrange(0, num_threads)]
+    for t in workers:
+        t.daemon = True
+        t.start()
 
     for fqu in all_names:
+        name_queue.put(fqu)
 
-        resp = {}
-        resp['fqu'] = fqu
+    for t in workers:
+        name_queue.put(None)
 
-        try:
-            resp['profile'] = get_name_profile(fqu)[0]
-            all_profiles.append(resp)
-        except:
-            pass
+    for t in workers:
+        t.join()
 
-        counter += 1
-        if counter % 100 == 0:
-            print counter
+    # carry over the profiles that did not change (or that we failed to refetch)
+    if len(carry_over) > 0:
+        for entry in read_profile_data(PROFILE_DATA_FILE):
+            if entry['fqu'] in carry_over:
+                fout.write(json.dumps(entry) + "\n")
+                carry_over.discard(entry['fqu'])
 
-    fout = open(PROFILE_DATA_FILE, 'w')
-    fout.write(json.dumps(all_profiles))
     fout.close()
+    os.rename(tmp_path, PROFILE_DATA_FILE)
 
+    log.debug("Fetched %s profiles for %s names (%s failed)" % (counts['fetched'], counts['processed'], counts['failed']))
     return
 
 
@@ -109,5 +197,9 @@ if __name__ == "__main__":
         # Step 2
         fetch_profiles()
 
+    elif(option == '--fetch_profiles_incremental'):
+        # Step 2, re-fetching only changed profiles
+        fetch_profiles(incremental=True)
+
     else:
         print "Usage error"
@@ -30,6 +30,9 @@ This file is part of Search.
 import os
 import sys
 import json
+import time
+import bisect
+import threading
 
 
 current_dir =  os.path.abspath(os.path.dirname(__file__))
@@ -39,7 +42,10 @@ sys.path.insert(0, parent_dir)
 from search.db import search_db, search_profiles
 from search.db import search_cache
 
-from search.config import DEFAULT_LIMIT
+from search.config import DEFAULT_LIMIT, SEARCH_INDEX_REFRESH_INTERVAL
+from search.utils import config_log
+
+log = config_log(__name__)
 
 
 def anyword_substring_search_inner(query_word, target_words):
@@ -109,32 +115,240 @@ def substring_search(query, list_of_strings, limit_results=DEFAULT_LIMIT):
     return matching
 
 
-def search_people_by_name(query, limit_results=DEFAULT_LIMIT):
+class PrefixIndex(object):
+    """ resident index from the words of a set of strings
+        (names, twitter handles or usernames) to the strings,
+        for answering multi-word prefix queries without a scan
+    """
 
-    query = query.lower()
+    def __init__(self):
 
-    people_names = []
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
 
-    # using mongodb as a cache, load data in people_names
-    for i in search_cache.people_cache.find():
-        people_names += i['name']
+        self.strings = []       # string ID --> string (None if removed)
+        self.string_ids = {}    # string --> string ID
+        self.postings = {}      # word --> set of string IDs
+        self.words = []         # sorted words, for prefix lookups
 
-    results = substring_search(query, people_names, limit_results)
+        # identifies the search cache contents we last loaded
+        self.signature = None
+        self.last_check = 0
+        self.refresh_thread = None
 
-    return order_search_results(query, results)
+    def update(self, strings):
+        """ add the strings we don't have, and drop the ones not given
+        """
 
+        strings = set(strings)
 
-def search_people_by_twitter(query, limit_results=DEFAULT_LIMIT):
+        with self.lock:
+
+            removed = [s for s in self.string_ids if s not in strings]
+            added = [s for s in strings if s not in self.string_ids]
+
+            if len(removed) > len(self.string_ids) / 2:
+                # cheaper to start over than to leave behind lots of dead IDs
+                self.strings = []
+                self.string_ids = {}
+                self.postings = {}
+                self.words = []
+                removed = []
+                added = list(strings)
+                words_changed = True
+
+            else:
+                words_changed = False
+
+            for s in removed:
+
+                string_id = self.string_ids.pop(s)
+                self.strings[string_id] = None
+
+                for word in set(s.split(' ')):
+                    self.postings[word].discard(string_id)
+
+                    if len(self.postings[word]) == 0:
+                        del self.postings[word]
+                        words_changed = True
+
+            for s in added:
+
+                string_id = len(self.strings)
+                self.strings.append(s)
+                self.string_ids[s] = string_id
+
+                for word in set(s.split(' ')):
+                    if word not in self.postings:
+                        self.postings[word] = set()
+                        words_changed = True
+
+                    self.postings[word].add(string_id)
+
+            if words_changed:
+                self.words = sorted(self.postings.keys())
+
+        return len(added), len(removed)
+
+    def prefix_words(self, prefix):
+        """ all indexed words that start with prefix (lock must be held)
+        """
+
+        i = bisect.bisect_left(self.words, prefix)
+
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            yield self.words[i]
+            i += 1
+
+    def search(self, query, limit_results=DEFAULT_LIMIT):
+        """ find the strings in which every query word is a prefix of some word.
+            results are ranked by where the first query word matches
+            (first word, then second word, then anywhere; see order_search_results())
+            and then by length
+        """
+
+        query_words = [w for w in query.split(' ') if len(w) > 0]
+
+        with self.lock:
+
+            if len(query_words) == 0:
+                matching = [s for s in self.strings if s is not None]
+
+            else:
+                # look up the longest word (fewest candidates),
+                # and check the rest against the candidates
+                lookup_words = sorted(query_words, key=len, reverse=True)
+
+                candidate_ids = set()
+                for word in self.prefix_words(lookup_words[0]):
+                    candidate_ids.update(self.postings[word])
+
+                matching = []
+                for string_id in candidate_ids:
+                    s = self.strings[string_id]
+
+                    if anyword_substring_search(s.split(' '), lookup_words[1:]):
+                        matching.append(s)
+
+        first_word = query_words[0] if len(query_words) > 0 else ''
+
+        def rank(s):
+            target_words = s.split(' ')
+
+            if target_words[0].startswith(first_word):
+                tier = 0
+            elif len(target_words) > 1 and target_words[1].startswith(first_word):
+                tier = 1
+            else:
+                tier = 2
+
+            return (tier, len(s), s)
+
+        matching.sort(key=rank)
+        return matching[:limit_results]
+
+    def refresh(self, collection, key):
+        """ (re)load the index from a search cache collection,
+            if it has changed since we last loaded it.
+            only the first load happens in the caller; after that,
+            the check runs in a background thread and searches
+            keep using the current index until it finishes
+        """
+
+        if self.signature is None:
+            with self.refresh_lock:
+                if self.signature is None:
+                    self.reload(collection, key)
+
+            return
+
+        if time.time() - self.last_check < SEARCH_INDEX_REFRESH_INTERVAL:
+            return
+
+        if not self.refresh_lock.acquire(False):
+            # another request is already refreshing
+            return
+
+        self.last_check = time.time()
+
+        self.refresh_thread = threading.Thread(target=self.background_reload, args=(collection, key))
+        self.refresh_thread.daemon = True
+        self.refresh_thread.start()
+
+    def background_reload(self, collection, key):
+        """ reload in a refresh thread (refresh_lock must be held,
+            and is released when done)
+        """
+
+        try:
+            self.reload(collection, key)
+
+        except Exception as e:
+            log.exception(e)
+
+        finally:
+            self.refresh_lock.release()
+
+    def reload(self, collection, key):
+        """ reload the index if the collection has changed
+            (refresh_lock must be held)
+        """
+
+        self.last_check = time.time()
+
+        # each run of create_search_index() adds a document
+        # (and a flush drops them all)
+        last_entry = collection.find_one(sort=[('_id', -1)])
+        signature = (collection.count(), last_entry['_id'] if last_entry is not None else None)
+
+        if signature == self.signature:
+            return
+
+        strings = []
+        for i in collection.find():
+            strings += i[key]
+
+        added, removed = self.update(strings)
+        self.signature = signature
+
+        log.debug("Prefix index for %s: %s added, %s removed" % (key, added, removed))
+
+
+SEARCH_INDEXES = {}
+SEARCH_INDEXES_LOCK = threading.Lock()
+
+
+def get_search_index(collection, key):
+    """ get the prefix index over a search cache collection, loading
+        or refreshing it as needed
+    """
+
+    with SEARCH_INDEXES_LOCK:
+        if key not in SEARCH_INDEXES:
+            SEARCH_INDEXES[key] = PrefixIndex()
+
+        index = SEARCH_INDEXES[key]
+
+    index.refresh(collection, key)
+    return index
+
+
+def search_people_by_name(query, limit_results=DEFAULT_LIMIT):
 
     query = query.lower()
 
-    twitter_handles = []
+    index = get_search_index(search_cache.people_cache, 'name')
+    results = index.search(query, limit_results)
 
-    # using mongodb as a cache, load data
-    for i in search_cache.twitter_cache.find():
-        twitter_handles += i['twitter_handle']
+    return order_search_results(query, results)
 
-    results = substring_search(query, twitter_handles, limit_results)
+
+def search_people_by_twitter(query, limit_results=DEFAULT_LIMIT):
+
+    query = query.lower()
+
+    index = get_search_index(search_cache.twitter_cache, 'twitter_handle')
+    results = index.search(query, limit_results)
 
     return results
 
@@ -143,13 +357,8 @@ def search_people_by_username(query, limit_results=DEFAULT_LIMIT):
 
     query = query.lower()
 
-    usernames = []
-
-    # using mongodb as a cache, load data
-    for i in search_cache.username_cache.find():
-        usernames += i['username']
-
-    results = substring_search(query, usernames, limit_results)
+    index = get_search_index(search_cache.username_cache, 'username')
+    results = index.search(query, limit_results)
 
     return results
 
@@ -23,6 +23,7 @@ This file is part of Search.
     along with Search. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import json
 import re
 
@@ -100,3 +101,21 @@ def validUsername(username):
         return True
     else:
         return False
+
+
+def read_profile_data(path):
+    """
+        Stream the entries of a profile data file (see fetch_data.fetch_profiles()),
+        one at a time.
+    """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'r') as fin:
+        for line in fin:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            yield json.loads(line)
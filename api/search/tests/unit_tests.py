@@ -26,6 +26,10 @@ This file is part of Search.
 import os
 import sys
 import json
+import shutil
+import time
+import tempfile
+import threading
 import unittest
 
 from pymongo import MongoClient
@@ -36,6 +40,10 @@ parent_dir = os.path.abspath(current_dir + "/../")
 sys.path.insert(0, parent_dir)
 
 from search.db_index import namespace
+from search.substring_search import PrefixIndex
+from search import fetch_data
+from search import attributes_index
+from search.utils import read_profile_data
 
 test_users = ['muneeb.id', 'fredwilson.id']
 
@@ -54,6 +62,332 @@ class SearchTestCase(unittest.TestCase):
             self.assertIsNotNone(entry['profile'], msg="Error in fetching profile")
 
 
+class PrefixIndexTestCase(unittest.TestCase):
+
+    def test_search(self):
+        """ Check multi-word prefix search and ranking
+        """
+
+        index = PrefixIndex()
+        self.assertEqual(index.update(['muneeb ali', 'ryan shea', 'ali muneeb']), (3, 0))
+
+        self.assertEqual(index.search('mu'), ['muneeb ali', 'ali muneeb'])
+        self.assertEqual(index.search('ali mu'), ['ali muneeb', 'muneeb ali'])
+        self.assertEqual(index.search('sh'), ['ryan shea'])
+        self.assertEqual(index.search('x'), [])
+
+    def test_update(self):
+        """ Check that updates add and drop strings
+        """
+
+        index = PrefixIndex()
+        index.update(['muneeb ali', 'ryan shea', 'jude nelson'])
+
+        self.assertEqual(index.update(['muneeb ali', 'ryan shea', 'guy lepage']), (1, 1))
+        self.assertEqual(index.search('ju'), [])
+        self.assertEqual(index.search('gu'), ['guy lepage'])
+
+    def test_update_reset(self):
+        """ Check searching after an update that rebuilds the index
+        """
+
+        index = PrefixIndex()
+        index.update(['muneeb ali'])
+        index.update([])
+
+        self.assertEqual(index.search('mu'), [])
+
+        index.update(['ryan shea'])
+        self.assertEqual(index.search('ry'), ['ryan shea'])
+        self.assertEqual(index.search('mu'), [])
+
+
+class FakeSearchCache(object):
+    """ stand-in for a search cache collection, whose find()
+        can be held up to simulate a slow database
+    """
+
+    def __init__(self, key, docs):
+        self.key = key
+        self.docs = docs
+        self.finds = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def count(self):
+        return len(self.docs)
+
+    def find_one(self, sort=None):
+        return self.docs[-1] if len(self.docs) > 0 else None
+
+    def find(self):
+        self.finds += 1
+        self.release.wait()
+        return list(self.docs)
+
+
+class PrefixIndexRefreshTestCase(unittest.TestCase):
+
+    def test_refresh(self):
+        """ Check that only the first load blocks, and that searches
+            use the current index while it reloads
+        """
+
+        collection = FakeSearchCache('name', [{'_id': 1, 'name': ['muneeb ali']}])
+
+        index = PrefixIndex()
+        index.refresh(collection, 'name')
+
+        self.assertIsNone(index.refresh_thread)
+        self.assertEqual(index.search('mu'), ['muneeb ali'])
+
+        # not due for a check
+        collection.docs.append({'_id': 2, 'name': ['ryan shea']})
+        index.refresh(collection, 'name')
+
+        self.assertIsNone(index.refresh_thread)
+        self.assertEqual(collection.finds, 1)
+
+        # due for a check, but the database is slow
+        collection.release.clear()
+        index.last_check = 0
+        index.refresh(collection, 'name')
+
+        refresh_thread = index.refresh_thread
+        self.assertIsNotNone(refresh_thread)
+        self.assertEqual(index.search('ry'), [])
+
+        # one refresh at a time
+        index.last_check = 0
+        index.refresh(collection, 'name')
+        self.assertIs(index.refresh_thread, refresh_thread)
+
+        collection.release.set()
+        refresh_thread.join()
+
+        self.assertEqual(collection.finds, 2)
+        self.assertEqual(index.search('ry'), ['ryan shea'])
+        self.assertEqual(index.search('mu'), ['muneeb ali'])
+
+    def test_refresh_error(self):
+        """ Check that a failed background reload keeps the current index
+            and lets a later refresh try again
+        """
+
+        collection = FakeSearchCache('name', [{'_id': 1, 'name': ['muneeb ali']}])
+
+        index = PrefixIndex()
+        index.refresh(collection, 'name')
+
+        collection.docs.append({'_id': 2, 'bad_key': []})
+        index.last_check = 0
+        index.refresh(collection, 'name')
+        index.refresh_thread.join()
+
+        self.assertEqual(index.search('mu'), ['muneeb ali'])
+
+        collection.docs[-1] = {'_id': 2, 'name': ['ryan shea']}
+        index.last_check = 0
+        index.refresh(collection, 'name')
+        index.refresh_thread.join()
+
+        self.assertEqual(index.search('ry'), ['ryan shea'])
+
+
+class FakeCollection(object):
+    """ stand-in for the few pymongo collection methods the indexers use
+    """
+
+    def __init__(self, docs=None):
+        self.docs = [dict(doc) for doc in (docs or [])]
+
+    def matches(self, doc, query):
+        return all(doc.get(k) == v for (k, v) in query.items())
+
+    def find(self, query={}, no_cursor_timeout=False):
+        return [dict(doc) for doc in self.docs if self.matches(doc, query)]
+
+    def find_one(self, query={}):
+        found = self.find(query)
+        return found[0] if len(found) > 0 else None
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if self.matches(doc, query):
+                doc.update(update['$set'])
+                return
+
+        if upsert:
+            doc = dict(query)
+            doc.update(update['$set'])
+            self.docs.append(doc)
+
+    def delete_one(self, query):
+        for doc in self.docs:
+            if self.matches(doc, query):
+                self.docs.remove(doc)
+                return
+
+    def delete_many(self, query):
+        self.docs = [doc for doc in self.docs if not self.matches(doc, query)]
+
+    def distinct(self, key):
+        return list(set(doc[key] for doc in self.docs if key in doc))
+
+    def ensure_index(self, *args, **kw):
+        pass
+
+
+class ProofsIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (attributes_index.namespace, attributes_index.proofs_index,
+                      attributes_index.proofs_cache, attributes_index.get_valid_proofs)
+
+        attributes_index.namespace = FakeCollection()
+        attributes_index.proofs_index = FakeCollection()
+        attributes_index.proofs_cache = FakeCollection()
+
+        # username --> set of (service, identifier)
+        self.valid_proofs = {}
+        attributes_index.get_valid_proofs = lambda username, profile: set(self.valid_proofs[username])
+
+    def tearDown(self):
+        (attributes_index.namespace, attributes_index.proofs_index,
+         attributes_index.proofs_cache, attributes_index.get_valid_proofs) = self.saved
+
+    def set_namespace(self, usernames):
+        attributes_index.namespace.docs = [{'username': username, 'profile': json.dumps({'name': username})}
+                                           for username in usernames]
+
+    def indexed_proofs(self):
+        return sorted((doc['username'], doc['service'], doc['identifier']) for doc in attributes_index.proofs_index.docs)
+
+    def test_create_incremental(self):
+        """ Check that rebuilding the index adds and removes only what changed,
+            and drops names that left the namespace
+        """
+
+        self.set_namespace(['alice.id', 'bob.id'])
+        self.valid_proofs = {'alice.id': [('twitter', 'alice'), ('github', 'alice')],
+                             'bob.id': [('twitter', 'bob')]}
+
+        attributes_index.create_proofs_index()
+        self.assertEqual(self.indexed_proofs(), [('alice.id', 'github', 'alice'), ('alice.id', 'twitter', 'alice'),
+                                                 ('bob.id', 'twitter', 'bob')])
+
+        self.assertEqual(attributes_index.search_proofs('twitter:Alice'), [{'username': 'alice.id', 'profile': {'name': 'alice.id'}}])
+
+        # alice drops a proof and adds one, bob leaves, carol arrives
+        self.set_namespace(['alice.id', 'carol.id'])
+        self.valid_proofs = {'alice.id': [('github', 'alice'), ('facebook', 'alice')],
+                             'carol.id': [('twitter', 'carol')]}
+
+        attributes_index.create_proofs_index()
+        self.assertEqual(self.indexed_proofs(), [('alice.id', 'facebook', 'alice'), ('alice.id', 'github', 'alice'),
+                                                 ('carol.id', 'twitter', 'carol')])
+
+        self.assertEqual(attributes_index.search_proofs('twitter:alice'), [])
+        self.assertEqual(attributes_index.search_proofs('twitter:bob'), [])
+
+    def test_cached_proof(self):
+        """ Check that a valid proof is cached, and verified again once it expires
+        """
+
+        verified = []
+        def verify():
+            verified.append(True)
+            return {'service': 'twitter', 'identifier': 'alice', 'valid': True}
+
+        proof = attributes_index.get_cached_proof('key', verify)
+        self.assertTrue(proof['valid'])
+        self.assertEqual(len(verified), 1)
+
+        # cache hit
+        self.assertEqual(attributes_index.get_cached_proof('key', verify), proof)
+        self.assertEqual(len(verified), 1)
+
+        # expired
+        attributes_index.proofs_cache.docs[0]['cached_at'] = time.time() - attributes_index.PROOFS_CACHE_TTL - 1
+
+        self.assertEqual(attributes_index.get_cached_proof('key', verify), proof)
+        self.assertEqual(len(verified), 2)
+        self.assertEqual(len(attributes_index.proofs_cache.docs), 1)
+
+        # refreshed
+        self.assertEqual(attributes_index.get_cached_proof('key', verify), proof)
+        self.assertEqual(len(verified), 2)
+
+    def test_invalid_proof(self):
+        """ Check that invalid results are not cached, and evict a stale valid one
+        """
+
+        results = [{'service': 'twitter', 'identifier': 'alice', 'valid': True}]
+        def verify():
+            return results[0]
+
+        attributes_index.get_cached_proof('key', verify)
+        self.assertEqual(len(attributes_index.proofs_cache.docs), 1)
+
+        # the proof was taken down
+        attributes_index.proofs_cache.docs[0]['cached_at'] = time.time() - attributes_index.PROOFS_CACHE_TTL - 1
+        results[0] = {'service': 'twitter', 'identifier': None, 'valid': False}
+
+        self.assertFalse(attributes_index.get_cached_proof('key', verify)['valid'])
+        self.assertEqual(attributes_index.proofs_cache.docs, [])
+
+        self.assertFalse(attributes_index.get_cached_proof('key', verify)['valid'])
+        self.assertEqual(attributes_index.proofs_cache.docs, [])
+
+        # verification errors are not cached either
+        def verify_error():
+            raise Exception("failed to load proof")
+
+        self.assertRaises(Exception, attributes_index.get_cached_proof, 'key2', verify_error)
+        self.assertEqual(attributes_index.proofs_cache.docs, [])
+
+
+class FetchProfilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (fetch_data.BLOCKCHAIN_DATA_FILE, fetch_data.PROFILE_DATA_FILE, fetch_data.fetch_profile_entry)
+
+        fetch_data.BLOCKCHAIN_DATA_FILE = os.path.join(self.tmpdir, 'blockchain_data.json')
+        fetch_data.PROFILE_DATA_FILE = os.path.join(self.tmpdir, 'profile_data.jsonl')
+
+        with open(fetch_data.BLOCKCHAIN_DATA_FILE, 'w') as f:
+            f.write(json.dumps(['changed.id', 'unchanged.id', 'flaky.id', 'new.id']))
+
+        with open(fetch_data.PROFILE_DATA_FILE, 'w') as f:
+            for fqu in ['changed.id', 'unchanged.id', 'flaky.id']:
+                f.write(json.dumps({'fqu': fqu, 'zonefile_hash': 'old', 'profile': {'name': 'old'}}) + "\n")
+
+    def tearDown(self):
+        fetch_data.BLOCKCHAIN_DATA_FILE, fetch_data.PROFILE_DATA_FILE, fetch_data.fetch_profile_entry = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_incremental(self):
+        """ Check that unchanged and unfetchable profiles are carried over
+        """
+
+        def fetch_profile_entry(fqu, known_zonefile_hashes):
+            if fqu == 'unchanged.id':
+                return False
+
+            if fqu in ['flaky.id', 'new.id']:
+                # lookup failed
+                return None
+
+            return {'fqu': fqu, 'zonefile_hash': 'new', 'profile': {'name': 'new'}}
+
+        fetch_data.fetch_profile_entry = fetch_profile_entry
+        fetch_data.fetch_profiles(incremental=True, num_threads=2)
+
+        profiles = dict([(entry['fqu'], entry['profile']['name']) for entry in read_profile_data(fetch_data.PROFILE_DATA_FILE)])
+        self.assertEqual(profiles, {'changed.id': 'new', 'unchanged.id': 'old', 'flaky.id': 'old'})
+
+
 if __name__ == '__main__':
 
     unittest.main()
@@ -33,6 +33,7 @@ import traceback
 import httplib
 import time
 import socket
+import select
 import math
 import random
 import shutil
@@ -42,6 +43,7 @@ import copy
 import atexit
 import threading
 import errno
+import Queue
 import blockstack_zones
 import keylib
 import base64
@@ -268,7 +270,50 @@ class BlockstackdRPCHandler(SimpleXMLRPCRequestHandler):
     """
     Dispatcher to properly instrument calls and do
     proper deserialization.
+
+    Connections are kept alive between requests, so clients
+    can pool them.  Only one request is served per call to handle():
+    the server waits for the next one on an idle connection without
+    holding a worker (see BlockstackdRPC.idle_connection_poller()).
     """
+    protocol_version = "HTTP/1.1"
+    timeout = config.RPC_KEEPALIVE_TIMEOUT
+
+    def handle(self):
+        """
+        Serve one request, and decide whether or not
+        the server can keep the connection open.
+        """
+        self.keep_alive = False
+        self.close_connection = 1
+        self.handle_one_request()
+
+        while not self.close_connection:
+            if getattr(self.server, 'idle_connections', None) is None:
+                # can't wait for the next request in the background
+                break
+
+            # the client may have sent more than one request at once,
+            # in which case we have the next one buffered already
+            rbuf = getattr(self.rfile, '_rbuf', None)
+            if rbuf is None or rbuf.tell() == 0:
+                self.keep_alive = True
+                break
+
+            self.handle_one_request()
+
+
+    def log_error(self, format, *args):
+        """
+        Clients that stall in the middle of a request time out;
+        don't report it as an error.
+        """
+        if format.startswith("Request timed out"):
+            log.debug("Closing stalled RPC connection from %s:%s" % (self.client_address[0], self.client_address[1]))
+            return
+
+        SimpleXMLRPCRequestHandler.log_error(self, format, *args)
+
     def _dispatch(self, method, params):
         try: 
             con_info = {
@@ -308,7 +353,18 @@ class BlockstackdRPCHandler(SimpleXMLRPCRequestHandler):
                 else:
                     log.debug("RPC %s(%s)" % ("rpc_" + str(method), params))
 
-            res = self.server.funcs["rpc_" + str(method)](*params, **con_info)
+            # don't let slow methods tie up every worker
+            method_limit = self.server.method_limits.get(str(method), None)
+            if method_limit is not None:
+                if not method_limit.acquire(False):
+                    log.warning("Too many concurrent calls to rpc_%s" % str(method))
+                    return json.dumps({'error': 'Server is busy; try again later'})
+
+            try:
+                res = self.server.funcs["rpc_" + str(method)](*params, **con_info)
+            finally:
+                if method_limit is not None:
+                    method_limit.release()
 
             # lol jsonrpc within xmlrpc
             ret = json.dumps(res)
@@ -329,10 +385,25 @@ class BlockstackdRPC( SimpleXMLRPCServer):
 
     Methods that start with rpc_* will be registered
     as RPC methods.
+
+    Requests are handed off to a fixed pool of worker
+    threads through a bounded queue, so one slow request
+    does not block everyone else.  Each request opens its
+    own read-only database handle via get_db_state().
+
+    Keep-alive connections do not hold a worker between
+    requests: once a request is served, the connection is
+    handed to a poller thread, which queues it again once the
+    client sends its next request, and closes it if it sits
+    idle for RPC_KEEPALIVE_TIMEOUT seconds.
     """
 
-    def __init__(self, host='0.0.0.0', port=config.RPC_SERVER_PORT, handler=BlockstackdRPCHandler ):
-        log.info("Listening on %s:%s" % (host, port))
+    # listen backlog
+    request_queue_size = config.RPC_MAX_QUEUE_LEN
+
+    def __init__(self, host='0.0.0.0', port=config.RPC_SERVER_PORT, handler=BlockstackdRPCHandler, num_workers=config.RPC_DEFAULT_WORKERS, max_queue_len=config.RPC_MAX_QUEUE_LEN, method_concurrency=config.RPC_METHOD_CONCURRENCY,
+                 keepalive_timeout=config.RPC_KEEPALIVE_TIMEOUT, max_idle_connections=config.RPC_MAX_IDLE_CONNECTIONS ):
+        log.info("Listening on %s:%s (%s workers)" % (host, port, num_workers))
         SimpleXMLRPCServer.__init__( self, (host, port), handler, allow_none=True )
 
         # register methods 
@@ -342,6 +413,180 @@ class BlockstackdRPC( SimpleXMLRPCServer):
                 if callable(method) or hasattr(method, '__call__'):
                     self.register_function( method )
 
+        # per-method concurrency limits
+        self.method_limits = {}
+        for (method_name, limit) in method_concurrency.items():
+            self.method_limits[method_name] = threading.BoundedSemaphore( limit )
+
+        # worker pool
+        self.num_workers = num_workers
+        self.request_queue = Queue.Queue( maxsize=max_queue_len )
+        self.workers = []
+        for i in xrange(0, num_workers):
+            worker = threading.Thread( target=self.process_request_worker, name="RPC worker %s" % i )
+            worker.daemon = True
+            worker.start()
+            self.workers.append( worker )
+
+        # idle keep-alive connections (only if we have workers to serve them)
+        self.idle_connections = None
+        self.idle_poller = None
+        if num_workers > 0:
+            self.keepalive_timeout = keepalive_timeout
+            self.max_idle_connections = max_idle_connections
+            self.idle_connections = {}      # socket => (client address, idle since)
+            self.idle_lock = threading.Lock()
+            self.idle_running = True
+            self.idle_wakeup_r, self.idle_wakeup_w = os.pipe()
+            self.idle_poller = threading.Thread( target=self.idle_connection_poller, name="RPC idle connection poller" )
+            self.idle_poller.daemon = True
+            self.idle_poller.start()
+
+
+    def process_request(self, request, client_address):
+        """
+        Queue an accepted request for a worker.
+        Drop it if the queue is full.
+        Serve it in this thread if we have no workers.
+        """
+        if self.num_workers <= 0:
+            return SimpleXMLRPCServer.process_request( self, request, client_address )
+
+        try:
+            self.request_queue.put_nowait( (request, client_address) )
+        except Queue.Full:
+            log.warning("RPC request queue is full; dropping request from %s:%s" % (client_address[0], client_address[1]))
+            self.shutdown_request( request )
+
+
+    def process_request_worker(self):
+        """
+        Worker thread body: serve queued requests until
+        we dequeue None.
+        """
+        while True:
+            next_request = self.request_queue.get()
+            if next_request is None:
+                break
+
+            request, client_address = next_request
+            keep_alive = False
+            try:
+                keep_alive = self.finish_request( request, client_address )
+            except:
+                self.handle_error( request, client_address )
+            finally:
+                if keep_alive:
+                    self.idle_connection_add( request, client_address )
+                else:
+                    self.shutdown_request( request )
+
+
+    def finish_request(self, request, client_address):
+        """
+        Serve a request.
+        Return True if the connection should be kept open for the next one.
+        """
+        handler = self.RequestHandlerClass( request, client_address, self )
+        return getattr( handler, 'keep_alive', False )
+
+
+    def idle_connection_add(self, request, client_address):
+        """
+        Hand off a served keep-alive connection to the poller,
+        to wait for its next request.  Close it if we have
+        too many idle connections already.
+        """
+        with self.idle_lock:
+            added = self.idle_running and len(self.idle_connections) < self.max_idle_connections
+            if added:
+                self.idle_connections[request] = (client_address, time.time())
+
+        if not added:
+            log.debug("Not keeping RPC connection from %s:%s open" % (client_address[0], client_address[1]))
+            self.shutdown_request( request )
+            return
+
+        os.write( self.idle_wakeup_w, 'x' )
+
+
+    def idle_connection_poller(self):
+        """
+        Poller thread body: wait for idle keep-alive connections
+        to send their next request, and queue them for a worker.
+        Close connections that stay idle for too long.
+        """
+        while True:
+            with self.idle_lock:
+                if not self.idle_running:
+                    break
+
+                socks = self.idle_connections.keys()
+
+            try:
+                readable, _, _ = select.select( socks + [self.idle_wakeup_r], [], [], 1.0 )
+            except (select.error, socket.error), se:
+                if se.args[0] == errno.EINTR:
+                    continue
+
+                raise
+
+            if self.idle_wakeup_r in readable:
+                os.read( self.idle_wakeup_r, 4096 )
+
+            ready = []
+            expired = []
+            now = time.time()
+            with self.idle_lock:
+                for sock in readable:
+                    if sock in self.idle_connections:
+                        client_address, _ = self.idle_connections.pop(sock)
+                        ready.append( (sock, client_address) )
+
+                for (sock, (client_address, idle_since)) in self.idle_connections.items():
+                    if now - idle_since >= self.keepalive_timeout:
+                        del self.idle_connections[sock]
+                        expired.append( sock )
+
+            for sock in expired:
+                self.shutdown_request( sock )
+
+            for (sock, client_address) in ready:
+                # next request (or EOF) has arrived
+                self.process_request( sock, client_address )
+
+
+    def server_close(self):
+        """
+        Stop listening, stop the worker threads
+        once they have drained the queue, and
+        close idle connections.
+        """
+        SimpleXMLRPCServer.server_close( self )
+
+        for worker in self.workers:
+            self.request_queue.put( None )
+
+        for worker in self.workers:
+            worker.join()
+
+        self.workers = []
+
+        if self.idle_poller is not None:
+            with self.idle_lock:
+                self.idle_running = False
+
+            os.write( self.idle_wakeup_w, 'x' )
+            self.idle_poller.join()
+            self.idle_poller = None
+
+            for sock in self.idle_connections.keys():
+                self.shutdown_request( sock )
+
+            self.idle_connections = {}
+            os.close( self.idle_wakeup_r )
+            os.close( self.idle_wakeup_w )
+
 
     def analytics(self, event_type, event_payload):
         """
@@ -578,6 +823,63 @@ class BlockstackdRPC( SimpleXMLRPCServer):
         return self.success_response( {'count': count} )
 
 
+    def rpc_get_nameops_in_range( self, start_block, end_block, **con_info ):
+        """
+        Get the sequence of name and namespace operations in each block
+        in [start_block, end_block], as they were written (i.e. restored
+        to their historic forms, with their SNV consensus fields), in a
+        single pass over the name database.
+
+        A reply covers whole blocks, and stops early once it has at least
+        RPC_MAX_NAMEOPS_RANGE_OPS operations or RPC_MAX_NAMEOPS_RANGE_BLOCKS blocks.
+        The caller should ask again from 'next_block' until it passes end_block.
+
+        Returns {'status': True, 'blocks': [{'block_id': ..., 'nameops': [nameops]}], 'next_block': ...} on success
+        Returns {'error': ...} on error
+
+        Used by SNV clients and indexers.
+        """
+        if not is_indexer():
+            return {'error': 'Method not supported'}
+
+        if type(start_block) not in [int, long] or type(end_block) not in [int, long]:
+            return {'error': 'Invalid block range'}
+
+        if start_block < 0 or end_block < start_block:
+            return {'error': 'Invalid block range'}
+
+        end_block = min( end_block, start_block + RPC_MAX_NAMEOPS_RANGE_BLOCKS - 1 )
+        next_block = end_block + 1
+        num_nameops = 0
+        blocks = []
+
+        db = get_db_state()
+        try:
+            for (block_id, prior_records) in db.get_all_ops_in_range( start_block, end_block, include_history=True ):
+                nameops = []
+                for prior_record in prior_records:
+                    # restore SNV consensus information (outstanding preorders have no history)
+                    if not prior_record.has_key('history'):
+                        prior_record['history'] = {}
+
+                    restored_rec = blockstack_client.operations.nameop_restore_snv_consensus_fields( prior_record, block_id )
+                    del restored_rec['history']
+                    nameops.append( restored_rec )
+
+                blocks.append( {'block_id': block_id, 'nameops': nameops} )
+                num_nameops += len(nameops)
+
+                if num_nameops >= RPC_MAX_NAMEOPS_RANGE_OPS:
+                    next_block = block_id + 1
+                    break
+
+        finally:
+            db.close()
+
+        log.debug("%s name operations in %s blocks in [%s, %s)" % (num_nameops, len(blocks), start_block, next_block))
+        return self.success_response( {'blocks': blocks, 'next_block': next_block} )
+
+
     def rpc_get_nameops_hash_at( self, block_id, **con_info ):
         """
         Get the hash over the sequence of names and namespaces altered at the given block.
@@ -605,6 +907,7 @@ class BlockstackdRPC( SimpleXMLRPCServer):
         * last_block_processed: the last block processed
         * server_alive: True
         * [optional] zonefile_count: the number of zonefiles known
+        * [optional] zonefile_fetch_rate: zonefiles fetched per second, recently
         """
         if not is_indexer():
             return {'error': 'Method not supported'}
@@ -632,6 +935,9 @@ class BlockstackdRPC( SimpleXMLRPCServer):
         if conf.get('atlas', False):
             # return zonefile inv length 
             reply['zonefile_count'] = atlas_get_num_zonefiles()
+
+            # how fast are we fetching zonefiles from peers and storage?
+            reply['zonefile_fetch_rate'] = atlas_zonefile_fetch_rate()
         
         self.analytics("getinfo", {})
         return reply
@@ -1602,6 +1908,34 @@ class BlockstackdRPC( SimpleXMLRPCServer):
         return self.success_response( {'inv': base64.b64encode(zonefile_inv) } )
 
 
+    def rpc_get_zonefile_inventory_delta( self, epoch, seq, **con_info ):
+        """
+        Get the changes to our zonefile inventory since change number
+        `seq` of our inventory change log `epoch` (pass "" and 0 to
+        start following the change log).
+        Peers use this to keep our inventory up-to-date without
+        re-fetching all of it.
+
+        Return {'status': True, 'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': False, 'set': [...], 'cleared': [...]} on success,
+        where 'set' and 'cleared' are the bit indexes that were set and cleared, and 'inv_length' is the inventory's length in bytes.
+        Return {'status': True, 'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': True} if the changes are not available;
+        the caller should fetch the whole inventory, and then ask for changes since 'seq'.
+        Return {'error': ...} on error.
+        """
+        conf = get_blockstack_opts()
+        if not conf['atlas']:
+            return {'error': 'Not an atlas node'}
+
+        if type(epoch) not in [str, unicode] or len(epoch) > 16:
+            return {'error': 'Invalid epoch'}
+
+        if type(seq) not in [int, long] or seq < 0:
+            return {'error': 'Invalid sequence number'}
+
+        delta = atlas_get_zonefile_inventory_delta( str(epoch), seq )
+        return self.success_response( delta )
+
+
     def rpc_get_all_neighbor_info( self, **con_info ):
         """
         For network simulator purposes only!
@@ -1635,17 +1969,19 @@ class BlockstackdRPCServer( threading.Thread, object ):
     """
     RPC server thread
     """
-    def __init__(self, port ):
+    def __init__(self, port, num_workers=config.RPC_DEFAULT_WORKERS, max_queue_len=config.RPC_MAX_QUEUE_LEN ):
         super( BlockstackdRPCServer, self ).__init__()
         self.rpc_server = None
         self.port = port
+        self.num_workers = num_workers
+        self.max_queue_len = max_queue_len
 
 
     def run(self):
         """
         Serve until asked to stop
         """
-        self.rpc_server = BlockstackdRPC( port=self.port )
+        self.rpc_server = BlockstackdRPC( port=self.port, num_workers=self.num_workers, max_queue_len=self.max_queue_len )
         self.rpc_server.serve_forever()
 
 
@@ -1655,6 +1991,7 @@ class BlockstackdRPCServer( threading.Thread, object ):
         """
         if self.rpc_server is not None:
             self.rpc_server.shutdown()
+            self.rpc_server.server_close()
 
 
 class BlockstackStoragePusher( threading.Thread ):
@@ -1903,7 +2240,7 @@ class BlockstackStoragePusher( threading.Thread ):
         return
 
 
-def rpc_start( port ):
+def rpc_start( port, num_workers=config.RPC_DEFAULT_WORKERS, max_queue_len=config.RPC_MAX_QUEUE_LEN ):
     """
     Start the global RPC server thread
     """
@@ -1912,7 +2249,7 @@ def rpc_start( port ):
     # let everyone in this thread know the PID
     os.environ["BLOCKSTACK_RPC_PID"] = str(os.getpid())
 
-    rpc_server = BlockstackdRPCServer( port )
+    rpc_server = BlockstackdRPCServer( port, num_workers=num_workers, max_queue_len=max_queue_len )
 
     log.debug("Starting RPC")
     rpc_server.start()
@@ -2287,7 +2624,7 @@ def run_server( foreground=False, expected_snapshots=GENESIS_SNAPSHOT, port=None
     storage_start( blockstack_opts )
 
     # start API server
-    rpc_start(port)
+    rpc_start(port, num_workers=blockstack_opts.get('rpc_workers', config.RPC_DEFAULT_WORKERS), max_queue_len=blockstack_opts.get('rpc_queue_len', config.RPC_MAX_QUEUE_LEN))
     set_running( True )
 
     # clear any stale indexing state
@@ -2597,6 +2934,12 @@ def run_blockstackd():
    parser.add_argument(
       '--expected-snapshots', action='store',
       help='path to a .snapshots file with the expected consensus hashes')
+   parser.add_argument(
+      '--resume-dir', nargs='?',
+      help='the temporary directory to store the database state as it is being verified.  Blockstackd will resume working from this directory if it is interrupted.')
+   parser.add_argument(
+      '--prefetch-processes', action='store',
+      help='the number of worker processes that extract name operations from upcoming blocks (0 to disable)')
    parser.add_argument(
       '--port', action='store',
       help='port to bind on')
@@ -2641,6 +2984,9 @@ def run_blockstackd():
    parser.add_argument(
       '--resume-dir', nargs='?',
       help='the temporary directory to store the database state as it is being rebuilt.  Blockstackd will resume working from this directory if it is interrupted.')
+   parser.add_argument(
+      '--prefetch-processes', action='store',
+      help='the number of worker processes that extract name operations from upcoming blocks (0 to disable)')
 
    parser = subparsers.add_parser(
       'verifydb',
@@ -2705,6 +3051,13 @@ def run_blockstackd():
       'private_key', action='store',
       help='a private key to use to sign the snapshot')
 
+   parser = subparsers.add_parser(
+      'migrate_zonefiles',
+      help='move cached zonefiles into the packed zonefile store')
+   parser.add_argument(
+      '--remove-old', action='store_true',
+      help='delete the old zonefile files once they are packed')
+
    args, _ = argparser.parse_known_args()
 
    if args.action == 'version':
@@ -2789,7 +3142,11 @@ def run_blockstackd():
       if hasattr(args, 'resume_dir') and args.resume_dir is not None:
           resume_dir = args.resume_dir
 
-      final_consensus_hash = rebuild_database( int(args.end_block_id), args.db_path, start_block=int(args.start_block_id), resume_dir=resume_dir )
+      num_prefetch_processes = None
+      if args.prefetch_processes is not None:
+          num_prefetch_processes = int(args.prefetch_processes)
+
+      final_consensus_hash = rebuild_database( int(args.end_block_id), args.db_path, start_block=int(args.start_block_id), resume_dir=resume_dir, num_prefetch_processes=num_prefetch_processes )
       print "Rebuilt database in '%s'" % working_dir
       print "The final consensus hash is '%s'" % final_consensus_hash
 
@@ -2803,7 +3160,12 @@ def run_blockstackd():
           if expected_snapshots is None:
               sys.exit(1)
 
-      rc = verify_database( args.consensus_hash, int(args.block_id), args.db_path, working_db_path=working_db_path, expected_snapshots=expected_snapshots )
+      num_prefetch_processes = None
+      if args.prefetch_processes is not None:
+          num_prefetch_processes = int(args.prefetch_processes)
+
+      rc = verify_database( args.consensus_hash, int(args.block_id), args.db_path, working_db_path=working_db_path, expected_snapshots=expected_snapshots, \
+                            resume_dir=args.resume_dir, num_prefetch_processes=num_prefetch_processes )
       if rc:
           # success!
           print "Database is consistent with %s" % args.consensus_hash
@@ -2889,7 +3251,14 @@ def run_blockstackd():
 
       print "Synchronizing from snapshot.  This will take about 10-15 minutes."
 
-      rc = fast_sync_import(working_dir, url, public_keys=public_keys, num_required=num_required)
+      def _progress(num_bytes, total_bytes):
+          if total_bytes is not None:
+              sys.stderr.write("\rDownloaded {} of {} MB".format(num_bytes / (1024 * 1024), total_bytes / (1024 * 1024)))
+          else:
+              sys.stderr.write("\rDownloaded {} MB".format(num_bytes / (1024 * 1024)))
+
+      rc = fast_sync_import(working_dir, url, public_keys=public_keys, num_required=num_required, progress_callback=_progress)
+      sys.stderr.write("\n")
       if not rc:
           print 'fast_sync failed'
           sys.exit(1)
@@ -2898,6 +3267,16 @@ def run_blockstackd():
       print "Start your node with `blockstack-core start`"
       print "Pass `--debug` for extra output."
 
+   elif args.action == 'migrate_zonefiles':
+      # move zonefiles from the one-directory-per-zonefile layout into the packed store
+      zonefile_dir = get_zonefile_dir( working_dir )
+      if not os.path.exists(zonefile_dir):
+          print "No zonefiles in {}".format(working_dir)
+          sys.exit(0)
+
+      count = migrate_zonefile_dir_to_pack( zonefile_dir, remove_old=args.remove_old )
+      print "Migrated {} zonefiles".format(count)
+
 if __name__ == '__main__':
 
    run_blockstackd()
@@ -41,6 +41,8 @@ import errno
 import socket
 import gc
 import subprocess
+import Queue
+import collections
 
 import blockstack_zones
 import virtualchain
@@ -50,6 +52,7 @@ from blockstack_client.proxy import \
         ping as blockstack_ping, \
         getinfo as blockstack_getinfo, \
         get_zonefile_inventory as blockstack_get_zonefile_inventory, \
+        get_zonefile_inventory_delta as blockstack_get_zonefile_inventory_delta, \
         get_atlas_peers as blockstack_get_atlas_peers, \
         get_zonefiles as blockstack_get_zonefiles, \
         put_zonefiles as blockstack_put_zonefiles
@@ -63,6 +66,7 @@ from .storage import *
 MIN_ATLAS_VERSION = "0.14.0"
 
 PEER_LIFETIME_INTERVAL = 3600  # 1 hour
+PEER_HEALTH_NUM_BUCKETS = 60   # number of time buckets in which we count requests to and responses from a peer over its lifetime interval
 PEER_PING_INTERVAL = 600       # 10 minutes
 PEER_MAX_AGE = 2678400         # 1 month
 PEER_CLEAN_INTERVAL = 3600     # 1 hour
@@ -79,15 +83,30 @@ PEER_CRAWL_NEIGHBOR_WORK_INTERVAL = 300     # minimum amount of time (seconds) t
 PEER_HEALTH_NEIGHBOR_WORK_INTERVAL = 1      # minimum amount of time (seconds) that must pass between randomly pinging someone
 PEER_CRAWL_ZONEFILE_WORK_INTERVAL = 300     # minimum amount of time (seconds) that must pass between two zonefile crawls
 PEER_PUSH_ZONEFILE_WORK_INTERVAL = 300      # minimum amount of time (seconds) that must pass between two zonefile pushes
+PEER_PUSH_ZONEFILE_THREADS = 8              # number of threads pushing zonefiles to peers at once
+PEER_PUSH_ZONEFILE_BATCH_SIZE = 100         # maximum number of zonefiles to send a peer in one put_zonefiles request
+PEER_HEALTH_REFRESH_THREADS = 8             # number of threads refreshing peers' zonefile inventories at once
+
+ZONEFILE_INV_LOG_MAX = 100000               # number of recent changes to our zonefile inventory we remember, so peers can fetch just the changes
+ZONEFILE_INV_DELTA_MAX = 4096               # maximum number of changed bits in an inventory delta (past this, peers should fetch the whole inventory)
 PEER_CRAWL_ZONEFILE_STORAGE_RETRY_INTERVAL = 3600 * 12      # retry storage for missing zonefiles every 12 hours
 
+PEER_CRAWL_ZONEFILE_FETCH_THREADS = 4       # number of threads fetching zonefiles at once (0 means fetch them serially)
+PEER_CRAWL_ZONEFILE_MAX_INFLIGHT = 2        # maximum number of outstanding zonefile requests to a single peer
+PEER_CRAWL_ZONEFILE_BATCH_SIZE = 100        # maximum number of zonefiles to ask a peer for in one request
+PEER_CRAWL_ZONEFILE_STORE_BATCH_SIZE = 50   # number of fetched zonefiles to store before flushing them to disk
+ZONEFILE_FETCH_RATE_INTERVAL = 60           # number of seconds over which to measure the zonefile fetch rate
+
 NUM_NEIGHBORS = 80     # number of neighbors a peer can report
 
-ZONEFILE_INV = None      # this atlas peer's current zonefile inventory
+ZONEFILE_INV = None      # this atlas peer's current zonefile inventory (an AtlasInventory)
 NUM_ZONEFILES = 0      # cache-coherent count of the number of zonefiles present
 
 MAX_QUEUED_ZONEFILES = 1000     # maximum number of queued zonefiles
 
+ATLASDB_WRITE_BATCH_MAX = 500   # maximum number of queued writes to group into one atlas db transaction
+ATLASDB_BUSY_TIMEOUT = 60       # number of seconds to wait for another process to release the atlas db
+
 if os.environ.get("BLOCKSTACK_ATLAS_PEER_LIFETIME") is not None:
     PEER_LIFETIME_INTERVAL = int(os.environ.get("BLOCKSTACK_ATLAS_PEER_LIFETIME"))
 
@@ -100,6 +119,9 @@ if os.environ.get("BLOCKSTACK_ATLAS_MIN_PEER_HEALTH") is not None:
 if os.environ.get("BLOCKSTACK_ATLAS_NUM_NEIGHBORS") is not None:
     NUM_NEIGHBORS = int(os.environ.get("BLOCKSTACK_ATLAS_NUM_NEIGHBORS"))
 
+if os.environ.get("BLOCKSTACK_ATLAS_ZONEFILE_FETCH_THREADS") is not None:
+    PEER_CRAWL_ZONEFILE_FETCH_THREADS = int(os.environ.get("BLOCKSTACK_ATLAS_ZONEFILE_FETCH_THREADS"))
+
 if os.environ.get("BLOCKSTACK_TEST", None) == "1":
     PEER_CRAWL_NEIGHBOR_WORK_INTERVAL = 1
     PEER_HEALTH_NEIGHBOR_WORK_INTERVAL = 1
@@ -242,8 +264,8 @@ CREATE TABLE peers( peer_index INTEGER PRIMARY KEY AUTOINCREMENT,
 """
 
 PEER_TABLE = {}        # map peer host:port (NOT url) to peer information
-                       # each element is {'time': [(responded, timestamp)...], 'zonefile_inv': ...}
-                       # 'zonefile_inv' is a *bitwise big-endian* bit string where bit i is set if the zonefile in the ith NAME_UPDATE transaction has been stored by us (i.e. "is present")
+                       # each element is {'health': AtlasPeerHealth, 'zonefile_inv': ...}
+                       # 'zonefile_inv' is an AtlasInventory: a *bitwise big-endian* bit vector where bit i is set if the zonefile in the ith NAME_UPDATE transaction has been stored by us (i.e. "is present")
                        # for example, if 'zonefile_inv' is 10110001, then the 0th, 2nd, 3rd, and 7th NAME_UPDATEs' zonefiles have been stored by us
                        # (note that we allow for the possibility of duplicate zonefiles, but this is a rare occurance and we keep track of it in the DB to avoid duplicate transfers)
 
@@ -255,7 +277,28 @@ PEER_QUEUE_LOCK = threading.Lock()
 PEER_TABLE_LOCK_HOLDER = None
 PEER_TABLE_LOCK_TRACEBACK = None
 ZONEFILE_QUEUE_LOCK = threading.Lock()
-DB_LOCK = threading.Lock()
+
+ATLASDB_CONNECTIONS = threading.local()     # each thread's connections to the atlas db(s), by path
+ATLASDB_WRITERS = {}                        # map atlas db path to its AtlasDBWriter
+ATLASDB_WRITERS_LOCK = threading.Lock()
+
+ZONEFILE_INV_EPOCH = None   # random ID of the current inventory change log (a new one is started whenever our inventory is reloaded)
+ZONEFILE_INV_SEQ = 0        # sequence number of the last change to our inventory in this epoch
+ZONEFILE_INV_CHANGES = collections.deque(maxlen=ZONEFILE_INV_LOG_MAX)   # recent (sequence number, bit index, present) changes to our inventory
+ZONEFILE_INV_CHANGES_LOCK = threading.Lock()
+
+ZONEFILE_FETCH_TIMES = []   # list of (timestamp, number of zonefiles stored) within the last ZONEFILE_FETCH_RATE_INTERVAL seconds
+ZONEFILE_FETCH_TIMES_LOCK = threading.Lock()
+
+ZONEFILE_PUSH_STATS = {     # counters on zonefile pushes to other peers
+    'pushed': 0,            # number of zonefiles peers accepted
+    'failed': 0,            # number of zonefiles peers did not accept (or didn't answer for)
+    'dropped': 0,           # number of zonefiles we could not queue, or could not push to anyone
+    'requests': 0,          # number of put_zonefiles requests sent
+    'latency_total': 0.0,   # total time spent in put_zonefiles requests
+    'latency_max': 0.0,     # longest put_zonefiles request
+}
+ZONEFILE_PUSH_STATS_LOCK = threading.Lock()
 
 def atlas_peer_table_lock():
     """
@@ -349,6 +392,83 @@ def atlas_zonefile_queue_unlock():
     ZONEFILE_QUEUE_LOCK.release()
 
 
+def atlas_zonefile_fetch_stats_update( count, now=None ):
+    """
+    Record that we fetched and stored some zonefiles
+    """
+    global ZONEFILE_FETCH_TIMES, ZONEFILE_FETCH_TIMES_LOCK
+
+    if now is None:
+        now = time_now()
+
+    with ZONEFILE_FETCH_TIMES_LOCK:
+        ZONEFILE_FETCH_TIMES.append( (now, count) )
+        ZONEFILE_FETCH_TIMES = filter( lambda (t, c): t + ZONEFILE_FETCH_RATE_INTERVAL >= now, ZONEFILE_FETCH_TIMES )
+
+
+def atlas_zonefile_push_stats_update( num_pushed=0, num_failed=0, num_dropped=0, latency=None ):
+    """
+    Record the outcome of pushing zonefiles to a peer
+    (and/or zonefiles we had to drop)
+    """
+    global ZONEFILE_PUSH_STATS, ZONEFILE_PUSH_STATS_LOCK
+
+    with ZONEFILE_PUSH_STATS_LOCK:
+        ZONEFILE_PUSH_STATS['pushed'] += num_pushed
+        ZONEFILE_PUSH_STATS['failed'] += num_failed
+        ZONEFILE_PUSH_STATS['dropped'] += num_dropped
+
+        if latency is not None:
+            ZONEFILE_PUSH_STATS['requests'] += 1
+            ZONEFILE_PUSH_STATS['latency_total'] += latency
+            ZONEFILE_PUSH_STATS['latency_max'] = max(ZONEFILE_PUSH_STATS['latency_max'], latency)
+
+
+def atlas_zonefile_push_stats():
+    """
+    Get the zonefile push queue depth and counters, for monitoring.
+    Not reported in getinfo while the zonefile pusher is deactivated.
+    Return {'queue_depth': ..., 'pushed': ..., 'failed': ..., 'dropped': ..., 'requests': ..., 'latency_avg': ..., 'latency_max': ...}
+    """
+    global ZONEFILE_PUSH_STATS, ZONEFILE_PUSH_STATS_LOCK
+
+    zonefile_queue = atlas_zonefile_queue_lock()
+    queue_depth = len(zonefile_queue)
+    atlas_zonefile_queue_unlock()
+
+    with ZONEFILE_PUSH_STATS_LOCK:
+        ret = {
+            'queue_depth': queue_depth,
+            'pushed': ZONEFILE_PUSH_STATS['pushed'],
+            'failed': ZONEFILE_PUSH_STATS['failed'],
+            'dropped': ZONEFILE_PUSH_STATS['dropped'],
+            'requests': ZONEFILE_PUSH_STATS['requests'],
+            'latency_avg': 0.0,
+            'latency_max': ZONEFILE_PUSH_STATS['latency_max']
+        }
+
+        if ZONEFILE_PUSH_STATS['requests'] > 0:
+            ret['latency_avg'] = ZONEFILE_PUSH_STATS['latency_total'] / ZONEFILE_PUSH_STATS['requests']
+
+    return ret
+
+
+def atlas_zonefile_fetch_rate( now=None ):
+    """
+    How many zonefiles per second have we fetched and
+    stored over the last ZONEFILE_FETCH_RATE_INTERVAL seconds?
+    """
+    global ZONEFILE_FETCH_TIMES, ZONEFILE_FETCH_TIMES_LOCK
+
+    if now is None:
+        now = time_now()
+
+    with ZONEFILE_FETCH_TIMES_LOCK:
+        count = sum( [c for (t, c) in ZONEFILE_FETCH_TIMES if t + ZONEFILE_FETCH_RATE_INTERVAL >= now] )
+
+    return float(count) / ZONEFILE_FETCH_RATE_INTERVAL
+
+
 def atlas_max_new_peers( max_neighbors ):
     """
     Maximum size of the new peers list
@@ -357,6 +477,214 @@ def atlas_max_new_peers( max_neighbors ):
     return max_new_peers
 
 
+class AtlasInventory(object):
+    """
+    Mutable zonefile inventory bit vector.
+
+    Bit i is the (i % 8)th most-significant bit of byte (i / 8),
+    i.e. the same bitwise big-endian encoding as the inventory
+    strings we exchange with other peers.
+
+    Bits are set, cleared, and tested in-place.  Reads behave
+    like the string encoding:  len() is the length in bytes,
+    indexing returns a one-character string, and slicing returns
+    a string.
+    """
+
+    def __init__(self, inv_vec="" ):
+        if isinstance(inv_vec, AtlasInventory):
+            self.inv = inv_vec.inv[:]
+        else:
+            self.inv = bytearray(inv_vec)
+
+
+    def __len__(self):
+        return len(self.inv)
+
+
+    def __str__(self):
+        return str(self.inv)
+
+
+    def __repr__(self):
+        return "AtlasInventory(%s)" % repr(str(self.inv))
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return str(self.inv[key])
+
+        return chr(self.inv[key])
+
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+
+        return str(self.inv) == str(other)
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    def copy(self):
+        """
+        Make a copy of this inventory
+        """
+        return AtlasInventory(self)
+
+
+    def extend(self, inv_vec):
+        """
+        Append inventory bytes
+        """
+        if isinstance(inv_vec, AtlasInventory):
+            inv_vec = inv_vec.inv
+
+        self.inv.extend(inv_vec)
+
+
+    def truncate(self, byte_length):
+        """
+        Drop every byte after byte_length
+        """
+        del self.inv[byte_length:]
+
+
+    def flip_bits(self, bit_indexes, operation):
+        """
+        Set (operation is True) or clear (operation is False)
+        the given bits, expanding the vector if need be.
+        """
+        if len(bit_indexes) == 0:
+            return
+
+        max_byte_index = max(bit_indexes) / 8 + 1
+        if len(self.inv) <= max_byte_index:
+            self.inv.extend( '\0' * (max_byte_index - len(self.inv)) )
+
+        for bit_index in bit_indexes:
+            byte_index = bit_index / 8
+            mask = 1 << (7 - (bit_index % 8))
+
+            if operation:
+                self.inv[byte_index] |= mask
+            else:
+                self.inv[byte_index] &= ~mask & 0xff
+
+
+    def set_bits(self, bit_indexes):
+        """
+        Set the given bits
+        """
+        self.flip_bits(bit_indexes, True)
+
+
+    def clear_bits(self, bit_indexes):
+        """
+        Clear the given bits
+        """
+        self.flip_bits(bit_indexes, False)
+
+
+    def test_bit(self, bit_index):
+        """
+        Is the given bit set?
+        Bits past the end of the vector are clear.
+        """
+        byte_index = bit_index / 8
+        if byte_index >= len(self.inv):
+            return False
+
+        return (self.inv[byte_index] & (1 << (7 - (bit_index % 8)))) != 0
+
+
+    def test_bits(self, bit_indexes):
+        """
+        Are all of the given bits set?
+        """
+        for bit_index in bit_indexes:
+            if not self.test_bit(bit_index):
+                return False
+
+        return True
+
+
+    def to_int(self, byte_length=None):
+        """
+        Get the vector as a (big-endian) integer,
+        zero-padded on the right to byte_length bytes.
+        """
+        if byte_length is None:
+            byte_length = len(self.inv)
+
+        assert byte_length >= len(self.inv)
+
+        if len(self.inv) == 0:
+            return 0
+
+        return int(binascii.hexlify(self.inv), 16) << (8 * (byte_length - len(self.inv)))
+
+
+    def popcount(self):
+        """
+        How many bits are set?
+        """
+        return bin(self.to_int()).count('1')
+
+
+    def and_not(self, other):
+        """
+        Get the inventory of bits that are set in this
+        inventory, but not in the other one.
+        """
+        if not isinstance(other, AtlasInventory):
+            other = AtlasInventory(other)
+
+        byte_length = max(len(self.inv), len(other.inv))
+        diff = self.to_int(byte_length) & ~other.to_int(byte_length)
+
+        if byte_length == 0:
+            return AtlasInventory()
+
+        return AtlasInventory( binascii.unhexlify( "%0*x" % (2 * byte_length, diff) ) )
+
+
+    def intersect(self, other):
+        """
+        Get the inventory of bits that are set in both
+        this inventory and the other one.
+        """
+        if not isinstance(other, AtlasInventory):
+            other = AtlasInventory(other)
+
+        byte_length = max(len(self.inv), len(other.inv))
+        common = self.to_int(byte_length) & other.to_int(byte_length)
+
+        if byte_length == 0:
+            return AtlasInventory()
+
+        return AtlasInventory( binascii.unhexlify( "%0*x" % (2 * byte_length, common) ) )
+
+
+    def bit_indexes(self):
+        """
+        Get the list of set bits, in ascending order.
+        """
+        ret = []
+        for byte_index in xrange(0, len(self.inv)):
+            zfbits = self.inv[byte_index]
+            if zfbits == 0:
+                continue
+
+            for j in xrange(0, 8):
+                if zfbits & (1 << (7 - j)):
+                    ret.append( byte_index * 8 + j )
+
+        return ret
+
+
 def atlas_inventory_flip_zonefile_bits( inv_vec, bit_indexes, operation ):
     """
     Given a list of bit indexes (bit_indexes), set or clear the
@@ -367,28 +695,17 @@ def atlas_inventory_flip_zonefile_bits( inv_vec, bit_indexes, operation ):
     If operation is True, then set the bits.
     If operation is False, then clear the bits
 
+    If inv_vec is an AtlasInventory, it is modified in-place.
+
     Return the new inv_vec
     """
-    inv_list = list(inv_vec)
-
-    max_byte_index = max(bit_indexes) / 8 + 1
-    if len(inv_list) <= max_byte_index:
-        inv_list += ['\0'] * (max_byte_index - len(inv_list))
+    if isinstance(inv_vec, AtlasInventory):
+        inv_vec.flip_bits( bit_indexes, operation )
+        return inv_vec
 
-    for bit_index in bit_indexes:
-        byte_index = bit_index / 8
-        bit_index = 7 - (bit_index % 8)
-        
-        zfbits = ord(inv_list[byte_index])
-
-        if operation:
-            zfbits = zfbits | (1 << bit_index)
-        else:
-            zfbits = zfbits & ~(1 << bit_index)
-
-        inv_list[byte_index] = chr(zfbits)
-
-    return "".join(inv_list)
+    inv = AtlasInventory(inv_vec)
+    inv.flip_bits( bit_indexes, operation )
+    return str(inv)
 
 
 def atlas_inventory_set_zonefile_bits( inv_vec, bit_indexes ):
@@ -413,21 +730,302 @@ def atlas_inventory_test_zonefile_bits( inv_vec, bit_indexes ):
     Return True if all are set
     Return False if not
     """
-    inv_list = list(inv_vec)
-
-    max_byte_index = max(bit_indexes) / 8 + 1
-    if len(inv_list) <= max_byte_index:
-        inv_list += ['\0'] * (max_byte_index - len(inv_list))
+    if isinstance(inv_vec, AtlasInventory):
+        return inv_vec.test_bits( bit_indexes )
 
-    ret = True
     for bit_index in bit_indexes:
         byte_index = bit_index / 8
-        bit_index = 7 - (bit_index % 8)
-        
-        zfbits = ord(inv_list[byte_index])
-        ret = (ret and ((zfbits & (1 << bit_index)) != 0))
+        if byte_index >= len(inv_vec):
+            return False
 
-    return ret
+        if (ord(inv_vec[byte_index]) & (1 << (7 - (bit_index % 8)))) == 0:
+            return False
+
+    return True
+
+
+class AtlasZonefileAvailability(object):
+    """
+    Index of which peers can serve which of our missing zonefiles.
+
+    Tracks the zonefile rows we don't have (keyed by inventory bit),
+    and for each peer, the subset of those bits that its inventory
+    vector has set.  It is updated as zonefiles become present or
+    missing and as peer inventories change, so finding the
+    availability of missing zonefiles does not require scanning
+    every peer's inventory for every missing zonefile.
+
+    Has its own lock.  Callers may hold the peer table lock when
+    calling into it, but not the other way around.
+    """
+
+    def __init__(self, missing_rows=[]):
+        self.lock = threading.Lock()
+        self.rows = {}                  # map bit index to missing zonefile row
+        self.hashes = {}                # map zonefile hash to set of missing bit indexes
+        self.missing_inv = AtlasInventory()
+        self.peer_bits = {}             # map peer host:port to set of missing bit indexes it has
+        self.bit_peers = {}             # map missing bit index to set of peer host:ports that have it
+
+        for row in missing_rows:
+            self._add_row( row )
+
+
+    def _add_row(self, row):
+        """
+        Add a missing zonefile row (lock must be held)
+        """
+        bit_index = row['inv_index'] - 1
+        self.rows[bit_index] = row
+
+        if not self.hashes.has_key(row['zonefile_hash']):
+            self.hashes[row['zonefile_hash']] = set([])
+
+        self.hashes[row['zonefile_hash']].add( bit_index )
+        self.missing_inv.set_bits( [bit_index] )
+
+
+    def _link(self, peer_hostport, bit_index):
+        """
+        Record that a peer has a missing bit (lock must be held)
+        """
+        if not self.peer_bits.has_key(peer_hostport):
+            self.peer_bits[peer_hostport] = set([])
+
+        if not self.bit_peers.has_key(bit_index):
+            self.bit_peers[bit_index] = set([])
+
+        self.peer_bits[peer_hostport].add( bit_index )
+        self.bit_peers[bit_index].add( peer_hostport )
+
+
+    def _unlink(self, peer_hostport, bit_index):
+        """
+        Forget that a peer has a missing bit (lock must be held)
+        """
+        if self.peer_bits.has_key(peer_hostport):
+            self.peer_bits[peer_hostport].discard( bit_index )
+
+        if self.bit_peers.has_key(bit_index):
+            self.bit_peers[bit_index].discard( peer_hostport )
+            if len(self.bit_peers[bit_index]) == 0:
+                del self.bit_peers[bit_index]
+
+
+    def add_missing(self, row, peer_table=None):
+        """
+        Add a zonefile row that we don't have.
+        If given, check the inventories in peer_table for it.
+        """
+        bit_index = row['inv_index'] - 1
+        with self.lock:
+            self._add_row( dict(row) )
+
+            if peer_table is not None:
+                for peer_hostport in peer_table.keys():
+                    if peer_table[peer_hostport]['zonefile_inv'].test_bit( bit_index ):
+                        self._link( peer_hostport, bit_index )
+
+
+    def remove_missing(self, bit_indexes):
+        """
+        We have the zonefiles at the given bits now.
+        """
+        with self.lock:
+            for bit_index in bit_indexes:
+                row = self.rows.get(bit_index, None)
+                if row is None:
+                    continue
+
+                del self.rows[bit_index]
+                self.hashes[row['zonefile_hash']].discard( bit_index )
+                if len(self.hashes[row['zonefile_hash']]) == 0:
+                    del self.hashes[row['zonefile_hash']]
+
+                for peer_hostport in self.bit_peers.get(bit_index, set([])).copy():
+                    self._unlink( peer_hostport, bit_index )
+
+            self.missing_inv.clear_bits( bit_indexes )
+
+
+    def set_tried_storage(self, zonefile_hash, tried_storage):
+        """
+        Record whether or not we tried storage for a zonefile.
+        If zonefile_hash is None, then set it for all missing zonefiles.
+        """
+        with self.lock:
+            if zonefile_hash is None:
+                bit_indexes = self.rows.keys()
+            else:
+                bit_indexes = self.hashes.get(zonefile_hash, set([]))
+
+            for bit_index in bit_indexes:
+                self.rows[bit_index]['tried_storage'] = tried_storage
+
+
+    def update_peer(self, peer_hostport, peer_inv):
+        """
+        A peer's inventory changed.
+        Work is proportional to the number of missing zonefiles it has.
+        """
+        with self.lock:
+            held = set( self.missing_inv.intersect(peer_inv).bit_indexes() )
+            cur = self.peer_bits.get(peer_hostport, set([]))
+
+            for bit_index in cur - held:
+                self._unlink( peer_hostport, bit_index )
+
+            for bit_index in held - cur:
+                self._link( peer_hostport, bit_index )
+
+
+    def update_peer_bits(self, peer_hostport, bit_indexes, present):
+        """
+        Some bits in a peer's inventory were set or cleared.
+        """
+        with self.lock:
+            for bit_index in bit_indexes:
+                if present and self.rows.has_key(bit_index):
+                    self._link( peer_hostport, bit_index )
+
+                elif not present:
+                    self._unlink( peer_hostport, bit_index )
+
+
+    def remove_peer(self, peer_hostport):
+        """
+        Forget a peer
+        """
+        with self.lock:
+            for bit_index in self.peer_bits.get(peer_hostport, set([])).copy():
+                self._unlink( peer_hostport, bit_index )
+
+            if self.peer_bits.has_key(peer_hostport):
+                del self.peer_bits[peer_hostport]
+
+
+    def get_availability(self):
+        """
+        Get the availability of each missing zonefile,
+        in the format returned by atlas_find_missing_zonefile_availability.
+        """
+        ret = {}
+        with self.lock:
+            for zfhash, bit_indexes in self.hashes.items():
+                bit_indexes = sorted(bit_indexes)
+                rows = [self.rows[bit_index] for bit_index in bit_indexes]
+
+                peers = set([])
+                for bit_index in bit_indexes:
+                    peers.update( self.bit_peers.get(bit_index, set([])) )
+
+                ret[zfhash] = {
+                    'names': [row['name'] for row in rows],
+                    'txid': rows[0]['txid'],
+                    'indexes': bit_indexes,
+                    'popularity': len(peers),
+                    'peers': list(peers),
+                    'tried_storage': rows[-1]['tried_storage']
+                }
+
+        return ret
+
+
+class AtlasPeerHealth(object):
+    """
+    Rolling count of the requests we sent to a peer and the responses
+    we got back, over the last peer lifetime interval.
+
+    Counts are kept in a fixed-size ring of time buckets, along
+    with running totals, so recording a request and reading the
+    health score are constant-time, and memory use is bounded
+    no matter how often we talk to the peer.
+    """
+
+    def __init__(self, lifetime=None, num_buckets=PEER_HEALTH_NUM_BUCKETS):
+        if lifetime is None:
+            lifetime = atlas_peer_lifetime_interval()
+
+        self.num_buckets = num_buckets
+        self.bucket_width = float(lifetime) / num_buckets
+        self.requests = [0] * num_buckets
+        self.responses = [0] * num_buckets
+        self.num_requests = 0
+        self.num_responses = 0
+        self.bucket = None          # absolute index of the newest bucket
+
+
+    def advance(self, now):
+        """
+        Expire the buckets that have fallen out of the lifetime interval
+        """
+        bucket = int(now / self.bucket_width)
+        if self.bucket is None:
+            self.bucket = bucket
+            return
+
+        if bucket <= self.bucket:
+            return
+
+        if bucket - self.bucket >= self.num_buckets:
+            # everything expired
+            self.requests = [0] * self.num_buckets
+            self.responses = [0] * self.num_buckets
+            self.num_requests = 0
+            self.num_responses = 0
+
+        else:
+            for b in xrange(self.bucket + 1, bucket + 1):
+                i = b % self.num_buckets
+                self.num_requests -= self.requests[i]
+                self.num_responses -= self.responses[i]
+                self.requests[i] = 0
+                self.responses[i] = 0
+
+        self.bucket = bucket
+
+
+    def record(self, now, responded):
+        """
+        Record that we sent a request, and whether or not the peer responded
+        """
+        self.advance(now)
+        i = self.bucket % self.num_buckets
+        self.requests[i] += 1
+        self.num_requests += 1
+        if responded:
+            self.responses[i] += 1
+            self.num_responses += 1
+
+
+    def get_request_count(self, now):
+        """
+        How many requests have we sent within the lifetime interval?
+        """
+        self.advance(now)
+        return self.num_requests
+
+
+    def get_response_count(self, now):
+        """
+        How many responses have we received within the lifetime interval?
+        """
+        self.advance(now)
+        return self.num_responses
+
+
+    def get_health(self, now):
+        """
+        Number of responses / number of requests within the lifetime interval
+        """
+        self.advance(now)
+        if self.num_requests == 0:
+            return 0.0
+
+        return float(self.num_responses) / float(self.num_requests)
+
+
+ZONEFILE_AVAILABILITY = None    # index of which peers have which of our missing zonefiles (an AtlasZonefileAvailability)
 
 
 def atlasdb_row_factory( cursor, row ):
@@ -474,16 +1072,8 @@ def atlasdb_query_execute( cur, query, values ):
 
     DO NOT CALL THIS DIRECTLY.
     """
-
-    # under heavy contention, this can cause timeouts (which is unacceptable)
-    # serialize access to the db just to be safe
-    
-    global DB_LOCK
-
     try:
-        DB_LOCK.acquire()
         ret = cur.execute( query, values )
-        DB_LOCK.release()
         return ret
     except Exception, e:
         log.exception(e)
@@ -495,6 +1085,8 @@ def atlasdb_query_execute( cur, query, values ):
 def atlasdb_open( path ):
     """
     Open the atlas db.
+    The db is put into WAL mode, so readers
+    never wait on the writer (and vice versa).
     Return a connection.
     Return None if it doesn't exist
     """
@@ -502,70 +1094,280 @@ def atlasdb_open( path ):
         log.debug("Atlas DB doesn't exist at %s" % path)
         return None
 
-    con = sqlite3.connect( path, isolation_level=None )
+    con = sqlite3.connect( path, isolation_level=None, timeout=ATLASDB_BUSY_TIMEOUT )
     con.row_factory = atlasdb_row_factory
+    con.execute( "PRAGMA journal_mode=WAL;" )
+    con.execute( "PRAGMA synchronous=NORMAL;" )
     return con
 
 
+def atlasdb_get_connection( path ):
+    """
+    Get the calling thread's connection to the atlas db,
+    opening it if need be.  Do not close it.
+    Return None if the db doesn't exist
+    """
+    global ATLASDB_CONNECTIONS
+
+    path = os.path.abspath(path)
+    if getattr(ATLASDB_CONNECTIONS, 'pid', None) != os.getpid():
+        # new thread (or we forked)
+        ATLASDB_CONNECTIONS.pid = os.getpid()
+        ATLASDB_CONNECTIONS.cons = {}
+
+    con = ATLASDB_CONNECTIONS.cons.get(path, None)
+    if con is None:
+        con = atlasdb_open( path )
+        if con is None:
+            return None
+
+        ATLASDB_CONNECTIONS.cons[path] = con
+
+    return con
+
+
+def atlasdb_con_path( con ):
+    """
+    Get the path to the db a connection is open on
+    """
+    cur = con.cursor()
+    cur.row_factory = None
+    for row in cur.execute( "PRAGMA database_list;" ):
+        if row[1] == 'main':
+            return row[2]
+
+    return None
+
+
+class AtlasDBWriter( threading.Thread ):
+    """
+    The only thread that writes to an atlas db.
+    Other threads queue up writes and wait for them to commit;
+    all writes queued by the time the writer gets to them
+    are applied in a single transaction.
+    """
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.pid = os.getpid()
+        self.write_queue = Queue.Queue()
+
+
+    def submit(self, write_func, args):
+        """
+        Apply write_func(cursor, *args) in the next transaction,
+        and wait for it to commit.
+        Return what write_func returns.
+        """
+        req = {
+            'func': write_func,
+            'args': args,
+            'done': threading.Event(),
+            'result': None,
+            'error': None
+        }
+
+        self.write_queue.put( req )
+        req['done'].wait()
+
+        if req['error'] is not None:
+            raise req['error']
+
+        return req['result']
+
+
+    def run(self):
+        con = atlasdb_open( self.path )
+        assert con is not None
+
+        running = True
+        while running:
+            req = self.write_queue.get()
+            if req is None:
+                break
+
+            batch = [req]
+            while len(batch) < ATLASDB_WRITE_BATCH_MAX:
+                try:
+                    req = self.write_queue.get_nowait()
+                except Queue.Empty:
+                    break
+
+                if req is None:
+                    running = False
+                    break
+
+                batch.append( req )
+
+            cur = con.cursor()
+            atlasdb_query_execute( cur, "BEGIN IMMEDIATE;", () )
+            for req in batch:
+                try:
+                    req['result'] = req['func']( cur, *req['args'] )
+                except Exception, e:
+                    log.exception(e)
+                    req['error'] = e
+
+            atlasdb_query_execute( cur, "COMMIT;", () )
+
+            for req in batch:
+                req['done'].set()
+
+        con.close()
+
+
+    def ask_join(self):
+        self.write_queue.put( None )
+
+
+def atlasdb_write( write_func, args, con=None, path=None ):
+    """
+    Apply write_func(cursor, *args) to the atlas db (given by @con or @path),
+    via the db's writer thread.  Wait for it to commit.
+    Return what write_func returns.
+    """
+    global ATLASDB_WRITERS, ATLASDB_WRITERS_LOCK
+
+    if con is not None:
+        path = atlasdb_con_path( con )
+
+    if path is None:
+        path = atlasdb_path()
+
+    path = os.path.abspath(path)
+
+    with ATLASDB_WRITERS_LOCK:
+        writer = ATLASDB_WRITERS.get(path, None)
+        if writer is None or writer.pid != os.getpid() or not writer.is_alive():
+            writer = AtlasDBWriter( path )
+            writer.start()
+            ATLASDB_WRITERS[path] = writer
+
+    return writer.submit( write_func, args )
+
+
+def atlasdb_write_query( sql, args, con=None, path=None ):
+    """
+    Execute a single write statement via the atlas db's writer thread.
+    Return the number of rows it changed.
+    """
+    def _write( cur ):
+        res = atlasdb_query_execute( cur, sql, args )
+        return res.rowcount
+
+    return atlasdb_write( _write, (), con=con, path=path )
+
+
+def atlasdb_stop_writers():
+    """
+    Stop all atlas db writer threads.
+    Pending writes are applied first.
+    """
+    global ATLASDB_WRITERS, ATLASDB_WRITERS_LOCK
+
+    with ATLASDB_WRITERS_LOCK:
+        writers = ATLASDB_WRITERS.values()
+        ATLASDB_WRITERS = {}
+
+    for writer in writers:
+        if writer.pid == os.getpid() and writer.is_alive():
+            writer.ask_join()
+            writer.join()
+
+    return True
+
+
 def atlasdb_add_zonefile_info( name, zonefile_hash, txid, present, tried_storage, block_height, con=None, path=None ):
     """
     Add a zonefile to the database.
     Mark it as present or absent.
     Keep our in-RAM inventory vector up-to-date
     """
-    global ZONEFILE_INV, NUM_ZONEFILES
+    zfinfo = {
+        'name': name,
+        'zonefile_hash': zonefile_hash,
+        'txid': txid,
+        'present': present,
+        'tried_storage': tried_storage,
+        'block_height': block_height
+    }
+
+    return atlasdb_add_zonefile_infos( [zfinfo], con=con, path=path )
+
+
+def atlasdb_add_zonefile_infos( zfinfos, con=None, path=None ):
+    """
+    Add a batch of zonefiles to the database, in a single transaction.
+    Each is a dict with 'name', 'zonefile_hash', 'txid', 'present', 'tried_storage', and 'block_height'.
+    Mark each as present or absent.
+    Keep our in-RAM inventory vector up-to-date
+    """
+    global ZONEFILE_INV, NUM_ZONEFILES, ZONEFILE_AVAILABILITY
 
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
-    if present:
-        present = 1
-    else:
-        present = 0
+    if len(zfinfos) == 0:
+        return True
 
-    if tried_storage:
-        tried_storage = 1
-    else:
-        tried_storage = 0
+    def _write( cur ):
+        for zfinfo in zfinfos:
+            present = 1 if zfinfo['present'] else 0
+            tried_storage = 1 if zfinfo['tried_storage'] else 0
 
-    sql = "UPDATE zonefiles SET name = ?, zonefile_hash = ?, txid = ?, present = ?, tried_storage = ?, block_height = ? WHERE txid = ?;"
-    args = (name, zonefile_hash, txid, present, tried_storage, block_height, txid )
+            sql = "UPDATE zonefiles SET name = ?, zonefile_hash = ?, txid = ?, present = ?, tried_storage = ?, block_height = ? WHERE txid = ?;"
+            args = (zfinfo['name'], zfinfo['zonefile_hash'], zfinfo['txid'], present, tried_storage, zfinfo['block_height'], zfinfo['txid'] )
 
-    cur = con.cursor()
-    update_res = atlasdb_query_execute( cur, sql, args )
-    con.commit()
+            update_res = atlasdb_query_execute( cur, sql, args )
+            if update_res.rowcount == 0:
+                sql = "INSERT OR IGNORE INTO zonefiles (name, zonefile_hash, txid, present, tried_storage, block_height) VALUES (?,?,?,?,?,?);"
+                args = (zfinfo['name'], zfinfo['zonefile_hash'], zfinfo['txid'], present, tried_storage, zfinfo['block_height'])
 
-    if update_res.rowcount == 0:
-        sql = "INSERT OR IGNORE INTO zonefiles (name, zonefile_hash, txid, present, tried_storage, block_height) VALUES (?,?,?,?,?,?);"
-        args = (name, zonefile_hash, txid, present, tried_storage, block_height)
-    
-        cur = con.cursor()
-        atlasdb_query_execute( cur, sql, args )
-        con.commit()
+                atlasdb_query_execute( cur, sql, args )
+
+        return True
 
-    # keep in-RAM zonefile inv coherent
-    zfbits = atlasdb_get_zonefile_bits( zonefile_hash, con=con, path=path )
+    atlasdb_write( _write, (), con=con, path=path )
 
-    inv_vec = None
     if ZONEFILE_INV is None:
-        inv_vec = ""
-    else:
-        inv_vec = ZONEFILE_INV[:]
+        ZONEFILE_INV = AtlasInventory()
+
+    missing_rows = []
+    for zfinfo in zfinfos:
+        present = 1 if zfinfo['present'] else 0
+
+        # keep in-RAM zonefile inv coherent
+        zfbits = atlasdb_get_zonefile_bits( zfinfo['zonefile_hash'], con=con, path=path )
+
+        ZONEFILE_INV.flip_bits( zfbits, present )
+        atlas_zonefile_inv_log_changes( zfbits, present )
+
+        # keep missing zonefile availability coherent
+        if ZONEFILE_AVAILABILITY is not None:
+            if present:
+                ZONEFILE_AVAILABILITY.remove_missing( zfbits )
+
+            else:
+                row = atlasdb_find_zonefile_by_txid( zfinfo['txid'], con=con, path=path )
+                if row is not None:
+                    missing_rows.append( row )
+
+    if ZONEFILE_AVAILABILITY is not None and len(missing_rows) > 0:
+        # link the peers that already have them
+        peer_table = atlas_peer_table_lock()
+        for row in missing_rows:
+            ZONEFILE_AVAILABILITY.add_missing( row, peer_table=peer_table )
 
-    ZONEFILE_INV = atlas_inventory_flip_zonefile_bits( inv_vec, zfbits, present )
+        atlas_peer_table_unlock()
 
     # keep in-RAM zonefile count coherent
     NUM_ZONEFILES = atlasdb_zonefile_inv_length( con=con, path=path )
 
-    if close:
-        con.close()
-
     return True
 
 
@@ -576,10 +1378,8 @@ def atlasdb_get_lastblock( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT MAX(block_height) FROM zonefiles;"
@@ -594,9 +1394,6 @@ def atlasdb_get_lastblock( con=None, path=None ):
         row.update(r)
         break
 
-    if close:
-        con.close()
-
     return row['MAX(block_height)']
 
 
@@ -609,10 +1406,8 @@ def atlasdb_get_zonefile( zonefile_hash, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT * FROM zonefiles WHERE zonefile_hash = ?;"
@@ -636,9 +1431,6 @@ def atlasdb_get_zonefile( zonefile_hash, con=None, path=None ):
         ret['present'] = ret['present'] or zfinfo['present']
         ret['tried_storage'] = ret['tried_storage'] or zfinfo['tried_storage']
 
-    if close:
-        con.close()
-
     return ret
 
 
@@ -651,10 +1443,8 @@ def atlasdb_find_zonefile_by_txid( txid, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT * FROM zonefiles WHERE txid = ?;"
@@ -670,9 +1460,6 @@ def atlasdb_find_zonefile_by_txid( txid, con=None, path=None ):
         ret.update(zfinfo)
         break
 
-    if close:
-        con.close()
-
     return ret
 
 
@@ -682,15 +1469,22 @@ def atlasdb_set_zonefile_present( zonefile_hash, present, con=None, path=None ):
     Keep our in-RAM zonefile inventory coherent.
     Return the previous state.
     """
-    global ZONEFILE_INV
+    return atlasdb_set_zonefiles_present( [zonefile_hash], present, con=con, path=path )[0]
+
+
+def atlasdb_set_zonefiles_present( zonefile_hashes, present, con=None, path=None ):
+    """
+    Mark a batch of zonefiles as present (or absent), in a single transaction.
+    Keep our in-RAM zonefile inventory coherent.
+    Return the list of their previous states.
+    """
+    global ZONEFILE_INV, ZONEFILE_AVAILABILITY
 
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     if present:
@@ -698,46 +1492,65 @@ def atlasdb_set_zonefile_present( zonefile_hash, present, con=None, path=None ):
     else:
         present = 0
 
-    sql = "UPDATE zonefiles SET present = ? WHERE zonefile_hash = ?;"
-    args = (present, zonefile_hash)
+    if len(zonefile_hashes) == 0:
+        return []
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
-    con.commit()
+    def _write( cur ):
+        sql = "UPDATE zonefiles SET present = ? WHERE zonefile_hash = ?;"
+        for zonefile_hash in zonefile_hashes:
+            atlasdb_query_execute( cur, sql, (present, zonefile_hash) )
+
+        return True
+
+    atlasdb_write( _write, (), con=con, path=path )
 
-    zfbits = atlasdb_get_zonefile_bits( zonefile_hash, con=con, path=path )
-    
-    inv_vec = None
     if ZONEFILE_INV is None:
-        inv_vec = ""
-    else:
-        inv_vec = ZONEFILE_INV[:]
+        ZONEFILE_INV = AtlasInventory()
 
-    # did we know about this?
-    was_present = atlas_inventory_test_zonefile_bits( inv_vec, zfbits )
+    ret = []
+    missing_rows = []
+    for zonefile_hash in zonefile_hashes:
+        zfbits = atlasdb_get_zonefile_bits( zonefile_hash, con=con, path=path )
 
-    # keep our inventory vector coherent.
-    ZONEFILE_INV = atlas_inventory_flip_zonefile_bits( inv_vec, zfbits, present )
+        # did we know about this?
+        was_present = ZONEFILE_INV.test_bits( zfbits )
 
-    if close:
-        con.close()
+        # keep our inventory vector coherent.
+        ZONEFILE_INV.flip_bits( zfbits, present )
+        atlas_zonefile_inv_log_changes( zfbits, present )
+
+        # keep missing zonefile availability coherent
+        if ZONEFILE_AVAILABILITY is not None:
+            if present:
+                ZONEFILE_AVAILABILITY.remove_missing( zfbits )
+
+            elif was_present:
+                missing_rows += atlasdb_get_zonefile_rows( zonefile_hash, con=con, path=path )
+
+        ret.append( was_present )
+
+    if ZONEFILE_AVAILABILITY is not None and len(missing_rows) > 0:
+        # link the peers that have them
+        peer_table = atlas_peer_table_lock()
+        for zfinfo in missing_rows:
+            ZONEFILE_AVAILABILITY.add_missing( zfinfo, peer_table=peer_table )
 
-    return was_present
+        atlas_peer_table_unlock()
+
+    return ret
 
 
 def atlasdb_set_zonefile_tried_storage( zonefile_hash, tried_storage, con=None, path=None ):
     """
     Make a note that we tried to get the zonefile from storage
     """
-    global ZONEFILE_INV
+    global ZONEFILE_AVAILABILITY
 
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     if tried_storage:
@@ -748,12 +1561,10 @@ def atlasdb_set_zonefile_tried_storage( zonefile_hash, tried_storage, con=None,
     sql = "UPDATE zonefiles SET tried_storage = ? WHERE zonefile_hash = ?;"
     args = (tried_storage, zonefile_hash)
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
+    atlasdb_write_query( sql, args, con=con, path=path )
 
-    con.commit()
-    if close:
-        con.close()
+    if ZONEFILE_AVAILABILITY is not None:
+        ZONEFILE_AVAILABILITY.set_tried_storage( zonefile_hash, (tried_storage == 1) )
 
     return True
 
@@ -766,36 +1577,57 @@ def atlasdb_reset_zonefile_tried_storage( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "UPDATE zonefiles SET tried_storage = ? WHERE present = ?;"
     args = (0, 0)
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
+    atlasdb_write_query( sql, args, con=con, path=path )
 
-    con.commit()
-    if close:
-        con.close()
+    if ZONEFILE_AVAILABILITY is not None:
+        ZONEFILE_AVAILABILITY.set_tried_storage( None, False )
 
     return True
 
 
 def atlasdb_cache_zonefile_info( con=None, path=None ):
     """
-    Load up and cache our zonefile inventory
+    Load up and cache our zonefile inventory,
+    and (re)build the index of which peers have
+    the zonefiles we're missing.
     """
-    global ZONEFILE_INV, NUM_ZONEFILES
+    global ZONEFILE_INV, NUM_ZONEFILES, ZONEFILE_AVAILABILITY
 
     inv_len = atlasdb_zonefile_inv_length( con=con, path=path )
     inv = atlas_make_zonefile_inventory( 0, inv_len, con=con, path=path )
 
-    ZONEFILE_INV = inv
+    ZONEFILE_INV = AtlasInventory(inv)
     NUM_ZONEFILES = inv_len
+    atlas_zonefile_inv_log_reset()
+
+    # which zonefiles are we missing?
+    bit_offset = 0
+    bit_count = 10000
+    missing = []
+    while True:
+        zfinfo = atlasdb_zonefile_find_missing( bit_offset, bit_count, con=con, path=path )
+        if len(zfinfo) == 0:
+            break
+
+        missing += zfinfo
+        bit_offset += len(zfinfo)
+
+    availability = AtlasZonefileAvailability( missing )
+
+    peer_table = atlas_peer_table_lock()
+    for peer_hostport in peer_table.keys():
+        availability.update_peer( peer_hostport, peer_table[peer_hostport]['zonefile_inv'] )
+
+    ZONEFILE_AVAILABILITY = availability
+    atlas_peer_table_unlock()
+
     return inv
 
 
@@ -807,10 +1639,8 @@ def atlasdb_get_zonefile_bits( zonefile_hash, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT inv_index FROM zonefiles WHERE zonefile_hash = ?;"
@@ -825,8 +1655,35 @@ def atlasdb_get_zonefile_bits( zonefile_hash, con=None, path=None ):
     for r in res:
         ret.append( r['inv_index'] - 1 )
 
-    if close:
-        con.close()
+    return ret
+
+
+def atlasdb_get_zonefile_rows( zonefile_hash, con=None, path=None ):
+    """
+    Get all zonefile rows for a zonefile hash
+    (there can be more than one, if the same zonefile
+    was announced by more than one transaction)
+    Return the list of rows, in inventory order.
+    """
+    if path is None:
+        path = atlasdb_path()
+
+    if con is None:
+        con = atlasdb_get_connection( path )
+        assert con is not None
+
+    sql = "SELECT * FROM zonefiles WHERE zonefile_hash = ? ORDER BY inv_index;"
+    args = (zonefile_hash,)
+
+    cur = con.cursor()
+    res = atlasdb_query_execute( cur, sql, args )
+    con.commit()
+
+    ret = []
+    for r in res:
+        tmp = {}
+        tmp.update(r)
+        ret.append(tmp)
 
     return ret
 
@@ -834,12 +1691,13 @@ def atlasdb_get_zonefile_bits( zonefile_hash, con=None, path=None ):
 def atlasdb_queue_zonefiles( con, db, start_block, zonefile_dir=None, validate=True ):
     """
     Queue all zonefile hashes in the BlockstackDB
-    to the zonefile queue
+    to the zonefile queue (one transaction per block)
     """
     # populate zonefile queue
     total = 0
     for block_height in xrange(start_block, db.lastblock+1, 1):
 
+        zfinfos = []
         zonefile_info = db.get_atlas_zonefile_info_at( block_height )
         for name_txid_zfhash in zonefile_info:
             name = str(name_txid_zfhash['name'])
@@ -853,8 +1711,10 @@ def atlasdb_queue_zonefiles( con, db, start_block, zonefile_dir=None, validate=T
                 tried_storage = zfinfo['tried_storage']
 
             log.debug("Add %s %s %s at %s (present: %s, tried_storage: %s)" % (name, zfhash, txid, block_height, present, tried_storage) )
-            atlasdb_add_zonefile_info( name, zfhash, txid, present, tried_storage, block_height, con=con )
-            total += 1
+            zfinfos.append( {'name': name, 'zonefile_hash': zfhash, 'txid': txid, 'present': present, 'tried_storage': tried_storage, 'block_height': block_height} )
+
+        atlasdb_add_zonefile_infos( zfinfos, con=con )
+        total += len(zfinfos)
 
     log.debug("Queued %s zonefiles from %s-%s" % (total, start_block, db.lastblock))
     return True
@@ -867,18 +1727,13 @@ def atlasdb_sync_zonefiles( db, start_block, zonefile_dir=None, validate=True, p
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     atlasdb_queue_zonefiles( con, db, start_block, zonefile_dir=zonefile_dir, validate=validate )
     atlasdb_cache_zonefile_info( con=con )
 
-    if close:
-        con.close()
-
     return True
 
 
@@ -923,10 +1778,8 @@ def atlasdb_add_peer( peer_hostport, discovery_time=None, peer_table=None, con=N
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     if discovery_time is None:
@@ -958,9 +1811,6 @@ def atlasdb_add_peer( peer_hostport, discovery_time=None, peer_table=None, con=N
             if res:
                 log.debug("Peer %s is still alive; will not replace" % (old_hostport))
                 
-                if close:
-                    con.close()
-
                 return False
 
         # re-acquire
@@ -973,12 +1823,7 @@ def atlasdb_add_peer( peer_hostport, discovery_time=None, peer_table=None, con=N
     sql = "INSERT OR REPLACE INTO peers (peer_hostport, peer_slot, discovery_time) VALUES (?,?,?);"
     args = (peer_hostport, peer_slot, discovery_time)
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
-    con.commit()
-
-    if close:
-        con.close()
+    atlasdb_write_query( sql, args, con=con, path=path )
 
     # add to peer table as well
     atlas_init_peer_info( peer_table, peer_hostport, blacklisted=False, whitelisted=False )
@@ -999,10 +1844,8 @@ def atlasdb_remove_peer( peer_hostport, con=None, path=None, peer_table=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     log.debug("Delete peer '%s'" % peer_hostport)
@@ -1010,12 +1853,7 @@ def atlasdb_remove_peer( peer_hostport, con=None, path=None, peer_table=None ):
     sql = "DELETE FROM peers WHERE peer_hostport = ?;"
     args = (peer_hostport,)
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
-    con.commit()
-
-    if close:
-        con.close()
+    atlasdb_write_query( sql, args, con=con, path=path )
 
     # remove from the peer table as well
     locked = False
@@ -1027,6 +1865,9 @@ def atlasdb_remove_peer( peer_hostport, con=None, path=None, peer_table=None ):
         if not atlas_peer_is_whitelisted( peer_hostport, peer_table=peer_table ) and not atlas_peer_is_blacklisted( peer_hostport, peer_table=peer_table ):
             del peer_table[peer_hostport]
 
+            if ZONEFILE_AVAILABILITY is not None:
+                ZONEFILE_AVAILABILITY.remove_peer( peer_hostport )
+
     if locked:
         atlas_peer_table_unlock()
         peer_table = None
@@ -1041,10 +1882,8 @@ def atlasdb_num_peers( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT MAX(peer_index) FROM peers;"
@@ -1062,9 +1901,6 @@ def atlasdb_num_peers( con=None, path=None ):
 
     assert len(ret) == 1
 
-    if close:
-        con.close()
-
     return ret[0]['MAX(peer_index)']
 
 
@@ -1094,10 +1930,8 @@ def atlasdb_get_random_peer( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     ret = {}
@@ -1122,9 +1956,6 @@ def atlasdb_get_random_peer( con=None, path=None ):
             ret.update( row )
             break
 
-    if close:
-        con.close()
-
     return ret['peer_hostport']
 
 
@@ -1135,10 +1966,8 @@ def atlasdb_get_old_peers( now, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     if now is None:
@@ -1158,9 +1987,6 @@ def atlasdb_get_old_peers( now, con=None, path=None ):
         tmp.update(row)
         rows.append(tmp)
 
-    if close:
-        con.close()
-
     return rows
 
 
@@ -1171,10 +1997,8 @@ def atlasdb_renew_peer( peer_hostport, now, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     if now is None:
@@ -1183,12 +2007,7 @@ def atlasdb_renew_peer( peer_hostport, now, con=None, path=None ):
     sql = "UPDATE peers SET discovery_time = ? WHERE peer_hostport = ?;"
     args = (now, peer_hostport)
 
-    cur = con.cursor()
-    res = atlasdb_query_execute( cur, sql, args )
-    con.commit()
-
-    if close:
-        con.close()
+    atlasdb_write_query( sql, args, con=con, path=path )
 
     return True
 
@@ -1202,10 +2021,8 @@ def atlasdb_load_peer_table( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT * FROM peers;"
@@ -1224,9 +2041,6 @@ def atlasdb_load_peer_table( con=None, path=None ):
        atlas_init_peer_info( peer_table, row['peer_hostport'] )
        count += 1
 
-    if close:
-        con.close()
-
     return peer_table
 
 
@@ -1281,7 +2095,8 @@ def atlasdb_init( path, db, peer_seeds, peer_blacklist, validate=False, zonefile
         log.debug("Initializing Atlas DB at %s" % path)
 
         lines = [l + ";" for l in ATLASDB_SQL.split(";")]
-        con = sqlite3.connect( path, isolation_level=None )
+        con = sqlite3.connect( path, isolation_level=None, timeout=ATLASDB_BUSY_TIMEOUT )
+        con.execute( "PRAGMA journal_mode=WAL;" )
 
         for line in lines:
             con.execute(line)
@@ -1341,10 +2156,8 @@ def atlasdb_zonefile_inv_list( bit_offset, bit_length, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT * FROM zonefiles LIMIT ? OFFSET ?;"
@@ -1360,9 +2173,6 @@ def atlasdb_zonefile_inv_list( bit_offset, bit_length, con=None, path=None ):
         tmp.update(row)
         ret.append(tmp)
 
-    if close:
-        con.close()
-
     return ret
 
 
@@ -1373,10 +2183,8 @@ def atlasdb_zonefile_inv_length( con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT MAX(inv_index) FROM zonefiles;"
@@ -1402,9 +2210,6 @@ def atlasdb_zonefile_inv_length( con=None, path=None ):
 
     assert len(ret) == 1
 
-    if close:
-        con.close()
-
     if ret[0]['MAX(inv_index)'] is None:
         return 0
 
@@ -1421,10 +2226,8 @@ def atlasdb_zonefile_find_missing( bit_offset, bit_count, con=None, path=None ):
     if path is None:
         path = atlasdb_path()
 
-    close = False
     if con is None:
-        close = True
-        con = atlasdb_open( path )
+        con = atlasdb_get_connection( path )
         assert con is not None
 
     sql = "SELECT * FROM zonefiles WHERE present = 0 LIMIT ? OFFSET ?;"
@@ -1440,9 +2243,6 @@ def atlasdb_zonefile_find_missing( bit_offset, bit_count, con=None, path=None ):
         tmp.update(row)
         ret.append(tmp)
 
-    if close:
-        con.close()
-
     return ret
 
 
@@ -1512,6 +2312,84 @@ def atlas_get_zonefile_inventory( offset=None, length=None ):
     return ret
 
 
+def atlas_zonefile_inv_log_reset():
+    """
+    Start a new log of changes to our zonefile inventory
+    (i.e. because the inventory was reloaded).
+    Peers following the old log will re-fetch the whole inventory.
+    """
+    global ZONEFILE_INV_EPOCH, ZONEFILE_INV_SEQ, ZONEFILE_INV_CHANGES, ZONEFILE_INV_CHANGES_LOCK
+
+    with ZONEFILE_INV_CHANGES_LOCK:
+        ZONEFILE_INV_EPOCH = binascii.hexlify( os.urandom(8) )
+        ZONEFILE_INV_SEQ = 0
+        ZONEFILE_INV_CHANGES.clear()
+
+
+def atlas_zonefile_inv_log_changes( bit_indexes, present ):
+    """
+    Remember that the given bits in our zonefile inventory were set (present is True) or cleared.
+    """
+    global ZONEFILE_INV_EPOCH, ZONEFILE_INV_SEQ, ZONEFILE_INV_CHANGES, ZONEFILE_INV_CHANGES_LOCK
+
+    if ZONEFILE_INV_EPOCH is None:
+        atlas_zonefile_inv_log_reset()
+
+    with ZONEFILE_INV_CHANGES_LOCK:
+        for bit_index in bit_indexes:
+            ZONEFILE_INV_SEQ += 1
+            ZONEFILE_INV_CHANGES.append( (ZONEFILE_INV_SEQ, bit_index, bool(present)) )
+
+
+def atlas_get_zonefile_inventory_delta( epoch, seq ):
+    """
+    Get the changes to our zonefile inventory since change
+    number @seq of the change log @epoch.
+
+    Return {'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': False, 'set': [...], 'cleared': [...]},
+    where 'seq' is the number of the last change, 'inv_length' is the length of our inventory in bytes,
+    and 'set' and 'cleared' are the bit indexes whose latest change set or cleared them.
+
+    If the changes since @seq are unknown (i.e. @epoch is not the current change log, or the
+    changes are too old or too many), then return {'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': True},
+    in which case the caller should fetch the whole inventory and then ask for changes since 'seq'.
+    """
+    global ZONEFILE_INV, ZONEFILE_INV_EPOCH, ZONEFILE_INV_SEQ, ZONEFILE_INV_CHANGES, ZONEFILE_INV_CHANGES_LOCK
+
+    if ZONEFILE_INV_EPOCH is None:
+        atlas_zonefile_inv_log_reset()
+
+    with ZONEFILE_INV_CHANGES_LOCK:
+        ret = {
+            'epoch': ZONEFILE_INV_EPOCH,
+            'seq': ZONEFILE_INV_SEQ,
+            'inv_length': len(ZONEFILE_INV) if ZONEFILE_INV is not None else 0,
+            'full': True
+        }
+
+        if epoch != ZONEFILE_INV_EPOCH or seq > ZONEFILE_INV_SEQ or ZONEFILE_INV_SEQ - seq > ZONEFILE_INV_DELTA_MAX:
+            return ret
+
+        oldest_seq = ZONEFILE_INV_SEQ - len(ZONEFILE_INV_CHANGES) + 1
+        if seq + 1 < oldest_seq:
+            # forgot some of these changes
+            return ret
+
+        # newest first, so the first change we see to a bit is its latest
+        latest = {}
+        for (change_seq, bit_index, present) in reversed(ZONEFILE_INV_CHANGES):
+            if change_seq <= seq:
+                break
+
+            if not latest.has_key(bit_index):
+                latest[bit_index] = present
+
+    ret['full'] = False
+    ret['set'] = sorted( [bit_index for (bit_index, present) in latest.items() if present] )
+    ret['cleared'] = sorted( [bit_index for (bit_index, present) in latest.items() if not present] )
+    return ret
+
+
 def atlas_get_num_zonefiles():
     """
     Get the number of zonefiles we know about
@@ -1525,12 +2403,18 @@ def atlas_init_peer_info( peer_table, peer_hostport, blacklisted=False, whitelis
     Initialize peer info table entry
     """
     peer_table[peer_hostport] = {
-        "time": [],
-        "zonefile_inv": "",
+        "health": AtlasPeerHealth(),
+        "zonefile_inv": AtlasInventory(),
+        "zonefile_inv_epoch": None,     # the peer's inventory change log we're following (None if we aren't)
+        "zonefile_inv_seq": 0,          # the last change in that log we applied
+        "zonefile_inv_delta": True,     # can we ask the peer for inventory changes?
         "blacklisted": blacklisted,
         "whitelisted": whitelisted
     }
 
+    if ZONEFILE_AVAILABILITY is not None:
+        ZONEFILE_AVAILABILITY.remove_peer( peer_hostport )
+
 
 def atlas_log_socket_error( method_invocation, peer_hostport, se ):
     """
@@ -1664,20 +2548,10 @@ def atlas_inventory_count_missing( inv1, inv2 ):
     Find out how many bits are set in inv2 
     that are not set in inv1.
     """
-    count = 0
-    common = min(len(inv1), len(inv2))
-    for i in xrange(0, common):
-        for j in xrange(0, 8):
-            if ((1 << (7 - j)) & ord(inv2[i])) != 0 and ((1 << (7 - j)) & ord(inv1[i])) == 0:
-                count += 1
-
-    if len(inv1) < len(inv2):
-        for i in xrange(len(inv1), len(inv2)):
-            for j in xrange(0, 8):
-                if ((1 << (7 - j)) & ord(inv2[i])) != 0:
-                    count += 1
+    if not isinstance(inv2, AtlasInventory):
+        inv2 = AtlasInventory(inv2)
 
-    return count
+    return inv2.and_not(inv1).popcount()
 
 
 def atlas_get_live_neighbors( remote_peer_hostport, peer_table=None, min_health=MIN_PEER_HEALTH, min_request_count=1 ):
@@ -1784,17 +2658,9 @@ def atlas_peer_get_health( peer_hostport, peer_table=None ):
         peer_table = atlas_peer_table_lock()
 
     # availability score: number of responses / number of requests
-    num_responses = 0
-    num_requests = 0
-    if peer_table.has_key(peer_hostport):
-        for (t, r) in peer_table[peer_hostport]['time']:
-            num_requests += 1
-            if r:
-                num_responses += 1
-
     availability_score = 0.0
-    if num_requests > 0:
-        availability_score = float(num_responses) / float(num_requests)
+    if peer_table.has_key(peer_hostport):
+        availability_score = peer_table[peer_hostport]['health'].get_health( time_now() )
 
     if locked:
         atlas_peer_table_unlock()
@@ -1812,17 +2678,14 @@ def atlas_peer_get_request_count( peer_hostport, peer_table=None ):
         locked = True
         peer_table = atlas_peer_table_lock()
 
-    if peer_hostport not in peer_table.keys():
+    if not peer_table.has_key(peer_hostport):
         if locked:
             atlas_peer_table_unlock()
             peer_table = None
 
         return 0
 
-    count = 0
-    for (t, r) in peer_table[peer_hostport]['time']:
-        if r:
-            count += 1
+    count = peer_table[peer_hostport]['health'].get_response_count( time_now() )
 
     if locked:
         atlas_peer_table_unlock()
@@ -1859,7 +2722,8 @@ def atlas_peer_get_zonefile_inventory( peer_hostport, peer_table=None ):
 
 def atlas_peer_set_zonefile_inventory( peer_hostport, peer_inv, peer_table=None ):
     """
-    Set this peer's zonefile inventory
+    Set this peer's zonefile inventory.
+    The peer table gets its own copy.
     """
     locked = False
     if peer_table is None:
@@ -1873,7 +2737,10 @@ def atlas_peer_set_zonefile_inventory( peer_hostport, peer_inv, peer_table=None
 
         return None 
 
-    peer_table[peer_hostport]['zonefile_inv'] = peer_inv
+    peer_table[peer_hostport]['zonefile_inv'] = AtlasInventory(peer_inv)
+
+    if ZONEFILE_AVAILABILITY is not None:
+        ZONEFILE_AVAILABILITY.update_peer( peer_hostport, peer_table[peer_hostport]['zonefile_inv'] )
 
     if locked:
         atlas_peer_table_unlock()
@@ -1947,7 +2814,7 @@ def atlas_peer_update_health( peer_hostport, received_response, peer_table=None
         locked = True 
         peer_table = atlas_peer_table_lock()
 
-    if peer_hostport not in peer_table.keys():
+    if not peer_table.has_key(peer_hostport):
         if locked:
             atlas_peer_table_unlock()
             peer_table = None
@@ -1956,17 +2823,7 @@ def atlas_peer_update_health( peer_hostport, received_response, peer_table=None
 
     # record that we contacted this peer, and whether or not we useful info from it
     now = time_now()
-
-    # update timestamps; remove old data
-    new_times = []
-    for (t, r) in peer_table[peer_hostport]['time']:
-        if t + atlas_peer_lifetime_interval() < now:
-            continue
-        
-        new_times.append((t, r))
-
-    new_times.append((now, received_response))
-    peer_table[peer_hostport]['time'] = new_times
+    peer_table[peer_hostport]['health'].record( now, received_response )
 
     if locked:
         atlas_peer_table_unlock()
@@ -2049,13 +2906,13 @@ def atlas_peer_download_zonefile_inventory( my_hostport, peer_hostport, maxlen,
         timeout = atlas_inv_timeout()
 
     interval = 524288       # number of bits in 64KB
-    peer_inv = ""
+    peer_inv = AtlasInventory()
 
     log.debug("Download zonefile inventory %s-%s from %s" % (bit_offset, maxlen, peer_hostport))
 
     if bit_offset > maxlen:
         # synced already
-        return peer_inv
+        return str(peer_inv)
 
     for offset in xrange( bit_offset, maxlen, interval):
         next_inv = atlas_peer_get_zonefile_inventory_range( my_hostport, peer_hostport, offset, interval, timeout=timeout, peer_table=peer_table )
@@ -2064,19 +2921,19 @@ def atlas_peer_download_zonefile_inventory( my_hostport, peer_hostport, maxlen,
             log.debug("Failed to sync inventory for %s from %s to %s" % (peer_hostport, offset, offset+interval))
             break
 
-        peer_inv += next_inv
+        peer_inv.extend( next_inv )
         if len(next_inv) < interval:
             # end-of-interval
             break
 
-    return peer_inv
+    return str(peer_inv)
 
 
 
 def atlas_peer_sync_zonefile_inventory( my_hostport, peer_hostport, maxlen, timeout=None, peer_table=None ):
     """
     Synchronize our knowledge of a peer's zonefiles up to a given byte length
-    NOT THREAD SAFE; CALL FROM ONLY ONE THREAD.
+    Sync a given peer from only one thread at a time.
 
     maxlen is the maximum length in bits of the expected zonefile.
 
@@ -2113,31 +2970,130 @@ def atlas_peer_sync_zonefile_inventory( my_hostport, peer_hostport, maxlen, time
         atlas_peer_table_unlock()
         peer_table = None
 
-    peer_inv = atlas_peer_download_zonefile_inventory( my_hostport, peer_hostport, maxlen, bit_offset=bit_offset, timeout=timeout, peer_table=peer_table )
-   
-    if locked:
+    peer_inv = atlas_peer_download_zonefile_inventory( my_hostport, peer_hostport, maxlen, bit_offset=bit_offset, timeout=timeout, peer_table=peer_table )
+   
+    if locked:
+        peer_table = atlas_peer_table_lock()
+
+    if peer_hostport not in peer_table.keys():
+        if locked:
+            atlas_peer_table_unlock()
+            peer_table = None
+
+        log.debug("%s no longer a peer" % peer_hostport)
+        return None 
+
+    inv_str = atlas_inventory_to_string(peer_inv)
+    if len(inv_str) > 40:
+        inv_str = inv_str[:40] + "..."
+
+    log.debug("Set zonefile inventory %s: %s" % (peer_hostport, inv_str))
+    atlas_peer_set_zonefile_inventory( peer_hostport, peer_inv, peer_table=peer_table ) # NOTE: may have trailing 0's for padding
+
+    if locked:
+        atlas_peer_table_unlock()
+        peer_table = None
+
+    return peer_inv
+
+
+def atlas_peer_get_zonefile_inventory_delta( my_hostport, peer_hostport, epoch, seq, timeout=None, peer_table=None ):
+    """
+    Ask a peer what changed in its zonefile inventory since change @seq of its change log @epoch.
+    Update peer health information if it answers.
+
+    Return the delta (see atlas_get_zonefile_inventory_delta()) on success.
+    Return None if the peer didn't answer (i.e. it timed out, or replied with an error)
+    Return False if the peer can't answer (i.e. it doesn't support the method)
+    """
+    if timeout is None:
+        timeout = atlas_inv_timeout()
+
+    host, port = url_to_host_port( peer_hostport )
+    RPC = get_rpc_client_class()
+    rpc = RPC( host, port, timeout=timeout, src=my_hostport )
+
+    assert not atlas_peer_table_is_locked_by_me()
+
+    delta = None
+    try:
+        delta = blockstack_get_zonefile_inventory_delta( peer_hostport, epoch if epoch is not None else "", seq, timeout=timeout, my_hostport=my_hostport, proxy=rpc )
+
+    except (socket.timeout, socket.gaierror, socket.herror, socket.error), se:
+        atlas_log_socket_error( "get_zonefile_inventory_delta(%s, %s, %s)" % (peer_hostport, epoch, seq), peer_hostport, se )
+        return None
+
+    except Exception, e:
+        if os.environ.get("BLOCKSTACK_DEBUG") == "1":
+            log.exception(e)
+
+        log.error("Failed to ask %s for zonefile inventory changes" % peer_hostport)
+        return None
+
+    if delta is None or 'error' in delta:
+        error = delta.get('error', None) if delta is not None else None
+        log.debug("No zonefile inventory delta from %s: %s" % (peer_hostport, error))
+
+        # older peers don't have this method; they fail to look it up
+        if error is not None and ('Method not supported' in error or 'rpc_get_zonefile_inventory_delta' in error):
+            return False
+
+        return None
+
+    atlas_peer_update_health( peer_hostport, True, peer_table=peer_table )
+    return delta
+
+
+def atlas_peer_apply_zonefile_inventory_delta( peer_hostport, delta, maxlen, peer_table=None ):
+    """
+    Apply a peer's inventory changes to our copy of its inventory,
+    and advance our position in its inventory change log.
+    The peer's inventory is not grown past maxlen bytes (i.e. the length
+    of our own inventory), and changes to bits past it are rejected.
+
+    Return True on success
+    Return False if the peer is not in the peer table, or the delta is out of range
+    """
+    for bit_index in delta['set'] + delta['cleared']:
+        if bit_index >= maxlen * 8:
+            log.debug("%s: inventory change to bit %s is past our inventory (%s bytes)" % (peer_hostport, bit_index, maxlen))
+            return False
+
+    inv_length = min(delta['inv_length'], maxlen)
+
+    locked = False
+    if peer_table is None:
+        locked = True
         peer_table = atlas_peer_table_lock()
 
-    if peer_hostport not in peer_table.keys():
+    if not peer_table.has_key(peer_hostport):
         if locked:
             atlas_peer_table_unlock()
             peer_table = None
 
-        log.debug("%s no longer a peer" % peer_hostport)
-        return None 
+        return False
 
-    inv_str = atlas_inventory_to_string(peer_inv)
-    if len(inv_str) > 40:
-        inv_str = inv_str[:40] + "..."
+    peer_inv = peer_table[peer_hostport]['zonefile_inv']
+    if len(peer_inv) < inv_length:
+        # new zonefiles
+        peer_inv.extend( '\0' * (inv_length - len(peer_inv)) )
 
-    log.debug("Set zonefile inventory %s: %s" % (peer_hostport, inv_str))
-    atlas_peer_set_zonefile_inventory( peer_hostport, peer_inv, peer_table=peer_table ) # NOTE: may have trailing 0's for padding
+    peer_inv.set_bits( delta['set'] )
+    peer_inv.clear_bits( delta['cleared'] )
+
+    if ZONEFILE_AVAILABILITY is not None:
+        ZONEFILE_AVAILABILITY.update_peer_bits( peer_hostport, delta['set'], True )
+        ZONEFILE_AVAILABILITY.update_peer_bits( peer_hostport, delta['cleared'], False )
+
+    peer_table[peer_hostport]['zonefile_inv_epoch'] = delta['epoch']
+    peer_table[peer_hostport]['zonefile_inv_seq'] = delta['seq']
+    peer_table[peer_hostport]['zonefile_inventory_last_refresh'] = time_now()
 
     if locked:
         atlas_peer_table_unlock()
         peer_table = None
 
-    return peer_inv
+    return True
 
 
 def atlas_peer_refresh_zonefile_inventory( my_hostport, peer_hostport, byte_offset, timeout=None, peer_table=None, con=None, path=None, local_inv=None ):
@@ -2150,7 +3106,10 @@ def atlas_peer_refresh_zonefile_inventory( my_hostport, peer_hostport, byte_offs
     of the peer's zonefile inventory is a lot less stable than the head (since
     peers will be actively distributing recent zonefiles).
 
-    NOT THREAD SAFE; CALL FROM ONLY ONE THREAD.
+    If the peer keeps an inventory change log, then once we have its whole
+    inventory, we only ask it for the bits that changed since the last refresh.
+
+    Refresh a given peer from only one thread at a time.
 
     Return True if we synced all the way up to the expected inventory length, and update the refresh time in the peer table.
     Return False if not.
@@ -2159,6 +3118,27 @@ def atlas_peer_refresh_zonefile_inventory( my_hostport, peer_hostport, byte_offs
     if timeout is None:
         timeout = atlas_inv_timeout()
 
+    # where are we in the peer's inventory change log?
+    locked = False
+    if peer_table is None:
+        locked = True
+        peer_table = atlas_peer_table_lock()
+
+    if not peer_table.has_key(peer_hostport):
+        if locked:
+            atlas_peer_table_unlock()
+            peer_table = None
+
+        return False
+
+    use_delta = peer_table[peer_hostport].get('zonefile_inv_delta', False)
+    epoch = peer_table[peer_hostport].get('zonefile_inv_epoch', None)
+    seq = peer_table[peer_hostport].get('zonefile_inv_seq', 0)
+
+    if locked:
+        atlas_peer_table_unlock()
+        peer_table = None
+
     if local_inv is None:
         # get local zonefile inv 
         inv_len = atlasdb_zonefile_inv_length( con=con, path=path )
@@ -2166,6 +3146,31 @@ def atlas_peer_refresh_zonefile_inventory( my_hostport, peer_hostport, byte_offs
 
     maxlen = len(local_inv)
 
+    delta = None
+    if use_delta:
+        delta = atlas_peer_get_zonefile_inventory_delta( my_hostport, peer_hostport, epoch, seq, timeout=timeout, peer_table=peer_table )
+        if delta is False:
+            # peer doesn't do deltas; don't ask again
+            if locked:
+                peer_table = atlas_peer_table_lock()
+
+            if peer_table.has_key(peer_hostport):
+                peer_table[peer_hostport]['zonefile_inv_delta'] = False
+
+            if locked:
+                atlas_peer_table_unlock()
+                peer_table = None
+
+            delta = None
+
+        elif delta is not None and not delta['full'] and epoch is not None:
+            log.debug("%s: %s set %s and cleared %s inventory bits" % (my_hostport, peer_hostport, len(delta['set']), len(delta['cleared'])))
+            if atlas_peer_apply_zonefile_inventory_delta( peer_hostport, delta, maxlen, peer_table=peer_table ):
+                return True
+
+            # out of range; re-fetch the whole inventory (up to maxlen) instead
+            delta = None
+
     locked = False
     if peer_table is None:
         locked = True
@@ -2201,6 +3206,15 @@ def atlas_peer_refresh_zonefile_inventory( my_hostport, peer_hostport, byte_offs
     # Update refresh time (even if we fail)
     peer_table[peer_hostport]['zonefile_inventory_last_refresh'] = time_now()
 
+    # follow the peer's change log from here on (its position was taken before we fetched the inventory)
+    if inv is not None and delta is not None:
+        peer_table[peer_hostport]['zonefile_inv_epoch'] = delta['epoch']
+        peer_table[peer_hostport]['zonefile_inv_seq'] = delta['seq']
+
+    else:
+        peer_table[peer_hostport]['zonefile_inv_epoch'] = None
+        peer_table[peer_hostport]['zonefile_inv_seq'] = 0
+
     if locked:
         atlas_peer_table_unlock()
         peer_table = None
@@ -2272,8 +3286,10 @@ def atlas_peer_set_zonefile_status( peer_hostport, zonefile_hash, present, zonef
 
     if peer_table.has_key(peer_hostport):
         peer_inv = atlas_peer_get_zonefile_inventory( peer_hostport, peer_table=peer_table )
-        peer_inv = atlas_inventory_flip_zonefile_bits( peer_inv, zonefile_bits, present )
-        atlas_peer_set_zonefile_inventory( peer_hostport, peer_inv, peer_table=peer_table )
+        peer_inv.flip_bits( zonefile_bits, present )
+
+        if ZONEFILE_AVAILABILITY is not None:
+            ZONEFILE_AVAILABILITY.update_peer_bits( peer_hostport, zonefile_bits, present )
                 
     if locked:
         atlas_peer_table_unlock()
@@ -2293,6 +3309,10 @@ def atlas_find_missing_zonefile_availability( peer_table=None, con=None, path=No
     every so often to make sure we detect when zonefiles
     become available).
 
+    If missing_zonefile_info is not given, this is answered from the
+    incrementally-maintained availability index (see
+    AtlasZonefileAvailability) whenever it has been loaded.
+
     Return a dict, structured as:
     {
         'zonefile hash': {
@@ -2306,6 +3326,11 @@ def atlas_find_missing_zonefile_availability( peer_table=None, con=None, path=No
     }
     """
 
+    if missing_zonefile_info is None and ZONEFILE_AVAILABILITY is not None:
+        ret = ZONEFILE_AVAILABILITY.get_availability()
+        log.debug("Missing %s zonefiles" % len(ret))
+        return ret
+
     # which zonefiles do we have?
     bit_offset = 0
     bit_count = 10000
@@ -2335,48 +3360,15 @@ def atlas_find_missing_zonefile_availability( peer_table=None, con=None, path=No
         locked = True
         peer_table = atlas_peer_table_lock()
 
-    # do any other peers have this zonefile?
-    for zfinfo in missing:
-        popularity = 0
-        byte_index = (zfinfo['inv_index'] - 1) / 8
-        bit_index = 7 - ((zfinfo['inv_index'] - 1) % 8)
-        peers = []
-
-        if not ret.has_key(zfinfo['zonefile_hash']):
-            ret[zfinfo['zonefile_hash']] = {
-                'names': [],
-                'txid': zfinfo['txid'],
-                'indexes': [],
-                'popularity': 0,
-                'peers': [],
-                'tried_storage': False
-            }
-
-        for peer_hostport in peer_table.keys():
-            peer_inv = atlas_peer_get_zonefile_inventory( peer_hostport, peer_table=peer_table )
-            if len(peer_inv) <= byte_index:
-                # too new for this peer
-                continue
-
-            if (ord(peer_inv[byte_index]) & (1 << bit_index)) == 0:
-                # this peer doesn't have it
-                continue
-
-            if peer_hostport not in ret[zfinfo['zonefile_hash']]['peers']:
-                popularity += 1
-                peers.append( peer_hostport )
-
-        ret[zfinfo['zonefile_hash']]['names'].append( zfinfo['name'] )
-        ret[zfinfo['zonefile_hash']]['indexes'].append( zfinfo['inv_index']-1 )
-        ret[zfinfo['zonefile_hash']]['popularity'] += popularity
-        ret[zfinfo['zonefile_hash']]['peers'] += peers
-        ret[zfinfo['zonefile_hash']]['tried_storage'] = zfinfo['tried_storage']
+    availability = AtlasZonefileAvailability( missing )
+    for peer_hostport in peer_table.keys():
+        availability.update_peer( peer_hostport, atlas_peer_get_zonefile_inventory( peer_hostport, peer_table=peer_table ) )
 
     if locked:
         atlas_peer_table_unlock()
         peer_table = None
 
-    return ret
+    return availability.get_availability()
 
 
 def atlas_peer_has_zonefile( peer_hostport, zonefile_hash, zonefile_bits=None, con=None, path=None, peer_table=None ):
@@ -2726,7 +3718,7 @@ def atlas_zonefile_find_push_peers( zonefile_hash, peer_table=None, zonefile_bit
     for peer_hostport in peer_table.keys():
         zonefile_inv = atlas_peer_get_zonefile_inventory( peer_hostport, peer_table=peer_table )
         res = atlas_inventory_test_zonefile_bits( zonefile_inv, zonefile_bits )
-        if res:
+        if not res:
             push_peers.append( peer_hostport )
 
     if table_locked:
@@ -2770,6 +3762,10 @@ def atlas_zonefile_push_enqueue( zonefile_hash, name, txid, zonefile_data, zonef
     
     if zonefile_queue_locked:
         atlas_zonefile_queue_unlock()
+
+    if not res:
+        log.warning("Zonefile push queue is full; dropping %s" % zonefile_hash)
+        atlas_zonefile_push_stats_update( num_dropped=1 )
             
     return res
 
@@ -2794,32 +3790,61 @@ def atlas_zonefile_push_dequeue( zonefile_queue=None ):
     return ret
 
 
-def atlas_zonefile_push( my_hostport, peer_hostport, zonefile_data, timeout=None, peer_table=None ):
+def atlas_zonefile_push_dequeue_batch( max_count, zonefile_queue=None ):
     """
-    Push the given zonefile to the given peer
-    Return True on success
-    Return False on failure
+    Dequeue up to max_count zonefiles' information to replicate
+    Return the list of them (empty if there are none queued)
+    """
+    zonefile_queue_locked = False
+    if zonefile_queue is None:
+        zonefile_queue = atlas_zonefile_queue_lock()
+        zonefile_queue_locked = True
+
+    ret = zonefile_queue[:max_count]
+    del zonefile_queue[:max_count]
+
+    if zonefile_queue_locked:
+        atlas_zonefile_queue_unlock()
+
+    return ret
+
+
+def atlas_zonefile_push_batch( my_hostport, peer_hostport, zonefile_datas, timeout=None, peer_table=None ):
     """
+    Push the given zonefiles to the given peer in one request
+    (there can be at most PEER_PUSH_ZONEFILE_BATCH_SIZE of them).
+    Return the list of hashes of the zonefiles the peer saved.
+    """
+    assert len(zonefile_datas) <= PEER_PUSH_ZONEFILE_BATCH_SIZE
+
     if timeout is None:
         timeout = atlas_push_zonefiles_timeout()
    
-    zonefile_hash = blockstack_client.get_zonefile_data_hash(zonefile_data)
-    zonefile_data_b64 = base64.b64encode( zonefile_data )
+    zonefile_hashes = [blockstack_client.get_zonefile_data_hash(zonefile_data) for zonefile_data in zonefile_datas]
+    zonefile_datas_b64 = [base64.b64encode( zonefile_data ) for zonefile_data in zonefile_datas]
 
     host, port = url_to_host_port( peer_hostport )
     RPC = get_rpc_client_class()
     rpc = RPC( host, port, timeout=timeout, src=my_hostport )
 
     status = False
+    saved = []
 
     assert not atlas_peer_table_is_locked_by_me()
 
+    t1 = time.time()
     try:
-        push_info = blockstack_put_zonefiles( peer_hostport, [zonefile_data_b64], timeout=timeout, my_hostport=my_hostport, proxy=rpc )
+        push_info = blockstack_put_zonefiles( peer_hostport, zonefile_datas_b64, timeout=timeout, my_hostport=my_hostport, proxy=rpc )
         if 'error' not in push_info:
-            if push_info['saved'] == 1:
-                # woo!
-                saved = True
+            # got a valid response
+            status = True
+            for i in xrange(0, len(zonefile_hashes)):
+                if push_info['saved'][i] == 1:
+                    # woo!
+                    saved.append( zonefile_hashes[i] )
+
+        else:
+            log.error("Failed to push %s zonefiles to %s: %s" % (len(zonefile_hashes), peer_hostport, push_info['error']))
 
     except (socket.timeout, socket.gaierror, socket.herror, socket.error), se:
         atlas_log_socket_error( "put_zonefiles(%s)" % peer_hostport, peer_hostport, se)
@@ -2830,7 +3855,10 @@ def atlas_zonefile_push( my_hostport, peer_hostport, zonefile_data, timeout=None
 
     except Exception, e:
         log.exception(e)
-        log.error("Failed to push zonefile %s to %s" % (zonefile_hash, peer_hostport))
+        log.error("Failed to push %s zonefiles to %s" % (len(zonefile_hashes), peer_hostport))
+
+    t2 = time.time()
+    atlas_zonefile_push_stats_update( num_pushed=len(saved), num_failed=len(zonefile_hashes) - len(saved), latency=t2 - t1 )
 
     locked = False
     if peer_table is None:
@@ -2843,7 +3871,17 @@ def atlas_zonefile_push( my_hostport, peer_hostport, zonefile_data, timeout=None
         atlas_peer_table_unlock()
         peer_table = None
 
-    return status
+    return saved
+
+
+def atlas_zonefile_push( my_hostport, peer_hostport, zonefile_data, timeout=None, peer_table=None ):
+    """
+    Push the given zonefile to the given peer
+    Return True on success
+    Return False on failure
+    """
+    saved = atlas_zonefile_push_batch( my_hostport, peer_hostport, [zonefile_data], timeout=timeout, peer_table=peer_table )
+    return len(saved) == 1
     
 
 class AtlasPeerCrawler( threading.Thread ):
@@ -3324,18 +4362,40 @@ class AtlasHealthChecker( threading.Thread ):
     Also finds unhealthy or old peers and removes them
     from the peer table and peer db.
     """
-    def __init__(self, my_host, my_port, path=None):
+    def __init__(self, my_host, my_port, path=None, num_refresh_threads=PEER_HEALTH_REFRESH_THREADS):
         threading.Thread.__init__(self)
         self.running = False
         self.path = path
         self.hostport = "%s:%s" % (my_host, my_port)
         self.last_clean_time = 0
+        self.num_refresh_threads = num_refresh_threads
         if path is None:
             path = atlasdb_path()
         
         self.atlasdb_path = path
 
 
+    def refresh_worker(self, refresh_queue, path, local_inv):
+        """
+        Refresh thread body for step().
+        Refresh peers' zonefile inventories until we dequeue None.
+        """
+        while True:
+            peer_hostport = refresh_queue.get()
+            if peer_hostport is None:
+                break
+
+            try:
+                log.debug("%s: Refresh zonefile inventory for %s" % (self.hostport, peer_hostport))
+                res = atlas_peer_refresh_zonefile_inventory( self.hostport, peer_hostport, 0, path=path, local_inv=local_inv )
+                if not res:
+                    log.warning("Failed to refresh zonefile inventory for %s" % peer_hostport)
+
+            except Exception, e:
+                log.exception(e)
+                log.error("Failed to refresh zonefile inventory for %s" % peer_hostport)
+
+
     def step(self, con=None, path=None, peer_table=None, local_inv=None):
         """
         Find peers with stale zonefile inventory data,
@@ -3376,13 +4436,32 @@ class AtlasHealthChecker( threading.Thread ):
         if len(stale_peers) > 0:
             log.debug("Refresh zonefile inventories for %s peers" % len(stale_peers))
 
+        if peer_table is not None or self.num_refresh_threads <= 1 or len(stale_peers) <= 1:
+            # refresh everyone, one at a time (we can't share the caller's peer table across threads)
+            for peer_hostport in stale_peers:
+                log.debug("%s: Refresh zonefile inventory for %s" % (self.hostport, peer_hostport))
+                res = atlas_peer_refresh_zonefile_inventory( self.hostport, peer_hostport, 0, con=con, path=path, peer_table=peer_table, local_inv=local_inv )
+                if not res:
+                    log.warning("Failed to refresh zonefile inventory for %s" % peer_hostport)
+
+            return
+
+        # refresh everyone at once, so slow peers don't hold up the others
+        refresh_queue = Queue.Queue()
         for peer_hostport in stale_peers:
-            # refresh everyone
-            log.debug("%s: Refresh zonefile inventory for %s" % (self.hostport, peer_hostport))
-            res = atlas_peer_refresh_zonefile_inventory( self.hostport, peer_hostport, 0, con=con, path=path, peer_table=peer_table, local_inv=local_inv )
-            if res is None:
-                log.warning("Failed to refresh zonefile inventory for %s" % peer_hostport)
-        
+            refresh_queue.put( peer_hostport )
+
+        workers = []
+        for i in xrange(0, min(self.num_refresh_threads, len(stale_peers))):
+            refresh_queue.put( None )
+            worker = threading.Thread( target=self.refresh_worker, args=(refresh_queue, path, local_inv) )
+            worker.daemon = True
+            worker.start()
+            workers.append( worker )
+
+        for worker in workers:
+            worker.join()
+
         return 
 
 
@@ -3417,7 +4496,7 @@ class AtlasZonefileCrawler( threading.Thread ):
     zonefiles that we don't have.
     """
 
-    def __init__(self, my_host, my_port, zonefile_storage_drivers=[], path=None, zonefile_dir=None):
+    def __init__(self, my_host, my_port, zonefile_storage_drivers=[], path=None, zonefile_dir=None, num_fetch_threads=PEER_CRAWL_ZONEFILE_FETCH_THREADS):
         threading.Thread.__init__(self)
         self.running = False
         self.hostport = "%s:%s" % (my_host, my_port)
@@ -3425,6 +4504,7 @@ class AtlasZonefileCrawler( threading.Thread ):
         self.zonefile_storage_drivers = zonefile_storage_drivers
         self.zonefile_dir = zonefile_dir
         self.last_storage_reset = time_now()
+        self.num_fetch_threads = num_fetch_threads
         if self.path is None:
             self.path = atlasdb_path()
 
@@ -3456,11 +4536,8 @@ class AtlasZonefileCrawler( threading.Thread ):
         Return the list of zonefile hashes stored.
         """
         ret = []
-        close = False
-
         if con is None:
-            close = True
-            con = atlasdb_open( path )
+            con = atlasdb_get_connection( path )
             assert con is not None
 
         for fetched_zfhash, zonefile_txt in zonefiles.items():
@@ -3495,12 +4572,278 @@ class AtlasZonefileCrawler( threading.Thread ):
                 ret.append( fetched_zfhash )
 
 
-        if close:
-            con.close()
-
         return ret
 
 
+    def fetch_worker( self, fetch_queue, result_queue ):
+        """
+        Fetch thread body for step_concurrent().
+        Process fetch requests until we dequeue None.
+
+        A request is ("storage", [zonefile hash], name) or (peer_hostport, [zonefile hashes], None).
+        A result is (source, [requested zonefile hashes], {zonefile hash: zonefile data} or None).
+        """
+        while True:
+            req = fetch_queue.get()
+            if req is None:
+                break
+
+            source, zonefile_hashes, name = req
+            zonefiles = None
+
+            try:
+                if source == "storage":
+                    zfhash = zonefile_hashes[0]
+                    log.debug("Try loading %s from storage" % zfhash)
+
+                    zonefile_info = atlas_get_zonefile_data_from_storage( name, zfhash, self.zonefile_storage_drivers )
+                    atlasdb_set_zonefile_tried_storage( zfhash, True, path=self.path )
+
+                    if 'error' in zonefile_info:
+                        log.error("%s: Failed to get zonefile '%s' from storage" % (self.hostport, zfhash))
+                    else:
+                        zonefiles = {zfhash: zonefile_info['zonefile_data']}
+
+                else:
+                    log.debug("%s: get %s zonefiles from %s" % (self.hostport, len(zonefile_hashes), source))
+                    zonefiles = atlas_get_zonefiles( self.hostport, source, zonefile_hashes )
+
+            except Exception, e:
+                log.exception(e)
+                zonefiles = None
+
+            result_queue.put( (source, zonefile_hashes, zonefiles) )
+
+
+    def store_zonefile_batch( self, batch, zonefile_txids, path, con ):
+        """
+        Writer stage for step_concurrent().
+        Validate and store a batch of fetched zonefiles, flush them
+        to disk together, and only then mark them present.
+
+        batch is a list of (zonefile hash, zonefile data, source).
+        Return the list of zonefile hashes stored.
+        """
+        stored = []
+        for (zfhash, zonefile_txt, source) in batch:
+
+            if get_zonefile_data_hash( zonefile_txt ) != zfhash:
+                log.warn("%s: Corrupt zonefile %s from %s" % (self.hostport, zfhash, source))
+                continue
+
+            zftxid = zonefile_txids[zfhash]
+            if atlasdb_find_zonefile_by_txid( zftxid, path=path, con=con ) is None:
+                # don't know about this txid 
+                log.warn("%s: Unknown txid %s for %s" % (self.hostport, zftxid, zfhash))
+                continue
+
+            rc = store_zonefile_data_to_storage( zonefile_txt, zftxid, required=self.zonefile_storage_drivers, cache=True, zonefile_dir=self.zonefile_dir, tx_required=False, fsync=False )
+            if not rc:
+                log.error("%s: Failed to store zonefile %s" % (self.hostport, zfhash))
+                continue
+
+            log.debug("%s: got %s from %s" % (self.hostport, zfhash, source))
+            stored.append( zfhash )
+
+        if len(stored) == 0:
+            return []
+
+        if not sync_cached_zonefile_data( stored, zonefile_dir=self.zonefile_dir ):
+            log.error("%s: Failed to flush %s zonefiles" % (self.hostport, len(stored)))
+            return []
+
+        atlasdb_set_zonefiles_present( stored, True, con=con, path=path )
+
+        atlas_zonefile_fetch_stats_update( len(stored) )
+        return stored
+
+
+    def schedule_zonefile_fetches( self, zonefile_hashes, missing_zfinfo, pending, tried_peers, peer_health ):
+        """
+        Plan one round of requests for step_concurrent().
+        Go through the pending zonefiles in rarest-first order, and
+        give each one to the least-loaded healthy peer that has it (and
+        that we haven't tried yet for it), without exceeding
+        PEER_CRAWL_ZONEFILE_MAX_INFLIGHT requests of at most
+        PEER_CRAWL_ZONEFILE_BATCH_SIZE zonefiles per peer.
+
+        Return the list of (peer_hostport, [zonefile hashes]) requests,
+        ordered by when their rarest zonefile was scheduled.
+        """
+        max_per_peer = PEER_CRAWL_ZONEFILE_MAX_INFLIGHT * PEER_CRAWL_ZONEFILE_BATCH_SIZE
+        assigned = {}       # map peer hostport to list of zonefile hashes
+        peer_order = []
+
+        for zfhash in zonefile_hashes:
+            if zfhash not in pending:
+                continue
+
+            candidates = []
+            for peer_hostport in missing_zfinfo[zfhash]['peers']:
+                if peer_hostport in tried_peers.get(zfhash, set([])):
+                    continue
+
+                if len(assigned.get(peer_hostport, [])) >= max_per_peer:
+                    continue
+
+                health = peer_health.get(peer_hostport, 0.0)
+                candidates.append( (health < MIN_PEER_HEALTH, len(assigned.get(peer_hostport, [])), -health, peer_hostport) )
+
+            if len(candidates) == 0:
+                continue
+
+            candidates.sort()
+            peer_hostport = candidates[0][-1]
+            if not assigned.has_key(peer_hostport):
+                assigned[peer_hostport] = []
+                peer_order.append( peer_hostport )
+
+            assigned[peer_hostport].append( zfhash )
+
+        requests = []
+        for peer_hostport in peer_order:
+            for i in xrange(0, len(assigned[peer_hostport]), PEER_CRAWL_ZONEFILE_BATCH_SIZE):
+                requests.append( (peer_hostport, assigned[peer_hostport][i:i+PEER_CRAWL_ZONEFILE_BATCH_SIZE]) )
+
+        return requests
+
+
+    def step_concurrent(self, path=None):
+        """
+        Run one step of the algorithm in step(), but fetch from
+        many peers (and storage) at once:
+        * a pool of fetch threads sends batched requests to multiple
+        peers, with a bounded number of requests outstanding per peer
+        * this thread stores the results in batches as they come in.
+
+        Zonefiles are still scheduled rarest-first.  Zonefiles a peer
+        failed to deliver are re-scheduled on other peers in later rounds.
+
+        Return the number of zonefiles fetched
+        """
+        if os.environ.get("BLOCKSTACK_TEST", None) == "1":
+            log.debug("%s: %s concurrent step" % (self.hostport, self.__class__.__name__))
+
+        if path is None:
+            path = self.path
+
+        num_fetched = 0
+
+        peer_table = atlas_peer_table_lock()
+        missing_zfinfo = atlas_find_missing_zonefile_availability( peer_table=peer_table, path=path )
+        peer_health = dict( [(peer_hostport, health) for (health, peer_hostport) in atlas_rank_peers_by_health( peer_table=peer_table, with_zero_requests=True, with_rank=True )] )
+        atlas_peer_table_unlock()
+        peer_table = None
+
+        # ask for zonefiles in rarest-first order
+        zonefile_ranking = [ (missing_zfinfo[zfhash]['popularity'], zfhash) for zfhash in missing_zfinfo.keys() ]
+        zonefile_ranking.sort()
+        zonefile_hashes = []
+        cached_hashes = []
+        for (_, zfhash) in zonefile_ranking:
+            if is_zonefile_cached( zfhash, zonefile_dir=self.zonefile_dir, validate=True ):
+                log.debug("%s: zonefile %s already cached.  Marking present" % (self.hostport, zfhash))
+                cached_hashes.append( zfhash )
+                continue
+
+            zonefile_hashes.append( zfhash )
+
+        atlasdb_set_zonefiles_present( cached_hashes, True, path=path )
+
+        zonefile_txids = dict([(zfhash, missing_zfinfo[zfhash]['txid']) for zfhash in zonefile_hashes])
+        pending = set(zonefile_hashes)
+        tried_peers = {}    # map zonefile hash to the set of peers that failed to give it to us
+
+        log.debug("%s: missing %s unique zonefiles" % (self.hostport, len(zonefile_hashes)))
+        if len(zonefile_hashes) == 0:
+            return 0
+
+        fetch_queue = Queue.Queue()
+        result_queue = Queue.Queue()
+        workers = []
+        for i in xrange(0, self.num_fetch_threads):
+            worker = threading.Thread( target=self.fetch_worker, args=(fetch_queue, result_queue) )
+            worker.daemon = True
+            worker.start()
+            workers.append( worker )
+
+        con = atlasdb_get_connection( path )
+        assert con is not None
+
+        try:
+            first_round = True
+            while len(pending) > 0 and self.running:
+
+                requests = []
+                if first_round:
+                    # try storage first for zonefiles we haven't looked for there
+                    for zfhash in zonefile_hashes:
+                        if not missing_zfinfo[zfhash]['tried_storage']:
+                            requests.append( ("storage", [zfhash], missing_zfinfo[zfhash]['names'][-1]) )
+
+                    storage_hashes = set([zfhashes[0] for (_, zfhashes, _) in requests])
+                    first_round = False
+
+                else:
+                    storage_hashes = set([])
+
+                requests += [(peer_hostport, zfhashes, None) for (peer_hostport, zfhashes) in \
+                                self.schedule_zonefile_fetches( [zfh for zfh in zonefile_hashes if zfh not in storage_hashes], missing_zfinfo, pending, tried_peers, peer_health )]
+
+                if len(requests) == 0:
+                    # nothing more we can do this step
+                    break
+
+                for req in requests:
+                    fetch_queue.put( req )
+
+                # store results as they arrive
+                store_batch = []
+                for i in xrange(0, len(requests)):
+                    source, requested, zonefiles = result_queue.get()
+                    if zonefiles is None:
+                        zonefiles = {}
+
+                    for zfhash in requested:
+                        if zfhash in pending and zonefiles.has_key(zfhash):
+                            store_batch.append( (zfhash, zonefiles[zfhash], source) )
+
+                        elif source != "storage":
+                            # peer didn't actually have it.  Don't ask it again.
+                            log.debug("%s: %s did not have %s" % (self.hostport, source, zfhash))
+                            if not tried_peers.has_key(zfhash):
+                                tried_peers[zfhash] = set([])
+
+                            tried_peers[zfhash].add( source )
+                            atlas_peer_set_zonefile_status( source, zfhash, False, zonefile_bits=missing_zfinfo[zfhash]['indexes'] )
+
+                    if len(store_batch) >= PEER_CRAWL_ZONEFILE_STORE_BATCH_SIZE or i == len(requests) - 1:
+                        stored = self.store_zonefile_batch( store_batch, zonefile_txids, path, con )
+                        pending -= set(stored)
+                        num_fetched += len(stored)
+
+                        for (zfhash, _, zf_source) in store_batch:
+                            if zfhash in pending and zf_source != "storage":
+                                # peer gave us something we could not store.  Don't ask it again.
+                                log.debug("%s: failed to store %s from %s" % (self.hostport, zfhash, zf_source))
+                                if not tried_peers.has_key(zfhash):
+                                    tried_peers[zfhash] = set([])
+
+                                tried_peers[zfhash].add( zf_source )
+
+                        store_batch = []
+
+        finally:
+            for worker in workers:
+                fetch_queue.put( None )
+
+            for worker in workers:
+                worker.join()
+
+        log.debug("%s: fetched %s zonefiles" % (self.hostport, num_fetched))
+        return num_fetched
+
+
     def try_crawl_storage( self, name, zfhash, txid, path, con=None ):
         """
         Try to get a zonefile from storage
@@ -3509,10 +4852,8 @@ class AtlasZonefileCrawler( threading.Thread ):
         Return False if not
         """
         rc = None
-        close = False
         if con is None:
-            close = True
-            con = atlasdb_open( path )
+            con = atlasdb_get_connection( path )
             assert con is not None
 
         # is this zonefile available via storage?
@@ -3532,9 +4873,6 @@ class AtlasZonefileCrawler( threading.Thread ):
             log.debug("%s: got %s from storage" % (self.hostport, zfhash))
             rc = self.store_zonefile_data( zfhash, txid, zonefile_info['zonefile_data'], "storage", con, path )
 
-        if close:
-            con.close()
-
         return rc
 
 
@@ -3542,16 +4880,13 @@ class AtlasZonefileCrawler( threading.Thread ):
         """
         Find out which peers can serve which zonefiles
         """
-        zonefile_origins = {}   # map peer hostport to list of zonefile hashes
+        zonefile_origins = dict( [(peer_hostport, set([])) for peer_hostport in peer_hostports] )   # map peer hostport to set of zonefile hashes
 
         # which peers can serve each zonefile?
         for zfhash in missing_zfinfo.keys():
-            for peer_hostport in peer_hostports:
-                if not zonefile_origins.has_key(peer_hostport):
-                    zonefile_origins[peer_hostport] = []
-
-                if peer_hostport in missing_zfinfo[zfhash]['peers']:
-                    zonefile_origins[peer_hostport].append( zfhash )
+            for peer_hostport in missing_zfinfo[zfhash]['peers']:
+                if zonefile_origins.has_key(peer_hostport):
+                    zonefile_origins[peer_hostport].add( zfhash )
 
         return zonefile_origins 
 
@@ -3594,12 +4929,13 @@ class AtlasZonefileCrawler( threading.Thread ):
         # ask for zonefiles in rarest-first order
         zonefile_ranking = [ (missing_zfinfo[zfhash]['popularity'], zfhash) for zfhash in missing_zfinfo.keys() ]
         zonefile_ranking.sort()
-        zonefile_hashes = list(set([zfhash for (_, zfhash) in zonefile_ranking]))
+        zonefile_hashes = [zfhash for (_, zfhash) in zonefile_ranking]
         zonefile_names = dict([(zfhash, missing_zfinfo[zfhash]['names']) for zfhash in zonefile_hashes])
         zonefile_txids = dict([(zfhash, missing_zfinfo[zfhash]['txid']) for zfhash in zonefile_hashes])
         zonefile_origins = self.find_zonefile_origins( missing_zfinfo, peer_hostports )
 
         # filter out the ones that are already cached
+        cached_hashes = []
         for i in xrange(0, len(zonefile_hashes)):
             # is this zonefile already cached?
             zfhash = zonefile_hashes[i]
@@ -3607,18 +4943,27 @@ class AtlasZonefileCrawler( threading.Thread ):
             if present:
                 log.debug("%s: zonefile %s already cached.  Marking present" % (self.hostport, zfhash))
                 zonefile_hashes[i] = None
+                cached_hashes.append( zfhash )
 
-                # mark it as present
-                res = atlasdb_set_zonefile_present( zfhash, True, path=self.path ) 
-
+        # mark them as present
+        atlasdb_set_zonefiles_present( cached_hashes, True, path=self.path )
 
         zonefile_hashes = filter( lambda zfh: zfh is not None, zonefile_hashes )
 
+        # zonefiles we still need to fetch (zonefile_hashes keeps them in rarest-first order)
+        pending = set(zonefile_hashes)
+
         log.debug("%s: missing %s unique zonefiles" % (self.hostport, len(zonefile_hashes)))
         
-        while len(zonefile_hashes) > 0 and self.running:
+        for zfhash in zonefile_hashes:
+
+            if not self.running:
+                break
+
+            if zfhash not in pending:
+                # fetched in a batch with an earlier zonefile
+                continue
 
-            zfhash = zonefile_hashes[0]
             zfnames = zonefile_names[zfhash]
             zftxid = zonefile_txids[zfhash]
             peers = missing_zfinfo[zfhash]['peers']
@@ -3640,7 +4985,7 @@ class AtlasZonefileCrawler( threading.Thread ):
 
                 if rc:
                     # don't ask for it again
-                    zonefile_hashes.pop(0)
+                    pending.discard(zfhash)
                     num_fetched += 1
                     continue
 
@@ -3649,7 +4994,7 @@ class AtlasZonefileCrawler( threading.Thread ):
                 if not missing_zfinfo[zfhash]['tried_storage']:
                     log.debug("%s: zonefile %s is unavailable" % (self.hostport, zfhash))
 
-                zonefile_hashes.pop(0)
+                pending.discard(zfhash)
                 continue
 
             # try this zonefile's hosts in order by perceived availability
@@ -3658,18 +5003,14 @@ class AtlasZonefileCrawler( threading.Thread ):
 
             for peer_hostport in peers:
 
-                if zfhash not in zonefile_origins[peer_hostport]:
+                if zfhash not in zonefile_origins.get(peer_hostport, set([])):
                     # not available
                     log.debug("%s not available from %s" % (zfhash, peer_hostport))
                     continue
 
                 # what other zonefiles can we get?
                 # only ask for the ones we don't have
-                peer_zonefile_hashes = []
-                for zfh in zonefile_origins[peer_hostport]:
-                    if zfh in zonefile_hashes:
-                        # can ask for this one too
-                        peer_zonefile_hashes.append( zfh )
+                peer_zonefile_hashes = [zfh for zfh in zonefile_origins[peer_hostport] if zfh in pending]
 
                 if len(peer_zonefile_hashes) == 0:
                     log.debug("%s: No zonefiles available from %s" % (self.hostport, peer_hostport))
@@ -3685,13 +5026,10 @@ class AtlasZonefileCrawler( threading.Thread ):
                     
                     # don't ask again
                     log.debug("Stored %s zonefiles" % len(stored_zfhashes))
-                    for zfh in stored_zfhashes:
-                        if zfh in peer_zonefile_hashes:
-                            peer_zonefile_hashes.remove(zfh)
-                        if zfh in zonefile_hashes:
-                            zonefile_hashes.remove(zfh)
-
-                        num_fetched += 1
+                    stored = set(stored_zfhashes)
+                    peer_zonefile_hashes = [zfh for zfh in peer_zonefile_hashes if zfh not in stored]
+                    pending -= stored
+                    num_fetched += len(stored_zfhashes)
                 
                 else:
                     log.debug("%s: no data received from %s" % (self.hostport, peer_hostport))
@@ -3704,18 +5042,16 @@ class AtlasZonefileCrawler( threading.Thread ):
                 for zfh in peer_zonefile_hashes:
                     log.debug("%s: %s did not have %s" % (self.hostport, peer_hostport, zfh))
                     atlas_peer_set_zonefile_status( peer_hostport, zfh, False, zonefile_bits=missing_zfinfo[zfh]['indexes'], peer_table=peer_table )
-
-                    if zfh in zonefile_origins[peer_hostport]:
-                        zonefile_origins[peer_hostport].remove( zfh )
+                    zonefile_origins[peer_hostport].discard( zfh )
 
                 if locked:
                     atlas_peer_table_unlock()
                     peer_table = None
 
             # done with this zonefile
-            if zfhash in zonefile_hashes:
-                zonefile_hashes.remove(zfhash)
+            pending.discard(zfhash)
 
+        atlas_zonefile_fetch_stats_update( num_fetched )
         log.debug("%s: fetched %s zonefiles" % (self.hostport, num_fetched))
         return num_fetched
 
@@ -3725,7 +5061,11 @@ class AtlasZonefileCrawler( threading.Thread ):
         while self.running:
 
             t1 = time.time()
-            num_fetched = self.step( path=self.path )
+            if self.num_fetch_threads > 0:
+                num_fetched = self.step_concurrent( path=self.path )
+            else:
+                num_fetched = self.step( path=self.path )
+
             t2 = time.time()
 
             if num_fetched == 0 and t2 - t1 < PEER_CRAWL_ZONEFILE_WORK_INTERVAL:
@@ -3754,9 +5094,13 @@ class AtlasZonefilePusher(threading.Thread):
     we can push, by sending them off to 
     known peers who need them.
 
+    Queued zonefiles are grouped by the peers that need them,
+    so each peer gets one put_zonefiles request per batch, and
+    peers are sent their batches concurrently.
+
     CURRENTLY DEACTIVATED
     """
-    def __init__(self, host, port, zonefile_storage_drivers=None, zonefile_dir=None, path=None ):
+    def __init__(self, host, port, zonefile_storage_drivers=None, zonefile_dir=None, path=None, num_push_threads=PEER_PUSH_ZONEFILE_THREADS ):
         threading.Thread.__init__(self)
         self.host = host
         self.port = port
@@ -3768,12 +5112,39 @@ class AtlasZonefilePusher(threading.Thread):
             self.path = atlasdb_path()
 
         self.push_timeout = None
+        self.num_push_threads = num_push_threads
+
+
+    def push_worker( self, push_queue, result_queue ):
+        """
+        Push thread body for step().
+        Process push requests until we dequeue None.
+
+        A request is (peer_hostport, [zonefile data]).
+        A result is (peer_hostport, [saved zonefile hashes]).
+        """
+        while True:
+            req = push_queue.get()
+            if req is None:
+                break
+
+            peer_hostport, zonefile_datas = req
+            saved = []
+
+            try:
+                log.debug("%s: Push %s zonefiles to %s" % (self.hostport, len(zonefile_datas), peer_hostport))
+                saved = atlas_zonefile_push_batch( self.hostport, peer_hostport, zonefile_datas, timeout=self.push_timeout )
+
+            except Exception, e:
+                log.exception(e)
+
+            result_queue.put( (peer_hostport, saved) )
 
 
     def step( self, peer_table=None, zonefile_queue=None, path=None ):
         """
         Run one step of this algorithm.
-        Push the zonefile to all the peers that need it.
+        Push a batch of queued zonefiles to all the peers that need them.
         Return the number of peers we sent to
         """
        
@@ -3783,49 +5154,92 @@ class AtlasZonefilePusher(threading.Thread):
         if self.push_timeout is None:
             self.push_timeout = atlas_push_zonefiles_timeout()
 
-        zfinfo = atlas_zonefile_push_dequeue( zonefile_queue=zonefile_queue )
-        if zfinfo is None:
+        zfinfos = atlas_zonefile_push_dequeue_batch( PEER_PUSH_ZONEFILE_BATCH_SIZE, zonefile_queue=zonefile_queue )
+        if len(zfinfos) == 0:
             return 0
 
-        zfhash = zfinfo['zonefile_hash']
-        zfdata_txt = zfinfo['zonefile']
-        name = zfinfo['name']
-        txid = zfinfo['txid']
+        # which of these can we send?
+        zonefiles = []      # [(zonefile hash, zonefile data, zonefile bits)]
+        for zfinfo in zfinfos:
+            zfhash = zfinfo['zonefile_hash']
+            zfdata_txt = zfinfo['zonefile']
+            txid = zfinfo['txid']
+
+            zfbits = atlasdb_get_zonefile_bits( zfhash, path=path )
+            if len(zfbits) == 0:
+                # not recognized 
+                log.warning("%s: Unrecognized zonefile %s; dropping" % (self.hostport, zfhash))
+                atlas_zonefile_push_stats_update( num_dropped=1 )
+                continue
 
-        zfbits = atlasdb_get_zonefile_bits( zfhash, path=path )
-        if len(zfbits) == 0:
-            # not recognized 
-            return 0
+            # it's a valid zonefile.  cache and store it.
+            rc = store_zonefile_data_to_storage( str(zfdata_txt), txid, required=self.zonefile_storage_drivers, cache=True, zonefile_dir=self.zonefile_dir, tx_required=False )
+            if not rc:
+                log.error("Failed to replicate zonefile %s to external storage" % zfhash)
 
-        # it's a valid zonefile.  cache and store it.
-        rc = store_zonefile_data_to_storage( str(zfdata_txt), txid, required=self.zonefile_storage_drivers, cache=True, zonefile_dir=self.zonefile_dir, tx_required=False )
-        if not rc:
-            log.error("Failed to replicate zonefile %s to external storage" % zonefile_hash)
+            zonefiles.append( (zfhash, str(zfdata_txt), zfbits) )
 
-        # see if we can send this somewhere
+        # see who needs which zonefiles
         table_locked = False
         if peer_table is None:
             peer_table = atlas_peer_table_lock()
             table_locked = True
 
-        peers = atlas_zonefile_find_push_peers( zfhash, peer_table=peer_table, zonefile_bits=zfbits )
+        peer_batches = {}   # map peer hostport to zonefiles to send it
+        sent_hashes = set([])
+        for (zfhash, zfdata_txt, zfbits) in zonefiles:
+            peers = atlas_zonefile_find_push_peers( zfhash, peer_table=peer_table, zonefile_bits=zfbits )
+            if len(peers) == 0:
+                # everyone has it
+                log.debug("%s: All peers have zonefile %s" % (self.hostport, zfhash))
+                continue
+
+            sent_hashes.add( zfhash )
+            for peer in peers:
+                if not peer_batches.has_key(peer):
+                    peer_batches[peer] = []
+
+                peer_batches[peer].append( zfdata_txt )
 
         if table_locked:
             atlas_peer_table_unlock()
             peer_table = None
 
-        if len(peers) == 0:
-            # everyone has it
-            log.debug("%s: All peers have zonefile %s" % (self.hostport, zfhash))
+        if len(peer_batches) == 0:
             return 0
 
-        # push it off
+        # push them off
+        push_queue = Queue.Queue()
+        result_queue = Queue.Queue()
+        for peer in peer_batches.keys():
+            push_queue.put( (peer, peer_batches[peer]) )
+
+        num_workers = max(1, min(self.num_push_threads, len(peer_batches)))
+        workers = []
+        for i in xrange(0, num_workers):
+            push_queue.put( None )
+            worker = threading.Thread( target=self.push_worker, args=(push_queue, result_queue) )
+            worker.daemon = True
+            worker.start()
+            workers.append( worker )
+
+        for worker in workers:
+            worker.join()
+
         ret = 0
-        for peer in peers:
-            log.debug("%s: Push to %s" % (self.hostport, peer))
-            atlas_zonefile_push( self.hostport, peer, zfdata_txt, timeout=self.push_timeout )
+        saved_hashes = set([])
+        while not result_queue.empty():
+            peer, saved = result_queue.get()
+            log.debug("%s: %s accepted %s of %s zonefiles" % (self.hostport, peer, len(saved), len(peer_batches[peer])))
+            saved_hashes.update( saved )
             ret += 1
 
+        # zonefiles that no peer accepted
+        unsaved_hashes = sent_hashes - saved_hashes
+        if len(unsaved_hashes) > 0:
+            log.debug("%s: could not push %s zonefiles to anyone" % (self.hostport, len(unsaved_hashes)))
+            atlas_zonefile_push_stats_update( num_dropped=len(unsaved_hashes) )
+
         return ret
 
     
@@ -3839,7 +5253,7 @@ class AtlasZonefilePusher(threading.Thread):
                 
                 deadline = time_now() + PEER_PUSH_ZONEFILE_WORK_INTERVAL - (t2 - t1)
                 while time_now() < deadline and self.running:
-                    time_sleep( self.my_hostport, self.__class__.__name__, 1.0 )
+                    time_sleep( self.hostport, self.__class__.__name__, 1.0 )
                 
                 if not self.running:
                     break
@@ -3850,7 +5264,7 @@ class AtlasZonefilePusher(threading.Thread):
 
 
 
-def atlas_node_start( my_hostname, my_portnum, atlasdb_path=None, zonefile_dir=None, zonefile_storage_drivers=[] ):
+def atlas_node_start( my_hostname, my_portnum, atlasdb_path=None, zonefile_dir=None, zonefile_storage_drivers=[], zonefile_fetch_threads=PEER_CRAWL_ZONEFILE_FETCH_THREADS ):
     """
     Start up the atlas node.
     Return a bundle of atlas state
@@ -3858,7 +5272,7 @@ def atlas_node_start( my_hostname, my_portnum, atlasdb_path=None, zonefile_dir=N
     atlas_state = {}
     atlas_state['peer_crawler'] = AtlasPeerCrawler( my_hostname, my_portnum )
     atlas_state['health_checker'] = AtlasHealthChecker( my_hostname, my_portnum, path=atlasdb_path )
-    atlas_state['zonefile_crawler'] = AtlasZonefileCrawler( my_hostname, my_portnum, zonefile_storage_drivers=zonefile_storage_drivers, path=atlasdb_path, zonefile_dir=zonefile_dir )
+    atlas_state['zonefile_crawler'] = AtlasZonefileCrawler( my_hostname, my_portnum, zonefile_storage_drivers=zonefile_storage_drivers, path=atlasdb_path, zonefile_dir=zonefile_dir, num_fetch_threads=zonefile_fetch_threads )
     # atlas_state['zonefile_pusher'] = AtlasZonefilePusher( my_hostname, my_portnum, path=atlasdb_path, zonefile_storage_drivers=zonefile_storage_drivers, zonefile_dir=zonefile_dir )
 
     # start them all up
@@ -3878,6 +5292,7 @@ def atlas_node_stop( atlas_state ):
         atlas_state[component].ask_join()
         atlas_state[component].join()
 
+    atlasdb_stop_writers()
     return True
 
 
@@ -85,6 +85,40 @@ RPC_MAX_ZONEFILE_LEN = 4096     # 4KB
 RPC_MAX_PROFILE_LEN = 1024000   # 1MB
 RPC_MAX_DATA_LEN = 10240000     # 10MB
 
+RPC_MAX_NAMEOPS_RANGE_OPS = 100         # a get_nameops_in_range reply stops after the block that reaches this many name operations
+RPC_MAX_NAMEOPS_RANGE_BLOCKS = 10000    # maximum number of blocks a get_nameops_in_range reply covers
+
+RPC_DEFAULT_WORKERS = 8         # number of threads serving RPC requests (0 means serve serially)
+RPC_MAX_QUEUE_LEN = 128         # maximum number of accepted connections waiting for a worker
+RPC_KEEPALIVE_TIMEOUT = 10      # close a keep-alive RPC connection once it has been idle this many seconds
+RPC_MAX_IDLE_CONNECTIONS = 256  # maximum number of idle keep-alive RPC connections to hold open (must stay below FD_SETSIZE)
+
+# methods that can fall through to storage drivers or do heavy db work,
+# and the maximum number of workers that may run each one at once.
+RPC_METHOD_CONCURRENCY = {
+    'get_zonefiles': 4,
+    'get_zonefiles_by_names': 4,
+    'get_profile': 2,
+    'get_mutable_data': 2,
+    'get_immutable_data': 2,
+    'put_zonefiles': 2,
+    'put_profile': 2,
+    'put_mutable_data': 2,
+    'get_nameops_in_range': 2,
+}
+
+""" database verification configs
+"""
+VERIFY_PREFETCH_PROCESSES = 4           # worker processes that extract the name operations of upcoming blocks while rebuilding a database (0 to disable)
+VERIFY_PREFETCH_BLOCKS = 64             # maximum number of blocks to extract ahead of the block being processed
+VERIFY_PREFETCH_TIMEOUT = 600           # seconds to wait for a worker to extract a block before doing it ourselves
+VERIFY_CHECKPOINT_INTERVAL = 1000       # minimum number of blocks between verification checkpoints
+
+""" name database configs
+"""
+NAMEDB_HISTORY_CACHE_SIZE = 1024            # number of names and namespaces whose decoded history we keep in RAM
+NAMEDB_HISTORY_CHECKPOINT_INTERVAL = 16     # when restoring a record's past states, remember them every this many blocks of history
+
 """ block indexing configs
 """
 REINDEX_FREQUENCY = 300 # seconds
@@ -458,6 +492,11 @@ if os.environ.get("BLOCKSTACK_TEST", None) == "1":
     NUM_CONFIRMATIONS = 0
     log.warning("NUM_CONFIRMATIONS = %s" % NUM_CONFIRMATIONS)
 
+# cross-check the incrementally-calculated ops hash at each block against a full recalculation (slow)
+CHECK_OPS_HASH = False
+if os.environ.get("BLOCKSTACK_TEST", None) == "1" or os.environ.get("BLOCKSTACK_CHECK_OPS_HASH", None) == "1":
+    CHECK_OPS_HASH = True
+
 # burn address for fees (the address of public key 0x0000000000000000000000000000000000000000)
 BLOCKSTACK_BURN_PUBKEY_HASH = "0000000000000000000000000000000000000000"
 BLOCKSTACK_BURN_ADDRESS = virtualchain.hex_hash160_to_address( BLOCKSTACK_BURN_PUBKEY_HASH )   # "1111111111111111111114oLvT2"
@@ -868,6 +907,8 @@ def default_blockstack_opts( config_file=None, virtualchain_impl=None ):
    backup_frequency = 144   # once a day; 10 minute block time
    backup_max_age = 1008    # one week
    rpc_port = RPC_SERVER_PORT 
+   rpc_workers = RPC_DEFAULT_WORKERS
+   rpc_queue_len = RPC_MAX_QUEUE_LEN
    serve_zonefiles = True
    serve_profiles = False
    serve_data = False
@@ -899,6 +940,12 @@ def default_blockstack_opts( config_file=None, virtualchain_impl=None ):
       if parser.has_option('blockstack', 'rpc_port'):
          rpc_port = int(parser.get('blockstack', 'rpc_port'))
 
+      if parser.has_option('blockstack', 'rpc_workers'):
+         rpc_workers = int(parser.get('blockstack', 'rpc_workers'))
+
+      if parser.has_option('blockstack', 'rpc_queue_len'):
+         rpc_queue_len = int(parser.get('blockstack', 'rpc_queue_len'))
+
       if parser.has_option('blockstack', 'serve_zonefiles'):
           serve_zonefiles = parser.get('blockstack', 'serve_zonefiles')
           if serve_zonefiles.lower() in ['1', 'yes', 'true', 'on']:
@@ -1024,6 +1071,8 @@ def default_blockstack_opts( config_file=None, virtualchain_impl=None ):
 
    blockstack_opts = {
        'rpc_port': rpc_port,
+       'rpc_workers': rpc_workers,
+       'rpc_queue_len': rpc_queue_len,
        'email': contact_email,
        'announcers': announcers,
        'announcements': announcements,
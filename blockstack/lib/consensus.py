@@ -36,6 +36,8 @@ import binascii
 import copy
 import threading
 import errno
+import multiprocessing
+import collections
 
 import virtualchain
 import blockstack_client
@@ -102,23 +104,29 @@ def rec_to_virtualchain_op( name_rec, block_number, history_index, working_db, u
     return merged_ret_op
 
 
-def rec_restore_snv_consensus_fields( name_rec, block_id ):
+def rec_restore_snv_consensus_fields( name_rec, block_id, db=None ):
     """
     Given a name record at a given point in time, ensure
     that all of its consensus fields are present.
     Because they can be reconstructed directly from the record,
     but they are not always stored in the db, we have to do so here.
+
+    If db is not given, a read-only db handle will be opened (and closed) for this record.
     """
 
     opcode_name = op_get_opcode_name( name_rec['op'] )
     assert opcode_name is not None, "Unrecognized opcode '%s'" % name_rec['op']
 
     ret_op = {}
-    db = get_db_state()
+    close_db = False
+    if db is None:
+        db = get_db_state()
+        close_db = True
 
     ret_op = op_snv_consensus_extra( opcode_name, name_rec, block_id, db )
 
-    db.close()
+    if close_db:
+        db.close()
 
     if ret_op is None:
         raise Exception("Failed to derive extra consensus fields for '%s'" % opcode_name)
@@ -131,20 +139,28 @@ def rec_restore_snv_consensus_fields( name_rec, block_id ):
     return merged_op
 
 
-def block_to_virtualchain_ops( block_id, working_db, untrusted_db ):
+# operations whose restoration needs the database being rebuilt (i.e. it can't be done ahead of time)
+RESTORE_NEEDS_WORKING_DB = [
+    'NAME_TRANSFER'         # needs the consensus hash at transfer_send_block_id
+]
+
+VERIFY_CHECKPOINT_FILENAME = "verify.checkpoint"
+
+# prefetch worker process state
+PREFETCH_UNTRUSTED_DB = None
+
+
+def block_to_sanitized_recs( block_id, untrusted_db ):
     """
-    convert a block's name ops to virtualchain ops.
-    This is needed in order to recreate the virtualchain
-    transactions that generated the block's name operations,
-    such as for re-building the db or serving SNV clients.
+    Get the records altered at a block from the untrusted database,
+    in tx order, with all untrusted fields removed.
 
-    Returns the list of virtualchain ops.
+    Returns the list of (record, history index) pairs (see block_to_virtualchain_ops()).
     """
 
     # all records altered at this block, in tx order, as they were
     prior_recs = untrusted_db.get_all_ops_at( block_id )
     log.debug("Records at %s: %s" % (block_id, len(prior_recs)))
-    virtualchain_ops = []
 
     # process records in order by vtxindex
     prior_recs = sorted( prior_recs, key=lambda op: op['vtxindex'] )
@@ -171,7 +187,7 @@ def block_to_virtualchain_ops( block_id, working_db, untrusted_db ):
         else:
             history_index[name][i] = max( history_index[name].values() ) + 1
 
-
+    sanitized_recs = []
     for i in xrange(0, len(prior_recs)):
 
         # only trusted fields
@@ -197,37 +213,199 @@ def block_to_virtualchain_ops( block_id, working_db, untrusted_db ):
                 log.debug("OP '%s': Removing untrusted field '%s'" % (opcode_name, field))
                 del prior_recs[i][field]
 
-        try:
-            # recover virtualchain op from name record
-            h = 0
-            if 'name' in prior_recs[i]:
-                if prior_recs[i]['name'] in history_index:
-                    h = history_index[ prior_recs[i]['name'] ][i]
-
-            log.debug("Recover %s" % op_get_opcode_name( prior_recs[i]['op'] ))
-            virtualchain_op = rec_to_virtualchain_op( prior_recs[i], block_id, h, working_db, untrusted_db )
-        except:
-            print json.dumps( prior_recs[i], indent=4, sort_keys=True )
-            raise
+        h = 0
+        if 'name' in prior_recs[i]:
+            if prior_recs[i]['name'] in history_index:
+                h = history_index[ prior_recs[i]['name'] ][i]
+
+        sanitized_recs.append( (prior_recs[i], h) )
+
+    return sanitized_recs
+
+
+def sanitized_rec_to_virtualchain_op( rec, block_id, history_index, working_db, untrusted_db ):
+    """
+    Recover the virtualchain op for a record from block_to_sanitized_recs().
+    Returns the op, or None if there isn't one
+    """
+    try:
+        # recover virtualchain op from name record
+        log.debug("Recover %s" % op_get_opcode_name( rec['op'] ))
+        virtualchain_op = rec_to_virtualchain_op( rec, block_id, history_index, working_db, untrusted_db )
+    except:
+        print json.dumps( rec, indent=4, sort_keys=True )
+        raise
+
+    return virtualchain_op
+
 
+def block_to_virtualchain_ops( block_id, working_db, untrusted_db ):
+    """
+    convert a block's name ops to virtualchain ops.
+    This is needed in order to recreate the virtualchain
+    transactions that generated the block's name operations,
+    such as for re-building the db or serving SNV clients.
+
+    Returns the list of virtualchain ops.
+    """
+
+    virtualchain_ops = []
+    for (rec, h) in block_to_sanitized_recs( block_id, untrusted_db ):
+        virtualchain_op = sanitized_rec_to_virtualchain_op( rec, block_id, h, working_db, untrusted_db )
         if virtualchain_op is not None:
             virtualchain_ops.append( virtualchain_op )
 
     return virtualchain_ops
 
 
-def rebuild_database( target_block_id, untrusted_db_path, working_db_path=None, resume_dir=None, start_block=None, expected_snapshots={} ):
+def block_prefetch_init( untrusted_db_path ):
+    """
+    Set up a prefetch worker process:
+    open its own handle to the untrusted database.
+    """
+    global PREFETCH_UNTRUSTED_DB
+    PREFETCH_UNTRUSTED_DB = BlockstackDB( untrusted_db_path, DISPOSITION_RO )
+
+
+def block_prefetch( block_id ):
+    """
+    Extract a block's name operations from the untrusted database,
+    in a prefetch worker process.
+
+    Returns a list with an entry for each record, in tx order:
+    ('op', virtualchain op or None) if the op could be recovered right away, or
+    ('rec', sanitized record, history index) if recovering it needs the working database
+    (see prefetched_to_virtualchain_ops())
+    """
+    untrusted_db = PREFETCH_UNTRUSTED_DB
+    untrusted_db.lastblock = block_id
+
+    prefetched = []
+    for (rec, h) in block_to_sanitized_recs( block_id, untrusted_db ):
+        if op_get_opcode_name( rec['op'] ) in RESTORE_NEEDS_WORKING_DB:
+            prefetched.append( ('rec', rec, h) )
+        else:
+            prefetched.append( ('op', sanitized_rec_to_virtualchain_op( rec, block_id, h, None, untrusted_db )) )
+
+    return prefetched
+
+
+def prefetched_to_virtualchain_ops( block_id, prefetched, working_db, untrusted_db ):
+    """
+    Finish recovering a block's virtualchain ops from the output of block_prefetch(),
+    now that the working database has processed all prior blocks.
+
+    Returns the list of virtualchain ops (same as block_to_virtualchain_ops())
+    """
+    virtualchain_ops = []
+    for entry in prefetched:
+        if entry[0] == 'op':
+            virtualchain_op = entry[1]
+        else:
+            virtualchain_op = sanitized_rec_to_virtualchain_op( entry[1], block_id, entry[2], working_db, untrusted_db )
+
+        if virtualchain_op is not None:
+            virtualchain_ops.append( virtualchain_op )
+
+    return virtualchain_ops
+
+
+def block_prefetch_iter( prefetch_pool, start_block, end_block ):
+    """
+    Iterate over the blocks in [start_block, end_block], keeping up to
+    VERIFY_PREFETCH_BLOCKS of them in-flight in the prefetch pool.
+
+    Yields (block_id, output of block_prefetch()), or (block_id, None) if the
+    block was not prefetched (i.e. there is no pool, or the worker took too long).
+    """
+    if prefetch_pool is None:
+        for block_id in xrange( start_block, end_block+1 ):
+            yield (block_id, None)
+
+        return
+
+    pending = collections.deque()
+    next_block = start_block
+
+    while next_block <= end_block or len(pending) > 0:
+        while next_block <= end_block and len(pending) < VERIFY_PREFETCH_BLOCKS:
+            pending.append( (next_block, prefetch_pool.apply_async( block_prefetch, (next_block,) )) )
+            next_block += 1
+
+        block_id, res = pending.popleft()
+        try:
+            prefetched = res.get( VERIFY_PREFETCH_TIMEOUT )
+        except multiprocessing.TimeoutError:
+            log.warning("Timed out prefetching block %s; extracting it directly" % block_id)
+            prefetched = None
+
+        yield (block_id, prefetched)
+
+
+def rebuild_database_save_checkpoint( working_dir, block_id, consensus_hash ):
+    """
+    Remember that the rebuilt database matched all expected
+    consensus hashes up to and including block_id.
+    """
+    path = os.path.join( working_dir, VERIFY_CHECKPOINT_FILENAME )
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w") as f:
+        f.write( json.dumps( {'block_id': block_id, 'consensus_hash': consensus_hash} ) )
+        f.flush()
+        os.fsync( f.fileno() )
+
+    os.rename( tmp_path, path )
+    log.debug("Verified up to %s (%s)" % (block_id, consensus_hash))
+
+
+def rebuild_database_load_checkpoint( working_dir ):
+    """
+    Get the last checkpoint saved with rebuild_database_save_checkpoint()
+    Return {'block_id': ..., 'consensus_hash': ...} on success
+    Return None if there is no checkpoint
+    """
+    path = os.path.join( working_dir, VERIFY_CHECKPOINT_FILENAME )
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r") as f:
+            checkpoint = json.loads( f.read() )
+
+        return {'block_id': int(checkpoint['block_id']), 'consensus_hash': str(checkpoint['consensus_hash'])}
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Invalid checkpoint in %s" % path)
+        return None
+
+
+def rebuild_database( target_block_id, untrusted_db_path, working_db_path=None, resume_dir=None, start_block=None, expected_snapshots={}, num_prefetch_processes=None ):
     """
     Given a target block ID and a path to an (untrusted) db, reconstruct it in a temporary directory by
     replaying all the nameops it contains.
 
     Optionally check that the snapshots in @expected_snapshots match up as we verify.
-    @expected_snapshots maps str(block_id) to str(consensus hash)
+    @expected_snapshots maps int(block_id) to str(consensus hash)
+
+    Upcoming blocks' operations are extracted from the untrusted db by @num_prefetch_processes
+    worker processes (default VERIFY_PREFETCH_PROCESSES) while the current block is processed.
+
+    If @resume_dir is given and it holds a partially-rebuilt database, then pick up where it left off.
+    Progress is checkpointed at expected snapshot heights, so on resume only the consensus hashes
+    computed since the last checkpoint need to be re-checked.
 
     Return the consensus hash calculated at the target block.
     Return None on verification failure (i.e. we got a different consensus hash than one for the same block in expected_snapshots)
     """
 
+    if expected_snapshots is None:
+        expected_snapshots = {}
+
+    if num_prefetch_processes is None:
+        num_prefetch_processes = VERIFY_PREFETCH_PROCESSES
+
     # reconfigure the virtualchain to use a temporary directory,
     # so we don't interfere with this instance's primary database
     working_dir = None
@@ -240,52 +418,92 @@ def rebuild_database( target_block_id, untrusted_db_path, working_db_path=None,
 
     virtualchain.setup_virtualchain( impl=blockstack_state_engine )
 
-    if resume_dir is None:
-        # not resuming
+    if resume_dir is None or start_block is None:
+        # not resuming, or resuming from scratch
         start_block = virtualchain.get_first_block_id()
-    else:
-        # resuming
-        old_start_block = start_block
-        start_block = get_lastblock()
-        if start_block is None:
-            start_block = old_start_block
 
-    log.debug( "Rebuilding database from %s to %s" % (start_block, target_block_id) )
+    # start the prefetch workers before we open any databases,
+    # so they don't inherit our connections
+    prefetch_pool = None
+    if num_prefetch_processes > 0:
+        prefetch_pool = multiprocessing.Pool( num_prefetch_processes, initializer=block_prefetch_init, initargs=(untrusted_db_path,) )
+
+    try:
+        # feed in operations, block by block, from the untrusted database
+        untrusted_db = BlockstackDB( untrusted_db_path, DISPOSITION_RO )
+
+        # working db, to build up the operations in the untrusted db block-by-block
+        working_db = None
+        if working_db_path is None:
+            working_db_path = virtualchain.get_db_filename()
 
-    # feed in operations, block by block, from the untrusted database
-    untrusted_db = BlockstackDB( untrusted_db_path, DISPOSITION_RO )
+        working_db = BlockstackDB( working_db_path, DISPOSITION_RW )
 
-    # working db, to build up the operations in the untrusted db block-by-block
-    working_db = None
-    if working_db_path is None:
-        working_db_path = virtualchain.get_db_filename()
+        last_checkpoint = None
+        if resume_dir is not None and working_db.lastblock is not None and working_db.lastblock >= start_block:
+            # resuming.  Re-check what we did since the last checkpoint
+            checkpoint = rebuild_database_load_checkpoint( working_dir )
+            checkpoint_block = start_block - 1
+            if checkpoint is not None:
+                if working_db.get_consensus_at( checkpoint['block_id'] ) != checkpoint['consensus_hash']:
+                    log.error("DATABASE IN %s DOES NOT MATCH ITS CHECKPOINT AT %s" % (working_dir, checkpoint['block_id']))
+                    return None
 
-    working_db = BlockstackDB( working_db_path, DISPOSITION_RW )
+                checkpoint_block = checkpoint['block_id']
+                last_checkpoint = checkpoint_block
 
-    # map block ID to consensus hashes
-    consensus_hashes = {}
+            for block_id in sorted(expected_snapshots.keys()):
+                if block_id <= checkpoint_block or block_id > working_db.lastblock:
+                    continue
 
-    for block_id in xrange( start_block, target_block_id+1 ):
+                consensus_hash = working_db.get_consensus_at( block_id )
+                if expected_snapshots[block_id] != consensus_hash:
+                    log.error("DATABASE IS NOT CONSISTENT AT %s: %s != %s" % (block_id, expected_snapshots[block_id], consensus_hash))
+                    return None
 
-        untrusted_db.lastblock = block_id
-        virtualchain_ops = block_to_virtualchain_ops( block_id, working_db, untrusted_db )
+            start_block = working_db.lastblock + 1
 
-        # feed ops to virtualchain to reconstruct the db at this block
-        consensus_hash = working_db.process_block( block_id, virtualchain_ops )
-        log.debug("VERIFY CONSENSUS(%s): %s" % (block_id, consensus_hash))
+        log.debug( "Rebuilding database from %s to %s" % (start_block, target_block_id) )
 
-        consensus_hashes[block_id] = consensus_hash
-        if block_id in expected_snapshots:
-            if expected_snapshots[block_id] != consensus_hash:
-                log.error("DATABASE IS NOT CONSISTENT AT %s: %s != %s" % (block_id, expected_snashots[block_id], consensus_hash))
-                return None
+        # map block ID to consensus hashes
+        consensus_hashes = {}
 
+        for (block_id, prefetched) in block_prefetch_iter( prefetch_pool, start_block, target_block_id ):
+
+            untrusted_db.lastblock = block_id
+            if prefetched is None:
+                virtualchain_ops = block_to_virtualchain_ops( block_id, working_db, untrusted_db )
+            else:
+                virtualchain_ops = prefetched_to_virtualchain_ops( block_id, prefetched, working_db, untrusted_db )
+
+            # feed ops to virtualchain to reconstruct the db at this block
+            consensus_hash = working_db.process_block( block_id, virtualchain_ops )
+            log.debug("VERIFY CONSENSUS(%s): %s" % (block_id, consensus_hash))
+
+            consensus_hashes[block_id] = consensus_hash
+            if block_id in expected_snapshots:
+                if expected_snapshots[block_id] != consensus_hash:
+                    log.error("DATABASE IS NOT CONSISTENT AT %s: %s != %s" % (block_id, expected_snapshots[block_id], consensus_hash))
+                    return None
+
+                if last_checkpoint is None or block_id - last_checkpoint >= VERIFY_CHECKPOINT_INTERVAL:
+                    rebuild_database_save_checkpoint( working_dir, block_id, consensus_hash )
+                    last_checkpoint = block_id
+
+    finally:
+        if prefetch_pool is not None:
+            prefetch_pool.terminate()
+            prefetch_pool.join()
 
     # final consensus hash
+    if not consensus_hashes.has_key( target_block_id ):
+        # already rebuilt
+        return working_db.get_consensus_at( target_block_id )
+
     return consensus_hashes[ target_block_id ]
 
 
-def verify_database( trusted_consensus_hash, consensus_block_id, untrusted_db_path, working_db_path=None, start_block=None, expected_snapshots={} ):
+def verify_database( trusted_consensus_hash, consensus_block_id, untrusted_db_path, working_db_path=None, start_block=None, expected_snapshots={}, resume_dir=None, num_prefetch_processes=None ):
     """
     Verify that a database is consistent with a
     known-good consensus hash.
@@ -297,7 +515,8 @@ def verify_database( trusted_consensus_hash, consensus_block_id, untrusted_db_pa
     database.
     """
 
-    final_consensus_hash = rebuild_database( consensus_block_id, untrusted_db_path, working_db_path=working_db_path, start_block=start_block, expected_snapshots=expected_snapshots )
+    final_consensus_hash = rebuild_database( consensus_block_id, untrusted_db_path, working_db_path=working_db_path, start_block=start_block, expected_snapshots=expected_snapshots, \
+                                             resume_dir=resume_dir, num_prefetch_processes=num_prefetch_processes )
 
     # did we reach the consensus hash we expected?
     if final_consensus_hash is not None and final_consensus_hash == trusted_consensus_hash:
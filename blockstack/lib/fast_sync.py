@@ -39,8 +39,10 @@ import errno
 import base64
 import keylib
 import subprocess
-import urllib
+import urllib2
 import hashlib
+import StringIO
+import tarfile
 
 import virtualchain
 import blockstack_client
@@ -63,6 +65,13 @@ from .storage import *
 from .nameset import *
 from .operations import *
 
+FAST_SYNC_TRAILER_MAX_LEN = 8 + 256 * (8 + 100)     # number of signatures, and up to 256 signatures and their lengths
+FAST_SYNC_CHUNK_SIZE = 65536
+FAST_SYNC_PROGRESS_INTERVAL = 10 * 1024 * 1024      # report download progress every this many bytes
+FAST_SYNC_SPOOL_FILENAME = ".fast_sync.partial"     # partial download, so we can resume
+FAST_SYNC_STAGING_DIRNAME = ".fast_sync.staging"    # where we extract the snapshot before installing it
+FAST_SYNC_MAX_EXTRACT_SIZE = 64 * 1024 * 1024 * 1024   # refuse to extract snapshots that unpack to more than this many bytes
+
 def snapshot_peek_number( fd, off ):
     """
     Read the last 8 bytes of fd
@@ -221,21 +230,46 @@ def fast_sync_snapshot( export_path, private_key, block_number ):
         return True
 
 
-    # ugly hack to work around the lack of a `nonlocal` keyword in Python 2.x
-    def _zonefile_copy_progress_outer():
-        def inner(src, names):
-            for name in names:
-                if name == 'zonefile.txt':
-                    inner.zonefile_count += 1
-                    if inner.zonefile_count % 100 == 0:
-                        log.debug("{} zone files copied".format(inner.zonefile_count))
-        
-            return []
+    def _copy_zonefiles(src_dir, dest_dir):
+        # the packed zonefile store is copied consistently: its index first, and then
+        # its (append-only) segments.  Legacy zone files are hard-linked where possible.
+        zonefile_count = 0
+        pack_dir = os.path.join(src_dir, ZONEFILE_PACK_DIRNAME)
+
+        for (dirpath, dirnames, filenames) in os.walk(src_dir):
+            dest_dirpath = os.path.join(dest_dir, os.path.relpath(dirpath, src_dir))
+            if not os.path.exists(dest_dirpath):
+                os.makedirs(dest_dirpath)
+
+            if os.path.abspath(dirpath) == os.path.abspath(pack_dir):
+                dirnames[:] = []
+                if ZONEFILE_PACK_INDEX in filenames:
+                    _log_backup(os.path.join(dirpath, ZONEFILE_PACK_INDEX))
+                    rc = sqlite3_backup(os.path.join(dirpath, ZONEFILE_PACK_INDEX), os.path.join(dest_dirpath, ZONEFILE_PACK_INDEX))
+                    if not rc:
+                        return False
+
+                for name in sorted(filenames):
+                    if name.startswith("segment-"):
+                        _log_backup(os.path.join(dirpath, name))
+                        shutil.copyfile(os.path.join(dirpath, name), os.path.join(dest_dirpath, name))
+
+                continue
+
+            for name in filenames:
+                src_path = os.path.join(dirpath, name)
+                dest_path = os.path.join(dest_dirpath, name)
+                try:
+                    os.link(src_path, dest_path)
+                except OSError:
+                    shutil.copy(src_path, dest_path)
 
-        inner.zonefile_count = 0
-        return inner
+                if name == 'zonefile.txt':
+                    zonefile_count += 1
+                    if zonefile_count % 100 == 0:
+                        log.debug("{} zone files copied".format(zonefile_count))
 
-    _zonefile_copy_progress = _zonefile_copy_progress_outer()
+        return True
 
     # make sure we have the apppriate tools
     tools = ['tar', 'bzip2', 'mv', 'sqlite3']
@@ -306,10 +340,12 @@ def fast_sync_snapshot( export_path, private_key, block_number ):
     zonefiles_path = os.path.join(working_dir, "zonefiles")
     dest_path = os.path.join(tmpdir, "zonefiles")
     try:
-        shutil.copytree(zonefiles_path, dest_path, ignore=_zonefile_copy_progress)
+        rc = _copy_zonefiles(zonefiles_path, dest_path)
+        assert rc, "Failed to back up zone file pack"
     except Exception, e:
         log.exception(e)
         log.error('Failed to copy {} to {}'.format(zonefiles_path, dest_path))
+        _cleanup(tmpdir)
         return False
 
     # compress
@@ -333,35 +369,182 @@ def fast_sync_snapshot( export_path, private_key, block_number ):
     return True
 
 
-def fast_sync_fetch( import_url ):
+def fast_sync_fetch( import_url, offset=0 ):
     """
-    Get the data for an import snapshot.
-    Store it to a temporary path
-    Return the path on success
+    Open a stream to an import snapshot, starting from
+    the given byte offset if the server supports it.
+    Return (stream, offset, total size) on success.  The offset will be 0 if
+    the server can't resume, and the total size will be None if it's not known.
     Return None on error
     """
+    log.debug("Fetch {} from offset {}...".format(import_url, offset))
+
+    req = urllib2.Request(import_url)
+    if offset > 0:
+        req.add_header('Range', 'bytes={}-'.format(offset))
+
     try:
-        fd, tmppath = tempfile.mkstemp(prefix='.blockstack-fast-sync-')
+        resp = urllib2.urlopen(req)
     except Exception, e:
         log.exception(e)
         return None
-    
-    log.debug("Fetch {} to {}...".format(import_url, tmppath))
 
+    if offset > 0 and resp.getcode() != 206:
+        log.debug("Cannot resume {}; fetching it from the beginning".format(import_url))
+        offset = 0
+
+    total_size = None
+    content_length = resp.info().getheader('Content-Length')
+    if content_length is not None:
+        try:
+            total_size = offset + int(content_length)
+        except ValueError:
+            pass
+
+    return (resp, offset, total_size)
+
+
+class FastSyncStream(object):
+    """
+    Consume a fast-sync snapshot as it arrives:
+    hash its payload and spool it to disk, so it is only
+    downloaded once and can be verified before it is extracted
+    (and so the download can be resumed).
+
+    Since the payload's length is only known once we see the
+    signature trailer, the last FAST_SYNC_TRAILER_MAX_LEN bytes
+    are held back from the hash until the end of the stream.
+    """
+
+    def __init__(self, spool_path, spool_append=False):
+        self.hasher = hashlib.sha256()
+        self.tail = ''
+        self.num_bytes = 0
+        self.spool = open(spool_path, 'ab' if spool_append else 'wb')
+
+
+    def write(self, data, spool=True):
+        """
+        Consume the next bytes of the snapshot.
+        If spool is False, then they are already in the spool file.
+        """
+        if spool:
+            self.spool.write(data)
+
+        self.tail += data
+        self.num_bytes += len(data)
+
+        if len(self.tail) > FAST_SYNC_TRAILER_MAX_LEN:
+            self.hasher.update(self.tail[:-FAST_SYNC_TRAILER_MAX_LEN])
+            self.tail = self.tail[-FAST_SYNC_TRAILER_MAX_LEN:]
+
+
+    def finish(self):
+        """
+        End of the snapshot.  Hash the rest of the payload,
+        and parse the signature trailer.
+        Return {'status': True, 'signatures': ..., 'payload_size': ..., 'hash': ...} on success
+        Return {'error': ...} on error
+        """
+        self.spool.close()
+
+        info = fast_sync_inspect( StringIO.StringIO(self.tail), fd_len=len(self.tail) )
+        if 'error' in info:
+            return info
+
+        self.hasher.update(self.tail[:info['payload_size']])
+
+        info['payload_size'] = self.num_bytes - len(self.tail) + info['payload_size']
+        info['hash'] = self.hasher.hexdigest()
+        return info
+
+
+    def abort(self):
+        """
+        Close the spool file
+        """
+        self.spool.close()
+
+
+class FastSyncPayloadReader(object):
+    """
+    Read only the first @payload_size bytes of a file
+    (i.e. a snapshot's payload, without its signature trailer)
+    """
+
+    def __init__(self, f, payload_size):
+        self.f = f
+        self.remaining = payload_size
+
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def fast_sync_extract( snapshot_path, payload_size, dest_dir, max_size=FAST_SYNC_MAX_EXTRACT_SIZE ):
+    """
+    Extract a (verified) snapshot's payload into @dest_dir.
+    Only regular files and directories are extracted, and only beneath @dest_dir:
+    absolute paths, '..' components, links, and device files are rejected, and
+    so is a snapshot whose files add up to more than @max_size bytes.
+    Files are written with our own ownership and default permissions.
+
+    Return True on success
+    Return False on error
+    """
+    extracted = 0
     try:
-        path, headers = urllib.urlretrieve(import_url, tmppath)
+        with open(snapshot_path, 'rb') as f:
+            tar = tarfile.open( fileobj=FastSyncPayloadReader(f, payload_size), mode='r|bz2' )
+            for member in tar:
+                name = os.path.normpath(member.name)
+                if os.path.isabs(name) or name == '..' or name.startswith('..' + os.path.sep):
+                    log.error("Refusing to extract {}: outside of {}".format(member.name, dest_dir))
+                    return False
+
+                dest_path = os.path.join(dest_dir, name)
+
+                if member.isdir():
+                    if not os.path.isdir(dest_path):
+                        os.makedirs(dest_path)
+
+                    continue
+
+                if not member.isfile():
+                    log.error("Refusing to extract {}: not a regular file or directory".format(member.name))
+                    return False
+
+                extracted += member.size
+                if extracted > max_size:
+                    log.error("Refusing to extract snapshot: more than {} bytes".format(max_size))
+                    return False
+
+                if not os.path.isdir(os.path.dirname(dest_path)):
+                    os.makedirs(os.path.dirname(dest_path))
+
+                src = tar.extractfile(member)
+                with open(dest_path, 'wb') as dest:
+                    shutil.copyfileobj(src, dest, FAST_SYNC_CHUNK_SIZE)
+
+            tar.close()
+
     except Exception, e:
-        os.close(fd)
         log.exception(e)
-        return None
-    
-    os.close(fd)
-    return tmppath
+        log.error("Failed to extract {}".format(snapshot_path))
+        return False
+
+    return True
 
 
-def fast_sync_inspect( fd ):
+def fast_sync_inspect( fd, fd_len=None ):
     """
-    Inspect a snapshot, given its file descriptor.
+    Inspect a snapshot, given its file descriptor
+    (and its length, if it's not a file on disk).
     Get the signatures and payload size
     Return {'status': True, 
             'signatures': signatures,
@@ -369,8 +552,11 @@ def fast_sync_inspect( fd ):
             'sig_append_offset': offset} on success
     Return {'error': ...} on error
     """
-    sb = os.fstat(fd.fileno())
-    ptr = sb.st_size
+    if fd_len is None:
+        sb = os.fstat(fd.fileno())
+        fd_len = sb.st_size
+
+    ptr = fd_len
     if ptr < 8:
         log.debug("fd is {} bytes".format(ptr))
         return {'error': 'File is too small to be a snapshot'}
@@ -425,7 +611,7 @@ def fast_sync_inspect_snapshot( snapshot_path ):
     with open(snapshot_path, 'r') as f:
         info = fast_sync_inspect( f )
         if 'error' in info:
-            log.error("Failed to inspect snapshot {}: {}".format(import_path, info['error']))
+            log.error("Failed to inspect snapshot {}: {}".format(snapshot_path, info['error']))
             return {'error': 'Failed to inspect snapshot'}
 
         # get the hash of the file 
@@ -435,24 +621,79 @@ def fast_sync_inspect_snapshot( snapshot_path ):
     return info
 
 
-def fast_sync_import( working_dir, import_url, public_keys=config.FAST_SYNC_PUBLIC_KEYS, num_required=len(config.FAST_SYNC_PUBLIC_KEYS) ):
+def fast_sync_verify_signatures( hash_hex, signatures, public_keys, num_required ):
+    """
+    Verify that at least `num_required` public keys in `public_keys`
+    signed the snapshot hash.
+    NOTE: `public_keys` needs to be in the same order as the private keys that signed.
+    Return True if so
+    Return False if not
+    """
+    key_idx = 0
+    num_match = 0
+    for next_pubkey in public_keys:
+        for sigb64 in signatures:
+            valid = blockstack_client.keys.verify_digest( hash_hex, keylib.ECPublicKey(next_pubkey).to_hex(), sigb64, hashfunc=hashlib.sha256 ) 
+            if valid:
+                num_match += 1
+                if num_match >= num_required:
+                    break
+                
+                log.debug("Public key {} matches {} ({})".format(next_pubkey, sigb64, hash_hex))
+                signatures.remove(sigb64)
+
+            elif os.environ.get("BLOCKSTACK_TEST") == "1":
+                log.debug("Public key {} does NOT match {} ({})".format(next_pubkey, sigb64, hash_hex))
+
+    # enough signatures?
+    if num_match < num_required:
+        log.error("Not enough signatures match (required {}, found {})".format(num_required, num_match))
+        return False
+
+    return True
+
+
+def fast_sync_move_tree( src_dir, dest_dir ):
+    """
+    Move the contents of src_dir into dest_dir,
+    merging directories and replacing files.
+    """
+    for name in os.listdir(src_dir):
+        src_path = os.path.join(src_dir, name)
+        dest_path = os.path.join(dest_dir, name)
+
+        if os.path.isdir(src_path) and os.path.isdir(dest_path):
+            fast_sync_move_tree(src_path, dest_path)
+            continue
+
+        if os.path.isdir(dest_path):
+            shutil.rmtree(dest_path)
+
+        os.rename(src_path, dest_path)
+
+
+def fast_sync_import( working_dir, import_url, public_keys=config.FAST_SYNC_PUBLIC_KEYS, num_required=len(config.FAST_SYNC_PUBLIC_KEYS), resume=True, progress_callback=None ):
     """
     Fast sync import.
-    Verify the given fast-sync file from @import_path using @public_key, and then 
-    uncompress it into @working_dir.
+    Stream the fast-sync file from @import_url, verify it using @public_keys,
+    and then uncompress it into @working_dir.
+
+    The snapshot is hashed and spooled to disk as it downloads, so it is only
+    fetched once.  It is only extracted (into a staging directory, see
+    fast_sync_extract()) once the signatures check out, and then moved into
+    @working_dir.
+
+    If @resume is True, the spooled download is kept if the import is interrupted,
+    so that calling this method again picks up the download where it left off
+    (if the server supports byte ranges).
+
+    If given, @progress_callback(bytes received, total bytes or None) is called
+    as the snapshot arrives.
 
     Verify that at least `num_required` public keys in `public_keys` signed.
     NOTE: `public_keys` needs to be in the same order as the private keys that signed.
     """
 
-    # make sure we have the apppriate tools
-    tools = ['tar', 'bzip2', 'mv']
-    for tool in tools:
-        rc = os.system("which {} > /dev/null".format(tool))
-        if rc != 0:
-            log.error("'{}' command not found".format(tool))
-            return False
-
     if working_dir is None:
         working_dir = virtualchain.get_working_dir()
 
@@ -460,69 +701,123 @@ def fast_sync_import( working_dir, import_url, public_keys=config.FAST_SYNC_PUBL
         log.error("No such directory {}".format(working_dir))
         return False
 
+    spool_path = os.path.join(working_dir, FAST_SYNC_SPOOL_FILENAME)
+    offset = 0
+    if resume and os.path.exists(spool_path):
+        offset = os.stat(spool_path).st_size
+
     # go get it 
-    import_path = fast_sync_fetch(import_url)
-    if import_path is None:
+    res = fast_sync_fetch(import_url, offset=offset)
+    if res is None and offset > 0:
+        # maybe the partial download is no good
+        res = fast_sync_fetch(import_url)
+
+    if res is None:
         log.error("Failed to fetch {}".format(import_url))
         return False
 
+    resp, offset, total_size = res
+
+    stream = FastSyncStream(spool_path, spool_append=(offset > 0))
+    next_progress = FAST_SYNC_PROGRESS_INTERVAL
+
+    def _progress():
+        log.debug("Received {} of {} bytes".format(stream.num_bytes, total_size if total_size is not None else "(unknown)"))
+        if progress_callback is not None:
+            progress_callback(stream.num_bytes, total_size)
+
     # format: <signed bz2 payload> <sigb64> <sigb64 length (8 bytes hex)> ... <num signatures>
-    file_size = 0
     try:
-        sb = os.stat(import_path)
-        file_size = sb.st_size
-    except Exception as e:
+        if offset > 0:
+            # replay what we already have
+            log.debug("Resuming {} from byte {}".format(import_url, offset))
+            with open(spool_path, 'rb') as f:
+                f.seek(0, os.SEEK_SET)
+                count = 0
+                while count < offset:
+                    buf = f.read(min(FAST_SYNC_CHUNK_SIZE, offset - count))
+                    if len(buf) == 0:
+                        raise Exception("Partial download {} is truncated".format(spool_path))
+
+                    stream.write(buf, spool=False)
+                    count += len(buf)
+
+        while True:
+            buf = resp.read(FAST_SYNC_CHUNK_SIZE)
+            if len(buf) == 0:
+                break
+
+            stream.write(buf)
+            if stream.num_bytes >= next_progress:
+                _progress()
+                next_progress += FAST_SYNC_PROGRESS_INTERVAL
+
+    except Exception, e:
         log.exception(e)
+        log.error("Failed to fetch {} (received {} bytes)".format(import_url, stream.num_bytes))
+        stream.abort()
+        if not resume:
+            os.unlink(spool_path)
+
         return False
 
-    num_signatures = 0
-    ptr = file_size
-    signatures = []
+    _progress()
 
-    with open(import_path, 'r') as f:
-        info = fast_sync_inspect( f )
-        if 'error' in info:
-            log.error("Failed to inspect snapshot {}: {}".format(import_path, info['error']))
-            return False
+    staging_dir = os.path.join(working_dir, FAST_SYNC_STAGING_DIRNAME)
 
-        signatures = info['signatures']
-        ptr = info['payload_size']
+    def _cleanup():
+        try:
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
 
-        # get the hash of the file 
-        hash_hex = blockstack_client.storage.get_file_hash(f, hashlib.sha256, fd_len=ptr)
-        
-        # validate signatures over the hash
-        log.debug("Verify {} bytes".format(ptr))
-        key_idx = 0
-        num_match = 0
-        for next_pubkey in public_keys:
-            for sigb64 in signatures:
-                valid = blockstack_client.keys.verify_digest( hash_hex, keylib.ECPublicKey(next_pubkey).to_hex(), sigb64, hashfunc=hashlib.sha256 ) 
-                if valid:
-                    num_match += 1
-                    if num_match >= num_required:
-                        break
-                    
-                    log.debug("Public key {} matches {} ({})".format(next_pubkey, sigb64, hash_hex))
-                    signatures.remove(sigb64)
-
-                elif os.environ.get("BLOCKSTACK_TEST") == "1":
-                    log.debug("Public key {} does NOT match {} ({})".format(next_pubkey, sigb64, hash_hex))
-
-        # enough signatures?
-        if num_match < num_required:
-            log.error("Not enough signatures match (required {}, found {})".format(num_required, num_match))
-            return False
+            if os.path.exists(spool_path):
+                os.unlink(spool_path)
 
-    # decompress
-    import_path = os.path.abspath(import_path)
-    cmd = "cd '{}' && tar xf '{}'".format(working_dir, import_path)
-    log.debug(cmd)
-    rc = os.system(cmd)
-    if rc != 0:
-        log.error("Failed to decompress. Exit code {}. Command: {}".format(rc, cmd))
+        except Exception, e:
+            log.exception(e)
+            log.error("Failed to clean up {}".format(staging_dir))
+
+    info = stream.finish()
+    if 'error' in info:
+        log.error("Failed to inspect snapshot {}: {}".format(import_url, info['error']))
+        _cleanup()
+        return False
+
+    # validate signatures over the hash
+    log.debug("Verify {} bytes".format(info['payload_size']))
+    rc = fast_sync_verify_signatures(info['hash'], info['signatures'], public_keys, num_required)
+    if not rc:
+        _cleanup()
         return False
 
+    # extract into a clean staging directory
+    try:
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+
+        os.makedirs(staging_dir)
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to set up {}".format(staging_dir))
+        _cleanup()
+        return False
+
+    rc = fast_sync_extract(spool_path, info['payload_size'], staging_dir)
+    if not rc:
+        log.error("Failed to extract snapshot {}".format(import_url))
+        _cleanup()
+        return False
+
+    # install
+    try:
+        fast_sync_move_tree(staging_dir, working_dir)
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to move snapshot from {} to {}".format(staging_dir, working_dir))
+        return False
+
+    _cleanup()
+
     # restore from backup
     rc = blockstack_backup_restore(working_dir, None)
     if not rc:
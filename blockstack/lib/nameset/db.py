@@ -36,8 +36,9 @@ import copy
 import shutil
 import time
 import random
+import threading
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 # hack around absolute paths
 curr_dir = os.path.abspath( os.path.join( os.path.dirname(__file__), ".." ) )
@@ -53,6 +54,11 @@ import virtualchain
 
 log = virtualchain.get_logger("blockstack-server")
 
+# decoded history and restore checkpoints for recently-restored names and namespaces,
+# least-recently-used first (see namedb_get_history_cached())
+NAMEDB_HISTORY_CACHE = OrderedDict()
+NAMEDB_HISTORY_CACHE_LOCK = threading.Lock()
+
 BLOCKSTACK_DB_SCRIPT = ""
 
 BLOCKSTACK_DB_SCRIPT += """
@@ -70,6 +76,7 @@ CREATE TABLE history( txid TEXT NOT NULL,
 BLOCKSTACK_DB_SCRIPT += """
 CREATE INDEX history_block_id_index ON history( history_id, block_id );
 CREATE INDEX history_id_index ON history( history_id );
+CREATE INDEX history_block_index ON history( block_id );
 """
 
 BLOCKSTACK_DB_SCRIPT += """
@@ -300,6 +307,24 @@ def namedb_open( path ):
     return con
 
 
+def namedb_upgrade( con, path ):
+    """
+    Bring an existing database's schema up to date.
+    Only call this from the (single) read/write opener,
+    since it may need to build indexes.
+    Return True on success
+    Return False on error
+    """
+    # databases created before this index existed need it too
+    try:
+        con.execute("CREATE INDEX IF NOT EXISTS history_block_index ON history( block_id );")
+    except sqlite3.OperationalError, oe:
+        log.warning("Failed to create history_block_index in %s: %s" % (path, oe))
+        return False
+
+    return True
+
+
 def namedb_row_factory( cursor, row ):
     """
     Row factor to enforce some additional types:
@@ -1314,6 +1339,8 @@ def namedb_history_save( cur, opcode, history_id, block_id, vtxindex, txid, inpu
         log.debug("Backup (%s, %s) from %s: %s" % (block_id, vtxindex, prev_opcode, ",".join(sorted(history_diff_fields))))
         history_diff = dict( [(field, input_rec.get(field, None)) for field in history_diff_fields] )
 
+    namedb_history_cache_invalidate( history_id )
+
     rc = namedb_history_append( cur, history_id, block_id, vtxindex, txid, history_diff )
     if not rc:
         raise Exception("Failed to save history for '%s' at %s" % (history_rec, block_id))
@@ -1429,6 +1456,64 @@ def namedb_get_history( cur, history_id ):
     return namedb_history_extract( history_rows )
 
 
+def namedb_get_history_cached( cur, history_id ):
+    """
+    Get the decoded history for a name or namespace from the history cache,
+    (re)loading it from the history table if it is missing or out of date.
+
+    Returns the cache entry, as a dict with:
+    * 'rows': the history rows
+    * 'history': the decoded history (see namedb_history_extract()).  DO NOT MODIFY.
+    * 'block_ids': the history's block heights, in descending order
+    * restore checkpoints (see namedb_restore_from_history_cached())
+    """
+    global NAMEDB_HISTORY_CACHE, NAMEDB_HISTORY_CACHE_LOCK
+
+    db_path = None
+    for r in namedb_query_execute( cur, "PRAGMA database_list;", () ):
+        if r['name'] == 'main':
+            db_path = r['file']
+
+    # history rows are only ever appended, so the row count tells us if we're out of date
+    num_rows = namedb_select_count_rows( cur, "SELECT COUNT(*) FROM history WHERE history_id = ?;", (history_id,) )
+
+    with NAMEDB_HISTORY_CACHE_LOCK:
+        history_entry = NAMEDB_HISTORY_CACHE.pop( history_id, None )
+        if history_entry is not None and history_entry['db_path'] == db_path and len(history_entry['rows']) == num_rows:
+            NAMEDB_HISTORY_CACHE[history_id] = history_entry
+            return history_entry
+
+    history_rows = namedb_get_history_rows( cur, history_id )
+    history = namedb_history_extract( history_rows )
+
+    history_entry = {
+        'db_path': db_path,
+        'rows': history_rows,
+        'history': history,
+        'block_ids': list( reversed( sorted( history.keys() ) ) ),
+        'base': None,
+        'checkpoints': {},
+    }
+
+    with NAMEDB_HISTORY_CACHE_LOCK:
+        NAMEDB_HISTORY_CACHE[history_id] = history_entry
+        while len(NAMEDB_HISTORY_CACHE) > NAMEDB_HISTORY_CACHE_SIZE:
+            NAMEDB_HISTORY_CACHE.popitem( last=False )
+
+    return history_entry
+
+
+def namedb_history_cache_invalidate( history_id ):
+    """
+    Forget the cached history for a name or namespace
+    """
+    global NAMEDB_HISTORY_CACHE, NAMEDB_HISTORY_CACHE_LOCK
+
+    with NAMEDB_HISTORY_CACHE_LOCK:
+        if NAMEDB_HISTORY_CACHE.has_key( history_id ):
+            del NAMEDB_HISTORY_CACHE[history_id]
+
+
 def namedb_history_extract( history_rows ):
     """
     TODO: DRY up; moved to client
@@ -1719,16 +1804,126 @@ def namedb_restore_from_history( name_rec, block_id ):
     return blockstack_client.operations.nameop_restore_from_history( name_rec, name_rec['history'], block_id )
     
 
-def namedb_rec_restore( db, rows, history_id_key, block_id, include_history=False ):
+def namedb_restore_from_history_cached( name_rec, history_entry, block_id ):
+    """
+    Same as namedb_restore_from_history(), but replay the record's cached history
+    (see namedb_get_history_cached()) back from the nearest checkpoint at or before
+    block_id, instead of from the record's current state.  Checkpoints are
+    remembered every NAMEDB_HISTORY_CHECKPOINT_INTERVAL blocks of history.
+
+    name_rec's 'history' (if present) is ignored.  Neither it nor the
+    cached history is modified.
+
+    Return the sequence of states the record went through at that block number.
+    Return None if the record does not exist at that point in time.
+    """
+
+    block_history = history_entry['block_ids']
+    name_history = history_entry['history']
+    base_rec = dict( [(k, v) for (k, v) in name_rec.items() if k != 'history'] )
+
+    if len(block_history) == 0:
+        # nothing to replay (will sanity-check the record)
+        return blockstack_client.operations.nameop_restore_from_history( base_rec, {}, block_id )
+
+    if block_id > block_history[0]:
+        # current record is valid
+        return [copy.deepcopy( base_rec )]
+
+    if block_id < name_rec['block_number']:
+        # doesn't yet exist
+        return None
+
+    # find the latest block prior to block_number
+    last_block = len(block_history)
+    for i in xrange( 0, len(block_history) ):
+        if block_id >= block_history[i]:
+            last_block = i
+            break
+
+    # checkpoints are only valid for the current state they were replayed from
+    with NAMEDB_HISTORY_CACHE_LOCK:
+        if history_entry['base'] != base_rec:
+            history_entry['base'] = base_rec
+            history_entry['checkpoints'] = {0: base_rec}
+
+        checkpoints = history_entry['checkpoints']
+
+        i = (last_block / NAMEDB_HISTORY_CHECKPOINT_INTERVAL) * NAMEDB_HISTORY_CHECKPOINT_INTERVAL
+        while not checkpoints.has_key(i):
+            i -= NAMEDB_HISTORY_CHECKPOINT_INTERVAL
+
+        historical_rec = dict( checkpoints[i] )
+
+    while i < last_block:
+        for diff in reversed( name_history[ block_history[i] ] ):
+            if diff.has_key('history_snapshot'):
+                # wholly new state
+                historical_rec = dict( diff )
+                del historical_rec['history_snapshot']
+
+            else:
+                # delta in current state
+                # no matter what, 'block_number' cannot be altered (unless it's a history snapshot)
+                historical_rec.update( [(k, v) for (k, v) in diff.items() if k != 'block_number'] )
+
+        i += 1
+        if i % NAMEDB_HISTORY_CHECKPOINT_INTERVAL == 0:
+            with NAMEDB_HISTORY_CACHE_LOCK:
+                if not checkpoints.has_key(i):
+                    checkpoints[i] = dict( historical_rec )
+
+    # generate the sequence of updates within the requested block,
+    # exactly as nameop_restore_from_history() does
+    updates = [ copy.deepcopy( historical_rec ) ]
+
+    if i < len(block_history):
+        diff_list = list( reversed( name_history[ block_history[i] ] ) )
+        if len(diff_list) > 1:
+            for diff in diff_list[:-1]:
+
+                # no matter what, 'block_number' cannot be altered
+                diff = dict( [(k, v) for (k, v) in diff.items() if k != 'block_number'] )
+
+                if diff.has_key('history_snapshot'):
+                    # wholly new state
+                    historical_rec = diff
+                    del historical_rec['history_snapshot']
+
+                else:
+                    # delta in current state
+                    historical_rec.update( diff )
+
+                updates.append( copy.deepcopy(historical_rec) )
+
+    return list( reversed( updates ) )
+
+
+def namedb_rec_restore( db, rows, history_id_key, block_id, include_history=False, history_cache=None ):
     """
     Restore a record to its previous states over a block.
+    If history_cache is given, it is used to remember history cache
+    entries across calls (i.e. when restoring records over a range of blocks).
+    It must be an OrderedDict; it is kept to NAMEDB_HISTORY_CACHE_SIZE entries,
+    evicting the least-recently-used.
     Return the list of previous states (not sorted; you can do so on vtxindex if you want).
     """
 
-    def get_history( history_id ):
+    def get_history_entry( history_id ):
+        if history_cache is not None and history_cache.has_key( history_id ):
+            # most-recently used
+            history_entry = history_cache.pop( history_id )
+            history_cache[history_id] = history_entry
+            return history_entry
+
         hist_cur = db.cursor()
-        hist = namedb_get_history( hist_cur, history_id )
-        return hist
+        history_entry = namedb_get_history_cached( hist_cur, history_id )
+        if history_cache is not None:
+            history_cache[history_id] = history_entry
+            while len(history_cache) > NAMEDB_HISTORY_CACHE_SIZE:
+                history_cache.popitem( last=False )
+
+        return history_entry
 
     ret = []
     
@@ -1736,13 +1931,20 @@ def namedb_rec_restore( db, rows, history_id_key, block_id, include_history=Fals
         rec = {}
         rec.update( row )
 
-        rec_history = get_history( rec[history_id_key] )
-        rec['history'] = rec_history
+        history_entry = get_history_entry( rec[history_id_key] )
 
-        restored_recs = namedb_restore_from_history( rec, block_id )
         if include_history:
+            # the caller gets its own copy of the history, in the same
+            # state that namedb_restore_from_history() leaves it in.
+            rec_history = namedb_history_extract( history_entry['rows'] )
+            rec['history'] = rec_history
+
+            restored_recs = namedb_restore_from_history( rec, block_id )
             for r in restored_recs:
                 r['history'] = rec_history
+
+        else:
+            restored_recs = namedb_restore_from_history_cached( rec, history_entry, block_id )
         
         ret += restored_recs
 
@@ -1784,7 +1986,7 @@ def namedb_select_count_rows( cur, query, args, count_column='COUNT(*)' ):
     return count
 
 
-def namedb_get_names_preordered_or_imported_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True ):
+def namedb_get_names_preordered_or_imported_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True, history_cache=None ):
     """
     Get the list of names preordered or imported at this block height.
 
@@ -1823,7 +2025,7 @@ def namedb_get_names_preordered_or_imported_at( db, block_id, include_history=Fa
     name_preorder_rows = namedb_query_execute( cur, name_preorder_rows_query, args )
 
     if restore_history:
-        restored_recs = namedb_rec_restore( db, name_preorder_rows, "name", block_id, include_history=include_history )
+        restored_recs = namedb_rec_restore( db, name_preorder_rows, "name", block_id, include_history=include_history, history_cache=history_cache )
     else:
         restored_recs = [dict(r) for r in name_preorder_rows]
 
@@ -1836,7 +2038,7 @@ def namedb_get_names_preordered_or_imported_at( db, block_id, include_history=Fa
     return restored_recs
 
 
-def namedb_get_names_modified_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True ):
+def namedb_get_names_modified_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True, history_cache=None ):
     """
     Get the list of name-modification operations that occurred at the given block height.
 
@@ -1882,7 +2084,7 @@ def namedb_get_names_modified_at( db, block_id, include_history=False, offset=No
     name_rows = namedb_query_execute( cur, name_rows_query, args )
 
     if restore_history:
-        restored_recs = namedb_rec_restore( db, name_rows, "name", block_id, include_history=include_history )
+        restored_recs = namedb_rec_restore( db, name_rows, "name", block_id, include_history=include_history, history_cache=history_cache )
     else:
         restored_recs = [dict(r) for r in name_rows]
 
@@ -1936,7 +2138,7 @@ def namedb_get_preorders_at( db, block_id, offset=None, count=None ):
     return ret
 
 
-def namedb_get_namespaces_preordered_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True ):
+def namedb_get_namespaces_preordered_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True, history_cache=None ):
     """
     Get the namespace preorders that have occurred at the given block height.
 
@@ -1972,7 +2174,7 @@ def namedb_get_namespaces_preordered_at( db, block_id, include_history=False, of
     namespace_preorder_rows = namedb_query_execute( cur, namespace_preorder_rows_query, args )
 
     if restore_history:
-        restored_recs = namedb_rec_restore( db, namespace_preorder_rows, "namespace_id", block_id, include_history=include_history )
+        restored_recs = namedb_rec_restore( db, namespace_preorder_rows, "namespace_id", block_id, include_history=include_history, history_cache=history_cache )
     else:
         restored_recs = [dict(r) for r in namespace_preorder_rows]
 
@@ -1980,7 +2182,7 @@ def namedb_get_namespaces_preordered_at( db, block_id, include_history=False, of
     return restored_recs
 
 
-def namedb_get_namespaces_modified_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True ):
+def namedb_get_namespaces_modified_at( db, block_id, include_history=False, offset=None, count=None, restore_history=True, history_cache=None ):
     """
     Get the namespace operations that occurred at the given blocok height.
 
@@ -2020,7 +2222,7 @@ def namedb_get_namespaces_modified_at( db, block_id, include_history=False, offs
     namespace_rows = namedb_query_execute( cur, namespace_rows_query, args )
 
     if restore_history:
-        restored_recs = namedb_rec_restore( db, namespace_rows, "namespace_id", block_id, include_history=include_history )
+        restored_recs = namedb_rec_restore( db, namespace_rows, "namespace_id", block_id, include_history=include_history, history_cache=history_cache )
     else:
         restored_recs = [dict(r) for r in namespace_rows]
 
@@ -2062,7 +2264,7 @@ def namedb_get_all_ops_countdown( restored_recs, rel_offset, remaining ):
        
 
 
-def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_history=False, restore_history=True ):
+def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_history=False, restore_history=True, history_cache=None ):
     """
     Get the states that each name and namespace record
     passed through in the given block.
@@ -2078,6 +2280,9 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
     Multiple modifications to the same record will be ignored.
 
     No ordering within these lists is guaranteed during pagination.
+
+    If history_cache is given, it will be used to remember history rows
+    across calls (see namedb_get_all_ops_in_range()).
     """
 
     assert not (restore_history and (offset is not None or count is not None)), "Invalid arguments: restore_history is incompatible with pagination"
@@ -2087,7 +2292,7 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
     remaining = count
 
     # all name records preordered or imported for the first time at this block 
-    res = namedb_get_names_preordered_or_imported_at( db, block_id, offset=rel_offset, count=remaining, include_history=include_history, restore_history=restore_history )
+    res = namedb_get_names_preordered_or_imported_at( db, block_id, offset=rel_offset, count=remaining, include_history=include_history, restore_history=restore_history, history_cache=history_cache )
     restored_recs, rel_offset, remaining = namedb_get_all_ops_countdown( res, rel_offset, remaining )
 
     ret += restored_recs
@@ -2095,7 +2300,7 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
         return ret
 
     # all name records affected by this block 
-    res = namedb_get_names_modified_at( db, block_id, offset=rel_offset, count=remaining, include_history=include_history, restore_history=restore_history )
+    res = namedb_get_names_modified_at( db, block_id, offset=rel_offset, count=remaining, include_history=include_history, restore_history=restore_history, history_cache=history_cache )
     restored_recs, rel_offset, remaining = namedb_get_all_ops_countdown( res, rel_offset, remaining )
 
     ret += restored_recs
@@ -2111,7 +2316,7 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
         return ret
 
     # all namespaces preordered at this block
-    res = namedb_get_namespaces_preordered_at( db, block_id, include_history=include_history, offset=rel_offset, count=remaining, restore_history=restore_history )
+    res = namedb_get_namespaces_preordered_at( db, block_id, include_history=include_history, offset=rel_offset, count=remaining, restore_history=restore_history, history_cache=history_cache )
     restored_recs, rel_offset, remaining = namedb_get_all_ops_countdown( res, rel_offset, remaining )
 
     ret += restored_recs
@@ -2119,7 +2324,7 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
         return ret
 
     # all namespaces revealed/readied at this block
-    res = namedb_get_namespaces_modified_at( db, block_id, include_history=include_history, offset=rel_offset, count=remaining, restore_history=restore_history )
+    res = namedb_get_namespaces_modified_at( db, block_id, include_history=include_history, offset=rel_offset, count=remaining, restore_history=restore_history, history_cache=history_cache )
     restored_recs, rel_offset, remaining = namedb_get_all_ops_countdown( res, rel_offset, remaining )
 
     ret += restored_recs
@@ -2130,6 +2335,122 @@ def namedb_get_all_ops_at( db, block_id, offset=None, count=None, include_histor
     return sorted( ret, key=lambda n: n['vtxindex'] )
 
 
+def namedb_get_ops_at_by_keys( db, block_id, names, namespace_ids, preorder_hashes, include_history=False, history_cache=None ):
+    """
+    Get the states that the given names, namespaces and preorders
+    passed through in the given block.  This is the same as
+    namedb_get_all_ops_at(), but it only looks up the given records
+    (by key) instead of searching the whole block.  The caller must
+    give all of the records affected at this block for the two to agree.
+
+    Return the list of prior record states, ordered by vtxindex.
+    """
+
+    names = sorted( names )
+    namespace_ids = sorted( namespace_ids )
+    preorder_hashes = sorted( preorder_hashes )
+
+    cur = db.cursor()
+
+    # all name records preordered or imported for the first time at this block
+    name_preorder_rows = []
+    name_preorder_rows_query = "SELECT * FROM name_records WHERE name_records.name = ? AND (name_records.block_number = ? OR name_records.preorder_block_number = ?);"
+    for name in names:
+        name_preorder_rows += namedb_query_execute( cur, name_preorder_rows_query, (name, block_id, block_id) ).fetchall()
+
+    restored_recs = namedb_rec_restore( db, name_preorder_rows, "name", block_id, include_history=include_history, history_cache=history_cache )
+    ret = filter( lambda rec: rec['op'] == NAME_PREORDER or rec['op'] == NAME_IMPORT, restored_recs )
+
+    # all name records affected by this block
+    name_rows = []
+    name_rows_query = "SELECT name_records.* FROM name_records JOIN history ON name_records.name = history.history_id " + \
+                      "WHERE name_records.name = ? AND name_records.block_number < ? AND name_records.preorder_block_number != ? AND history.block_id = ? " + \
+                      "GROUP BY name_records.name;"
+
+    for name in names:
+        name_rows += namedb_query_execute( cur, name_rows_query, (name, block_id, block_id, block_id) ).fetchall()
+
+    ret += namedb_rec_restore( db, name_rows, "name", block_id, include_history=include_history, history_cache=history_cache )
+
+    # all outstanding name/namespace preorders created at this block
+    preorder_rows_query = "SELECT * FROM preorders WHERE preorder_hash = ? AND block_number = ?;"
+    for preorder_hash in preorder_hashes:
+        for preorder in namedb_query_execute( cur, preorder_rows_query, (preorder_hash, block_id) ):
+            preorder_rec = {}
+            preorder_rec.update( preorder )
+            ret.append( preorder_rec )
+
+    # all namespaces preordered at this block
+    namespace_preorder_rows = []
+    namespace_preorder_rows_query = "SELECT * FROM namespaces WHERE namespaces.namespace_id = ? AND namespaces.block_number = ?;"
+    for namespace_id in namespace_ids:
+        namespace_preorder_rows += namedb_query_execute( cur, namespace_preorder_rows_query, (namespace_id, block_id) ).fetchall()
+
+    ret += namedb_rec_restore( db, namespace_preorder_rows, "namespace_id", block_id, include_history=include_history, history_cache=history_cache )
+
+    # all namespaces revealed/readied at this block.
+    # NOTE: like namedb_get_namespaces_modified_at(), this yields one row per history entry at this block
+    namespace_rows = []
+    namespace_rows_query = "SELECT namespaces.* FROM namespaces JOIN history ON namespaces.namespace_id = history.history_id " + \
+                           "WHERE namespaces.namespace_id = ? AND namespaces.block_number <= ? AND history.block_id = ? AND (namespaces.op = ? OR namespaces.op = ?);"
+
+    for namespace_id in namespace_ids:
+        namespace_rows += namedb_query_execute( cur, namespace_rows_query, (namespace_id, block_id, block_id, NAMESPACE_REVEAL, NAMESPACE_READY) ).fetchall()
+
+    ret += namedb_rec_restore( db, namespace_rows, "namespace_id", block_id, include_history=include_history, history_cache=history_cache )
+
+    log.debug("%s states for %s names, %s namespaces and %s preorders at %s" % (len(ret), len(names), len(namespace_ids), len(preorder_hashes), block_id))
+
+    # put into block order
+    return sorted( ret, key=lambda n: n['vtxindex'] )
+
+
+def namedb_get_blocks_with_ops_in_range( cur, start_block_id, end_block_id ):
+    """
+    Get the heights of the blocks in [start_block_id, end_block_id]
+    at which at least one name or namespace operation was processed.
+    Returns the sorted list of heights.
+    """
+    queries = [
+        ("SELECT DISTINCT block_id FROM history WHERE block_id >= ? AND block_id <= ?;", (start_block_id, end_block_id), ['block_id']),
+        ("SELECT block_number,preorder_block_number FROM name_records WHERE (block_number >= ? AND block_number <= ?) OR (preorder_block_number >= ? AND preorder_block_number <= ?);",
+            (start_block_id, end_block_id, start_block_id, end_block_id), ['block_number', 'preorder_block_number']),
+        ("SELECT DISTINCT block_number FROM preorders WHERE block_number >= ? AND block_number <= ?;", (start_block_id, end_block_id), ['block_number']),
+        ("SELECT DISTINCT block_number FROM namespaces WHERE block_number >= ? AND block_number <= ?;", (start_block_id, end_block_id), ['block_number']),
+    ]
+
+    block_ids = set()
+    for (query, args, columns) in queries:
+        rows = namedb_query_execute( cur, query, args )
+        for r in rows:
+            for column in columns:
+                if r[column] is not None and r[column] >= start_block_id and r[column] <= end_block_id:
+                    block_ids.add( r[column] )
+
+    return sorted( block_ids )
+
+
+def namedb_get_all_ops_in_range( db, start_block_id, end_block_id, include_history=False ):
+    """
+    Get the states that each name and namespace record passed through
+    in each block in [start_block_id, end_block_id], in block order.
+
+    Recently-used records' histories are remembered over the whole range
+    (up to NAMEDB_HISTORY_CACHE_SIZE of them), instead of being loaded once per block.
+
+    Yields (block_id, [prior record states ordered by vtxindex]) for
+    each block that had at least one operation.
+    """
+    cur = db.cursor()
+    block_ids = namedb_get_blocks_with_ops_in_range( cur, start_block_id, end_block_id )
+    history_cache = OrderedDict()
+
+    for block_id in block_ids:
+        recs = namedb_get_all_ops_at( db, block_id, include_history=include_history, history_cache=history_cache )
+        if len(recs) > 0:
+            yield (block_id, recs)
+
+
 def namedb_get_num_ops_at( db, block_id ):
     """
     Get the number of operations that occurred at a particular block.
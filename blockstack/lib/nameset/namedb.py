@@ -110,6 +110,9 @@ class BlockstackDB( virtualchain.StateEngine ):
         self.db_filename = db_filename
         if os.path.exists( db_filename ):
             self.db = namedb_open( db_filename )
+            if disposition == DISPOSITION_RW:
+                namedb_upgrade( self.db, db_filename )
+
         else:
             self.db = namedb_create( db_filename )
 
@@ -138,6 +141,11 @@ class BlockstackDB( virtualchain.StateEngine ):
         # map block_id --> history_id_key --> list of history ID values
         self.collisions = {}
 
+        # records affected by the operations committed at the current block,
+        # so we can calculate its ops hash without searching the whole block
+        # (see calculate_block_ops_hash_incremental())
+        self.block_ops_acc = None
+
 
     @classmethod 
     def borrow_readwrite_instance( cls, db_path, block_number, expected_snapshots={} ):
@@ -665,7 +673,8 @@ class BlockstackDB( virtualchain.StateEngine ):
         at a particular block number.
         """
 
-        name_rec = self.get_name( name, include_expired=include_expired )
+        cur = self.db.cursor()
+        name_rec = namedb_get_name( cur, name, self.lastblock, include_expired=include_expired, include_history=False )
 
         # trivial reject
         if name_rec is None:
@@ -676,7 +685,8 @@ class BlockstackDB( virtualchain.StateEngine ):
             # didn't exist then
             return None
 
-        historical_recs = namedb_restore_from_history( name_rec, block_number )
+        history_entry = namedb_get_history_cached( cur, name )
+        historical_recs = namedb_restore_from_history_cached( name_rec, history_entry, block_number )
         return historical_recs
 
 
@@ -687,11 +697,12 @@ class BlockstackDB( virtualchain.StateEngine ):
         """
 
         cur = self.db.cursor()
-        namespace_rec = namedb_get_namespace( cur, namespace_id, None, include_expired=True )
+        namespace_rec = namedb_get_namespace( cur, namespace_id, None, include_expired=True, include_history=False )
         if namespace_rec is None:
             return None
 
-        historical_recs = namedb_restore_from_history( namespace_rec, block_number )
+        history_entry = namedb_get_history_cached( cur, namespace_id )
+        historical_recs = namedb_restore_from_history_cached( namespace_rec, history_entry, block_number )
         return historical_recs
 
 
@@ -761,6 +772,24 @@ class BlockstackDB( virtualchain.StateEngine ):
         return recs
        
 
+    def get_all_ops_in_range( self, start_block, end_block, include_history=False ):
+        """
+        Get all records affected in the blocks [start_block, end_block],
+        in the states they were at each block.
+
+        Yields (block number, [records]) in block order.
+        """
+        log.debug("Get all ops in [%s, %s] in %s" % (start_block, end_block, self.db_filename))
+        for (block_number, recs) in namedb_get_all_ops_in_range( self.db, start_block, end_block, include_history=include_history ):
+
+            # include opcode
+            for rec in recs:
+                assert 'op' in rec
+                rec['opcode'] = op_get_opcode_name(rec['op'])
+
+            yield (block_number, recs)
+
+
     def get_num_ops_at( self, block_number ):
         """
         Get the number of name operations at a particular block.
@@ -1331,6 +1360,7 @@ class BlockstackDB( virtualchain.StateEngine ):
         op_seq = None
         op_seq_type_str = None
         opcode = nameop.get('opcode', None)
+        history_id_key = None
         history_id = None
 
         try:
@@ -1389,10 +1419,41 @@ class BlockstackDB( virtualchain.StateEngine ):
                 del op_seq[i]['history']
 
             self.log_commit( current_block_number, op_seq[i]['vtxindex'], op_seq[i]['op'], opcode, op_seq[i] )
+
+        if len(op_seq) > 0:
+            self.block_ops_acc_add( current_block_number, op_seq, history_id_key, history_id )
     
         return op_seq
 
 
+    def block_ops_acc_add( self, block_id, op_seq, history_id_key, history_id ):
+        """
+        Remember which records were affected by a committed operation,
+        so we can calculate the block's ops hash from them later.
+        """
+        if self.block_ops_acc is None or self.block_ops_acc['block_id'] != block_id:
+            self.block_ops_acc = {
+                'block_id': block_id,
+                'names': set([]),
+                'namespaces': set([]),
+                'preorders': set([])
+            }
+
+        if history_id is None:
+            # preorder
+            for op in op_seq:
+                self.block_ops_acc['preorders'].add( str(op['preorder_hash']) )
+
+        elif history_id_key == 'name':
+            self.block_ops_acc['names'].add( str(history_id) )
+
+        elif history_id_key == 'namespace_id':
+            self.block_ops_acc['namespaces'].add( str(history_id) )
+
+        else:
+            raise Exception("Unknown history ID key '%s'" % history_id_key)
+
+
     def commit_state_preorder( self, nameop, current_block_number ):
         """
         Commit a state preorder (works for namespace_preorder,
@@ -1732,6 +1793,14 @@ class BlockstackDB( virtualchain.StateEngine ):
             restored_rec = rec_restore_snv_consensus_fields( prior_recs[i], block_id )
             restored_recs.append( restored_rec )
 
+        return cls.make_block_ops_hash( restored_recs )
+
+
+    @classmethod
+    def make_block_ops_hash( cls, restored_recs ):
+        """
+        Get the hash of a block's sequence of restored operations.
+        """
         # NOTE: extracts only the operation-given fields, and ignores ancilliary record fields
         serialized_ops = [ virtualchain.StateEngine.serialize_op( str(op['op'][0]), op, BlockstackDB.make_opfields(), verbose=True ) for op in restored_recs ]
         ops_hash = virtualchain.StateEngine.make_ops_snapshot( serialized_ops )
@@ -1739,6 +1808,41 @@ class BlockstackDB( virtualchain.StateEngine ):
         return ops_hash
 
 
+    def calculate_block_ops_hash_incremental( self, block_id ):
+        """
+        Get the hash of the sequence of operations that occurred in a particular block,
+        using only the records affected by the operations we committed at this block.
+        This gives the same hash as calculate_block_ops_hash(), but without searching
+        the whole block or opening a db handle for each operation.
+
+        Falls back to calculate_block_ops_hash() if we did not commit this block's operations
+        (i.e. if it had none).
+
+        If CHECK_OPS_HASH is set, both hashes are calculated and compared.
+        Return the hash on success.
+        Raise on mismatch.
+        """
+
+        from ..consensus import rec_restore_snv_consensus_fields
+
+        acc = self.block_ops_acc
+        if acc is None or acc['block_id'] != block_id:
+            return BlockstackDB.calculate_block_ops_hash( self, block_id )
+
+        prior_recs = namedb_get_ops_at_by_keys( self.db, block_id, acc['names'], acc['namespaces'], acc['preorders'], include_history=True )
+        restored_recs = [ rec_restore_snv_consensus_fields( prior_rec, block_id, db=self ) for prior_rec in prior_recs ]
+
+        ops_hash = BlockstackDB.make_block_ops_hash( restored_recs )
+
+        if CHECK_OPS_HASH:
+            expected_ops_hash = BlockstackDB.calculate_block_ops_hash( self, block_id )
+            if ops_hash != expected_ops_hash:
+                raise Exception("Incremental ops hash mismatch at %s: %s != %s" % (block_id, ops_hash, expected_ops_hash))
+
+        self.block_ops_acc = None
+        return ops_hash
+
+
     def store_block_ops_hash( self, block_id, ops_hash ):
         """
         Store the operation hash for a block ID, calculated from
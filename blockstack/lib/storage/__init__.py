@@ -23,3 +23,6 @@
 
 import crawl
 from crawl import *
+
+import pack
+from pack import *
@@ -31,6 +31,7 @@ import time
 from ..config import *
 from ..nameset import *
 from .auth import *
+from .pack import get_zonefile_pack
 
 from ..scripts import is_name_valid
 
@@ -47,20 +48,27 @@ log = virtualchain.get_logger("blockstack-server")
 
 def get_cached_zonefile_data( zonefile_hash, zonefile_dir=None ):
     """
-    Get a serialized cached zonefile from local disk 
+    Get a serialized cached zonefile from local disk.
+    Looks in the packed zonefile store first, and then
+    in the legacy one-directory-per-zonefile layout.
     Return None if not found
     """
     if zonefile_dir is None:
         zonefile_dir = get_zonefile_dir()
 
-    zonefile_path_dir = cached_zonefile_dir( zonefile_dir, zonefile_hash )
-    zonefile_path = os.path.join( zonefile_path_dir, "zonefile.txt" )
-    if not os.path.exists( zonefile_path ):
-        log.debug("No zonefile at %s" % zonefile_path )
-        return None 
+    data = None
+    if os.path.exists( zonefile_dir ):
+        data = get_zonefile_pack( zonefile_dir ).get( zonefile_hash )
 
-    with open(zonefile_path, "r") as f:
-        data = f.read()
+    if data is None:
+        zonefile_path_dir = cached_zonefile_dir( zonefile_dir, zonefile_hash )
+        zonefile_path = os.path.join( zonefile_path_dir, "zonefile.txt" )
+        if not os.path.exists( zonefile_path ):
+            log.debug("No zonefile at %s" % zonefile_path )
+            return None 
+
+        with open(zonefile_path, "r") as f:
+            data = f.read()
 
     # sanity check 
     if not verify_zonefile( data, zonefile_hash ):
@@ -132,12 +140,16 @@ def is_zonefile_cached( zonefile_hash, zonefile_dir=None, validate=False):
     if zonefile_dir is None:
         zonefile_dir = get_zonefile_dir()
     
-    zonefile_path_dir = cached_zonefile_dir( zonefile_dir, zonefile_hash )
-    zonefile_path = os.path.join(zonefile_path_dir, "zonefile.txt")
-
-    if not os.path.exists(zonefile_path):
+    if not os.path.exists(zonefile_dir):
         return False
 
+    if not get_zonefile_pack( zonefile_dir ).has( zonefile_hash ):
+        # not migrated yet?
+        zonefile_path_dir = cached_zonefile_dir( zonefile_dir, zonefile_hash )
+        zonefile_path = os.path.join(zonefile_path_dir, "zonefile.txt")
+        if not os.path.exists(zonefile_path):
+            return False
+
     if validate:
         zf = get_cached_zonefile_data( zonefile_hash, zonefile_dir=zonefile_dir )
         if zf is None:
@@ -146,36 +158,48 @@ def is_zonefile_cached( zonefile_hash, zonefile_dir=None, validate=False):
     return True
 
 
-def store_cached_zonefile_data( zonefile_data, zonefile_dir=None ):
+def store_cached_zonefile_data( zonefile_data, zonefile_dir=None, fsync=True ):
     """
-    Store a validated zonefile.
+    Store a validated zonefile to the packed zonefile store.
     zonefile_data should be a dict.
     The caller should first authenticate the zonefile.
+    If fsync is False, the caller must call sync_cached_zonefile_data() on it later.
     Return True on success
     Return False on error
     """
     if zonefile_dir is None:
         zonefile_dir = get_zonefile_dir()
 
-    if not os.path.exists(zonefile_dir):
-        os.makedirs(zonefile_dir, 0700 )
+    try:
+        if not os.path.exists(zonefile_dir):
+            os.makedirs(zonefile_dir, 0700 )
 
-    zonefile_hash = get_zonefile_data_hash( zonefile_data )
-    zonefile_dir_path = cached_zonefile_dir( zonefile_dir, zonefile_hash )
-    if not os.path.exists(zonefile_dir_path):
-        os.makedirs(zonefile_dir_path)
+        return get_zonefile_pack( zonefile_dir ).put( zonefile_data, fsync=fsync )
+
+    except Exception, e:
+        log.exception(e)
+        return False
+
+
+def sync_cached_zonefile_data( zonefile_hashes, zonefile_dir=None ):
+    """
+    Flush a batch of zonefiles stored with store_cached_zonefile_data(..., fsync=False) to disk.
+    The packed store syncs all pending zonefiles at once, so
+    zonefile_hashes is only used to skip needless work.
+    Return True on success
+    Return False on error
+    """
+    if len(zonefile_hashes) == 0:
+        return True
+
+    if zonefile_dir is None:
+        zonefile_dir = get_zonefile_dir()
 
-    zonefile_path = os.path.join(zonefile_dir_path, "zonefile.txt")
     try:
-        with open( zonefile_path, "w" ) as f:
-            f.write(zonefile_data)
-            f.flush()
-            os.fsync(f.fileno())
+        return get_zonefile_pack( zonefile_dir ).sync()
     except Exception, e:
         log.exception(e)
         return False
-        
-    return True
 
 
 def store_cached_zonefile( zonefile_dict, zonefile_dir=None ):
@@ -206,7 +230,13 @@ def remove_cached_zonefile_data( zonefile_hash, zonefile_dir=None ):
     if not os.path.exists(zonefile_dir):
         return True
 
-    zonefile_hash = get_zonefile_data_hash( zonefile_data )
+    try:
+        get_zonefile_pack( zonefile_dir ).remove( zonefile_hash )
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to remove zonefile %s from pack" % zonefile_hash)
+        return False
+
     zonefile_dir_path = cached_zonefile_dir( zonefile_dir, zonefile_hash )
     if not os.path.exists(zonefile_dir_path):
         return True
@@ -224,9 +254,11 @@ def remove_cached_zonefile_data( zonefile_hash, zonefile_dir=None ):
     return True
 
 
-def store_zonefile_data_to_storage( zonefile_text, txid, required=None, skip=None, cache=False, zonefile_dir=None, tx_required=True ):
+def store_zonefile_data_to_storage( zonefile_text, txid, required=None, skip=None, cache=False, zonefile_dir=None, tx_required=True, fsync=True ):
     """
     Upload a zonefile to our storage providers.
+    If cache is True and fsync is False, the caller must
+    call sync_cached_zonefile_data() on it later.
     Return True if at least one provider got it.
     Return False otherwise.
     """
@@ -237,7 +269,7 @@ def store_zonefile_data_to_storage( zonefile_text, txid, required=None, skip=Non
     zonefile_hash = get_zonefile_data_hash( zonefile_text )
     
     if cache:
-        rc = store_cached_zonefile_data( zonefile_text, zonefile_dir=zonefile_dir )
+        rc = store_cached_zonefile_data( zonefile_text, zonefile_dir=zonefile_dir, fsync=fsync )
         if not rc:
             log.debug("Failed to cache zonefile %s" % zonefile_hash)
 
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack
+
+    Blockstack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Packed zonefile store.
+
+Zonefiles are appended to a small number of segment files, and a
+sqlite index maps each zonefile hash to its (segment, offset, length).
+Segments are memory-mapped for reads.  Writes can be batched, so that
+many zonefiles cost one fsync.
+
+Each record in a segment is a header (magic bytes, binary zonefile
+hash, big-endian data length) followed by the zonefile data, so the
+segments are self-describing if the index ever needs to be rebuilt.
+"""
+
+import os
+import mmap
+import struct
+import sqlite3
+import binascii
+import threading
+
+import virtualchain
+from blockstack_client import get_zonefile_data_hash
+
+log = virtualchain.get_logger("blockstack-server")
+
+ZONEFILE_PACK_DIRNAME = "packs"
+ZONEFILE_PACK_INDEX = "index.db"
+ZONEFILE_PACK_SEGMENT_MAX = 256 * 1024 * 1024      # start a new segment once a segment reaches this size
+ZONEFILE_PACK_RECORD_MAGIC = "BSZF"
+ZONEFILE_PACK_RECORD_HEADER = ">4s20sI"
+ZONEFILE_PACK_RECORD_HEADER_LEN = struct.calcsize(ZONEFILE_PACK_RECORD_HEADER)
+
+ZONEFILE_PACK_SQL = """
+CREATE TABLE IF NOT EXISTS zonefiles( zonefile_hash TEXT PRIMARY KEY NOT NULL,
+                                      segment INTEGER NOT NULL,
+                                      offset INTEGER NOT NULL,
+                                      length INTEGER NOT NULL );
+"""
+
+ZONEFILE_PACKS = {}     # map zonefile dir to its ZonefilePack
+ZONEFILE_PACKS_LOCK = threading.Lock()
+
+
+class ZonefilePack(object):
+    """
+    Append-only store of zonefiles, indexed by zonefile hash.
+    Thread-safe.
+
+    Nothing is created on disk until the first put(), so read-only
+    users never create the pack directory, index, or segments.
+    Reads do not wait on writers:  each reader thread has its own
+    index connection, and writes that are not yet committed are
+    looked up in memory.
+    """
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.index_path = os.path.join(pack_dir, ZONEFILE_PACK_INDEX)
+
+        self.lock = threading.Lock()        # serializes writers
+        self.read_lock = threading.Lock()   # guards pending and maps (never held across I/O to the index)
+        self.readers = threading.local()    # each reader thread's index connection
+
+        self.index = None       # writer's index connection (opened on first write)
+        self.segment = None     # segment we append to (opened on first write)
+        self.segment_id = None
+        self.pending = {}       # zonefile hash => (segment, offset, length) for rows not yet committed
+        self.maps = {}          # map segment ID to (mmap, file)
+        self.dirty = False      # have we written records that aren't yet fsync'ed and committed?
+
+
+    def segment_path(self, segment_id):
+        """
+        Path to a segment file
+        """
+        return os.path.join( self.pack_dir, "segment-%08d.dat" % segment_id )
+
+
+    def _open_writer(self):
+        """
+        Create the pack if need be, and open the index and the newest segment for writing (lock must be held)
+        """
+        if self.index is not None:
+            return
+
+        if not os.path.exists(self.pack_dir):
+            os.makedirs(self.pack_dir, 0700)
+
+        index = sqlite3.connect( self.index_path, check_same_thread=False, timeout=2**30 )
+        index.execute( "PRAGMA journal_mode=WAL;" )
+        index.execute( ZONEFILE_PACK_SQL )
+        index.commit()
+
+        segment_id = 0
+        while os.path.exists( self.segment_path(segment_id + 1) ):
+            segment_id += 1
+
+        self.segment = open( self.segment_path(segment_id), "ab" )
+        self.segment_id = segment_id
+        self.index = index
+
+
+    def _reader(self):
+        """
+        Get this thread's read connection to the index.
+        Return None if the pack has not been created yet
+        """
+        con = getattr(self.readers, 'con', None)
+        if con is None:
+            if not os.path.exists(self.index_path):
+                return None
+
+            con = sqlite3.connect( self.index_path, timeout=2**30 )
+            self.readers.con = con
+
+        return con
+
+
+    def _lookup(self, zonefile_hash):
+        """
+        Find (segment, offset, length) for a zonefile
+        Return None if not present
+        """
+        with self.read_lock:
+            loc = self.pending.get(zonefile_hash, None)
+            if loc is not None:
+                return loc
+
+        con = self._reader()
+        if con is None:
+            return None
+
+        try:
+            cur = con.execute( "SELECT segment, offset, length FROM zonefiles WHERE zonefile_hash = ?;", (zonefile_hash,) )
+            row = cur.fetchone()
+        except sqlite3.OperationalError, oe:
+            # index is still being created
+            log.debug("Failed to query %s: %s" % (self.index_path, oe))
+            return None
+
+        if row is None:
+            return None
+
+        return (row[0], row[1], row[2])
+
+
+    def _map(self, segment_id, end):
+        """
+        Get a read-only memory map of a segment that covers at least [0, end) (read_lock must be held)
+        """
+        m = self.maps.get(segment_id, None)
+        if m is not None and len(m[0]) >= end:
+            return m[0]
+
+        if m is not None:
+            # segment grew since we mapped it
+            m[0].close()
+            m[1].close()
+
+        f = open( self.segment_path(segment_id), "rb" )
+        mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        self.maps[segment_id] = (mm, f)
+        return mm
+
+
+    def has(self, zonefile_hash):
+        """
+        Is the zonefile in this pack?
+        """
+        return self._lookup(zonefile_hash) is not None
+
+
+    def get(self, zonefile_hash):
+        """
+        Get the zonefile data for a hash.
+        Return None if not present.
+        """
+        loc = self._lookup(zonefile_hash)
+        if loc is None:
+            return None
+
+        segment_id, offset, length = loc
+        with self.read_lock:
+            mm = self._map( segment_id, offset + length )
+            return mm[offset:offset+length]
+
+
+    def put(self, zonefile_data, fsync=True):
+        """
+        Append a zonefile.  No-op if we already have it.
+        If fsync is False, the zonefile is readable right away but is
+        only durable once sync() is called.
+        Return True on success
+        Return False on error
+        """
+        zonefile_hash = get_zonefile_data_hash( zonefile_data )
+
+        with self.lock:
+            try:
+                self._open_writer()
+
+                if self._lookup(zonefile_hash) is not None:
+                    return True
+
+                if self.segment.tell() >= ZONEFILE_PACK_SEGMENT_MAX:
+                    self._sync()
+                    self.segment.close()
+                    self.segment_id += 1
+                    self.segment = open( self.segment_path(self.segment_id), "ab" )
+
+                header = struct.pack( ZONEFILE_PACK_RECORD_HEADER, ZONEFILE_PACK_RECORD_MAGIC, binascii.unhexlify(zonefile_hash), len(zonefile_data) )
+                offset = self.segment.tell() + len(header)
+
+                self.segment.write( header )
+                self.segment.write( zonefile_data )
+
+                # make it visible to our memory maps
+                self.segment.flush()
+
+                self.index.execute( "INSERT INTO zonefiles (zonefile_hash, segment, offset, length) VALUES (?,?,?,?);", (zonefile_hash, self.segment_id, offset, len(zonefile_data)) )
+                self.dirty = True
+
+                with self.read_lock:
+                    self.pending[zonefile_hash] = (self.segment_id, offset, len(zonefile_data))
+
+                if fsync:
+                    self._sync()
+
+            except Exception, e:
+                log.exception(e)
+                log.error("Failed to store zonefile %s to %s" % (zonefile_hash, self.pack_dir))
+                return False
+
+        return True
+
+
+    def _sync(self):
+        """
+        Flush appended zonefiles to disk, and then commit
+        their index entries (lock must be held)
+        """
+        if not self.dirty:
+            return
+
+        self.segment.flush()
+        os.fsync( self.segment.fileno() )
+        self.index.commit()
+        self.dirty = False
+
+        # readers can find them in the index now
+        with self.read_lock:
+            self.pending = {}
+
+
+    def sync(self):
+        """
+        Make all appended zonefiles durable.
+        Return True on success
+        Return False on error
+        """
+        with self.lock:
+            try:
+                self._sync()
+            except Exception, e:
+                log.exception(e)
+                return False
+
+        return True
+
+
+    def remove(self, zonefile_hash):
+        """
+        Forget a zonefile.
+        Its space in the segment is not reclaimed.
+        """
+        with self.lock:
+            if self.index is None and not os.path.exists(self.index_path):
+                # nothing to remove
+                return True
+
+            self._open_writer()
+            self.index.execute( "DELETE FROM zonefiles WHERE zonefile_hash = ?;", (zonefile_hash,) )
+            self.dirty = True
+            self._sync()
+
+        return True
+
+
+    def close(self):
+        """
+        Sync and release resources.
+        Other threads' index connections are closed when they exit.
+        """
+        with self.lock:
+            if self.index is not None:
+                self._sync()
+                self.segment.close()
+                self.index.close()
+                self.segment = None
+                self.index = None
+
+            with self.read_lock:
+                for (mm, f) in self.maps.values():
+                    mm.close()
+                    f.close()
+
+                self.maps = {}
+
+            con = getattr(self.readers, 'con', None)
+            if con is not None:
+                con.close()
+                self.readers.con = None
+
+
+def get_zonefile_pack( zonefile_dir ):
+    """
+    Get the (shared) packed zonefile store for a zonefile directory
+    """
+    global ZONEFILE_PACKS, ZONEFILE_PACKS_LOCK
+
+    zonefile_dir = os.path.abspath(zonefile_dir)
+    with ZONEFILE_PACKS_LOCK:
+        if not ZONEFILE_PACKS.has_key(zonefile_dir):
+            ZONEFILE_PACKS[zonefile_dir] = ZonefilePack( os.path.join(zonefile_dir, ZONEFILE_PACK_DIRNAME) )
+
+        return ZONEFILE_PACKS[zonefile_dir]
+
+
+def migrate_zonefile_dir_to_pack( zonefile_dir, remove_old=False, batch_size=1000 ):
+    """
+    Copy zonefiles from the one-directory-per-hash layout
+    (see cached_zonefile_dir()) into the packed store.
+    Zonefiles whose data does not match the hash in their path are skipped.
+    Optionally remove the old files (and empty directories) once
+    they are durably packed.
+
+    Return the number of zonefiles migrated
+    """
+    pack = get_zonefile_pack( zonefile_dir )
+    pack_dir = os.path.abspath( pack.pack_dir )
+
+    count = 0
+    batch = []
+
+    def _flush():
+        pack.sync()
+        if remove_old:
+            for path in batch:
+                os.unlink(path)
+
+    for (dirpath, dirnames, filenames) in os.walk( zonefile_dir ):
+        if os.path.abspath(dirpath) == pack_dir:
+            dirnames[:] = []
+            continue
+
+        if "zonefile.txt" not in filenames:
+            continue
+
+        path = os.path.join( dirpath, "zonefile.txt" )
+        zonefile_hash = os.path.relpath( dirpath, zonefile_dir ).replace(os.path.sep, "")
+
+        with open(path, "r") as f:
+            zonefile_data = f.read()
+
+        if get_zonefile_data_hash( zonefile_data ) != zonefile_hash:
+            log.warning("Skipping corrupt zonefile %s" % path)
+            continue
+
+        if not pack.put( zonefile_data, fsync=False ):
+            raise Exception("Failed to pack %s" % path)
+
+        batch.append( path )
+        count += 1
+
+        if len(batch) >= batch_size:
+            _flush()
+            batch = []
+            log.debug("Migrated %s zonefiles" % count)
+
+    _flush()
+
+    if remove_old:
+        # clean up empty directories
+        for (dirpath, dirnames, filenames) in os.walk( zonefile_dir, topdown=False ):
+            if os.path.abspath(dirpath) in [os.path.abspath(zonefile_dir), pack_dir]:
+                continue
+
+            if len(os.listdir(dirpath)) == 0:
+                os.rmdir(dirpath)
+
+    log.debug("Migrated %s zonefiles in total" % count)
+    return count
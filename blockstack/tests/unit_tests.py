@@ -0,0 +1,1411 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+    Blockstack
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack
+
+    Blockstack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import copy
+import random
+import hashlib
+import collections
+import time
+import threading
+import httplib
+import xmlrpclib
+import shutil
+import sqlite3
+import tempfile
+import tarfile
+import StringIO
+import unittest
+import keylib
+
+# Hack around absolute paths
+current_dir = os.path.abspath(os.path.dirname(__file__))
+parent_dir = os.path.abspath(current_dir + "/../../")
+sys.path.insert(0, parent_dir)
+
+from blockstack.blockstackd import BlockstackdRPC
+from blockstack.lib import atlas
+from blockstack.lib.atlas import AtlasInventory, AtlasPeerHealth
+from blockstack.lib.atlas import atlas_inventory_set_zonefile_bits, atlas_inventory_clear_zonefile_bits, atlas_inventory_test_zonefile_bits
+from blockstack.lib import consensus
+from blockstack.lib.config import NAMEDB_HISTORY_CHECKPOINT_INTERVAL, NAME_REGISTRATION, NAME_TRANSFER
+from blockstack.lib.consensus import rebuild_database, rebuild_database_load_checkpoint, rebuild_database_save_checkpoint
+from blockstack.lib import fast_sync
+from blockstack.lib.fast_sync import fast_sync_import, fast_sync_extract, fast_sync_sign_snapshot, fast_sync_inspect_snapshot
+from blockstack.lib.nameset.db import namedb_restore_from_history_cached
+from blockstack.lib.storage import pack
+from blockstack.lib.storage.pack import ZonefilePack, get_zonefile_pack, migrate_zonefile_dir_to_pack
+from blockstack_client import get_zonefile_data_hash
+from blockstack_client.operations import nameop_restore_from_history
+
+
+class TestRPCServer(BlockstackdRPC):
+    """
+    RPC server that doesn't report analytics
+    """
+    def analytics(self, event_type, event_payload):
+        return
+
+
+def rpc_ping(conn):
+    """
+    Ping the server over an HTTP connection, leaving it open
+    """
+    conn.request('POST', '/RPC2', xmlrpclib.dumps((), 'ping'), {'Content-Type': 'text/xml'})
+    resp = conn.getresponse()
+    return json.loads(xmlrpclib.loads(resp.read())[0][0])
+
+
+class RPCKeepAliveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # one worker, so an idle connection that held it would block everyone else
+        self.server = TestRPCServer(host='127.0.0.1', port=0, num_workers=1, keepalive_timeout=0.5)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_idle_connection_does_not_block_others(self):
+        """ An idle keep-alive connection does not hold the only worker
+        """
+        idle_conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(rpc_ping(idle_conn)['status'], 'alive')
+
+        other_conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        start = time.time()
+        self.assertEqual(rpc_ping(other_conn)['status'], 'alive')
+        self.assertLess(time.time() - start, 0.5)
+
+        # the idle connection is still usable
+        sock = idle_conn.sock
+        self.assertEqual(rpc_ping(idle_conn)['status'], 'alive')
+        self.assertIs(idle_conn.sock, sock)
+
+        idle_conn.close()
+        other_conn.close()
+
+    def test_idle_connection_timeout(self):
+        """ Idle keep-alive connections get closed
+        """
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(rpc_ping(conn)['status'], 'alive')
+
+        time.sleep(2)
+        self.assertEqual(len(self.server.idle_connections), 0)
+        conn.close()
+
+
+class AtlasInventoryTestCase(unittest.TestCase):
+
+    def test_set_clear_test(self):
+        """ Bits are big-endian within each byte, and the vector grows as needed
+        """
+        inv = AtlasInventory()
+        inv.set_bits([0, 9])
+
+        self.assertEqual(str(inv), '\x80\x40')
+        self.assertEqual(len(inv), 2)
+        self.assertTrue(inv.test_bit(0))
+        self.assertTrue(inv.test_bits([0, 9]))
+        self.assertFalse(inv.test_bit(1))
+        self.assertFalse(inv.test_bit(1000))
+
+        inv.clear_bits([0])
+        self.assertEqual(str(inv), '\x00\x40')
+        self.assertFalse(inv.test_bits([0, 9]))
+
+    def test_string_compat(self):
+        """ Inventories read like the inventory strings peers exchange
+        """
+        inv = AtlasInventory('\x01\xff')
+
+        self.assertEqual(inv, '\x01\xff')
+        self.assertEqual(inv[0], '\x01')
+        self.assertEqual(inv[0:2], '\x01\xff')
+        self.assertEqual(inv.copy(), inv)
+
+        inv.extend('\x80')
+        self.assertEqual(inv, '\x01\xff\x80')
+
+        inv.truncate(1)
+        self.assertEqual(inv, '\x01')
+
+    def test_set_operations(self):
+        """ Check bit counting and set operations
+        """
+        a = AtlasInventory('\xf0\x0f')
+        b = AtlasInventory('\x30')
+
+        self.assertEqual(a.popcount(), 8)
+        self.assertEqual(a.and_not(b), '\xc0\x0f')
+        self.assertEqual(a.intersect(b), '\x30\x00')
+        self.assertEqual(b.bit_indexes(), [2, 3])
+        self.assertEqual(b.to_int(2), 0x3000)
+        self.assertEqual(AtlasInventory().and_not(''), '')
+
+    def test_inventory_functions(self):
+        """ The atlas_inventory_* functions work on strings and on inventories
+        """
+        inv_str = atlas_inventory_set_zonefile_bits('', [1, 15])
+        self.assertEqual(inv_str, '\x40\x01')
+        self.assertTrue(atlas_inventory_test_zonefile_bits(inv_str, [1, 15]))
+        self.assertEqual(atlas_inventory_clear_zonefile_bits(inv_str, [15]), '\x40\x00')
+
+        inv = AtlasInventory(inv_str)
+        self.assertIs(atlas_inventory_clear_zonefile_bits(inv, [1]), inv)
+        self.assertEqual(inv, '\x00\x01')
+        self.assertFalse(atlas_inventory_test_zonefile_bits(inv, [1]))
+
+
+class AtlasPeerHealthTestCase(unittest.TestCase):
+
+    def test_health(self):
+        """ Health is the fraction of requests that got responses
+        """
+        health = AtlasPeerHealth(lifetime=100, num_buckets=10)
+        self.assertEqual(health.get_health(0), 0.0)
+
+        health.record(1, True)
+        health.record(2, True)
+        health.record(3, False)
+        health.record(15, True)
+
+        self.assertEqual(health.get_request_count(20), 4)
+        self.assertEqual(health.get_response_count(20), 3)
+        self.assertEqual(health.get_health(20), 0.75)
+
+    def test_expiry(self):
+        """ Requests older than the lifetime interval are forgotten
+        """
+        health = AtlasPeerHealth(lifetime=100, num_buckets=10)
+        health.record(1, False)
+        health.record(55, True)
+
+        # the first bucket falls out of the interval
+        self.assertEqual(health.get_request_count(105), 1)
+        self.assertEqual(health.get_health(105), 1.0)
+
+        # everything falls out of the interval
+        self.assertEqual(health.get_request_count(1000), 0)
+        self.assertEqual(health.get_health(1000), 0.0)
+
+        health.record(1001, True)
+        self.assertEqual(health.get_request_count(1001), 1)
+        self.assertEqual(health.get_response_count(1001), 1)
+
+    def test_old_timestamps(self):
+        """ Recording a time before the newest bucket does not expire anything
+        """
+        health = AtlasPeerHealth(lifetime=100, num_buckets=10)
+        health.record(50, True)
+        health.record(45, False)
+
+        self.assertEqual(health.get_request_count(50), 2)
+        self.assertEqual(health.get_health(50), 0.5)
+
+
+class ZonefileInventoryDeltaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (atlas.ZONEFILE_INV, atlas.ZONEFILE_INV_CHANGES, atlas.ZONEFILE_INV_DELTA_MAX)
+        atlas.ZONEFILE_INV = AtlasInventory('\x00\x00')
+        atlas.atlas_zonefile_inv_log_reset()
+
+    def tearDown(self):
+        atlas.ZONEFILE_INV, atlas.ZONEFILE_INV_CHANGES, atlas.ZONEFILE_INV_DELTA_MAX = self.saved
+        atlas.atlas_zonefile_inv_log_reset()
+
+    def test_delta(self):
+        """ A delta has the latest change to each bit since the given sequence number
+        """
+        epoch = atlas.atlas_get_zonefile_inventory_delta(None, 0)['epoch']
+
+        atlas.atlas_zonefile_inv_log_changes([1, 2], True)
+        atlas.atlas_zonefile_inv_log_changes([2], False)
+
+        delta = atlas.atlas_get_zonefile_inventory_delta(epoch, 0)
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['seq'], 3)
+        self.assertEqual(delta['inv_length'], 2)
+        self.assertEqual(delta['set'], [1])
+        self.assertEqual(delta['cleared'], [2])
+
+        delta = atlas.atlas_get_zonefile_inventory_delta(epoch, 2)
+        self.assertEqual(delta['set'], [])
+        self.assertEqual(delta['cleared'], [2])
+
+        delta = atlas.atlas_get_zonefile_inventory_delta(epoch, 3)
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['set'], [])
+        self.assertEqual(delta['cleared'], [])
+
+    def test_full(self):
+        """ Peers are told to fetch the whole inventory when the changes are unknown
+        """
+        epoch = atlas.atlas_get_zonefile_inventory_delta(None, 0)['epoch']
+        atlas.atlas_zonefile_inv_log_changes([1, 2, 3], True)
+
+        # wrong log, or a sequence number from the future
+        self.assertTrue(atlas.atlas_get_zonefile_inventory_delta('00' * 8, 0)['full'])
+        self.assertTrue(atlas.atlas_get_zonefile_inventory_delta(epoch, 4)['full'])
+
+        # too many changes
+        atlas.ZONEFILE_INV_DELTA_MAX = 2
+        self.assertTrue(atlas.atlas_get_zonefile_inventory_delta(epoch, 0)['full'])
+        self.assertFalse(atlas.atlas_get_zonefile_inventory_delta(epoch, 1)['full'])
+
+        # forgotten changes
+        atlas.ZONEFILE_INV_CHANGES = collections.deque(maxlen=1)
+        atlas.atlas_zonefile_inv_log_changes([4, 5], True)
+        self.assertTrue(atlas.atlas_get_zonefile_inventory_delta(epoch, 3)['full'])
+        self.assertEqual(atlas.atlas_get_zonefile_inventory_delta(epoch, 4)['set'], [5])
+
+        # a new log
+        atlas.atlas_zonefile_inv_log_reset()
+        delta = atlas.atlas_get_zonefile_inventory_delta(epoch, 5)
+        self.assertTrue(delta['full'])
+        self.assertNotEqual(delta['epoch'], epoch)
+        self.assertEqual(delta['seq'], 0)
+
+    def test_apply_delta(self):
+        """ Applying a peer's delta updates our copy of its inventory, up to our inventory's length
+        """
+        peer_table = {'1.2.3.4:6264': {'zonefile_inv': AtlasInventory('\x80')}}
+        delta = {'epoch': 'abcd', 'seq': 5, 'inv_length': 3, 'full': False, 'set': [9], 'cleared': [0]}
+
+        self.assertTrue(atlas.atlas_peer_apply_zonefile_inventory_delta('1.2.3.4:6264', delta, 2, peer_table=peer_table))
+        self.assertEqual(peer_table['1.2.3.4:6264']['zonefile_inv'], '\x00\x40')
+        self.assertEqual(peer_table['1.2.3.4:6264']['zonefile_inv_epoch'], 'abcd')
+        self.assertEqual(peer_table['1.2.3.4:6264']['zonefile_inv_seq'], 5)
+
+        # past our inventory
+        delta = {'epoch': 'abcd', 'seq': 6, 'inv_length': 3, 'full': False, 'set': [16], 'cleared': []}
+        self.assertFalse(atlas.atlas_peer_apply_zonefile_inventory_delta('1.2.3.4:6264', delta, 2, peer_table=peer_table))
+        self.assertEqual(peer_table['1.2.3.4:6264']['zonefile_inv_seq'], 5)
+
+        # unknown peer
+        self.assertFalse(atlas.atlas_peer_apply_zonefile_inventory_delta('5.6.7.8:6264', delta, 3, peer_table=peer_table))
+
+
+def atlasdb_insert_zonefile(cur, i):
+    """
+    Write a zonefile row via the atlas db writer.
+    Return the number of rows afterwards.
+    """
+    cur.execute("INSERT INTO zonefiles (name, zonefile_hash, txid, present, tried_storage, block_height) VALUES (?,?,?,?,?,?);",
+                ("name%s.test" % i, "%040x" % i, "%064x" % i, 0, 0, i))
+
+    return cur.execute("SELECT COUNT(*) FROM zonefiles;").fetchone()['COUNT(*)']
+
+
+class FakeNameDB(object):
+    """
+    Stand-in for the name database, with zonefile info by block
+    """
+    def __init__(self, zonefile_info):
+        self.zonefile_info = zonefile_info
+        self.lastblock = max(zonefile_info.keys())
+
+    def get_atlas_zonefile_info_at(self, block_height):
+        return self.zonefile_info.get(block_height, [])
+
+
+class AtlasDBWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "atlas.db")
+
+        con = sqlite3.connect(self.path)
+        con.executescript(atlas.ATLASDB_SQL)
+        con.commit()
+        con.close()
+
+        self.saved = (atlas.ZONEFILE_INV, atlas.NUM_ZONEFILES, atlas.ZONEFILE_AVAILABILITY, atlas.is_zonefile_cached, atlas.atlasdb_write, atlas.atlasdb_path)
+        atlas.atlasdb_path = lambda impl=None: self.path
+        atlas.ZONEFILE_INV = AtlasInventory()
+        atlas.ZONEFILE_AVAILABILITY = None
+        atlas.atlas_zonefile_inv_log_reset()
+
+    def tearDown(self):
+        atlas.atlasdb_stop_writers()
+        atlas.ZONEFILE_INV, atlas.NUM_ZONEFILES, atlas.ZONEFILE_AVAILABILITY, atlas.is_zonefile_cached, atlas.atlasdb_write, atlas.atlasdb_path = self.saved
+        atlas.atlas_zonefile_inv_log_reset()
+        shutil.rmtree(self.tmpdir)
+
+    def count_rows(self):
+        con = atlas.atlasdb_get_connection(self.path)
+        return con.execute("SELECT COUNT(*) FROM zonefiles;").fetchone()['COUNT(*)']
+
+    def test_concurrent_writes(self):
+        """ Concurrent writers are serialized without losing writes, while readers keep reading
+        """
+        num_threads = 8
+        num_writes = 25
+        results = []
+        errors = []
+        done = threading.Event()
+        counts = []
+
+        def _writer(thread_id):
+            try:
+                for i in xrange(num_writes):
+                    results.append(atlas.atlasdb_write(atlasdb_insert_zonefile, (thread_id * num_writes + i,), path=self.path))
+            except Exception, e:
+                errors.append(e)
+
+        def _reader():
+            try:
+                while True:
+                    counts.append(self.count_rows())
+                    if done.is_set():
+                        break
+            except Exception, e:
+                errors.append(e)
+
+        reader = threading.Thread(target=_reader)
+        reader.start()
+
+        writers = [threading.Thread(target=_writer, args=(i,)) for i in xrange(num_threads)]
+        for writer in writers:
+            writer.start()
+
+        for writer in writers:
+            writer.join()
+
+        done.set()
+        reader.join()
+
+        self.assertEqual(errors, [])
+
+        # each write saw all the ones before it, and none after
+        self.assertEqual(sorted(results), range(1, num_threads * num_writes + 1))
+        self.assertEqual(self.count_rows(), num_threads * num_writes)
+
+        # readers only ever see committed writes
+        self.assertTrue(len(counts) > 0)
+        self.assertEqual(counts, sorted(counts))
+
+        # one writer thread for the db
+        self.assertEqual(atlas.ATLASDB_WRITERS.keys(), [os.path.abspath(self.path)])
+
+    def test_write_error(self):
+        """ A failed write is reported to its caller, and does not stop the writer
+        """
+        def _fail(cur):
+            raise ValueError("failed")
+
+        self.assertRaises(ValueError, atlas.atlasdb_write, _fail, (), path=self.path)
+        self.assertEqual(atlas.atlasdb_write(atlasdb_insert_zonefile, (1,), path=self.path), 1)
+
+    def test_stop_drains(self):
+        """ Stopping the writers applies the writes already queued
+        """
+        started = threading.Event()
+        release = threading.Event()
+        results = {}
+
+        def _blocked(cur):
+            started.set()
+            release.wait()
+            return atlasdb_insert_zonefile(cur, 0)
+
+        def _write(i, write_func):
+            results[i] = atlas.atlasdb_write(write_func, (i,) if i > 0 else (), path=self.path)
+
+        threads = [threading.Thread(target=_write, args=(0, _blocked))]
+        threads[0].start()
+        self.assertTrue(started.wait(10))
+
+        # queue up writes behind the blocked one
+        writer = atlas.ATLASDB_WRITERS[os.path.abspath(self.path)]
+        for i in xrange(1, 11):
+            threads.append(threading.Thread(target=_write, args=(i, atlasdb_insert_zonefile)))
+            threads[-1].start()
+
+        deadline = time.time() + 10
+        while writer.write_queue.qsize() < 10 and time.time() < deadline:
+            time.sleep(0.01)
+
+        stopper = threading.Thread(target=atlas.atlasdb_stop_writers)
+        stopper.start()
+
+        while writer.write_queue.qsize() < 11 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(writer.write_queue.qsize(), 11)
+        release.set()
+
+        stopper.join()
+        for thread in threads:
+            thread.join()
+
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(atlas.ATLASDB_WRITERS, {})
+        self.assertEqual(sorted(results.values()), range(1, 12))
+        self.assertEqual(self.count_rows(), 11)
+
+        # a new writer starts on demand
+        self.assertEqual(atlas.atlasdb_write(atlasdb_insert_zonefile, (11,), path=self.path), 12)
+
+    def test_queue_zonefiles(self):
+        """ Zonefiles are queued with one write per block, and re-queueing updates them in place
+        """
+        zonefile_info = {
+            100: [{'name': 'a.test', 'value_hash': '%040x' % 1, 'txid': '%064x' % 1}, {'name': 'b.test', 'value_hash': '%040x' % 2, 'txid': '%064x' % 2}],
+            102: [{'name': 'a.test', 'value_hash': '%040x' % 3, 'txid': '%064x' % 3}],
+            103: [{'name': 'c.test', 'value_hash': '%040x' % 1, 'txid': '%064x' % 4}],
+        }
+
+        cached = set(['%040x' % 1])
+        atlas.is_zonefile_cached = lambda zfhash, zonefile_dir=None, validate=True: zfhash in cached
+
+        writes = []
+        def _atlasdb_write(write_func, args, con=None, path=None):
+            writes.append(write_func)
+            return self.saved[4](write_func, args, con=con, path=path)
+
+        atlas.atlasdb_write = _atlasdb_write
+
+        con = atlas.atlasdb_get_connection(self.path)
+        self.assertTrue(atlas.atlasdb_queue_zonefiles(con, FakeNameDB(zonefile_info), 100))
+
+        # blocks with no zonefiles are not written
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(self.count_rows(), 4)
+        self.assertEqual(atlas.NUM_ZONEFILES, atlas.atlasdb_zonefile_inv_length(con=con))
+
+        for i in xrange(1, 5):
+            row = atlas.atlasdb_find_zonefile_by_txid('%064x' % i, con=con)
+            self.assertEqual(row['present'], i in [1, 4])
+            self.assertEqual(atlas_inventory_test_zonefile_bits(atlas.ZONEFILE_INV, [row['inv_index'] - 1]), i in [1, 4])
+
+        # got another zonefile
+        cached.add('%040x' % 3)
+        self.assertTrue(atlas.atlasdb_queue_zonefiles(con, FakeNameDB(zonefile_info), 102))
+
+        self.assertEqual(self.count_rows(), 4)
+        row = atlas.atlasdb_find_zonefile_by_txid('%064x' % 3, con=con)
+        self.assertTrue(row['present'])
+        self.assertTrue(atlas_inventory_test_zonefile_bits(atlas.ZONEFILE_INV, [row['inv_index'] - 1]))
+
+
+class ZonefileFetchTestCase(unittest.TestCase):
+
+    patched = ['PEER_CRAWL_ZONEFILE_MAX_INFLIGHT', 'PEER_CRAWL_ZONEFILE_BATCH_SIZE', 'PEER_CRAWL_ZONEFILE_STORE_BATCH_SIZE',
+               'atlas_peer_table_lock', 'atlas_peer_table_unlock', 'atlas_find_missing_zonefile_availability',
+               'atlas_rank_peers_by_health', 'is_zonefile_cached', 'atlasdb_get_connection', 'atlasdb_set_zonefiles_present',
+               'atlasdb_find_zonefile_by_txid', 'atlas_get_zonefiles', 'atlas_peer_set_zonefile_status',
+               'store_zonefile_data_to_storage', 'sync_cached_zonefile_data', 'atlas_zonefile_fetch_stats_update']
+
+    def setUp(self):
+        self.saved = dict([(name, getattr(atlas, name)) for name in self.patched])
+
+        atlas.PEER_CRAWL_ZONEFILE_MAX_INFLIGHT = 2
+        atlas.PEER_CRAWL_ZONEFILE_BATCH_SIZE = 2
+        atlas.PEER_CRAWL_ZONEFILE_STORE_BATCH_SIZE = 2
+
+        # peers and what they send back for each zonefile hash they're asked for
+        self.zonefiles = {}         # map zonefile hash to zonefile
+        self.missing_zfinfo = {}
+        self.peer_health = {}
+        self.peer_data = {}         # map peer to {zonefile hash: zonefile}
+        self.requests = []          # (peer, zonefile hashes) in the order received
+        self.not_present = []       # (peer, zonefile hash) reported missing
+        self.present = []           # zonefile hashes marked present
+        self.stored = []            # zonefile hashes written to storage
+        self.store_fails = set([])  # zonefile hashes that fail to store (once)
+        self.sync_ok = True
+        self.lock = threading.Lock()
+
+        atlas.atlas_peer_table_lock = lambda: {}
+        atlas.atlas_peer_table_unlock = lambda: None
+        atlas.atlas_find_missing_zonefile_availability = lambda peer_table=None, path=None: copy.deepcopy(self.missing_zfinfo)
+        atlas.atlas_rank_peers_by_health = lambda peer_table=None, with_zero_requests=False, with_rank=False: [(h, p) for (p, h) in self.peer_health.items()]
+        atlas.is_zonefile_cached = lambda zfhash, zonefile_dir=None, validate=False: False
+        atlas.atlasdb_get_connection = lambda path: object()
+        atlas.atlasdb_set_zonefiles_present = lambda zfhashes, present, con=None, path=None: self.present.extend(zfhashes)
+        atlas.atlasdb_find_zonefile_by_txid = lambda txid, con=None, path=None: {'txid': txid}
+        atlas.atlas_get_zonefiles = self.get_zonefiles
+        atlas.atlas_peer_set_zonefile_status = lambda peer_hostport, zfhash, present, zonefile_bits=None: self.not_present.append((peer_hostport, zfhash))
+        atlas.store_zonefile_data_to_storage = self.store_zonefile
+        atlas.sync_cached_zonefile_data = lambda zfhashes, zonefile_dir=None: self.sync_ok
+        atlas.atlas_zonefile_fetch_stats_update = lambda count: None
+
+        self.crawler = atlas.AtlasZonefileCrawler('127.0.0.1', 6264, path='/dev/null', num_fetch_threads=2)
+        self.crawler.running = True
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(atlas, name, value)
+
+    def get_zonefiles(self, my_hostport, peer_hostport, zonefile_hashes):
+        with self.lock:
+            self.requests.append((peer_hostport, zonefile_hashes))
+
+        peer_data = self.peer_data.get(peer_hostport, {})
+        return dict([(zfhash, peer_data[zfhash]) for zfhash in zonefile_hashes if peer_data.has_key(zfhash)])
+
+    def store_zonefile(self, zonefile_txt, txid, required=None, cache=False, zonefile_dir=None, tx_required=True, fsync=True):
+        zfhash = get_zonefile_data_hash(zonefile_txt)
+        if zfhash in self.store_fails:
+            self.store_fails.remove(zfhash)
+            return False
+
+        self.stored.append(zfhash)
+        return True
+
+    def add_zonefile(self, data, peers):
+        """
+        Add a missing zonefile that the given peers say they have
+        """
+        zfhash = get_zonefile_data_hash(data)
+        self.zonefiles[zfhash] = data
+        self.missing_zfinfo[zfhash] = {'popularity': len(peers), 'peers': peers, 'txid': '%064x' % len(self.missing_zfinfo),
+                                       'tried_storage': True, 'names': ['foo.test'], 'indexes': [len(self.missing_zfinfo)]}
+        return zfhash
+
+    def schedule(self, zonefile_hashes, pending=None, tried_peers={}):
+        if pending is None:
+            pending = set(zonefile_hashes)
+
+        return self.crawler.schedule_zonefile_fetches(zonefile_hashes, self.missing_zfinfo, pending, tried_peers, self.peer_health)
+
+    def test_schedule_rarest_first(self):
+        """ Zonefiles are scheduled in the order given, up to the per-peer limit
+        """
+        self.peer_health = {'a:1': 1.0}
+        zfhashes = [self.add_zonefile('zonefile %s' % i, ['a:1']) for i in xrange(6)]
+
+        # at most 2 requests of at most 2 zonefiles
+        self.assertEqual(self.schedule(zfhashes), [('a:1', zfhashes[0:2]), ('a:1', zfhashes[2:4])])
+
+        # rarest first: the rest come in a later round
+        self.assertEqual(self.schedule(zfhashes, pending=set(zfhashes[4:])), [('a:1', zfhashes[4:6])])
+
+    def test_schedule_spread(self):
+        """ Zonefiles go to the least-loaded healthy peer that has them and has not failed to send them
+        """
+        self.peer_health = {'a:1': 1.0, 'b:1': 0.9, 'c:1': 0.1}
+        zf_ab = [self.add_zonefile('ab %s' % i, ['a:1', 'b:1', 'c:1']) for i in xrange(4)]
+        zf_b = self.add_zonefile('b', ['b:1'])
+        zf_c = self.add_zonefile('c', ['c:1'])
+
+        requests = self.schedule([zf_b, zf_c] + zf_ab)
+        assigned = {}
+        for (peer, zfhashes) in requests:
+            assigned[peer] = assigned.get(peer, []) + zfhashes
+
+        # unhealthy peers only get what no one else has
+        self.assertEqual(assigned['c:1'], [zf_c])
+        self.assertEqual(sorted(assigned['a:1'] + assigned['b:1']), sorted([zf_b] + zf_ab))
+        self.assertEqual(assigned['b:1'][0], zf_b)
+        self.assertEqual(len(assigned['a:1']), 3)
+        self.assertEqual(len(assigned['b:1']), 2)
+
+        # requests are ordered by when their peer was first scheduled
+        self.assertEqual([peer for (peer, _) in requests], ['b:1', 'c:1', 'a:1', 'a:1'])
+
+        # peers that failed are not asked again
+        requests = self.schedule(zf_ab, tried_peers=dict([(zfhash, set(['a:1', 'b:1'])) for zfhash in zf_ab]))
+        self.assertEqual(requests, [('c:1', zf_ab[0:2]), ('c:1', zf_ab[2:4])])
+
+        # nothing left to try
+        self.assertEqual(self.schedule([zf_b], tried_peers={zf_b: set(['b:1'])}), [])
+
+    def test_fetch(self):
+        """ Zonefiles are fetched from the peers that have them, and stored
+        """
+        self.peer_health = {'a:1': 1.0, 'b:1': 1.0}
+        zfhashes = [self.add_zonefile('zonefile %s' % i, ['a:1', 'b:1']) for i in xrange(10)]
+        self.peer_data = {'a:1': self.zonefiles, 'b:1': self.zonefiles}
+
+        self.assertEqual(self.crawler.step_concurrent(), 10)
+        self.assertEqual(sorted(self.stored), sorted(zfhashes))
+        self.assertEqual(sorted(self.present), sorted(zfhashes))
+        self.assertEqual(self.not_present, [])
+
+        # each zonefile was asked for once, and no peer was asked for too many at once
+        requested = sum([zfh for (_, zfh) in self.requests], [])
+        self.assertEqual(sorted(requested), sorted(zfhashes))
+        self.assertTrue(max([len(zfh) for (_, zfh) in self.requests]) <= atlas.PEER_CRAWL_ZONEFILE_BATCH_SIZE)
+
+    def test_fetch_failures(self):
+        """ Zonefiles a peer does not send, sends corrupt, or that fail to store are fetched from another peer
+        """
+        # b is unhealthy, so it is only asked for what a fails to deliver
+        self.peer_health = {'a:1': 1.0, 'b:1': 0.4}
+        zf_missing = self.add_zonefile('missing from a', ['a:1', 'b:1'])
+        zf_corrupt = self.add_zonefile('corrupt from a', ['a:1', 'b:1'])
+        zf_unstored = self.add_zonefile('not stored', ['a:1', 'b:1'])
+        zf_nowhere = self.add_zonefile('nowhere', ['a:1'])
+
+        self.peer_data = {'a:1': {zf_corrupt: 'garbage', zf_unstored: self.zonefiles[zf_unstored]}, 'b:1': self.zonefiles}
+        self.store_fails = set([zf_unstored])
+
+        self.assertEqual(self.crawler.step_concurrent(), 3)
+        self.assertEqual(sorted(self.stored), sorted([zf_missing, zf_corrupt, zf_unstored]))
+        self.assertEqual(sorted(self.present), sorted([zf_missing, zf_corrupt, zf_unstored]))
+
+        a_requested = sum([zfh for (peer, zfh) in self.requests if peer == 'a:1'], [])
+        b_requested = sum([zfh for (peer, zfh) in self.requests if peer == 'b:1'], [])
+        self.assertEqual(sorted(a_requested), sorted([zf_missing, zf_corrupt, zf_unstored, zf_nowhere]))
+        self.assertEqual(sorted(b_requested), sorted([zf_missing, zf_corrupt, zf_unstored]))
+
+        # only peers that did not have a zonefile are recorded as such
+        self.assertEqual(sorted(self.not_present), sorted([('a:1', zf_missing), ('a:1', zf_nowhere)]))
+
+    def test_fetch_sync_failure(self):
+        """ Zonefiles are not marked present unless they were flushed to disk
+        """
+        self.peer_health = {'a:1': 1.0, 'b:1': 1.0}
+        zfhashes = [self.add_zonefile('zonefile %s' % i, ['a:1', 'b:1']) for i in xrange(3)]
+        self.peer_data = {'a:1': self.zonefiles, 'b:1': self.zonefiles}
+        self.sync_ok = False
+
+        self.assertEqual(self.crawler.step_concurrent(), 0)
+        self.assertEqual(self.present, [])
+
+        # each peer got one chance at each zonefile
+        requested = sum([zfh for (_, zfh) in self.requests], [])
+        self.assertEqual(sorted(requested), sorted(zfhashes + zfhashes))
+
+
+def make_name_history(rng, num_blocks, first_block=400000):
+    """
+    Make a random name record and its history of diffs,
+    with some history snapshots and some diffs that try to change block_number
+    """
+    def _random_state(block_id):
+        return {
+            'name': 'test.id',
+            'block_number': first_block,
+            'last_renewed': block_id,
+            'value_hash': '%040x' % rng.getrandbits(160),
+            'address': rng.choice(['addr1', 'addr2', 'addr3']),
+            'sequence': rng.randint(0, 100),
+        }
+
+    history = {}
+    block_id = first_block
+    for i in xrange(0, num_blocks):
+        diffs = []
+        for j in xrange(0, rng.randint(1, 3)):
+            if (i == 0 and j == 0) or rng.random() < 0.1:
+                diff = _random_state(block_id)
+                diff['history_snapshot'] = True
+            else:
+                diff = dict(rng.sample(_random_state(block_id).items(), rng.randint(1, 3)))
+                if rng.random() < 0.2:
+                    diff['block_number'] = block_id
+
+            diffs.append(diff)
+
+        history[block_id] = diffs
+        block_id += rng.randint(1, 5)
+
+    name_rec = _random_state(block_id)
+    return name_rec, history
+
+
+def make_history_entry(history):
+    """
+    Make a history cache entry, like namedb_get_history_cached() does
+    """
+    return {
+        'history': history,
+        'block_ids': list(reversed(sorted(history.keys()))),
+        'base': None,
+        'checkpoints': {},
+    }
+
+
+class HistoryRestoreTestCase(unittest.TestCase):
+
+    def assertRestoresMatch(self, name_rec, history, history_entry, block_id):
+        # nameop_restore_from_history() modifies the history it is given, so give it a fresh copy,
+        # like a freshly-loaded record would have
+        expected = nameop_restore_from_history(name_rec, copy.deepcopy(history), block_id)
+        restored = namedb_restore_from_history_cached(name_rec, history_entry, block_id)
+        self.assertEqual(restored, expected, "mismatch at block %s" % block_id)
+
+    def test_random_histories(self):
+        """ Cached restores match nameop_restore_from_history(), in any query order
+        """
+        rng = random.Random(0)
+        for trial in xrange(0, 20):
+            name_rec, history = make_name_history(rng, rng.randint(1, 4 * NAMEDB_HISTORY_CHECKPOINT_INTERVAL))
+            history_entry = make_history_entry(history)
+
+            block_ids = range(name_rec['block_number'] - 1, max(history.keys()) + 2)
+            rng.shuffle(block_ids)
+            for block_id in block_ids + block_ids:
+                self.assertRestoresMatch(name_rec, history, history_entry, block_id)
+
+    def test_checkpoint_boundaries(self):
+        """ Checkpoints are made every NAMEDB_HISTORY_CHECKPOINT_INTERVAL blocks of history, and restores across them match
+        """
+        rng = random.Random(1)
+        name_rec, history = make_name_history(rng, 2 * NAMEDB_HISTORY_CHECKPOINT_INTERVAL + 1)
+        history_entry = make_history_entry(history)
+        block_ids = sorted(history.keys())
+
+        # oldest first, so each restore replays the whole history
+        self.assertRestoresMatch(name_rec, history, history_entry, block_ids[0])
+        self.assertEqual(sorted(history_entry['checkpoints'].keys()), [0, NAMEDB_HISTORY_CHECKPOINT_INTERVAL, 2 * NAMEDB_HISTORY_CHECKPOINT_INTERVAL])
+
+        for i in xrange(0, len(block_ids)):
+            for block_id in [block_ids[i] - 1, block_ids[i], block_ids[i] + 1]:
+                self.assertRestoresMatch(name_rec, history, history_entry, block_id)
+
+    def test_base_change(self):
+        """ Checkpoints made from an older current record are not reused
+        """
+        rng = random.Random(2)
+        name_rec, history = make_name_history(rng, 3 * NAMEDB_HISTORY_CHECKPOINT_INTERVAL)
+        history_entry = make_history_entry(history)
+        block_ids = sorted(history.keys())
+
+        for block_id in block_ids:
+            self.assertRestoresMatch(name_rec, history, history_entry, block_id)
+
+        new_rec = dict(name_rec)
+        new_rec['value_hash'] = '00' * 20
+        new_rec['sequence'] = name_rec['sequence'] + 1
+
+        for block_id in block_ids:
+            self.assertRestoresMatch(new_rec, history, history_entry, block_id)
+
+        self.assertEqual(history_entry['base'], new_rec)
+
+    def test_history_unmodified(self):
+        """ The cached history and the record are not modified by restores
+        """
+        rng = random.Random(3)
+        name_rec, history = make_name_history(rng, NAMEDB_HISTORY_CHECKPOINT_INTERVAL + 5)
+        name_rec['history'] = copy.deepcopy(history)
+        history_entry = make_history_entry(history)
+
+        saved_rec = copy.deepcopy(name_rec)
+        saved_history = copy.deepcopy(history)
+
+        for block_id in sorted(history.keys()):
+            for rec in namedb_restore_from_history_cached(name_rec, history_entry, block_id):
+                self.assertNotIn('history', rec)
+                rec['value_hash'] = 'modified'
+
+        self.assertEqual(name_rec, saved_rec)
+        self.assertEqual(history, saved_history)
+
+
+class FakeBlockstackDB(object):
+    """
+    Stand-in for BlockstackDB when rebuilding a database:
+    the untrusted database's ops are read from a JSON file, and the
+    rebuilt database records the ops it is given and a running hash of them.
+    """
+    def __init__(self, path, disposition):
+        self.path = path
+        self.state = {'lastblock': None, 'ops': {}, 'consensus': {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.state = json.loads(f.read())
+
+        self.lastblock = self.state['lastblock']
+
+    def get_all_ops_at(self, block_id):
+        return copy.deepcopy(self.state['ops'].get(str(block_id), []))
+
+    def sanitize_op(self, op):
+        return dict([(k, v) for (k, v) in op.items() if not k.startswith('virtualchain_')])
+
+    def get_consensus_at(self, block_id):
+        return self.state['consensus'].get(str(block_id), None)
+
+    def process_block(self, block_id, ops):
+        assert self.lastblock is None or block_id == self.lastblock + 1, "Out of order: %s after %s" % (block_id, self.lastblock)
+
+        prev_hash = self.get_consensus_at(block_id - 1) or ''
+        consensus_hash = hashlib.sha256(prev_hash + json.dumps(ops, sort_keys=True)).hexdigest()[:32]
+
+        self.state['ops'][str(block_id)] = ops
+        self.state['consensus'][str(block_id)] = consensus_hash
+        self.state['lastblock'] = self.lastblock = block_id
+
+        with open(self.path, 'w') as f:
+            f.write(json.dumps(self.state))
+
+        return consensus_hash
+
+
+def fake_sanitized_rec_to_virtualchain_op(rec, block_id, history_index, working_db, untrusted_db):
+    """
+    Stand-in for consensus.sanitized_rec_to_virtualchain_op().
+    Like a transfer, restoring an op marked 'prior' needs the working database's prior consensus hash.
+    """
+    op = {'name': rec['name'], 'op': rec['op'], 'block_id': block_id, 'history_index': history_index}
+    if rec['op'][0] == NAME_TRANSFER:
+        op['prior'] = working_db.get_consensus_at(block_id - 1)
+
+    return op
+
+
+class FakeVirtualchain(object):
+    """
+    Stand-in for the virtualchain module in consensus
+    """
+    def __init__(self, first_block):
+        self.first_block = first_block
+
+    def setup_virtualchain(self, impl=None):
+        pass
+
+    def get_first_block_id(self):
+        return self.first_block
+
+
+class RebuildDatabaseTestCase(unittest.TestCase):
+
+    first_block = 100
+    last_block = 139
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (consensus.BlockstackDB, consensus.sanitized_rec_to_virtualchain_op, consensus.virtualchain,
+                      consensus.VERIFY_PREFETCH_BLOCKS, consensus.VERIFY_CHECKPOINT_INTERVAL)
+
+        consensus.BlockstackDB = FakeBlockstackDB
+        consensus.sanitized_rec_to_virtualchain_op = fake_sanitized_rec_to_virtualchain_op
+        consensus.virtualchain = FakeVirtualchain(self.first_block)
+        consensus.VERIFY_PREFETCH_BLOCKS = 3
+        consensus.VERIFY_CHECKPOINT_INTERVAL = 5
+
+        # random registrations and transfers, in random tx order, with untrusted fields
+        rng = random.Random(0)
+        ops = {}
+        for block_id in xrange(self.first_block, self.last_block + 1):
+            num_ops = rng.randint(0, 4)
+            vtxindexes = range(num_ops)
+            rng.shuffle(vtxindexes)
+
+            ops[str(block_id)] = []
+            for vtxindex in vtxindexes:
+                op = NAME_REGISTRATION
+                if block_id > self.first_block and rng.random() < 0.5:
+                    op = NAME_TRANSFER + '>'
+
+                ops[str(block_id)].append({'name': 'name%s.test' % rng.randint(0, 5), 'op': op, 'vtxindex': vtxindex,
+                                           'virtualchain_txid': '%064x' % rng.getrandbits(256)})
+
+        self.untrusted_db_path = os.path.join(self.tmpdir, 'untrusted.db')
+        with open(self.untrusted_db_path, 'w') as f:
+            f.write(json.dumps({'lastblock': self.last_block, 'ops': ops, 'consensus': {}}))
+
+    def tearDown(self):
+        consensus.BlockstackDB, consensus.sanitized_rec_to_virtualchain_op, consensus.virtualchain, \
+                consensus.VERIFY_PREFETCH_BLOCKS, consensus.VERIFY_CHECKPOINT_INTERVAL = self.saved
+
+        shutil.rmtree(self.tmpdir)
+
+    def rebuild(self, name, target_block_id, num_prefetch_processes, resume=False, expected_snapshots=None):
+        """
+        Rebuild the untrusted database into working directory @name.
+        Return (consensus hash, rebuilt database)
+        """
+        working_dir = os.path.join(self.tmpdir, name)
+        if not os.path.exists(working_dir):
+            os.makedirs(working_dir)
+
+        working_db_path = os.path.join(working_dir, 'blockstack-server.db')
+        consensus_hash = rebuild_database(target_block_id, self.untrusted_db_path, working_db_path=working_db_path,
+                                          resume_dir=(working_dir if resume else None), expected_snapshots=expected_snapshots,
+                                          num_prefetch_processes=num_prefetch_processes)
+
+        return (consensus_hash, FakeBlockstackDB(working_db_path, None))
+
+    def test_prefetch(self):
+        """ Rebuilding with prefetch workers gives the same ops and consensus hashes as rebuilding serially
+        """
+        serial_hash, serial_db = self.rebuild('serial', self.last_block, 0)
+        prefetch_hash, prefetch_db = self.rebuild('prefetch', self.last_block, 2)
+
+        self.assertIsNotNone(serial_hash)
+        self.assertEqual(prefetch_hash, serial_hash)
+        self.assertEqual(prefetch_db.state, serial_db.state)
+        self.assertEqual(serial_db.lastblock, self.last_block)
+
+        # ops came out in tx order, and transfers were restored against the rebuilt database
+        for block_id in xrange(self.first_block, self.last_block + 1):
+            ops = serial_db.state['ops'][str(block_id)]
+            for op in ops:
+                if op['op'][0] == NAME_TRANSFER:
+                    self.assertEqual(op['prior'], serial_db.get_consensus_at(block_id - 1))
+
+            self.assertEqual(len(ops), len(FakeBlockstackDB(self.untrusted_db_path, None).get_all_ops_at(block_id)))
+
+    def test_resume(self):
+        """ A rebuild resumed from its checkpoint picks up where it left off
+        """
+        serial_hash, serial_db = self.rebuild('serial', self.last_block, 0)
+        expected_snapshots = dict([(block_id, serial_db.get_consensus_at(block_id)) for block_id in xrange(self.first_block, self.last_block + 1, 5)])
+
+        partial_hash, partial_db = self.rebuild('resume', 117, 2, resume=True, expected_snapshots=expected_snapshots)
+        self.assertEqual(partial_hash, serial_db.get_consensus_at(117))
+        self.assertEqual(rebuild_database_load_checkpoint(os.path.join(self.tmpdir, 'resume')), {'block_id': 115, 'consensus_hash': str(expected_snapshots[115])})
+
+        # each block is processed once (FakeBlockstackDB checks), and we end up where a full rebuild does
+        resumed_hash, resumed_db = self.rebuild('resume', self.last_block, 2, resume=True, expected_snapshots=expected_snapshots)
+        self.assertEqual(resumed_hash, serial_hash)
+        self.assertEqual(resumed_db.state, serial_db.state)
+
+        # already done
+        self.assertEqual(self.rebuild('resume', self.last_block, 2, resume=True)[0], serial_hash)
+
+    def test_resume_mismatch(self):
+        """ A resumed rebuild fails if the partial database does not match its checkpoint or snapshots
+        """
+        serial_hash, serial_db = self.rebuild('serial', self.last_block, 0)
+        expected_snapshots = dict([(block_id, serial_db.get_consensus_at(block_id)) for block_id in xrange(self.first_block, self.last_block + 1)])
+
+        partial_hash, partial_db = self.rebuild('resume', 117, 0, resume=True, expected_snapshots=expected_snapshots)
+        checkpoint = rebuild_database_load_checkpoint(os.path.join(self.tmpdir, 'resume'))
+        self.assertEqual(checkpoint['block_id'], 115)
+
+        # a block processed since the checkpoint does not match
+        bad_snapshots = dict(expected_snapshots)
+        bad_snapshots[117] = '00' * 16
+        self.assertIsNone(self.rebuild('resume', self.last_block, 0, resume=True, expected_snapshots=bad_snapshots)[0])
+
+        # the checkpoint does not match
+        rebuild_database_save_checkpoint(os.path.join(self.tmpdir, 'resume'), 115, '00' * 16)
+        self.assertIsNone(self.rebuild('resume', self.last_block, 0, resume=True, expected_snapshots=expected_snapshots)[0])
+
+
+class ZonefilePackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pack_dir = os.path.join(self.tmpdir, "packs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_put_get(self):
+        """ Stored zonefiles can be read back, and are stored once
+        """
+        zf = ZonefilePack(self.pack_dir)
+        zonefile_hash = get_zonefile_data_hash("hello")
+
+        self.assertFalse(zf.has(zonefile_hash))
+        self.assertIsNone(zf.get(zonefile_hash))
+
+        self.assertTrue(zf.put("hello"))
+        self.assertTrue(zf.put("hello"))
+        self.assertTrue(zf.has(zonefile_hash))
+        self.assertEqual(zf.get(zonefile_hash), "hello")
+
+        size = os.path.getsize(zf.segment_path(0))
+        self.assertEqual(size, pack.ZONEFILE_PACK_RECORD_HEADER_LEN + len("hello"))
+        zf.close()
+
+    def test_deferred_sync(self):
+        """ Unsynced zonefiles are readable, and durable once synced
+        """
+        zf = ZonefilePack(self.pack_dir)
+        for data in ["a", "bb", "ccc"]:
+            self.assertTrue(zf.put(data, fsync=False))
+            self.assertEqual(zf.get(get_zonefile_data_hash(data)), data)
+
+        self.assertTrue(zf.dirty)
+        self.assertTrue(zf.sync())
+        self.assertFalse(zf.dirty)
+        zf.close()
+
+        zf = ZonefilePack(self.pack_dir)
+        for data in ["a", "bb", "ccc"]:
+            self.assertEqual(zf.get(get_zonefile_data_hash(data)), data)
+
+        zf.close()
+
+    def test_remove(self):
+        """ Removed zonefiles stay removed
+        """
+        zf = ZonefilePack(self.pack_dir)
+        zf.put("hello")
+        zf.remove(get_zonefile_data_hash("hello"))
+        self.assertFalse(zf.has(get_zonefile_data_hash("hello")))
+        zf.close()
+
+        zf = ZonefilePack(self.pack_dir)
+        self.assertFalse(zf.has(get_zonefile_data_hash("hello")))
+        zf.close()
+
+    def test_read_only(self):
+        """ Reading a pack that does not exist yet creates nothing
+        """
+        zf = ZonefilePack(self.pack_dir)
+        self.assertFalse(zf.has(get_zonefile_data_hash("hello")))
+        self.assertIsNone(zf.get(get_zonefile_data_hash("hello")))
+        self.assertTrue(zf.remove(get_zonefile_data_hash("hello")))
+        zf.close()
+
+        self.assertFalse(os.path.exists(self.pack_dir))
+
+    def test_concurrent_reads(self):
+        """ Readers in other threads see unsynced zonefiles, and do not wait on the writer
+        """
+        zf = ZonefilePack(self.pack_dir)
+        zf.put("hello")
+        zf.put("world", fsync=False)
+
+        results = {}
+
+        def _read():
+            results['hello'] = zf.get(get_zonefile_data_hash("hello"))
+            results['world'] = zf.get(get_zonefile_data_hash("world"))
+
+        # hold the write lock, as a writer in the middle of an fsync would
+        with zf.lock:
+            reader = threading.Thread(target=_read)
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+
+        self.assertEqual(results, {'hello': 'hello', 'world': 'world'})
+
+        zf.sync()
+        self.assertEqual(zf.pending, {})
+
+        reader = threading.Thread(target=_read)
+        reader.start()
+        reader.join(5)
+        self.assertEqual(results, {'hello': 'hello', 'world': 'world'})
+        zf.close()
+
+    def test_segments(self):
+        """ Full segments are closed, and we append to the newest one on reopen
+        """
+        segment_max = pack.ZONEFILE_PACK_SEGMENT_MAX
+        pack.ZONEFILE_PACK_SEGMENT_MAX = 1
+        try:
+            zf = ZonefilePack(self.pack_dir)
+            zf.put("hello")
+            zf.put("world")
+            self.assertEqual(zf.segment_id, 1)
+            zf.close()
+
+            zf = ZonefilePack(self.pack_dir)
+            self.assertEqual(zf.get(get_zonefile_data_hash("hello")), "hello")
+            self.assertEqual(zf.get(get_zonefile_data_hash("world")), "world")
+
+            zf.put("again")
+            self.assertEqual(zf.segment_id, 2)
+            self.assertTrue(os.path.exists(zf.segment_path(2)))
+            self.assertEqual(zf.get(get_zonefile_data_hash("again")), "again")
+            zf.close()
+
+        finally:
+            pack.ZONEFILE_PACK_SEGMENT_MAX = segment_max
+
+    def test_migrate(self):
+        """ Zonefiles in the old layout are packed, and corrupt ones are skipped
+        """
+        zonefile_dir = os.path.join(self.tmpdir, "zonefiles")
+        paths = {}
+        for data, zonefile_hash in [("hello", get_zonefile_data_hash("hello")), ("corrupt", get_zonefile_data_hash("other"))]:
+            dirpath = os.path.join(zonefile_dir, *[zonefile_hash[i:i+2] for i in xrange(0, len(zonefile_hash), 2)])
+            os.makedirs(dirpath)
+            paths[data] = os.path.join(dirpath, "zonefile.txt")
+            with open(paths[data], "w") as f:
+                f.write(data)
+
+        self.assertEqual(migrate_zonefile_dir_to_pack(zonefile_dir, remove_old=True), 1)
+
+        zf = get_zonefile_pack(zonefile_dir)
+        self.assertEqual(zf.get(get_zonefile_data_hash("hello")), "hello")
+        self.assertFalse(zf.has(get_zonefile_data_hash("other")))
+
+        # the migrated zonefile is removed from the old layout; the corrupt one is not
+        self.assertFalse(os.path.exists(os.path.dirname(paths["hello"])))
+        self.assertTrue(os.path.exists(paths["corrupt"]))
+
+        zf.close()
+        del pack.ZONEFILE_PACKS[os.path.abspath(zonefile_dir)]
+
+
+class FailingStream(object):
+    """
+    Stream that fails after returning the given data
+    """
+    def __init__(self, data):
+        self.stream = StringIO.StringIO(data)
+
+    def read(self, size=-1):
+        buf = self.stream.read(size)
+        if len(buf) == 0:
+            raise IOError("Connection reset")
+
+        return buf
+
+
+class FastSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.working_dir = os.path.join(self.tmpdir, "working")
+        os.makedirs(os.path.join(self.working_dir, "dir"))
+
+        with open(os.path.join(self.working_dir, "blockstack-server.db"), "w") as f:
+            f.write("old db")
+
+        with open(os.path.join(self.working_dir, "dir", "keep"), "w") as f:
+            f.write("keep")
+
+        self.privkey_hex = keylib.ECPrivateKey().to_hex()
+        self.public_keys = [keylib.ECPrivateKey(self.privkey_hex).public_key().to_hex()]
+
+        # serve snapshots from memory
+        self.snapshots = {}
+        self.fetch_offsets = []
+        self.ranges = True
+        self.fail_at = None
+        self.restored = []
+        self.extracted = []
+
+        self.saved = (fast_sync.fast_sync_fetch, fast_sync.fast_sync_extract, fast_sync.blockstack_backup_restore)
+        fast_sync.fast_sync_fetch = self.fetch
+        fast_sync.fast_sync_extract = self.extract
+        fast_sync.blockstack_backup_restore = lambda working_dir, block_number: self.restored.append(working_dir) or True
+
+    def tearDown(self):
+        fast_sync.fast_sync_fetch, fast_sync.fast_sync_extract, fast_sync.blockstack_backup_restore = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, import_url, offset=0):
+        self.fetch_offsets.append(offset)
+        data = self.snapshots[import_url]
+
+        if self.fail_at is not None:
+            fail_at = self.fail_at
+            self.fail_at = None
+            return (FailingStream(data[offset:fail_at]), offset, len(data))
+
+        if offset > 0 and not self.ranges:
+            offset = 0
+
+        return (StringIO.StringIO(data[offset:]), offset, len(data))
+
+    def extract(self, snapshot_path, payload_size, dest_dir, max_size=fast_sync.FAST_SYNC_MAX_EXTRACT_SIZE):
+        self.extracted.append(snapshot_path)
+        return self.saved[1](snapshot_path, payload_size, dest_dir, max_size=max_size)
+
+    def make_snapshot(self, members, privkey_hex=None, url="http://snapshot"):
+        """
+        Make a signed snapshot out of a list of (tarinfo, data or None)
+        Return its path
+        """
+        path = os.path.join(self.tmpdir, "snapshot.bsk")
+        tar = tarfile.open(path, "w:bz2")
+        for (tarinfo, data) in members:
+            if data is not None:
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, StringIO.StringIO(data))
+            else:
+                tar.addfile(tarinfo)
+
+        tar.close()
+
+        self.assertTrue(fast_sync_sign_snapshot(path, privkey_hex or self.privkey_hex, first=True))
+        with open(path, "r") as f:
+            self.snapshots[url] = f.read()
+
+        return path
+
+    def make_file(self, name, data):
+        return (tarfile.TarInfo(name), data)
+
+    def make_dir(self, name):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type = tarfile.DIRTYPE
+        return (tarinfo, None)
+
+    def good_members(self, db_data="new db"):
+        return [self.make_file("blockstack-server.db", db_data), self.make_dir("dir"), self.make_dir("dir/sub"),
+                self.make_file("dir/sub/file", "file")]
+
+    def read(self, *path):
+        with open(os.path.join(self.working_dir, *path), "r") as f:
+            return f.read()
+
+    def assertCleanedUp(self):
+        self.assertFalse(os.path.exists(os.path.join(self.working_dir, fast_sync.FAST_SYNC_SPOOL_FILENAME)))
+        self.assertFalse(os.path.exists(os.path.join(self.working_dir, fast_sync.FAST_SYNC_STAGING_DIRNAME)))
+
+    def assertUntouched(self):
+        # (except for a partial download)
+        names = [name for name in os.listdir(self.working_dir) if name != fast_sync.FAST_SYNC_SPOOL_FILENAME]
+        self.assertEqual(sorted(names), ["blockstack-server.db", "dir"])
+        self.assertEqual(os.listdir(os.path.join(self.working_dir, "dir")), ["keep"])
+        self.assertEqual(self.read("blockstack-server.db"), "old db")
+        self.assertEqual(self.restored, [])
+
+    def test_import(self):
+        """ A signed snapshot is merged into the working directory
+        """
+        self.make_snapshot(self.good_members())
+
+        self.assertTrue(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+        self.assertEqual(self.read("blockstack-server.db"), "new db")
+        self.assertEqual(self.read("dir", "sub", "file"), "file")
+        self.assertEqual(self.read("dir", "keep"), "keep")
+        self.assertEqual(self.restored, [self.working_dir])
+        self.assertCleanedUp()
+
+    def test_bad_signature(self):
+        """ A snapshot is not extracted unless enough signatures match its contents
+        """
+        # wrong key
+        self.make_snapshot(self.good_members(), privkey_hex=keylib.ECPrivateKey().to_hex())
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+
+        # altered after signing
+        path = self.make_snapshot(self.good_members())
+        payload_size = fast_sync_inspect_snapshot(path)['payload_size']
+        data = self.snapshots["http://snapshot"]
+        self.snapshots["http://snapshot"] = data[:payload_size / 2] + chr(ord(data[payload_size / 2]) ^ 0xff) + data[payload_size / 2 + 1:]
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+
+        # not signed
+        self.snapshots["http://snapshot"] = data[:payload_size] + "{:08x}".format(0)
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+
+        self.assertEqual(self.extracted, [])
+        self.assertUntouched()
+        self.assertCleanedUp()
+
+    def test_malicious(self):
+        """ Snapshots that would write outside of the working directory, or anything but files and directories, are rejected
+        """
+        symlink = tarfile.TarInfo("dir/link")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = "/etc/passwd"
+
+        hardlink = tarfile.TarInfo("dir/hardlink")
+        hardlink.type = tarfile.LNKTYPE
+        hardlink.linkname = "blockstack-server.db"
+
+        device = tarfile.TarInfo("dir/null")
+        device.type = tarfile.CHRTYPE
+
+        bad_members = [
+            self.make_file("../escaped", "evil"),
+            self.make_file("../../escaped", "evil"),
+            self.make_file("dir/../../escaped", "evil"),
+            self.make_file(os.path.join(self.tmpdir, "absolute"), "evil"),
+            (symlink, None),
+            (hardlink, None),
+            (device, None),
+        ]
+
+        for bad_member in bad_members:
+            self.make_snapshot(self.good_members() + [bad_member])
+            self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1), bad_member[0].name)
+
+            self.assertUntouched()
+            self.assertCleanedUp()
+            self.assertEqual(sorted(os.listdir(self.tmpdir)), ["snapshot.bsk", "working"])
+
+    def test_extract_max_size(self):
+        """ Snapshots that unpack to too many bytes are rejected
+        """
+        path = self.make_snapshot([self.make_file("a", "x" * 100), self.make_file("b", "x" * 100)])
+        payload_size = fast_sync_inspect_snapshot(path)['payload_size']
+
+        dest_dir = os.path.join(self.tmpdir, "dest")
+        self.assertFalse(fast_sync_extract(path, payload_size, dest_dir, max_size=150))
+        self.assertFalse(os.path.exists(os.path.join(dest_dir, "b")))
+
+        shutil.rmtree(dest_dir)
+        self.assertTrue(fast_sync_extract(path, payload_size, dest_dir, max_size=200))
+        self.assertEqual(sorted(os.listdir(dest_dir)), ["a", "b"])
+
+    def test_resume(self):
+        """ An interrupted download picks up where it left off
+        """
+        # big enough to take several reads
+        self.make_snapshot(self.good_members(db_data=os.urandom(4 * fast_sync.FAST_SYNC_CHUNK_SIZE)))
+        data = self.snapshots["http://snapshot"]
+
+        self.fail_at = len(data) / 2 + 1
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+        self.assertEqual(os.stat(os.path.join(self.working_dir, fast_sync.FAST_SYNC_SPOOL_FILENAME)).st_size, len(data) / 2 + 1)
+        self.assertUntouched()
+
+        progress = []
+        self.assertTrue(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1,
+                                         progress_callback=lambda received, total: progress.append((received, total))))
+
+        self.assertEqual(self.fetch_offsets, [0, len(data) / 2 + 1])
+        self.assertEqual(progress[-1], (len(data), len(data)))
+        self.assertEqual(len(self.read("blockstack-server.db")), 4 * fast_sync.FAST_SYNC_CHUNK_SIZE)
+        self.assertCleanedUp()
+
+    def test_resume_unsupported(self):
+        """ An interrupted download starts over if the server cannot send the rest of it
+        """
+        self.make_snapshot(self.good_members())
+        data = self.snapshots["http://snapshot"]
+        self.ranges = False
+
+        self.fail_at = len(data) / 2
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+
+        self.assertTrue(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1))
+        self.assertEqual(self.fetch_offsets, [0, len(data) / 2])
+        self.assertEqual(self.read("blockstack-server.db"), "new db")
+        self.assertCleanedUp()
+
+    def test_no_resume(self):
+        """ An interrupted download is discarded if we are not resuming
+        """
+        self.make_snapshot(self.good_members())
+        data = self.snapshots["http://snapshot"]
+
+        self.fail_at = len(data) / 2
+        self.assertFalse(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1, resume=False))
+        self.assertCleanedUp()
+
+        self.assertTrue(fast_sync_import(self.working_dir, "http://snapshot", public_keys=self.public_keys, num_required=1, resume=False))
+        self.assertEqual(self.fetch_offsets, [0, 0])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -23,11 +23,11 @@
 
 from pybitcoin.services import BlockchainClient
 
-from xmlrpclib import ServerProxy, Transport
 from defusedxml import xmlrpc
-import httplib
 import json
 
+from ...connection_pool import TimeoutServerProxy
+
 # prevent the usual XML attacks
 xmlrpc.monkey_patch()
 
@@ -44,46 +44,6 @@ class BlockstackUTXOClient( BlockchainClient ):
         return broadcast_transaction( txdata, self )
 
 
-# TODO: make into its own module
-# https://seattle.poly.edu/browser/seattle/trunk/demokit/timeout_xmlrpclib.py?rev=692
-class TimeoutHTTPConnection(httplib.HTTPConnection):
-    def connect(self):
-        httplib.HTTPConnection.connect(self)
-        self.sock.settimeout(self.timeout)
-
-
-class TimeoutHTTP(httplib.HTTP):
-    _connection_class = TimeoutHTTPConnection
-
-    def set_timeout(self, timeout):
-        self._conn.timeout = timeout
-
-    def getresponse(self, **kw):
-        return self._conn.getresponse(**kw)
-
-
-class TimeoutTransport(Transport):
-    def __init__(self, *l, **kw):
-        self.timeout = kw.get('timeout', 10)
-        if 'timeout' in kw.keys():
-            del kw['timeout']
-
-        Transport.__init__(self, *l, **kw)
-
-    def make_connection(self, host):
-        conn = TimeoutHTTP(host)
-        conn.set_timeout(self.timeout)
-        return conn
-
-class TimeoutServerProxy(ServerProxy):
-    def __init__(self, uri, *l, **kw):
-        kw['transport'] = TimeoutTransport(timeout=kw.get('timeout',10), use_datetime=kw.get('use_datetime', 0))
-        if 'timeout' in kw.keys():
-            del kw['timeout']
-        
-        ServerProxy.__init__(self, uri, *l, **kw)
-
-
 class BlockstackRPCClient(object):
     """
     RPC client for the blockstack server
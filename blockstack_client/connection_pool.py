@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Keep-alive HTTP connections for XML-RPC.
+
+All XML-RPC clients in the process share one pool of idle connections,
+keyed by host:port.  A call checks out an idle connection (or opens
+a new one), and returns it to the pool once the reply has been read.
+Idle connections that the server has since closed are detected before
+reuse, and a call that fails on a reused connection is retried once
+on a new one.
+
+This module only depends on the standard library and constants, so it
+can be used from the backends (which are loaded while config is).
+"""
+
+import socket
+import select
+import httplib
+import threading
+import time
+
+from xmlrpclib import ServerProxy, Transport, ProtocolError
+
+from .constants import RPC_POOL_MAX_IDLE_PER_HOST, RPC_POOL_MAX_IDLE_TIME
+
+
+class ConnectionPool(object):
+    """
+    Per-host pool of idle, persistent HTTP connections.
+    Thread-safe.
+    """
+
+    def __init__(self, max_idle_per_host=RPC_POOL_MAX_IDLE_PER_HOST, max_idle_time=RPC_POOL_MAX_IDLE_TIME):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_time = max_idle_time
+        self.lock = threading.Lock()
+
+        # map host:port to list of (connection, time returned), most recent last
+        self.idle = {}
+
+        self.stats = {
+            'new': 0,           # connections opened
+            'reused': 0,        # calls served on an idle connection
+            'stale': 0,         # idle connections found closed or expired
+            'retried': 0,       # calls retried on a new connection after failing on a reused one
+            'discarded': 0,     # connections closed after an error or a non-keep-alive reply
+        }
+
+
+    def count(self, stat, n=1):
+        """
+        Bump a counter
+        """
+        with self.lock:
+            self.stats[stat] += n
+
+
+    def get_stats(self):
+        """
+        Get a copy of the counters, and the number of idle connections
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['idle'] = sum([len(conns) for conns in self.idle.values()])
+
+        return stats
+
+
+    @classmethod
+    def is_alive(cls, conn):
+        """
+        Can an idle connection be reused?
+        An idle connection should have nothing to read; if it does,
+        the server either closed it (EOF) or sent something unexpected.
+        """
+        if conn.sock is None:
+            return False
+
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+
+        return len(readable) == 0
+
+
+    def get(self, host, timeout):
+        """
+        Check out a connection to host:port.
+        Return (connection, reused)
+        """
+        now = time.time()
+        conn = None
+
+        with self.lock:
+            conns = self.idle.get(host, [])
+            while len(conns) > 0:
+                candidate, returned_at = conns.pop()
+                if now - returned_at <= self.max_idle_time and self.is_alive(candidate):
+                    conn = candidate
+                    break
+
+                candidate.close()
+                self.stats['stale'] += 1
+
+            if conn is not None:
+                self.stats['reused'] += 1
+            else:
+                self.stats['new'] += 1
+
+        if conn is not None:
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            return conn, True
+
+        return httplib.HTTPConnection(host, timeout=timeout), False
+
+
+    def release(self, host, conn):
+        """
+        Return a connection whose reply has been fully read
+        """
+        with self.lock:
+            conns = self.idle.setdefault(host, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append( (conn, time.time()) )
+                return
+
+        conn.close()
+
+
+    def discard(self, conn):
+        """
+        Close a connection that can't be reused
+        """
+        conn.close()
+        self.count('discarded')
+
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self.lock:
+            for conns in self.idle.values():
+                for (conn, _) in conns:
+                    conn.close()
+
+            self.idle = {}
+
+
+# shared by all RPC clients in this process
+CONNECTION_POOL = ConnectionPool()
+
+
+def get_connection_pool():
+    """
+    Get the process-wide connection pool
+    """
+    return CONNECTION_POOL
+
+
+class TimeoutTransport(Transport):
+    """
+    XML-RPC transport with a socket timeout, which sends
+    its requests over pooled keep-alive connections.
+    """
+    def __init__(self, *l, **kw):
+        self.timeout = kw.pop('timeout', 10)
+        self.pool = kw.pop('pool', None)
+        if self.pool is None:
+            self.pool = get_connection_pool()
+
+        Transport.__init__(self, *l, **kw)
+
+
+    def request(self, host, handler, request_body, verbose=0):
+        """
+        Send a request and parse the reply.
+        If the request fails on a reused connection (i.e. the server
+        closed it while it was idle), retry it once on a new one.
+        """
+        host, extra_headers, x509 = self.get_host_info(host)
+
+        for attempt in xrange(0, 2):
+            conn, reused = self.pool.get(host, self.timeout)
+            try:
+                conn.putrequest("POST", handler, skip_accept_encoding=True)
+                if extra_headers:
+                    for (key, value) in extra_headers:
+                        conn.putheader(key, value)
+
+                conn.putheader("Content-Type", "text/xml")
+                conn.putheader("User-Agent", self.user_agent)
+                conn.putheader("Content-Length", str(len(request_body)))
+                conn.endheaders(request_body)
+
+                response = conn.getresponse(buffering=True)
+
+            except (socket.error, httplib.HTTPException), e:
+                self.pool.discard(conn)
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    self.pool.count('retried')
+                    continue
+
+                raise
+
+            if response.status != 200:
+                response.read()
+                self.pool.discard(conn)
+                raise ProtocolError(host + handler, response.status, response.reason, response.msg)
+
+            try:
+                self.verbose = verbose
+                ret = self.parse_response(response)
+            except:
+                self.pool.discard(conn)
+                raise
+
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(host, conn)
+
+            return ret
+
+
+class TimeoutServerProxy(ServerProxy):
+    def __init__(self, uri, *l, **kw):
+        timeout = kw.pop('timeout', 10)
+        use_datetime = kw.get('use_datetime', 0)
+        kw['transport'] = TimeoutTransport(timeout=timeout, use_datetime=use_datetime)
+        ServerProxy.__init__(self, uri, *l, **kw)
@@ -72,6 +72,31 @@ BLOCKSTACK_REQUIRED_STORAGE_DRIVERS_WRITE = 'disk,blockstack_server,dht'
 
 DEFAULT_TIMEOUT = 30  # in secs
 
+# keep-alive RPC connections (see connection_pool.py)
+RPC_POOL_MAX_IDLE_PER_HOST = 8  # idle connections to keep per host
+RPC_POOL_MAX_IDLE_TIME = 8      # close idle connections older than this many seconds (servers close them after 10)
+
+# storage reads (see storage.py)
+STORAGE_HEDGED_READS = True     # query storage drivers concurrently, and take the first response that verifies
+STORAGE_HEDGE_DELAY = 0.5       # seconds to wait on a driver before also asking the next one, when we have no latency data for it
+STORAGE_HEDGE_MAX_DELAY = 2.0   # upper bound on how long to wait on a driver before also asking the next one
+STORAGE_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]    # latency histogram bucket upper bounds, in seconds
+STORAGE_LATENCY_WINDOW = 200    # halve a driver's latency histogram once it holds this many samples, so it tracks recent behavior
+
+# storage writes (see storage.py)
+STORAGE_PARALLEL_WRITES = True  # replicate to all storage drivers at once
+STORAGE_WRITE_QUORUM = 1        # a write succeeds once all required drivers and at least this many drivers in total have acknowledged it
+
+# datastores (see data.py)
+DATASTORE_PREFETCH_THREADS = 8  # number of inodes to fetch (or delete) at once when walking many paths, or a whole tree
+DATASTORE_INODE_CACHE_SIZE = 16 * 1024 * 1024     # bytes of (serialized) directory inodes to cache
+DATASTORE_INODE_CACHE_MAX_AGE = 3600    # refetch a cached inode once it is this many seconds old, even if we know of no newer version
+DATASTORE_INODE_CACHE_SAVE_INTERVAL = 30    # write the inode cache to disk at most this often (and on exit)
+DATASTORE_INODE_CACHE_FILENAME = 'inode_cache.json'     # in the metadata directory
+
+# signatures (see keys.py)
+VERIFIED_SIGNATURE_CACHE_SIZE = 10000   # number of known-valid (public key, data hash, signature) tuples to remember
+
 """ transaction fee configs
 """
 
@@ -37,6 +37,9 @@ import errno
 import hashlib
 import jsontokens
 import collections
+import threading
+import atexit
+from multiprocessing.pool import ThreadPool
 from keylib import *
 
 from .keys import *
@@ -46,7 +49,8 @@ from .storage import hash_zonefile
 from .zonefile import get_name_zonefile, load_name_zonefile, url_to_uri_record, store_name_zonefile
 
 from .config import get_logger, get_config, get_local_device_id, get_all_device_ids
-from .constants import BLOCKSTACK_TEST, BLOCKSTACK_DEBUG, DATASTORE_SIGNING_KEY_INDEX
+from .constants import BLOCKSTACK_TEST, BLOCKSTACK_DEBUG, DATASTORE_SIGNING_KEY_INDEX, DATASTORE_PREFETCH_THREADS
+from .constants import DATASTORE_INODE_CACHE_SIZE, DATASTORE_INODE_CACHE_MAX_AGE, DATASTORE_INODE_CACHE_SAVE_INTERVAL, DATASTORE_INODE_CACHE_FILENAME
 from .schemas import *
 
 log = get_logger()
@@ -55,46 +59,200 @@ DIR_CACHE = None      # cached directories (maps inode uuid to dir data)
 
 class InodeCache(object):
     """
-    Cache inode-uuid --> inode data
-    in an LRU style
+    Cache of verified inodes, keyed by (datastore ID, inode UUID),
+    evicted in LRU order once their serialized size exceeds capacity bytes.
+
+    Each entry records the inode version it was fetched (or written) at.
+    An entry is only used if that version is still the latest version we know
+    of locally (see _get_inode_local_version()).  Since other devices can
+    write the inode without us knowing, _get_inode() also checks the entry
+    against the inode's current header before using it.
+
+    If config_path is given, the cache is loaded from and saved to the
+    metadata directory, so it survives restarts.  Changes are saved in
+    the background at most every DATASTORE_INODE_CACHE_SAVE_INTERVAL seconds.
+    Thread-safe.
     """
-    def __init__(self, capacity=10000):
+    def __init__(self, capacity=DATASTORE_INODE_CACHE_SIZE, max_age=DATASTORE_INODE_CACHE_MAX_AGE, config_path=None):
         self.capacity = capacity
+        self.max_age = max_age
+        self.size = 0
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.save_timer = None
+
+        # map (datastore_id, inode_uuid) to (version, time cached, serialized inode, serialized header)
         self.cache = collections.OrderedDict()
 
-    def get(self, inode_uuid):
+        self.path = None
+        if config_path is not None:
+            conf = get_config(config_path)
+            if conf is not None and conf.get('metadata', None) is not None:
+                self.path = os.path.join(get_metadata_dir(conf), DATASTORE_INODE_CACHE_FILENAME)
+                self.load()
+                atexit.register(self.save)
+
+
+    def _put(self, key, entry):
         """
-        Get cached inode data
+        Insert an entry, evicting old ones to make room (lock must be held)
         """
-        try:
-            value = self.cache.pop(inode_uuid)
-            self.cache[inode_uuid] = value
-            return value
+        self._evict(key)
+
+        entry_size = len(entry[2]) + len(entry[3])
+        if entry_size > self.capacity:
+            return
+
+        while self.size + entry_size > self.capacity:
+            _, old_entry = self.cache.popitem(last=False)
+            self.size -= len(old_entry[2]) + len(old_entry[3])
 
-        except KeyError:
-            return None
+        self.cache[key] = entry
+        self.size += entry_size
+        self._set_dirty()
 
-    def put(self, inode_uuid, inode_data):
+
+    def _evict(self, key):
         """
-        Cache inode data
+        Remove an entry (lock must be held)
         """
-        try:
-            self.cache.pop(inode_uuid)
-        except KeyError:
-            if len(self.cache) >= self.capacity:
-                self.cache.popitem(last=False)
+        old_entry = self.cache.pop(key, None)
+        if old_entry is not None:
+            self.size -= len(old_entry[2]) + len(old_entry[3])
+            self._set_dirty()
+
+
+    def _set_dirty(self):
+        """
+        Mark the cache as changed, and schedule a save (lock must be held)
+        """
+        self.dirty = True
+        if self.path is None or self.save_timer is not None:
+            return
+
+        self.save_timer = threading.Timer(DATASTORE_INODE_CACHE_SAVE_INTERVAL, self._save_later)
+        self.save_timer.daemon = True
+        self.save_timer.start()
+
 
-        self.cache[inode_uuid] = inode_data
+    def _save_later(self):
+        """
+        Save the cache from the save timer
+        """
+        with self.lock:
+            self.save_timer = None
+
+        self.save()
+
+
+    def get(self, datastore_id, inode_uuid, version):
+        """
+        Get a cached inode and its header, if we have it at the given version.
+        Return (inode, header) on hit
+        Return (None, None) on miss
+        """
+        key = (datastore_id, inode_uuid)
+        with self.lock:
+            entry = self.cache.get(key, None)
+            if entry is None:
+                return (None, None)
+
+            if entry[0] != version or time.time() - entry[1] > self.max_age:
+                # stale
+                self._evict(key)
+                return (None, None)
 
+            # most-recently used
+            self.cache.pop(key)
+            self.cache[key] = entry
 
-    def evict(self, inode_uuid):
+        # callers may modify what we give them
+        return (json.loads(entry[2]), json.loads(entry[3]))
+
+
+    def put(self, datastore_id, inode_uuid, version, inode_data, inode_header):
+        """
+        Cache a verified inode and its header at a given version
+        """
+        entry = (version, time.time(), json.dumps(inode_data, sort_keys=True), json.dumps(inode_header, sort_keys=True))
+        with self.lock:
+            self._put((datastore_id, inode_uuid), entry)
+
+
+    def evict(self, datastore_id, inode_uuid):
         """
         Evict inode data
         """
+        with self.lock:
+            self._evict((datastore_id, inode_uuid))
+
+
+    def load(self):
+        """
+        Load cached inodes from disk.
+        Return True on success
+        Return False on error
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.loads(f.read())
+
+            with self.lock:
+                # least-recently used first
+                for (datastore_id, inode_uuid, version, cached_at, inode_str, header_str) in entries:
+                    self._put((datastore_id, inode_uuid), (version, cached_at, inode_str, header_str))
+
+                self.dirty = False
+
+        except Exception as e:
+            if BLOCKSTACK_DEBUG:
+                log.exception(e)
+
+            log.warning("Failed to load inode cache from {}".format(self.path))
+            return False
+
+        return True
+
+
+    def save(self):
+        """
+        Write cached inodes to disk, if they changed.
+        Return True on success
+        Return False on error
+        """
+        if self.path is None:
+            return False
+
+        with self.lock:
+            if not self.dirty:
+                return True
+
+            entries = [list(key) + list(entry) for (key, entry) in self.cache.items()]
+            self.dirty = False
+
+        tmp_path = '{}.tmp.{}'.format(self.path, threading.current_thread().ident)
         try:
-            self.cache.pop(inode_uuid)
-        except KeyError:
-            pass
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(tmp_path, self.path)
+
+        except Exception as e:
+            if BLOCKSTACK_DEBUG:
+                log.exception(e)
+
+            log.warning("Failed to save inode cache to {}".format(self.path))
+            with self.lock:
+                self._set_dirty()
+
+            return False
+
+        return True
 
 
 def serialize_mutable_data_id(data_id):
@@ -178,12 +336,14 @@ def store_mutable_data_version(conf, device_id, data_id, ver, config_path=CONFIG
             log.debug("Make metadata directory {}".format(metadata_dir))
             os.makedirs(metadata_dir)
         except Exception, e:
-            if BLOCKSTACK_DEBUG:
-                log.exception(e)
+            # (unless another thread made it)
+            if not os.path.isdir(metadata_dir):
+                if BLOCKSTACK_DEBUG:
+                    log.exception(e)
 
-            msg = 'No metadata directory created; cannot store version of "{}"'
-            log.warning(msg.format(data_id))
-            return False
+                msg = 'No metadata directory created; cannot store version of "{}"'
+                log.warning(msg.format(data_id))
+                return False
 
     d_id = serialize_mutable_data_id(data_id)
     dev_id = serialize_mutable_data_id(device_id)
@@ -194,11 +354,13 @@ def store_mutable_data_version(conf, device_id, data_id, ver, config_path=CONFIG
             log.debug("Make metadata directory {}".format(ver_dir))
             os.makedirs(ver_dir)
         except Exception, e:
-            if BLOCKSTACK_DEBUG:
-                log.exception(e)
+            # (unless another thread made it)
+            if not os.path.isdir(ver_dir):
+                if BLOCKSTACK_DEBUG:
+                    log.exception(e)
 
-            log.warning("No metadata directory created for {}:{}".format(device_id, data_id))
-            return False
+                log.warning("No metadata directory created for {}:{}".format(device_id, data_id))
+                return False
 
     ver_path = os.path.join(ver_dir, '{}.ver'.format(dev_id))
     try:
@@ -1528,7 +1690,7 @@ def delete_datastore( datastore_privkey, force=False, config_path=CONFIG_PATH, p
         proxy = get_default_proxy(config_path)
    
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_pubkey = get_pubkey_hex(datastore_privkey)
     datastore_id = datastore_get_id(datastore_pubkey)
@@ -1572,22 +1734,46 @@ def delete_datastore( datastore_privkey, force=False, config_path=CONFIG_PATH, p
 def _is_cacheable(inode_info):
     """
     Can we cache this inode?
+    (the cache bounds how many bytes of them we keep)
     """
-    if inode_info['type'] == MUTABLE_DATUM_DIR_TYPE and len(inode_info['idata']) < 1024:
+    if inode_info['type'] == MUTABLE_DATUM_DIR_TYPE:
         return True
     else:
         return False
 
 
+def _get_inode_local_version(datastore_id, inode_uuid, device_ids, config_path=CONFIG_PATH):
+    """
+    Get the latest version of an inode (and its header) that we know of locally
+    Return {'status': True, 'version': version} on success
+    Return {'error': ...} on error
+    """
+    inode_id = '{}.{}'.format(datastore_id, inode_uuid)
+    inode_hdr_id = '{}.{}.hdr'.format(datastore_id, inode_uuid)
+
+    res = _get_mutable_data_versions( inode_id, device_ids, config_path=config_path )
+    if 'error' in res:
+        return res
+
+    inode_version = res['version']
+
+    res = _get_mutable_data_versions( inode_hdr_id, device_ids, config_path=config_path )
+    if 'error' in res:
+        return res
+
+    return {'status': True, 'version': max(inode_version, res['version'])}
+
+
 def _get_inode(datastore_id, inode_uuid, inode_type, data_pubkey_hex, drivers, device_ids, config_path=CONFIG_PATH, proxy=None, cache=None ):
     """
     Get an inode from non-local mutable storage.  Verify that it has an
     equal or later version number than the one we have locally.
 
     If cache is not None, and if the inode is a directory, then check
-    the cache for the data and add it if it is not present
-
-    # TODO: check data hash against inode header
+    the cache for the data and add it if it is not present.  The header
+    is always fetched, and a cached inode is only used if the header's
+    data hash still matches the cached header's (i.e. no other device
+    has changed it since we cached it).
 
     Return {'status': True, 'inode': inode info} on success.
     Return {'error': ...} on error
@@ -1599,24 +1785,13 @@ def _get_inode(datastore_id, inode_uuid, inode_type, data_pubkey_hex, drivers, d
     conf = get_config(config_path)
     assert conf
 
-    '''
-    # cached?
-    if cache is not None and inode_type == MUTABLE_DATUM_DIR_TYPE:
-        inode_data = cache.get(inode_uuid)
-        if inode_data is not None:
-            # already-fetched
-            log.debug("Cache HIT on {}".format(inode_uuid))
-            inode_version = max(inode_data[
-            return {'status': True, 'inode': inode_data}
-    '''
-
     header_version = 0
     inode_header = None
     inode_info = None
     inode_version = None
 
     # get latest header from all drivers 
-    res = _get_inode_header(datastore_id, inode_uuid, data_pubkey_hex, drivers, device_ids, config_path=config_path, proxy=proxy, cache=cache)
+    res = _get_inode_header(datastore_id, inode_uuid, data_pubkey_hex, drivers, device_ids, config_path=config_path, proxy=proxy)
     if 'error' in res:
         log.error("Failed to get inode header for {}: {}".format(inode_uuid, res['error']))
         return res
@@ -1626,6 +1801,23 @@ def _get_inode(datastore_id, inode_uuid, inode_type, data_pubkey_hex, drivers, d
     drivers_to_try = res['drivers']
     data_hash = inode_header['data_hash']
 
+    # cached?
+    if cache is not None and inode_type == MUTABLE_DATUM_DIR_TYPE:
+        res = _get_inode_local_version(datastore_id, inode_uuid, device_ids, config_path=config_path)
+        if 'error' in res:
+            return res
+
+        inode_data, cached_header = cache.get(datastore_id, inode_uuid, res['version'])
+        if inode_data is not None:
+            if cached_header.get('data_hash', None) == data_hash:
+                # already-fetched, and still fresh
+                log.debug("Cache HIT on {}".format(inode_uuid))
+                return {'status': True, 'inode': inode_data, 'version': res['version']}
+
+            # changed by another device
+            log.debug("Cache STALE on {}".format(inode_uuid))
+            cache.evict(datastore_id, inode_uuid)
+
     # get inode from only the driver(s) that gave back fresh information 
     data_id = '{}.{}'.format(datastore_id, inode_uuid)
     res = get_mutable(data_id, ver_min=header_version, data_hash=data_hash, storage_drivers=drivers_to_try, proxy=proxy, config_path=config_path)
@@ -1668,21 +1860,31 @@ def _get_inode(datastore_id, inode_uuid, inode_type, data_pubkey_hex, drivers, d
         log.error("Inode {} not owned by {} (but by {})".format(inode_info['uuid'], data_address, inode_info['owner']))
         return {'error': 'Invalid owner'}
 
-    '''
-    # yup!
-    # cache small directories
-    if cache is not None and _is_cacheable(inode_info):
-        log.debug("Cache PUT {}".format(inode_uuid))
-        cache.put( inode_uuid, inode_info )
-    '''
-
     res = _put_inode_consistency_info(datastore_id, inode_uuid, max(inode_version, header_version), device_ids, config_path=config_path)
     if 'error' in res:
         return res
 
+    # yup!
+    # cache directories
+    if cache is not None and _is_cacheable(inode_info):
+        _cache_inode(datastore_id, inode_info, inode_header, device_ids, cache, config_path=config_path)
+
     return {'status': True, 'inode': inode_info, 'version': max(inode_version, header_version)}
 
 
+def _cache_inode(datastore_id, inode_info, inode_header, device_ids, cache, config_path=CONFIG_PATH):
+    """
+    Cache a verified inode and its header at the latest version we know of locally
+    (i.e. after its consistency info has been updated).
+    """
+    res = _get_inode_local_version(datastore_id, inode_info['uuid'], device_ids, config_path=config_path)
+    if 'error' in res:
+        return
+
+    log.debug("Cache PUT {}".format(inode_info['uuid']))
+    cache.put(datastore_id, inode_info['uuid'], res['version'], inode_info, inode_header)
+
+
 def _get_mutable_data_versions( data_id, device_ids, config_path=CONFIG_PATH ):
     """
     Get the mutable data version for a datum spread across multiple devices
@@ -1756,7 +1958,7 @@ def _put_inode_consistency_info(datastore_id, inode_uuid, new_version, device_id
     return {'status': True}
 
 
-def _get_inode_header(datastore_id, inode_uuid, data_pubkey_hex, drivers, device_ids, inode_hdr_version=None, config_path=CONFIG_PATH, proxy=None, cache=None):
+def _get_inode_header(datastore_id, inode_uuid, data_pubkey_hex, drivers, device_ids, inode_hdr_version=None, config_path=CONFIG_PATH, proxy=None):
     """
     Get an inode's header data.  Verify it matches the inode info.
     Fetch the header from *all* drivers
@@ -1791,20 +1993,6 @@ def _get_inode_header(datastore_id, inode_uuid, data_pubkey_hex, drivers, device
 
         inode_hdr_version = res['version']
         
-    '''
-    if cache is not None:
-        inode_data = cache.get(inode_uuid)
-        if inode_data is not None:
-            # reconstruct header 
-            inode_hdr = {}
-            for k in inode_data.keys():
-                if k != 'idata':
-                    inode_hdr[k] = copy.deepcopy(inode_data[k])
-
-            log.debug("Cache HIT on {}".format(inode_uuid))
-            return {'status': True, 'inode': inode_hdr}
-    '''
-
     # get from *all* drivers so we know that if we succeed, we have a fresh version
     data_id = '{}.{}.hdr'.format(datastore_id, inode_uuid)
     res = get_mutable(data_id, ver_min=max(inode_version, inode_hdr_version), data_pubkey=data_pubkey_hex, storage_drivers=drivers, device_ids=device_ids, proxy=proxy, config_path=config_path, all_drivers=True)
@@ -1893,12 +2081,9 @@ def _put_inode(datastore_id, _inode, data_privkey, drivers, device_ids, config_p
     if 'error' in res:
         return res
 
-    '''
     # coherently cache
     if cache is not None and _is_cacheable(_inode):
-        log.debug("Cache PUT {}".format(_inode['uuid']))
-        cache.put(_inode['uuid'], _inode)
-    '''
+        _cache_inode(datastore_id, _inode, inode_hdr, device_ids, cache, config_path=config_path)
 
     return {'status': True}
 
@@ -1930,17 +2115,76 @@ def _delete_inode(datastore_id, inode_uuid, data_privkey, drivers, device_ids, c
 
     # invalidate cache 
     if cache is not None:
-        cache.evict(inode_uuid)
+        cache.evict(datastore_id, inode_uuid)
 
     return {'status': True}
     
 
-def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CONFIG_PATH, proxy=None ):
+def _datastore_map( func, items, num_threads=DATASTORE_PREFETCH_THREADS ):
+    """
+    Apply func to each item, running up to num_threads at once.
+    Return the list of results, in the same order as items
+    """
+    if len(items) <= 1 or num_threads <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool( min(num_threads, len(items)) )
+    try:
+        return pool.map( func, items )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_inodes(datastore_id, inode_specs, data_pubkey_hex, drivers, device_ids, config_path=CONFIG_PATH, proxy=None, cache=None ):
+    """
+    Fetch many inodes concurrently.
+    inode_specs is a list of {'uuid': ..., 'type': ..., 'header_only': True/False, 'uncached': True/False};
+    header-only inodes are fetched with _get_inode_header(), and the rest with _get_inode().
+    Inodes marked 'uncached' are always fetched from storage, bypassing cache.
+
+    Return a list of results, one per inode spec, in the same order.
+    Each result is {'status': True, 'inode': ...} on success, or {'error': ...} on error
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy(config_path)
+
+    def _fetch( inode_spec ):
+        inode_cache = None if inode_spec.get('uncached', False) else cache
+        if inode_spec['header_only']:
+            return _get_inode_header(datastore_id, inode_spec['uuid'], data_pubkey_hex, drivers, device_ids, config_path=config_path, proxy=proxy)
+        else:
+            return _get_inode(datastore_id, inode_spec['uuid'], inode_spec['type'], data_pubkey_hex, drivers, device_ids, config_path=config_path, proxy=proxy, cache=inode_cache)
+
+    return _datastore_map( _fetch, inode_specs )
+
+
+def _make_path_entry( name, child_uuid, child_entry, prefix ):
+    """
+    Make a resolved path entry
+    """
+    path_ent = {
+        'name': name,
+        'uuid': child_uuid,
+        'inode': child_entry,
+        'parent': prefix,
+    }
+    if len(path_ent['parent']) > 1:
+        path_ent['parent'] = path_ent['parent'].rstrip('/')
+
+    return path_ent
+
+
+def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CONFIG_PATH, proxy=None, use_cache=True ):
     """
     Given a fully-qualified data path, the user's datastore record, and a private key,
     go and traverse the directory heirarchy encoded
     in the data path and fetch the data at the leaf.
 
+    If use_cache is False, every inode is fetched from storage (i.e. when
+    they are about to be modified and written back).
+
     Return the resolved path on success.  If the path was '/a/b/c', then return
     {
         '/': {'uuid': ..., 'name': '', 'uuid': ...., 'parent': '',  'inode': directory},
@@ -1958,22 +2202,9 @@ def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CON
         proxy = get_default_proxy(config_path)
 
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
-    def _make_path_entry(  name, child_uuid, child_entry, prefix ):
-        """
-        Make a path entry to return
-        """
-        path_ent = {
-            'name': name,
-            'uuid': child_uuid,
-            'inode': child_entry,
-            'parent': prefix,
-        }
-        if len(path_ent['parent']) > 1:
-            path_ent['parent'] = path_ent['parent'].rstrip('/')
-
-        return path_ent
+    cache = DIR_CACHE if use_cache else None
 
     path = posixpath.normpath(path).strip("/")
     path_parts = path.split('/')
@@ -1985,7 +2216,7 @@ def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CON
     root_uuid = datastore['root_uuid']
    
     # getting only the root?
-    root_inode = _get_inode(datastore_id, root_uuid, MUTABLE_DATUM_DIR_TYPE, data_pubkey, drivers, device_ids, config_path=CONFIG_PATH, proxy=proxy, cache=DIR_CACHE)
+    root_inode = _get_inode(datastore_id, root_uuid, MUTABLE_DATUM_DIR_TYPE, data_pubkey, drivers, device_ids, config_path=CONFIG_PATH, proxy=proxy, cache=cache)
     if 'error' in root_inode:
         log.error("Failed to get root inode: {}".format(root_inode['error']))
         return {'error': root_inode['error'], 'errno': errno.EIO}
@@ -2028,7 +2259,7 @@ def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CON
             break
         
         # get child
-        child_entry = _get_inode(datastore_id, child_uuid, child_type, data_pubkey, drivers, device_ids, config_path=CONFIG_PATH, proxy=proxy, cache=DIR_CACHE)
+        child_entry = _get_inode(datastore_id, child_uuid, child_type, data_pubkey, drivers, device_ids, config_path=CONFIG_PATH, proxy=proxy, cache=cache)
         if 'error' in child_entry:
             log.error("Failed to get inode {} at {}: {}".format(child_uuid, prefix + name, child_entry['error']))
             return {'error': child_entry['error'], 'errno': errno.EIO}
@@ -2053,19 +2284,18 @@ def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CON
         return {'error': 'Not a directory', 'errno': errno.ENOTDIR}
 
     if child_type == MUTABLE_DATUM_DIR_TYPE or (get_idata and child_type == MUTABLE_DATUM_FILE_TYPE):
-        # get file data too 
+        # already fetched the whole inode in the walk
         assert ret.has_key(prefix + name), "BUG: missing {}".format(prefix + name) 
-        child_entry = _get_inode(datastore_id, child_uuid, child_type, data_pubkey, drivers, device_ids, config_path=CONFIG_PATH, proxy=proxy )
+        return ret
 
-    else:
-        # get only inode header.
-        # didn't request idata, so add a path entry here
-        assert not ret.has_key(prefix + name), "BUG: already defined {}".format(prefix + name)
+    # get only inode header.
+    # didn't request idata, so add a path entry here
+    assert not ret.has_key(prefix + name), "BUG: already defined {}".format(prefix + name)
 
-        path_ent = _make_path_entry(name, child_uuid, child_entry, prefix)
-        ret[prefix + name] = path_ent
+    path_ent = _make_path_entry(name, child_uuid, child_entry, prefix)
+    ret[prefix + name] = path_ent
 
-        child_entry = _get_inode_header(datastore_id, child_uuid, data_pubkey, drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
+    child_entry = _get_inode_header(datastore_id, child_uuid, data_pubkey, drivers, device_ids, config_path=config_path, proxy=proxy)
 
     if 'error' in child_entry:
         log.error("Failed to get file data for {} at {}: {}".format(child_uuid, prefix + name, child_entry['error']))
@@ -2079,6 +2309,112 @@ def _resolve_path( datastore, path, data_pubkey, get_idata=True, config_path=CON
     return ret
 
 
+def _resolve_paths( datastore, paths, data_pubkey, get_idata=True, config_path=CONFIG_PATH, proxy=None ):
+    """
+    Resolve many fully-qualified data paths at once.
+    The paths are walked together, one level at a time: once a level's
+    directories are known, all the inodes needed at the next level
+    (across all paths) are fetched concurrently, and each one only once.
+
+    Return {path: {'status': True, 'inode_info': path entry for the leaf}} on success, where the
+    path entry is as in _resolve_path().  Paths that fail map to {'error': ..., 'errno': ...}.
+    Return {'error': ..., 'errno': ...} if the root directory could not be fetched.
+    """
+
+    global DIR_CACHE
+
+    if proxy is None:
+        proxy = get_default_proxy(config_path)
+
+    if DIR_CACHE is None:
+        DIR_CACHE = InodeCache(config_path=config_path)
+
+    datastore_id = datastore_get_id(datastore['pubkey'])
+    drivers = datastore['drivers']
+    device_ids = datastore['device_ids']
+    root_uuid = datastore['root_uuid']
+
+    root_inode = _get_inode(datastore_id, root_uuid, MUTABLE_DATUM_DIR_TYPE, data_pubkey, drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
+    if 'error' in root_inode:
+        log.error("Failed to get root inode: {}".format(root_inode['error']))
+        return {'error': root_inode['error'], 'errno': errno.EIO}
+
+    ret = {}
+    dirs = {'/': root_inode['inode']}     # resolved directories, by path
+    pending = {}                            # paths not yet resolved, mapped to their components
+
+    for path in paths:
+        path_parts = posixpath.normpath(path).strip('/').split('/')
+        if path_parts == ['']:
+            ret[path] = {'status': True, 'inode_info': {'uuid': root_uuid, 'name': '', 'parent': '', 'inode': root_inode['inode']}}
+        else:
+            pending[path] = path_parts
+
+    depth = 1
+    while len(pending) > 0:
+
+        # which inodes do we need at this depth?
+        wanted = collections.OrderedDict()
+        for path, path_parts in pending.items():
+            parent_path = '/' + '/'.join(path_parts[:depth-1])
+            child_path = '/' + '/'.join(path_parts[:depth])
+            name = path_parts[depth-1]
+
+            child_dirent = dirs[parent_path]['idata'].get(name, None)
+            if child_dirent is None:
+                log.debug('No child "{}" in "{}"'.format(name, parent_path))
+                ret[path] = {'error': 'No such file or directory', 'errno': errno.ENOENT}
+                del pending[path]
+                continue
+
+            is_leaf = (depth == len(path_parts))
+            if not is_leaf and child_dirent['type'] != MUTABLE_DATUM_DIR_TYPE:
+                log.debug('Out of path at "{}" in {}'.format(child_path, path))
+                ret[path] = {'error': 'Not a directory', 'errno': errno.ENOTDIR}
+                del pending[path]
+                continue
+
+            wanted[child_path] = {
+                'uuid': child_dirent['uuid'],
+                'type': child_dirent['type'],
+                'header_only': (is_leaf and child_dirent['type'] == MUTABLE_DATUM_FILE_TYPE and not get_idata),
+                'name': name,
+                'parent': parent_path if parent_path == '/' else parent_path + '/',
+            }
+
+        # fetch them all at once
+        child_paths = wanted.keys()
+        results = _get_inodes(datastore_id, wanted.values(), data_pubkey, drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
+        fetched = dict(zip(child_paths, results))
+
+        for path, path_parts in pending.items():
+            child_path = '/' + '/'.join(path_parts[:depth])
+            res = fetched[child_path]
+            if 'error' in res:
+                log.error("Failed to get inode {} at {}: {}".format(wanted[child_path]['uuid'], child_path, res['error']))
+                ret[path] = {'error': res['error'], 'errno': errno.EIO}
+                del pending[path]
+                continue
+
+            if res['inode']['type'] != wanted[child_path]['type']:
+                log.error("Corrupt inode {} at {}".format(wanted[child_path]['uuid'], child_path))
+                ret[path] = {'error': 'Corrupt inode', 'errno': errno.EIO}
+                del pending[path]
+                continue
+
+            if depth == len(path_parts):
+                child_spec = wanted[child_path]
+                ret[path] = {'status': True, 'inode_info': _make_path_entry(child_spec['name'], child_spec['uuid'], res['inode'], child_spec['parent'])}
+                del pending[path]
+
+            else:
+                dirs[child_path] = res['inode']
+
+        depth += 1
+
+    return ret
+
+
 def _mutable_data_make_inode( inode_type, owner_address, inode_uuid, data_hash=None ):
     """
     Set up the basic properties of an inode.
@@ -2201,9 +2537,10 @@ def _parse_data_path( data_path ):
     return {'iname': name, 'parent_path': dirpath, 'data_path': path}
 
 
-def _lookup(datastore, data_path, data_pubkey, get_idata=True, config_path=CONFIG_PATH, proxy=None ):
+def _lookup(datastore, data_path, data_pubkey, get_idata=True, config_path=CONFIG_PATH, proxy=None, use_cache=True ):
     """
     Look up all the inodes along the given fully-qualified path, verifying them and ensuring that they're fresh along the way.
+    Pass use_cache=False if the inodes will be modified (see _resolve_path()).
 
     Return {'status': True, 'path_info': path info: path, 'inode_info': inode info} on success
     Return {'error': ..., 'errno': ...} on error
@@ -2219,7 +2556,7 @@ def _lookup(datastore, data_path, data_pubkey, get_idata=True, config_path=CONFI
     data_pubkey = str(data_pubkey)
 
     # find the parent directory
-    path_info = _resolve_path(datastore, data_path, data_pubkey, get_idata=get_idata, config_path=config_path, proxy=proxy )
+    path_info = _resolve_path(datastore, data_path, data_pubkey, get_idata=get_idata, config_path=config_path, proxy=proxy, use_cache=use_cache )
     if 'error' in path_info:
         log.error('Failed to resolve {}'.format(dirpath))
         return path_info
@@ -2243,7 +2580,7 @@ def datastore_mkdir(datastore, data_path, data_privkey_hex, config_path=CONFIG_P
         proxy = get_default_proxy(config_path)
 
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_id = datastore_get_id(datastore['pubkey'])
     path_info = _parse_data_path( data_path )
@@ -2258,7 +2595,7 @@ def datastore_mkdir(datastore, data_path, data_privkey_hex, config_path=CONFIG_P
     data_pubkey = get_pubkey_hex(str(data_privkey_hex))
     data_address = keylib.public_key_to_address(data_pubkey)
 
-    parent_info = _lookup(datastore, parent_path, data_pubkey, config_path=config_path, proxy=proxy )
+    parent_info = _lookup(datastore, parent_path, data_pubkey, config_path=config_path, proxy=proxy, use_cache=False )
     if 'error' in parent_info:
         log.error('Failed to resolve {}'.format(parent_path))
         return parent_info
@@ -2311,7 +2648,7 @@ def datastore_rmdir(datastore, data_path, data_privkey_hex, config_path=CONFIG_P
         proxy = get_default_proxy(config_path)
    
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_id = datastore_get_id(datastore['pubkey'])
     path_info = _parse_data_path( data_path )
@@ -2329,7 +2666,7 @@ def datastore_rmdir(datastore, data_path, data_privkey_hex, config_path=CONFIG_P
 
     log.debug("rmdir {}:{}".format(datastore_id, data_path))
 
-    dir_info = _lookup(datastore, data_path, data_pubkey, config_path=config_path, proxy=proxy )
+    dir_info = _lookup(datastore, data_path, data_pubkey, config_path=config_path, proxy=proxy, use_cache=False )
     if 'error' in dir_info:
         log.error('Failed to resolve {}'.format(data_path))
         return {'error': dir_info['error'], 'errno': errno.ENOENT}
@@ -2400,6 +2737,46 @@ def datastore_getfile(datastore, data_path, config_path=CONFIG_PATH, proxy=None
     return {'status': True, 'file': file_info['inode_info']['inode']}
 
 
+def datastore_getfiles(datastore, data_paths, config_path=CONFIG_PATH, proxy=None ):
+    """
+    Get many files, identified by their paths, in one pass.
+    The paths are resolved together (see _resolve_paths()), so shared
+    directories are fetched once and the files are fetched concurrently.
+
+    Return {'status': True, 'files': {path: {'status': True, 'file': inode and data} or {'error': ..., 'errno': ...}}}
+    Return {'error': ..., 'errno': ...} on error
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy(config_path)
+
+    datastore_id = datastore_get_id(datastore['pubkey'])
+
+    log.debug("getfiles {}:{}".format(datastore_id, ','.join(data_paths)))
+
+    res = _resolve_paths(datastore, data_paths, str(datastore['pubkey']), config_path=config_path, proxy=proxy )
+    if 'error' in res:
+        log.error("Failed to resolve {}".format(','.join(data_paths)))
+        return res
+
+    files = {}
+    for data_path in data_paths:
+        file_info = res[data_path]
+        if 'error' in file_info:
+            log.error("Failed to resolve {}".format(data_path))
+            files[data_path] = file_info
+            continue
+
+        if file_info['inode_info']['inode']['type'] != MUTABLE_DATUM_FILE_TYPE:
+            log.error("Not a file: {}".format(data_path))
+            files[data_path] = {'error': 'Not a file', 'errno': errno.EISDIR}
+            continue
+
+        files[data_path] = {'status': True, 'file': file_info['inode_info']['inode']}
+
+    return {'status': True, 'files': files}
+
+
 def datastore_listdir(datastore, data_path, config_path=CONFIG_PATH, proxy=None ):
     """
     Get a file identified by a path.
@@ -2444,7 +2821,7 @@ def datastore_putfile(datastore, data_path, file_data, data_privkey_hex, create=
         proxy = get_default_proxy(config_path)
  
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_id = datastore_get_id(datastore['pubkey'])
     path_info = _parse_data_path( data_path )
@@ -2461,7 +2838,7 @@ def datastore_putfile(datastore, data_path, file_data, data_privkey_hex, create=
     log.debug("putfile {}:{}".format(datastore_id, data_path))
 
     # make sure the file doesn't exist
-    parent_path_info = _lookup(datastore, parent_dirpath, data_pubkey, config_path=config_path, proxy=proxy )
+    parent_path_info = _lookup(datastore, parent_dirpath, data_pubkey, config_path=config_path, proxy=proxy, use_cache=False )
     if 'error' in parent_path_info:
         log.error("Failed to resolve {}".format(data_path))
         return parent_path_info
@@ -2511,7 +2888,7 @@ def datastore_deletefile(datastore, data_path, data_privkey_hex, config_path=CON
         proxy = get_default_proxy(config_path=config_path)
  
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_id = datastore_get_id(datastore['pubkey'])
     path_info = _parse_data_path( data_path )
@@ -2526,7 +2903,7 @@ def datastore_deletefile(datastore, data_path, data_privkey_hex, config_path=CON
 
     log.debug("deletefile {}:{}".format(datastore_id, data_path))
 
-    file_path_info = _lookup( datastore, data_path, data_pubkey, get_idata=False, config_path=config_path, proxy=proxy )
+    file_path_info = _lookup( datastore, data_path, data_pubkey, get_idata=False, config_path=config_path, proxy=proxy, use_cache=False )
     if 'error' in file_path_info:
         log.error('Failed to resolve {}'.format(data_path))
         return file_path_info
@@ -2586,6 +2963,40 @@ def datastore_stat(datastore, data_path, config_path=CONFIG_PATH, proxy=None ):
     return {'status': True, 'inode': inode_info['inode_info']['inode']}
 
 
+def datastore_stat_many(datastore, data_paths, config_path=CONFIG_PATH, proxy=None ):
+    """
+    Stat many files and directories in one pass.  Get just their inode metadata.
+    The paths are resolved together (see _resolve_paths()).
+
+    Return {'status': True, 'inodes': {path: {'status': True, 'inode': inode info} or {'error': ..., 'errno': ...}}}
+    Return {'error': ..., 'errno': ...} on error
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy(config_path=config_path)
+
+    datastore_id = datastore_get_id(datastore['pubkey'])
+
+    log.debug("stat_many {}:{}".format(datastore_id, ','.join(data_paths)))
+
+    res = _resolve_paths(datastore, data_paths, str(datastore['pubkey']), get_idata=False, config_path=config_path, proxy=proxy )
+    if 'error' in res:
+        log.error("Failed to resolve {}".format(','.join(data_paths)))
+        return res
+
+    inodes = {}
+    for data_path in data_paths:
+        inode_info = res[data_path]
+        if 'error' in inode_info:
+            log.error("Failed to resolve {}".format(data_path))
+            inodes[data_path] = inode_info
+            continue
+
+        inodes[data_path] = {'status': True, 'inode': inode_info['inode_info']['inode']}
+
+    return {'status': True, 'inodes': inodes}
+
+
 def datastore_rmtree(datastore, data_path, data_privkey_hex, config_path=CONFIG_PATH, proxy=None):
     """
     Remove a directory tree and all its children.
@@ -2599,7 +3010,7 @@ def datastore_rmtree(datastore, data_path, data_privkey_hex, config_path=CONFIG_
         proxy = get_default_proxy(config_path=config_path)
  
     if DIR_CACHE is None:
-        DIR_CACHE = InodeCache()
+        DIR_CACHE = InodeCache(config_path=config_path)
 
     datastore_id = datastore_get_id(datastore['pubkey'])
     path_info = _parse_data_path( data_path )
@@ -2610,9 +3021,7 @@ def datastore_rmtree(datastore, data_path, data_privkey_hex, config_path=CONFIG_
     drivers = datastore['drivers']
     device_ids = datastore['device_ids']
 
-    inode_stack = []        # stack of {'type': ..., 'inode': ...}
-
-    dir_path_info = _lookup( datastore, data_path, data_pubkey_hex, config_path=config_path, proxy=proxy )
+    dir_path_info = _lookup( datastore, data_path, data_pubkey_hex, config_path=config_path, proxy=proxy, use_cache=False )
     if 'error' in dir_path_info:
         log.error('Failed to resolve {}'.format(data_path))
         return dir_path_info
@@ -2626,95 +3035,44 @@ def datastore_rmtree(datastore, data_path, data_privkey_hex, config_path=CONFIG_
         # file.  remove 
         return datastore_deletefile(datastore, data_path, data_privkey_hex, config_path=config_path, proxy=proxy)
 
-    
-    def _stack_push( dirents, stack ):
-        """
-        add files and directories to the deletion stack
-        Return {'status': True, 'stack': stack, 'num_added': ...}
-        """
-        # push files
-        for dirent_name, dirent_data in dirents.items():
-            d_type = dirent_data['type']
-            d_uuid = dirent_data['uuid']
-            
-            stack_ent = {'type': d_type, 'uuid': d_uuid, 'searched': False}
-
-            if d_type == MUTABLE_DATUM_FILE_TYPE:
-                stack.append( stack_ent )
-
-        # push directories 
-        for dirent_name, dirent_data in dirents.items():
-            d_type = dirent_data['type']
-            d_uuid = dirent_data['uuid']
+    # find everything under this directory, one level at a time,
+    # fetching each level's directories concurrently
+    levels = []         # list of (file uuids, directory uuids), one per level
+    dirents = dir_inode['idata'].values()
 
-            stack_ent = {'type': d_type, 'uuid': d_uuid, 'searched': False}
+    while len(dirents) > 0:
+        file_uuids = [d['uuid'] for d in dirents if d['type'] == MUTABLE_DATUM_FILE_TYPE]
+        dir_uuids = [d['uuid'] for d in dirents if d['type'] == MUTABLE_DATUM_DIR_TYPE]
+        levels.append( (file_uuids, dir_uuids) )
 
-            if d_type == MUTABLE_DATUM_DIR_TYPE:
-                stack.append( stack_ent )
+        log.debug("Search {}".format(','.join(dir_uuids)))
 
-        return {'status': True, 'stack': stack, 'num_added': len(dirents)}
-
-
-    def _search( dir_inode_uuid, stack ):
-        """
-        Search a path for entries to remove.
-        Push files onto the stack, and then directories.
-        Return {'status': True, 'stack': stack, 'num_added': ...} on success
-        Return {'error': ...} on error
-        """
-        log.debug("Search {}".format(dir_inode_uuid))
+        # bypass the cache, so we see every child that is there now
+        inode_specs = [{'uuid': d_uuid, 'type': MUTABLE_DATUM_DIR_TYPE, 'header_only': False, 'uncached': True} for d_uuid in dir_uuids]
+        results = _get_inodes(datastore_id, inode_specs, str(data_pubkey_hex), drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
 
-        res = _get_inode(datastore_id, dir_inode_uuid, MUTABLE_DATUM_DIR_TYPE, str(data_pubkey_hex), drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
-        if 'error' in res:
-            return res
-        
-        if res['inode']['type'] == MUTABLE_DATUM_FILE_TYPE:
-            return {'status': True, 'stack': stack, 'num_added': 0}
-
-        dirents = res['inode']['idata']
-
-        return _stack_push( dirents, stack )
-
-    
-    inode_stack = []
-    res = _stack_push( dir_inode['idata'], inode_stack )
-    inode_stack = res['stack']
-
-    while len(inode_stack) > 0:
-
-        # next entry to delete 
-        inode_info = inode_stack[-1]
-
-        if inode_info['type'] == MUTABLE_DATUM_FILE_TYPE:
-            # files can be deleted immediately 
-            log.debug("Delete file {}".format(inode_info['uuid']))
-            res = _delete_inode(datastore_id, inode_info['uuid'], str(data_privkey_hex), drivers, device_ids, config_path=config_path, proxy=proxy )
+        dirents = []
+        for res in results:
             if 'error' in res:
                 return res
 
-            # done 
-            inode_stack.pop()
+            if res['inode']['type'] == MUTABLE_DATUM_DIR_TYPE:
+                dirents += res['inode']['idata'].values()
 
-        else:
-            # already explored?
-            if inode_info['searched']:
-                # already explored this directory.  Can remove now
-                log.debug("Delete directory {}".format(inode_info['uuid']))
-                res = _delete_inode(datastore_id, inode_info['uuid'], str(data_privkey_hex), drivers, device_ids, config_path=config_path, proxy=proxy, cache=DIR_CACHE)
-                if 'error' in res:
-                    return res
+    def _delete( inode_info ):
+        log.debug("Delete {} {}".format('directory' if inode_info['type'] == MUTABLE_DATUM_DIR_TYPE else 'file', inode_info['uuid']))
+        cache = DIR_CACHE if inode_info['type'] == MUTABLE_DATUM_DIR_TYPE else None
+        return _delete_inode(datastore_id, inode_info['uuid'], str(data_privkey_hex), drivers, device_ids, config_path=config_path, proxy=proxy, cache=cache)
 
-                # done
-                inode_stack.pop()
+    # delete deepest levels first, so directories are only removed once their children are.
+    # each level's inodes are deleted concurrently.
+    for (file_uuids, dir_uuids) in reversed(levels):
+        inode_infos = [{'type': MUTABLE_DATUM_FILE_TYPE, 'uuid': f_uuid} for f_uuid in file_uuids] + \
+                      [{'type': MUTABLE_DATUM_DIR_TYPE, 'uuid': d_uuid} for d_uuid in dir_uuids]
 
-            else:
-                # explore directories.  Only remove empty ones.
-                inode_stack[-1]['searched'] = True
-                res = _search(inode_info['uuid'], inode_stack)
-                if 'error' in res:
-                    return res
-
-                inode_stack = res['stack']
+        for res in _datastore_map( _delete, inode_infos ):
+            if 'error' in res:
+                return res
 
     # clear this inode's children
     dir_inode_info = _mutable_data_make_dir( data_address, dir_uuid, {} )
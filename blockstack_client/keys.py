@@ -26,6 +26,7 @@ from binascii import hexlify
 import collections
 import json
 import traceback
+import threading
 
 import keylib
 from keylib import ECPrivateKey, ECPublicKey
@@ -65,7 +66,7 @@ from jsonschema.exceptions import ValidationError
 from utilitybelt import is_hex
 
 from .config import get_logger
-from .constants import CONFIG_PATH, BLOCKSTACK_DEBUG, BLOCKSTACK_TEST
+from .constants import CONFIG_PATH, BLOCKSTACK_DEBUG, BLOCKSTACK_TEST, VERIFIED_SIGNATURE_CACHE_SIZE
 
 log = get_logger()
 
@@ -74,6 +75,56 @@ log = get_logger()
 KEY_CACHE = {}
 KEYCHAIN_CACHE = {}
 
+
+class VerifiedSignatureCache(object):
+    """
+    LRU set of signature checks known to have passed,
+    so verifying the same data again is a lookup.
+    Keys must cover the public key (or address), a hash of
+    the signed data, and the signature.  Only successful
+    verifications are remembered.
+    Thread-safe.
+    """
+    def __init__(self, capacity=VERIFIED_SIGNATURE_CACHE_SIZE):
+        self.capacity = capacity
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the value stored with a verified key.
+        Return None if not present
+        """
+        with self.lock:
+            value = self.cache.pop(key, None)
+            if value is not None:
+                self.cache[key] = value
+
+            return value
+
+    def put(self, key, value=True):
+        """
+        Remember a verified key (and an optional value)
+        """
+        with self.lock:
+            if self.cache.pop(key, None) is None and len(self.cache) >= self.capacity:
+                self.cache.popitem(last=False)
+
+            self.cache[key] = value
+
+
+# signatures we have already verified
+VERIFIED_SIGNATURES = VerifiedSignatureCache()
+
+
+def get_verified_signature_cache():
+    """
+    Get the process-wide cache of verified signatures
+    """
+    global VERIFIED_SIGNATURES
+    return VERIFIED_SIGNATURES
+
+
 class HDWallet(object):
     """
     Initialize a hierarchical deterministic wallet with
@@ -896,9 +947,17 @@ def verify_raw_data(raw_data, pubkey_hex, sigb64):
     Return True on success.
     Return False on error.
     """
+    raw_data_bin = raw_data.encode('utf-8') if isinstance(raw_data, unicode) else raw_data
+    cache_key = ('raw', str(pubkey_hex), hashlib.sha256(raw_data_bin).digest(), str(sigb64))
+    if get_verified_signature_cache().get(cache_key):
+        return True
+
     sig_r, sig_s = decode_signature(sigb64)
     pubk_i = decode_pubkey_hex(pubkey_hex)
     res = fastecdsa.ecdsa.verify((sig_r, sig_s), raw_data, pubk_i, curve=fastecdsa.curve.secp256k1)
+    if res:
+        get_verified_signature_cache().put(cache_key)
+
     return res
 
 
@@ -923,6 +982,10 @@ def verify_digest( digest_hex, pubkey_hex, sigb64, curve=fastecdsa.curve.secp256
     Return True if it matches
     """
 
+    cache_key = ('digest', curve.name, str(pubkey_hex), str(digest_hex), str(sigb64))
+    if get_verified_signature_cache().get(cache_key):
+        return True
+
     Q = decode_pubkey_hex(str(pubkey_hex))
     r, s = decode_signature(sigb64)
 
@@ -935,6 +998,10 @@ def verify_digest( digest_hex, pubkey_hex, sigb64, curve=fastecdsa.curve.secp256
         raise fastecdsa.ecdsa.EcdsaError('Invalid Signature: s is not a positive integer smaller than the curve order')
 
     qx, qy = Q
-    return _ecdsa.verify(str(r), str(s), digest_hex, str(qx), str(qy), curve.name)
+    res = _ecdsa.verify(str(r), str(s), digest_hex, str(qx), str(qy), curve.name)
+    if res:
+        get_verified_signature_cache().put(cache_key)
+
+    return res
 
 
@@ -28,9 +28,7 @@ import json
 import traceback
 import os
 import random
-from xmlrpclib import ServerProxy, Transport
 from defusedxml import xmlrpc
-import httplib
 import base64
 import jsonschema
 from jsonschema.exceptions import ValidationError
@@ -42,6 +40,8 @@ xmlrpc.monkey_patch()
 import storage
 import scripts
 
+from .connection_pool import TimeoutServerProxy, get_connection_pool
+
 from .constants import (
     MAX_RPC_LEN, CONFIG_PATH, BLOCKSTACK_TEST
 )
@@ -62,46 +62,6 @@ log = get_logger('blockstack-client')
 
 BLOCKSTACK_CLIENT_TEST_ALTERNATIVE_CONFIG = os.environ.get('BLOCKSTACK_CLIENT_TEST_ALTERNATIVE_CONFIG', None)
 
-class TimeoutHTTPConnection(httplib.HTTPConnection):
-    """
-    borrowed with gratitude from Justin Cappos
-    https://seattle.poly.edu/browser/seattle/trunk/demokit/timeout_xmlrpclib.py?rev=692
-    """
-    def connect(self):
-        httplib.HTTPConnection.connect(self)
-        self.sock.settimeout(self.timeout)
-
-
-class TimeoutHTTP(httplib.HTTP):
-    _connection_class = TimeoutHTTPConnection
-
-    def set_timeout(self, timeout):
-        self._conn.timeout = timeout
-
-    def getresponse(self, **kw):
-        return self._conn.getresponse(**kw)
-
-
-class TimeoutTransport(Transport):
-    def __init__(self, *l, **kw):
-        self.timeout = kw.pop('timeout', 10)
-        Transport.__init__(self, *l, **kw)
-
-    def make_connection(self, host):
-        conn = TimeoutHTTP(host)
-        conn.set_timeout(self.timeout)
-
-        return conn
-
-
-class TimeoutServerProxy(ServerProxy):
-    def __init__(self, uri, *l, **kw):
-        timeout = kw.pop('timeout', 10)
-        use_datetime = kw.get('use_datetime', 0)
-        kw['transport'] = TimeoutTransport(timeout=timeout, use_datetime=use_datetime)
-        ServerProxy.__init__(self, uri, *l, **kw)
-
-
 # default API endpoint proxy to blockstackd
 default_proxy = None
 
@@ -196,6 +156,13 @@ def set_default_proxy(proxy):
     default_proxy = proxy
 
 
+def get_rpc_connection_stats():
+    """
+    Get the keep-alive connection pool counters for RPC clients in this process
+    """
+    return get_connection_pool().get_stats()
+
+
 def json_is_error(resp):
     """
     Is the given response object
@@ -1166,7 +1133,7 @@ def get_name_blockchain_history(name, start_block, end_block, proxy=None):
 
     ret = {}
     for qb in query_blocks:
-        name_at = get_name_at(name, qb)
+        name_at = get_name_at(name, qb, proxy=proxy)
         if json_is_error(name_at):
             # error
             return name_at
@@ -1448,6 +1415,96 @@ def get_nameops_at(block_id, proxy=None):
     return sorted(nameops, key=lambda n: n['vtxindex'])
 
 
+def get_nameops_in_range(start_block, end_block, proxy=None):
+    """
+    Get all the name operations that happened in the blocks
+    [start_block, end_block], as they were written.
+    This is a generator: it fetches the range from the server a few
+    blocks at a time, and yields (block_id, [operations ordered by transaction index])
+    for each block with at least one operation, in block order.
+    The operations are the same as get_nameops_at() returns, except
+    that they do not include their 'history'.
+
+    On error, yields {'error': ...} and stops.
+    """
+    nameop_schema = {
+        'type': 'object',
+        'properties': OP_HISTORY_SCHEMA['properties'],
+        'required': [
+            'op',
+            'opcode',
+            'txid',
+            'vtxindex',
+        ]
+    }
+
+    nameops_range_schema = {
+        'type': 'object',
+        'properties': {
+            'blocks': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'block_id': {
+                            'type': 'integer',
+                        },
+                        'nameops': {
+                            'type': 'array',
+                            'items': nameop_schema,
+                        },
+                    },
+                    'required': [
+                        'block_id',
+                        'nameops',
+                    ],
+                },
+            },
+            'next_block': {
+                'type': 'integer',
+            },
+        },
+        'required': [
+            'blocks',
+            'next_block',
+        ],
+    }
+
+    resp_schema = json_response_schema( nameops_range_schema )
+
+    proxy = get_default_proxy() if proxy is None else proxy
+
+    next_block = start_block
+    while next_block <= end_block:
+        resp = {}
+        try:
+            resp = proxy.get_nameops_in_range(next_block, end_block)
+            resp = json_validate(resp_schema, resp)
+            if json_is_error(resp):
+                yield resp
+                return
+
+            if resp['next_block'] <= next_block:
+                yield {'error': 'Server did not make progress at block {}'.format(next_block)}
+                return
+
+        except ValidationError as e:
+            log.exception(e)
+            yield json_traceback(resp.get('error'))
+            return
+
+        except Exception as ee:
+            log.exception(ee)
+            yield {'error': 'Failed to contact Blockstack node.  Try again with `--debug`.'}
+            return
+
+        for block_info in resp['blocks']:
+            log.debug('{} nameops at {}'.format(len(block_info['nameops']), block_info['block_id']))
+            yield (block_info['block_id'], sorted(block_info['nameops'], key=lambda n: n['vtxindex']))
+
+        next_block = resp['next_block']
+
+
 def get_nameops_hash_at(block_id, proxy=None):
     """
     Get the hash of a set of records as they were at a particular block.
@@ -1722,6 +1779,90 @@ def get_zonefile_inventory(hostport, bit_offset, bit_count, timeout=30, my_hostp
     return zf_inv
 
 
+def get_zonefile_inventory_delta(hostport, epoch, seq, timeout=30, my_hostport=None, proxy=None):
+    """
+    Get the changes to an atlas peer's zonefile inventory since
+    change number `seq` of its change log `epoch`.
+    Return {'status': True, 'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': False, 'set': [...], 'cleared': [...]} on success.
+    Return {'status': True, 'epoch': ..., 'seq': ..., 'inv_length': ..., 'full': True} if the peer can't say what changed
+    (fetch its whole inventory instead).
+    Return {'error': ...} on error
+    """
+
+    delta_schema = {
+        'type': 'object',
+        'properties': {
+            'epoch': {
+                'type': 'string',
+                'pattern': '^[0-9a-f]{16}$',
+            },
+            'seq': {
+                'type': 'integer',
+                'minimum': 0,
+            },
+            'inv_length': {
+                'type': 'integer',
+                'minimum': 0,
+            },
+            'full': {
+                'type': 'boolean',
+            },
+            'set': {
+                'type': 'array',
+                'items': {
+                    'type': 'integer',
+                    'minimum': 0,
+                },
+            },
+            'cleared': {
+                'type': 'array',
+                'items': {
+                    'type': 'integer',
+                    'minimum': 0,
+                },
+            },
+        },
+        'required': [
+            'epoch',
+            'seq',
+            'inv_length',
+            'full',
+        ]
+    }
+
+    schema = json_response_schema( delta_schema )
+
+    if proxy is None:
+        host, port = url_to_host_port(hostport)
+        assert host is not None and port is not None
+        proxy = BlockstackRPCClient(host, port, timeout=timeout, src=my_hostport)
+
+    delta = None
+    try:
+        delta = proxy.get_zonefile_inventory_delta(epoch, seq)
+        delta = json_validate(schema, delta)
+        if json_is_error(delta):
+            return delta
+
+        if not delta['full']:
+            assert 'set' in delta and 'cleared' in delta, 'Missing inventory changes'
+
+            # changed bits must be in the inventory
+            for bit_index in delta['set'] + delta['cleared']:
+                assert bit_index < delta['inv_length'] * 8, 'Changed bit {} is out of range'.format(bit_index)
+
+    except (ValidationError, AssertionError) as e:
+        log.exception(e)
+        delta = {'error': 'Failed to fetch and parse zonefile inventory delta'}
+
+    except Exception as ee:
+        log.exception(ee)
+        resp = {'error': 'Failed to contact Blockstack node.  Try again with `--debug`.'}
+        return resp
+
+    return delta
+
+
 def get_atlas_peers(hostport, timeout=30, my_hostport=None, proxy=None):
     """
     Get an atlas peer's neighbors.
@@ -33,6 +33,9 @@ import urllib
 import urllib2
 import base64
 import posixpath
+import time
+import threading
+import Queue
 
 import blockstack_zones
 
@@ -41,9 +44,13 @@ from binascii import hexlify
 from keylib import ECPrivateKey, ECPublicKey
 
 import blockstack_profiles
+import jsontokens
 
 from config import get_logger
 from constants import CONFIG_PATH, BLOCKSTACK_TEST, BLOCKSTACK_DEBUG
+from constants import STORAGE_HEDGED_READS, STORAGE_HEDGE_DELAY, STORAGE_HEDGE_MAX_DELAY
+from constants import STORAGE_LATENCY_BUCKETS, STORAGE_LATENCY_WINDOW
+from constants import STORAGE_PARALLEL_WRITES, STORAGE_WRITE_QUORUM
 from scripts import is_name_valid
 import schemas
 from keys import *
@@ -136,6 +143,367 @@ def lookup_storage_handler(handler_name):
     return None
 
 
+class StorageLatencyStats(object):
+    """
+    Per-driver read latency histograms.
+    Reads that return nothing usable are counted
+    in the overflow bucket, since to the caller they
+    are as good as a timeout.
+    Thread-safe.
+    """
+
+    def __init__(self, buckets=STORAGE_LATENCY_BUCKETS, window=STORAGE_LATENCY_WINDOW):
+        self.buckets = buckets
+        self.window = window
+        self.lock = threading.Lock()
+
+        # map driver name to list of counts (one per bucket, plus overflow)
+        self.histograms = {}
+
+
+    def record(self, driver_name, latency, success):
+        """
+        Record how long a read took, and whether or not it
+        returned verified data.
+        """
+        i = len(self.buckets)
+        if success:
+            for (j, upper) in enumerate(self.buckets):
+                if latency <= upper:
+                    i = j
+                    break
+
+        with self.lock:
+            hist = self.histograms.setdefault(driver_name, [0] * (len(self.buckets) + 1))
+            hist[i] += 1
+
+            if sum(hist) >= self.window:
+                # age out old samples
+                self.histograms[driver_name] = [c / 2 for c in hist]
+
+
+    def estimate(self, driver_name, percentile=0.5):
+        """
+        Estimate a driver's read latency at a percentile,
+        as the upper bound of the bucket it falls into.
+        Return None if we have no samples (or it always fails)
+        """
+        with self.lock:
+            hist = list(self.histograms.get(driver_name, []))
+
+        total = sum(hist)
+        if total == 0:
+            return None
+
+        seen = 0
+        for (i, count) in enumerate(hist[:-1]):
+            seen += count
+            if seen >= total * percentile:
+                return self.buckets[i]
+
+        return None
+
+
+    def order(self, driver_names):
+        """
+        Sort driver names by median latency, fastest first.
+        Drivers we have no samples for go first, so we learn about them;
+        drivers that mostly fail go last.  Ties keep the given order.
+        """
+        def _key(driver_name):
+            with self.lock:
+                have_samples = sum(self.histograms.get(driver_name, [])) > 0
+
+            if not have_samples:
+                return 0
+
+            median = self.estimate(driver_name)
+            if median is None:
+                return float('inf')
+
+            return median
+
+        return sorted(driver_names, key=_key)
+
+
+    def hedge_delay(self, driver_name):
+        """
+        How long to wait on a driver before also asking the next one
+        """
+        p90 = self.estimate(driver_name, 0.9)
+        if p90 is None:
+            return STORAGE_HEDGE_DELAY
+
+        return min(p90, STORAGE_HEDGE_MAX_DELAY)
+
+
+    def get_stats(self):
+        """
+        Get a copy of the histograms
+        """
+        with self.lock:
+            return dict([(name, list(hist)) for (name, hist) in self.histograms.items()])
+
+
+# read latency, per storage driver
+storage_latency_stats = StorageLatencyStats()
+
+
+def get_storage_latency_stats():
+    """
+    Get the per-driver read latency histograms
+    """
+    global storage_latency_stats
+    return storage_latency_stats
+
+
+def storage_read(attempts, hedged=STORAGE_HEDGED_READS):
+    """
+    Run a list of (driver name, read callable) attempts, and return
+    the first non-None result.  Each callable must return verified
+    data, or None.
+
+    Attempts are made in order of each driver's observed latency.
+    If hedged is True, attempts overlap: if a driver has not answered
+    within its usual (90th percentile) latency, the next one is started
+    as well, and whichever verifies first wins.  Slower attempts are
+    left to finish in the background; their results are ignored.
+
+    Return the data on success
+    Return None if no attempt succeeded
+    """
+    stats = get_storage_latency_stats()
+
+    driver_names = []
+    for (driver_name, _) in attempts:
+        if driver_name not in driver_names:
+            driver_names.append(driver_name)
+
+    order = stats.order(driver_names)
+    attempts = sorted(attempts, key=lambda a: order.index(a[0]))
+
+    def _attempt(driver_name, read_func):
+        start = time.time()
+        data = None
+        try:
+            data = read_func()
+        except Exception as e:
+            log.exception(e)
+            data = None
+
+        stats.record(driver_name, time.time() - start, data is not None)
+        return data
+
+    if not hedged or len(attempts) <= 1:
+        for (driver_name, read_func) in attempts:
+            data = _attempt(driver_name, read_func)
+            if data is not None:
+                return data
+
+        return None
+
+    results = Queue.Queue()
+
+    def _run(driver_name, read_func):
+        results.put(_attempt(driver_name, read_func))
+
+    pending = 0
+    next_attempt = 0
+    while next_attempt < len(attempts) or pending > 0:
+        delay = None
+        if next_attempt < len(attempts):
+            driver_name, read_func = attempts[next_attempt]
+            next_attempt += 1
+
+            t = threading.Thread(target=_run, args=(driver_name, read_func), name='storage read {}'.format(driver_name))
+            t.daemon = True
+            t.start()
+            pending += 1
+
+            delay = stats.hedge_delay(driver_name)
+            if next_attempt >= len(attempts):
+                delay = None
+
+        try:
+            data = results.get(True, delay)
+        except Queue.Empty:
+            # slow driver; hedge with the next one
+            continue
+
+        pending -= 1
+        if data is not None:
+            return data
+
+    return None
+
+
+class StorageWriteSerializer(object):
+    """
+    Serialize writes to the same data on the same storage driver.
+
+    Since storage_replicate() can return while writes are still in flight,
+    a slow write could otherwise land after a newer write to the same data,
+    and clobber it.  Each write to a (driver name, data ID) is numbered when
+    it is issued; writes to the same key run one at a time, and a write that
+    is superseded by a newer one before it starts is dropped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = {}      # (driver name, data ID) => {'lock': ..., 'latest': ..., 'refs': ...}
+
+
+    def begin(self, key):
+        """
+        Issue a write to a key.
+        Return its sequence number, to pass to run()
+        """
+        with self.lock:
+            entry = self.keys.get(key)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'latest': 0, 'refs': 0}
+                self.keys[key] = entry
+
+            entry['latest'] += 1
+            entry['refs'] += 1
+            return entry['latest']
+
+
+    def run(self, key, seq, write_func):
+        """
+        Run an issued write, once the writes ahead of it are done.
+        Return write_func()'s result
+        Return None if a newer write to the key was issued in the meantime.
+        """
+        with self.lock:
+            entry = self.keys[key]
+
+        try:
+            with entry['lock']:
+                with self.lock:
+                    superseded = (seq < entry['latest'])
+
+                if superseded:
+                    return None
+
+                return write_func()
+
+        finally:
+            with self.lock:
+                entry['refs'] -= 1
+                if entry['refs'] == 0:
+                    del self.keys[key]
+
+
+storage_write_serializer = StorageWriteSerializer()
+
+
+def storage_replicate(writes, required, quorum=STORAGE_WRITE_QUORUM, parallel=STORAGE_PARALLEL_WRITES, data_id=None):
+    """
+    Run a list of (driver name, write callable) attempts.  Each callable
+    returns True if the driver acknowledged the write.
+
+    The write succeeds once every driver in required that is being written to,
+    and at least quorum drivers in total (or all of them, if there are fewer),
+    have acknowledged it.  It fails as soon as a required driver fails, or
+    once the quorum can no longer be reached.
+
+    If parallel is True, all writes start at once, and we return as soon
+    as the outcome is known.  The remaining writes carry on in the
+    background (in non-daemon threads, so they finish before the process
+    exits) and log their results.
+
+    If data_id is given, the writes are ordered with other writes to data_id
+    through storage_write_serializer, so a straggler never overwrites newer data.
+    A write that gets superseded this way counts as failed.
+
+    Return True on success
+    Return False on error
+    """
+    quorum = max(1, min(quorum, len(writes)))
+    pending_required = set([name for (name, _) in writes if name in required])
+
+    seqs = {}
+    if data_id is not None and parallel:
+        # claim our places in line before any write starts
+        seqs = dict([(name, storage_write_serializer.begin((name, data_id))) for (name, _) in writes])
+
+    def _attempt(driver_name, write_func):
+        rc = False
+        try:
+            log.debug('Try "{}"'.format(driver_name))
+            if data_id is not None:
+                seq = seqs.get(driver_name)
+                if seq is None:
+                    seq = storage_write_serializer.begin((driver_name, data_id))
+
+                rc = storage_write_serializer.run((driver_name, data_id), seq, write_func)
+                if rc is None:
+                    log.debug('Write to "{}" with "{}" superseded by a newer write'.format(data_id, driver_name))
+                    rc = False
+
+            else:
+                rc = write_func()
+
+        except Exception as e:
+            log.exception(e)
+            rc = False
+
+        if rc:
+            log.debug('Replication succeeded with "{}"'.format(driver_name))
+        elif driver_name in required:
+            log.error('Failed to replicate with required storage provider "{}"'.format(driver_name))
+        else:
+            log.debug('Failed to replicate with "{}"'.format(driver_name))
+
+        return bool(rc)
+
+    if len(writes) == 0:
+        return False
+
+    if not parallel:
+        successes = 0
+        for (driver_name, write_func) in writes:
+            if _attempt(driver_name, write_func):
+                successes += 1
+            elif driver_name in required:
+                return False
+
+        return successes >= quorum
+
+    results = Queue.Queue()
+
+    def _run(driver_name, write_func):
+        results.put((driver_name, _attempt(driver_name, write_func)))
+
+    for (driver_name, write_func) in writes:
+        t = threading.Thread(target=_run, args=(driver_name, write_func), name='storage write {}'.format(driver_name))
+        t.start()
+
+    successes = 0
+    for i in xrange(0, len(writes)):
+        driver_name, rc = results.get()
+        remaining = len(writes) - i - 1
+
+        if rc:
+            successes += 1
+            pending_required.discard(driver_name)
+
+        elif driver_name in required:
+            return False
+
+        if len(pending_required) == 0 and successes >= quorum:
+            if remaining > 0:
+                log.debug('Write quorum reached; {} replica(s) still in flight'.format(remaining))
+
+            return True
+
+        if successes + remaining < quorum:
+            return False
+
+    return False
+
+
 def make_mutable_data_urls(data_id, use_only=None):
     """
     Given a data ID for mutable data, get a list of URLs to it
@@ -319,11 +687,45 @@ def parse_mutable_data(mutable_data_json_txt, public_key, public_key_hash=None,
 
     mutable_data_json = None
 
+    # the tokens carry their own signatures, so a hash of the text covers them
+    data_digest = hashlib.sha256(mutable_data_json_txt.encode('utf-8') if isinstance(mutable_data_json_txt, unicode) else mutable_data_json_txt).digest()
+
+    def _verify_tokens(key):
+        """
+        Verify the tokens with a public key or address.
+        Only the positions of the tokens that verified are remembered,
+        so a cache hit decodes those tokens again without verifying them.
+        Return the parsed data (possibly empty)
+        """
+        if not isinstance(mutable_data_jwt, list):
+            return blockstack_profiles.get_profile_from_tokens(mutable_data_jwt, key)
+
+        cache_key = ('tokens', key, data_digest)
+        verified_indexes = get_verified_signature_cache().get(cache_key)
+        if verified_indexes is not None:
+            verified_json = {}
+            for i in verified_indexes:
+                verified_json.update(jsontokens.decode_token(mutable_data_jwt[i]['token'])['payload']['claim'])
+
+            return verified_json
+
+        # same as get_profile_from_tokens(mutable_data_jwt, key), but one token at a time
+        verified_json = {}
+        verified_indexes = []
+        for (i, token_record) in enumerate(mutable_data_jwt):
+            claim = blockstack_profiles.get_profile_from_tokens([token_record], key)
+            if len(claim) > 0:
+                verified_json.update(claim)
+                verified_indexes.append(i)
+
+        if len(verified_indexes) > 0:
+            get_verified_signature_cache().put(cache_key, tuple(verified_indexes))
+
+        return verified_json
+
     # try pubkey, if given
     if public_key is not None:
-        mutable_data_json = blockstack_profiles.get_profile_from_tokens(
-            mutable_data_jwt, str(public_key)
-        )
+        mutable_data_json = _verify_tokens(str(public_key))
 
         if len(mutable_data_json) > 0:
             return mutable_data_json
@@ -342,9 +744,7 @@ def parse_mutable_data(mutable_data_json_txt, public_key, public_key_hash=None,
             version_byte=0
         )
 
-        mutable_data_json = blockstack_profiles.get_profile_from_tokens(
-            mutable_data_jwt, public_key_hash_0
-        )
+        mutable_data_json = _verify_tokens(public_key_hash_0)
 
         if len(mutable_data_json) > 0:
             log.debug('Verified with {}'.format(public_key_hash))
@@ -394,7 +794,7 @@ def register_storage(storage_impl):
 
 
 def get_immutable_data(data_hash, data_url=None, hash_func=get_data_hash, fqu=None,
-                       data_id=None, zonefile=False, drivers=None):
+                       data_id=None, zonefile=False, drivers=None, hedged=STORAGE_HEDGED_READS):
     """
     Given the hash of the data, go through the list of
     immutable data handlers and look it up.
@@ -402,6 +802,8 @@ def get_immutable_data(data_hash, data_url=None, hash_func=get_data_hash, fqu=No
     Optionally pass the fully-qualified name (@fqu), human-readable data ID (data_id),
     and whether or not this is a zonefile request (zonefile) as hints to the driver.
 
+    If hedged is True, the handlers are queried concurrently (see storage_read()).
+
     Return the data (as a dict) on success.
     Return None on failure
     """
@@ -423,31 +825,41 @@ def get_immutable_data(data_hash, data_url=None, hash_func=get_data_hash, fqu=No
 
     log.debug('get_immutable {}'.format(data_hash))
 
-    for handler in [data_url] + handlers_to_use:
-        if handler is None:
-            continue
+    def _verify(data, source):
+        """
+        Return the data if it matches the hash
+        """
+        if data is None:
+            msg = 'No data: {}.get_immutable_handler({})'
+            log.debug(msg.format(source, data_hash))
+            return None
 
-        data, data_dict = None, None
+        dh = hash_func(data)
+        if dh != data_hash:
+            # nope
+            msg = 'Invalid data hash from {}'
+            log.error(msg.format(source))
+            return None
 
-        if handler == data_url:
-            # url hint
-            try:
-                # assume it's something we can urlopen
-                urlh = urllib2.urlopen(data_url)
-                data = urlh.read()
-                urlh.close()
-            except Exception as e:
-                log.exception(e)
-                msg = 'Failed to load profile from "{}"'
-                log.error(msg.format(data_url))
-                continue
-        else:
-            # handler
-            if not getattr(handler, 'get_immutable_handler', None):
-                msg = 'No method: {}.get_immutable_handler({})'
-                log.debug(msg.format(handler, data_hash))
-                continue
+        log.debug('loaded {} with {}'.format(data_hash, source))
+        return data
+
+    def _read_url():
+        # assume it's something we can urlopen
+        try:
+            urlh = urllib2.urlopen(data_url)
+            data = urlh.read()
+            urlh.close()
+        except Exception as e:
+            log.exception(e)
+            msg = 'Failed to load profile from "{}"'
+            log.error(msg.format(data_url))
+            return None
+
+        return _verify(data, '"{}"'.format(data_url))
 
+    def _make_read_handler(handler):
+        def _read_handler():
             log.debug('Try {} ({})'.format(handler.__name__, data_hash))
             try:
                 data = handler.get_immutable_handler(
@@ -457,30 +869,26 @@ def get_immutable_data(data_hash, data_url=None, hash_func=get_data_hash, fqu=No
                 log.exception(e)
                 msg = 'Method failed: {}.get_immutable_handler({})'
                 log.debug(msg.format(handler, data_hash))
-                continue
+                return None
 
-        if data is None:
-            msg = 'No data: {}.get_immutable_handler({})'
-            log.debug(msg.format(handler.__name__, data_hash))
-            continue
+            return _verify(data, handler.__name__)
 
-        # validate
-        dh = hash_func(data)
-        if dh != data_hash:
-            # nope
-            if handler == data_url:
-                msg = 'Invalid data hash from "{}"'
-                log.error(msg.format(data_url))
-            else:
-                msg = 'Invalid data hash from {}.get_immutable_handler'
-                log.error(msg.format(handler.__name__))
+        return _read_handler
+
+    attempts = []
+    if data_url is not None:
+        # url hint
+        attempts.append(('url', _read_url))
 
+    for handler in handlers_to_use:
+        if not getattr(handler, 'get_immutable_handler', None):
+            msg = 'No method: {}.get_immutable_handler({})'
+            log.debug(msg.format(handler, data_hash))
             continue
 
-        log.debug('loaded {} with {}'.format(data_hash, handler.__name__))
-        return data
+        attempts.append((handler.__name__, _make_read_handler(handler)))
 
-    return None
+    return storage_read(attempts, hedged=hedged)
 
 
 def get_file_hash( fd, hashfunc, fd_len=None ):
@@ -541,12 +949,14 @@ def get_driver_urls( fq_data_id, storage_drivers ):
 
 
 def get_mutable_data(fq_data_id, data_pubkey, urls=None, data_address=None, data_hash=None,
-                     owner_address=None, blockchain_id=None, drivers=None, decode=True):
+                     owner_address=None, blockchain_id=None, drivers=None, decode=True, hedged=STORAGE_HEDGED_READS):
     """
     Low-level call to get mutable data, given a fully-qualified data name.
     
     if decode is False, then data_pubkey, data_address, and owner_address are not needed and raw bytes will be returned.
 
+    If hedged is True, the handlers are queried concurrently (see storage_read()).
+
     Return a mutable data dict on success (or raw bytes if decode=False)
     Return None on error
     """
@@ -568,46 +978,8 @@ def get_mutable_data(fq_data_id, data_pubkey, urls=None, data_address=None, data
                 h for h in storage_handlers if h.__name__ == d
             )
 
-    log.debug('get_mutable_data {} fqu={}'.format(fq_data_id, fqu))
-    for storage_handler in handlers_to_use:
-        if not getattr(storage_handler, 'get_mutable_handler', None):
-            continue
-
-        # which URLs to attempt?
-        try_urls = []
-        if urls is None:
-            # make one on-the-fly
-            if not getattr(storage_handler, 'make_mutable_url', None):
-                msg = 'Storage handler {} does not support `{}`'
-                log.warning(msg.format(storage_handler.__name__, 'make_mutable_url'))
-                continue
-
-            new_url = None
-
-            try:
-                new_url = storage_handler.make_mutable_url(fq_data_id)
-            except Exception as e:
-                log.exception(e)
-                continue
-
-            if new_url is None:
-                log.debug("Cannot use {} to generate a URL for {}".format(storage_handler.__name__, fq_data_id))
-                continue
-
-            try_urls = [new_url]
-
-        else:
-            # find the set that this handler can manage
-            for url in urls:
-                if not getattr(storage_handler, 'handles_url', None):
-                    msg = 'Storage handler {} does not support `{}`'
-                    log.warning(msg.format(storage_handler.__name__, 'handles_url'))
-                    continue
-
-                if storage_handler.handles_url(url):
-                    try_urls.append(url)
-
-        for url in try_urls:
+    def _make_read_url(storage_handler, url):
+        def _read_url():
             data_txt, data = None, None
 
             log.debug('Try {} ({})'.format(storage_handler.__name__, url))
@@ -617,16 +989,16 @@ def get_mutable_data(fq_data_id, data_pubkey, urls=None, data_address=None, data
                 # handler doesn't handle this URL
                 msg = 'Storage handler {} does not handle URLs like {}'
                 log.debug(msg.format(storage_handler.__name__, url))
-                continue
+                return None
             except Exception as e:
                 log.exception(e)
-                continue
+                return None
 
             if data_txt is None:
                 # no data
                 msg = 'No data from {} ({})'
                 log.debug(msg.format(storage_handler.__name__, url))
-                continue
+                return None
 
             # parse it, if desired
             if decode:
@@ -644,7 +1016,7 @@ def get_mutable_data(fq_data_id, data_pubkey, urls=None, data_address=None, data
                 if data is None:
                     msg = 'Unparseable data from "{}"'
                     log.error(msg.format(url))
-                    continue
+                    return None
 
                 msg = 'Loaded "{}" with {}'
                 log.debug(msg.format(url, storage_handler.__name__))
@@ -659,7 +1031,53 @@ def get_mutable_data(fq_data_id, data_pubkey, urls=None, data_address=None, data
 
             return data
 
-    return None
+        return _read_url
+
+    log.debug('get_mutable_data {} fqu={}'.format(fq_data_id, fqu))
+
+    attempts = []
+    for storage_handler in handlers_to_use:
+        if not getattr(storage_handler, 'get_mutable_handler', None):
+            continue
+
+        # which URLs to attempt?
+        try_urls = []
+        if urls is None:
+            # make one on-the-fly
+            if not getattr(storage_handler, 'make_mutable_url', None):
+                msg = 'Storage handler {} does not support `{}`'
+                log.warning(msg.format(storage_handler.__name__, 'make_mutable_url'))
+                continue
+
+            new_url = None
+
+            try:
+                new_url = storage_handler.make_mutable_url(fq_data_id)
+            except Exception as e:
+                log.exception(e)
+                continue
+
+            if new_url is None:
+                log.debug("Cannot use {} to generate a URL for {}".format(storage_handler.__name__, fq_data_id))
+                continue
+
+            try_urls = [new_url]
+
+        else:
+            # find the set that this handler can manage
+            for url in urls:
+                if not getattr(storage_handler, 'handles_url', None):
+                    msg = 'Storage handler {} does not support `{}`'
+                    log.warning(msg.format(storage_handler.__name__, 'handles_url'))
+                    continue
+
+                if storage_handler.handles_url(url):
+                    try_urls.append(url)
+
+        for url in try_urls:
+            attempts.append((storage_handler.__name__, _make_read_url(storage_handler, url)))
+
+    return storage_read(attempts, hedged=hedged)
 
 
 def serialize_immutable_data(data_json):
@@ -671,10 +1089,12 @@ def serialize_immutable_data(data_json):
     return json.dumps(data_json, sort_keys=True)
 
 
-def put_immutable_data(data_json, txid, data_hash=None, data_text=None, required=None, skip=None):
+def put_immutable_data(data_json, txid, data_hash=None, data_text=None, required=None, skip=None,
+                       quorum=STORAGE_WRITE_QUORUM, parallel=STORAGE_PARALLEL_WRITES):
     """
     Given a string of data (which can either be data or a zonefile), store it into our immutable data stores.
-    Do so in a best-effort manner--this method only fails if *all* storage providers fail.
+    Do so in a best-effort manner--this method fails if a storage provider in required fails,
+    or if fewer than quorum storage providers succeed (see storage_replicate()).
 
     Return the hash of the data on success
     Return None on error
@@ -700,10 +1120,13 @@ def put_immutable_data(data_json, txid, data_hash=None, data_text=None, required
     else:
         data_hash = str(data_hash)
 
-    successes = 0
     msg = 'put_immutable_data({}), required={}, skip={}'
     log.debug(msg.format(data_hash, ','.join(required), ','.join(skip)))
 
+    def _make_write(handler):
+        return lambda: handler.put_immutable_handler(data_hash, data_text, txid)
+
+    writes = []
     for handler in storage_handlers:
         if handler.__name__ in skip:
             log.debug("Skipping {}".format(handler.__name__))
@@ -717,41 +1140,21 @@ def put_immutable_data(data_json, txid, data_hash=None, data_text=None, required
             log.debug("Storage provider {} is required but does not allow immutable storage".format(handler.__name__))
             return None
 
-        rc = False
+        writes.append((handler.__name__, _make_write(handler)))
 
-        try:
-            log.debug('Try "{}"'.format(handler.__name__))
-            rc = handler.put_immutable_handler(data_hash, data_text, txid)
-        except Exception as e:
-            log.exception(e)
-            if handler.__name__ not in required:
-                continue
-
-            # fatal
-            log.debug("Failed to replicate to required storage provider {}".format(handler.__name__))
-            return None
-
-        if not rc:
-            log.debug('Failed to replicate with "{}"'.format(handler.__name__))
-            if handler.__name__ not in required:
-                continue
-
-            # fatal
-            return None
-
-        else:
-            log.debug('Replication succeeded with "{}"'.format(handler.__name__))
-            successes += 1
+    # failed everywhere or on a required driver, or succeeded on enough of them
+    if not storage_replicate(writes, required, quorum=quorum, parallel=parallel, data_id=data_hash):
+        return None
 
-    # failed everywhere or succeeded somewhere
-    return None if successes == 0 else data_hash
+    return data_hash
 
 
-def put_mutable_data(fq_data_id, data_text_or_json, privatekey_hex, profile=False, blockchain_id=None, required=None, skip=None, required_exclusive=False):
+def put_mutable_data(fq_data_id, data_text_or_json, privatekey_hex, profile=False, blockchain_id=None, required=None, skip=None, required_exclusive=False,
+                     quorum=STORAGE_WRITE_QUORUM, parallel=STORAGE_PARALLEL_WRITES):
     """
     Given the unserialized data, store it into our mutable data stores.
-    Do so in a best-effort way.  This method fails if all storage providers fail,
-    or if a storage provider in required fails.
+    Do so in a best-effort way.  This method fails if a storage provider in required fails,
+    or if fewer than quorum storage providers succeed (see storage_replicate()).
 
     Return True on success
     Return False on error
@@ -776,14 +1179,14 @@ def put_mutable_data(fq_data_id, data_text_or_json, privatekey_hex, profile=Fals
     pubkey_hex = get_pubkey_hex( privatekey_hex )
     serialized_data = serialize_mutable_data(data_text_or_json, privatekey_hex, pubkey_hex, profile=profile)
     
-    successes = 0
-
     log.debug('put_mutable_data({}), required={}, skip={} required_exclusive={}'.format(fq_data_id, ','.join(required), ','.join(skip), required_exclusive))
     if BLOCKSTACK_TEST:
         log.debug("data: {}".format(serialized_data))
 
-    fail_msg = 'Failed to replicate with required storage provider "{}"'
+    def _make_write(handler):
+        return lambda: handler.put_mutable_handler(fq_data_id, serialized_data, fqu=fqu)
 
+    writes = []
     for handler in storage_handlers:
         if handler.__name__ in skip:
             log.debug("Skipping {}".format(handler.__name__))
@@ -800,33 +1203,10 @@ def put_mutable_data(fq_data_id, data_text_or_json, privatekey_hex, profile=Fals
             log.debug("Skipping non-required driver {}".format(handler.__name__))
             continue
 
-        rc = False
+        writes.append((handler.__name__, _make_write(handler)))
 
-        try:
-            log.debug('Try "{}"'.format(handler.__name__))
-            rc = handler.put_mutable_handler(fq_data_id, serialized_data, fqu=fqu)
-        except Exception as e:
-            log.exception(e)
-            if handler.__name__ not in required:
-                continue
-
-            log.error(fail_msg.format(handler.__name__))
-            return None
-
-        if rc:
-            log.debug("Replicated {} bytes with {}".format(len(serialized_data), handler.__name__))
-            successes += 1
-            continue
-
-        if handler.__name__ not in required:
-            log.debug('Failed to replicate with "{}"'.format(handler.__name__))
-            continue
-
-        log.error(fail_msg.format(handler.__name__))
-        return None
-
-    # failed everywhere or succeeded somewhere
-    return (successes > 0)
+    # failed everywhere or on a required driver, or succeeded on enough of them
+    return storage_replicate(writes, required, quorum=quorum, parallel=parallel, data_id=fq_data_id)
 
 
 def delete_immutable_data(data_hash, txid, privkey):
@@ -899,9 +1279,13 @@ def delete_mutable_data(fq_data_id, privatekey, required=None, required_exclusiv
             log.debug("Skipping non-required driver {}".format(handler.__name__))
             continue
 
+        # wait for (or supersede) any write to this data that is still in flight
+        key = (handler.__name__, fq_data_id)
+        seq = storage_write_serializer.begin(key)
+
         rc = False
         try:
-            rc = handler.delete_mutable_handler(fq_data_id, sigb64, fqu=fqu, profile=profile)
+            rc = storage_write_serializer.run(key, seq, lambda: handler.delete_mutable_handler(fq_data_id, sigb64, fqu=fqu, profile=profile))
         except Exception as e:
             log.exception(e)
             rc = False
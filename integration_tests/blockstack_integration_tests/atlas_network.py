@@ -1812,7 +1812,7 @@ if __name__ == "__main__":
         for i in xrange(0, len(zflisting)):
             assert zflisting[i]['present'] == inv_bool[i], "Present mismatch at %s: %s" % (i, zflisting[i]['zonefile_hash'])
 
-        assert inv_vec == blockstack.atlas.ZONEFILE_INV, "Inv mismatch: %s != %s" % (binascii.hexlify(inv_vec), binascii.hexlify(blockstack.atlas.ZONEFILE_INV))
+        assert inv_vec == blockstack.atlas.ZONEFILE_INV, "Inv mismatch: %s != %s" % (binascii.hexlify(inv_vec), binascii.hexlify(str(blockstack.atlas.ZONEFILE_INV)))
     
         
 
@@ -1929,7 +1929,7 @@ if __name__ == "__main__":
         peer0_expected_inv_value = peer0_expected_inv_value | (1 << (len(zonefile_hashes) - i))
 
     peer0_expected_inv = "%x" % peer0_expected_inv_value
-    peer0_zonefile_inv = binascii.hexlify( peer_table[peers[0]]['zonefile_inv'] )
+    peer0_zonefile_inv = binascii.hexlify( str(peer_table[peers[0]]['zonefile_inv']) )
     assert peer0_expected_inv == peer0_zonefile_inv, "Inv mismatch: %s != %s" % (peer0_expected_inv, peer0_zonefile_inv)
 
     # peer 2 should discover that peer 1 has the zonefiles
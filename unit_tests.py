@@ -25,12 +25,29 @@ This file is part of Blockstack-client.
 
 import os
 import sys
+import errno
 import json
+import time
+import shutil
+import tempfile
+import threading
 import unittest
 
 from blockstack_client import client
 from blockstack_client.utils import print_result as pprint
 from blockstack_client.config import BLOCKSTACKD_SERVER, BLOCKSTACKD_PORT, CONFIG_DIR
+from blockstack_client.config import get_config, get_local_device_id
+from blockstack_client.storage import StorageLatencyStats, get_storage_latency_stats, storage_read
+from blockstack_client.storage import StorageWriteSerializer, storage_write_serializer, storage_replicate
+from blockstack_client.storage import serialize_mutable_data, parse_mutable_data
+from blockstack_client import data
+from blockstack_client.data import InodeCache, make_datastore, put_datastore, datastore_get_id
+from blockstack_client.data import datastore_mkdir, datastore_putfile, datastore_getfile, datastore_listdir
+from blockstack_client.data import datastore_getfiles, datastore_stat, datastore_stat_many, datastore_rmtree
+from blockstack_client.schemas import MUTABLE_DATUM_DIR_TYPE, MUTABLE_DATUM_FILE_TYPE
+from blockstack_client.keys import VerifiedSignatureCache, get_verified_signature_cache
+from blockstack_client.keys import get_pubkey_hex, sign_raw_data, verify_raw_data
+from keylib import ECPrivateKey
 
 # start session
 if not os.path.exists( CONFIG_DIR ):
@@ -88,6 +105,486 @@ class BlockstackClientTest(unittest.TestCase):
 
         self.assertIsInstance(resp, dict, msg="Not json")
 
+
+class StorageLatencyStatsTest(unittest.TestCase):
+
+    def test_estimate(self):
+        """ Check latency estimates
+        """
+
+        stats = StorageLatencyStats(buckets=[0.1, 1.0], window=100)
+        self.assertIsNone(stats.estimate('disk'))
+
+        for i in xrange(0, 9):
+            stats.record('disk', 0.05, True)
+
+        stats.record('disk', 0.5, True)
+
+        self.assertEqual(stats.estimate('disk'), 0.1)
+        self.assertEqual(stats.estimate('disk', 1.0), 1.0)
+
+        # failures count as timeouts
+        stats.record('http', 0.01, False)
+        self.assertIsNone(stats.estimate('http'))
+
+    def test_window(self):
+        """ Check that old samples age out
+        """
+
+        stats = StorageLatencyStats(buckets=[0.1, 1.0], window=4)
+        for i in xrange(0, 4):
+            stats.record('disk', 0.5, True)
+
+        self.assertEqual(stats.get_stats()['disk'], [0, 2, 0])
+
+    def test_order(self):
+        """ Check driver order: unknown, fastest, slowest, failing
+        """
+
+        stats = StorageLatencyStats(buckets=[0.1, 1.0], window=100)
+        stats.record('slow', 0.5, True)
+        stats.record('fast', 0.05, True)
+        stats.record('broken', 0.05, False)
+
+        self.assertEqual(stats.order(['broken', 'slow', 'fast', 'new']), ['new', 'fast', 'slow', 'broken'])
+
+
+class StorageReadTest(unittest.TestCase):
+
+    def test_read(self):
+        """ Check that reads skip failing drivers
+        """
+
+        def _fail():
+            raise Exception("read failed")
+
+        attempts = [('test-read-none', lambda: None), ('test-read-error', _fail), ('test-read-ok', lambda: 'data')]
+        self.assertEqual(storage_read(attempts, hedged=False), 'data')
+        self.assertIsNone(storage_read(attempts[:2], hedged=False))
+        self.assertIsNone(storage_read([], hedged=False))
+
+    def test_read_order(self):
+        """ Check that the fastest driver is asked first
+        """
+
+        stats = get_storage_latency_stats()
+        stats.record('test-order-slow', 5.0, True)
+        stats.record('test-order-fast', 0.05, True)
+
+        called = []
+
+        def _read(driver_name):
+            called.append(driver_name)
+            return driver_name
+
+        attempts = [('test-order-slow', lambda: _read('test-order-slow')), ('test-order-fast', lambda: _read('test-order-fast'))]
+        self.assertEqual(storage_read(attempts, hedged=False), 'test-order-fast')
+        self.assertEqual(called, ['test-order-fast'])
+
+    def test_hedged_read(self):
+        """ Check that a slow driver does not hold up a hedged read
+        """
+
+        unblock = threading.Event()
+
+        def _slow():
+            unblock.wait(10)
+            return 'slow'
+
+        attempts = [('test-hedge-slow', _slow), ('test-hedge-fast', lambda: 'fast')]
+
+        try:
+            start = time.time()
+            self.assertEqual(storage_read(attempts, hedged=True), 'fast')
+            self.assertLess(time.time() - start, 5)
+
+        finally:
+            unblock.set()
+
+
+class StorageReplicateTest(unittest.TestCase):
+
+    def test_serial(self):
+        """ Check quorum and required drivers for serial writes
+        """
+
+        writes = [('test-ok', lambda: True), ('test-fail', lambda: False)]
+
+        self.assertTrue(storage_replicate(writes, [], quorum=1, parallel=False))
+        self.assertFalse(storage_replicate(writes, [], quorum=2, parallel=False))
+        self.assertFalse(storage_replicate(writes, ['test-fail'], quorum=1, parallel=False))
+        self.assertFalse(storage_replicate([], [], parallel=False))
+
+    def test_parallel(self):
+        """ Check that parallel writes return once the outcome is known
+        """
+
+        unblock = threading.Event()
+        done = threading.Event()
+
+        def _slow():
+            unblock.wait(10)
+            done.set()
+            return True
+
+        writes = [('test-slow', _slow), ('test-ok', lambda: True)]
+
+        try:
+            self.assertTrue(storage_replicate(writes, ['test-ok'], quorum=1, parallel=True))
+            self.assertFalse(done.is_set())
+
+            # a failed required write fails the whole write
+            writes = [('test-slow', _slow), ('test-fail', lambda: False)]
+            self.assertFalse(storage_replicate(writes, ['test-fail'], quorum=1, parallel=True))
+
+        finally:
+            unblock.set()
+
+    def test_superseded(self):
+        """ Check that a write that is overtaken by a newer write is dropped
+        """
+
+        serializer = StorageWriteSerializer()
+        first = serializer.begin(('disk', 'foo'))
+        second = serializer.begin(('disk', 'foo'))
+
+        written = []
+        self.assertIsNone(serializer.run(('disk', 'foo'), first, lambda: written.append(1)))
+        self.assertTrue(serializer.run(('disk', 'foo'), second, lambda: written.append(2) or True))
+
+        self.assertEqual(written, [2])
+        self.assertEqual(serializer.keys, {})
+
+    def test_data_id(self):
+        """ Check that a straggling write does not overwrite newer data
+        """
+
+        key = ('test-serial', 'foo')
+        started = threading.Event()
+        unblock = threading.Event()
+        written = []
+        results = {}
+
+        def _write(value):
+            started.set()
+            unblock.wait(10)
+            written.append(value)
+            return True
+
+        def _run(name, seq, value):
+            results[name] = storage_write_serializer.run(key, seq, lambda: _write(value))
+
+        def _replicate():
+            results['new'] = storage_replicate([('test-serial', lambda: _write('new'))], [], parallel=True, data_id='foo')
+
+        # a write is in flight, and an older write is queued behind it
+        first = threading.Thread(target=_run, args=('first', storage_write_serializer.begin(key), 'first'))
+        first.start()
+        started.wait(10)
+
+        stale = threading.Thread(target=_run, args=('stale', storage_write_serializer.begin(key), 'stale'))
+        stale.start()
+
+        new = threading.Thread(target=_replicate)
+        new.start()
+
+        try:
+            deadline = time.time() + 10
+            while storage_write_serializer.keys[key]['latest'] < 3 and time.time() < deadline:
+                time.sleep(0.01)
+
+        finally:
+            unblock.set()
+            for t in [first, stale, new]:
+                t.join()
+
+        self.assertEqual(written, ['first', 'new'])
+        self.assertTrue(results['first'])
+        self.assertIsNone(results['stale'])
+        self.assertTrue(results['new'])
+        self.assertNotIn(key, storage_write_serializer.keys)
+
+class InodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        """ Check that inodes are only used at the version they were cached at
+        """
+
+        cache = InodeCache()
+        self.assertEqual(cache.get('ds', 'uuid', 1), (None, None))
+
+        cache.put('ds', 'uuid', 1, {'idata': {}}, {'version': 1})
+        self.assertEqual(cache.get('ds', 'uuid', 1), ({'idata': {}}, {'version': 1}))
+
+        # callers get their own copies
+        inode, _ = cache.get('ds', 'uuid', 1)
+        inode['idata']['foo'] = 'bar'
+        self.assertEqual(cache.get('ds', 'uuid', 1)[0], {'idata': {}})
+
+        # newer version known; the entry is dropped
+        self.assertEqual(cache.get('ds', 'uuid', 2), (None, None))
+        self.assertEqual(cache.get('ds', 'uuid', 1), (None, None))
+        self.assertEqual(cache.size, 0)
+
+    def test_max_age(self):
+        """ Check that old entries are refetched
+        """
+
+        cache = InodeCache(max_age=-1)
+        cache.put('ds', 'uuid', 1, {}, {})
+        self.assertEqual(cache.get('ds', 'uuid', 1), (None, None))
+
+    def test_capacity(self):
+        """ Check that the least recently used inodes are evicted
+        """
+
+        entry_size = len('{"a": 1}') + len('{}')
+        cache = InodeCache(capacity=2 * entry_size)
+
+        cache.put('ds', 'a', 1, {'a': 1}, {})
+        cache.put('ds', 'b', 1, {'a': 1}, {})
+        cache.get('ds', 'a', 1)
+        cache.put('ds', 'c', 1, {'a': 1}, {})
+
+        self.assertIsNotNone(cache.get('ds', 'a', 1)[0])
+        self.assertIsNone(cache.get('ds', 'b', 1)[0])
+        self.assertIsNotNone(cache.get('ds', 'c', 1)[0])
+        self.assertEqual(cache.size, 2 * entry_size)
+
+        # too big to cache at all
+        cache.put('ds', 'd', 1, {'a': 'x' * 100}, {})
+        self.assertIsNone(cache.get('ds', 'd', 1)[0])
+        self.assertEqual(cache.size, 2 * entry_size)
+
+    def test_save_load(self):
+        """ Check that the cache survives a restart
+        """
+
+        cache = InodeCache()
+        cache.put('ds', 'a', 1, {'a': 1}, {'b': 2})
+        cache.put('ds', 'b', 3, {'c': 4}, {})
+
+        cache.path = os.path.join(self.tmpdir, 'inode_cache.json')
+        self.assertTrue(cache.save())
+        self.assertFalse(cache.dirty)
+
+        cache = InodeCache()
+        cache.path = os.path.join(self.tmpdir, 'inode_cache.json')
+        self.assertTrue(cache.load())
+        self.assertFalse(cache.dirty)
+
+        self.assertEqual(cache.get('ds', 'a', 1), ({'a': 1}, {'b': 2}))
+        self.assertEqual(cache.get('ds', 'b', 3), ({'c': 4}, {}))
+        self.assertEqual(cache.cache.keys(), [('ds', 'a'), ('ds', 'b')])
+
+        if cache.save_timer is not None:
+            cache.save_timer.cancel()
+
+
+class DatastoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.privkey_hex = ECPrivateKey().to_hex()
+        self.device_ids = [get_local_device_id(), 'unit-test-other-device']
+
+        info = make_datastore('datastore', self.privkey_hex, driver_names=['disk'], device_ids=self.device_ids)
+        res = put_datastore(info, self.privkey_hex)
+        self.assertNotIn('error', res)
+
+        self.datastore = info['datastore']
+        self.datastore_id = datastore_get_id(self.datastore['pubkey'])
+
+    def make_tree(self, dirs, files):
+        """
+        Make directories (in order) and files (mapping path to data)
+        """
+        for path in dirs:
+            self.assertNotIn('error', datastore_mkdir(self.datastore, path, self.privkey_hex))
+
+        for path in sorted(files.keys()):
+            self.assertNotIn('error', datastore_putfile(self.datastore, path, files[path], self.privkey_hex))
+
+    def test_rmtree(self):
+        """ Check that rmtree removes everything under a nested directory
+        """
+
+        self.make_tree(['/t', '/t/x', '/t/x/y', '/t/z', '/keep'],
+                       {'/t/f': 'f', '/t/x/g': 'g', '/t/x/y/h': 'h', '/t/z/i': 'i', '/keep/j': 'j'})
+
+        y_uuid = datastore_listdir(self.datastore, '/t/x')['dir']['idata']['y']['uuid']
+        h_uuid = datastore_listdir(self.datastore, '/t/x/y')['dir']['idata']['h']['uuid']
+
+        res = datastore_rmtree(self.datastore, '/t', self.privkey_hex)
+        self.assertNotIn('error', res)
+
+        # the directory itself is emptied, and its descendants are gone
+        self.assertEqual(datastore_listdir(self.datastore, '/t')['dir']['idata'], {})
+        for path in ['/t/f', '/t/x', '/t/x/g', '/t/x/y/h', '/t/z/i']:
+            self.assertEqual(datastore_stat(self.datastore, path).get('errno'), errno.ENOENT)
+
+        pubkey_hex = str(self.datastore['pubkey'])
+        for inode_uuid, inode_type in [(y_uuid, MUTABLE_DATUM_DIR_TYPE), (h_uuid, MUTABLE_DATUM_FILE_TYPE)]:
+            res = data._get_inode(self.datastore_id, inode_uuid, inode_type, pubkey_hex, ['disk'], self.device_ids)
+            self.assertIn('error', res)
+
+        # siblings are untouched
+        self.assertEqual(datastore_getfile(self.datastore, '/keep/j')['file']['idata'], 'j')
+
+    def test_getfiles(self):
+        """ Check that many files are fetched at once, including paths that share prefixes and bad paths
+        """
+
+        files = {'/s/a/f1': 'a1', '/s/a/f2': 'a2', '/s/ab/f1': 'ab1', '/s/a/b/f3': 'ab3', '/s/f1': 's1'}
+        self.make_tree(['/s', '/s/a', '/s/ab', '/s/a/b'], files)
+
+        paths = files.keys() + ['/s/a/missing', '/s/missing/f1', '/s/a/f1/x', '/s/a']
+        res = datastore_getfiles(self.datastore, paths)
+        self.assertNotIn('error', res)
+
+        for path in files.keys():
+            self.assertEqual(res['files'][path]['file']['idata'], files[path])
+            self.assertEqual(res['files'][path], datastore_getfile(self.datastore, path))
+
+        self.assertEqual(res['files']['/s/a/missing']['errno'], errno.ENOENT)
+        self.assertEqual(res['files']['/s/missing/f1']['errno'], errno.ENOENT)
+        self.assertEqual(res['files']['/s/a/f1/x']['errno'], errno.ENOTDIR)
+        self.assertEqual(res['files']['/s/a']['errno'], errno.EISDIR)
+
+    def test_stat_many(self):
+        """ Check that many paths are stat'ed at once, and agree with stat
+        """
+
+        self.make_tree(['/s', '/s/a', '/s/ab', '/s/a/b'], {'/s/a/f1': 'a1', '/s/ab/f1': 'ab1', '/s/a/b/f3': 'ab3'})
+
+        paths = ['/', '/s', '/s/a', '/s/ab', '/s/a/b', '/s/a/f1', '/s/ab/f1', '/s/a/b/f3']
+        res = datastore_stat_many(self.datastore, paths + ['/s/a/missing', '/s/a/f1/x'])
+        self.assertNotIn('error', res)
+
+        for path in paths:
+            self.assertEqual(res['inodes'][path]['inode']['uuid'], datastore_stat(self.datastore, path)['inode']['uuid'])
+
+        self.assertEqual(res['inodes']['/s/a']['inode']['type'], MUTABLE_DATUM_DIR_TYPE)
+        self.assertEqual(res['inodes']['/s/a/f1']['inode']['type'], MUTABLE_DATUM_FILE_TYPE)
+        self.assertEqual(res['inodes']['/s/a/missing']['errno'], errno.ENOENT)
+        self.assertEqual(res['inodes']['/s/a/f1/x']['errno'], errno.ENOTDIR)
+
+    def test_remote_update(self):
+        """ Check that a cached directory is refetched once another device changes it
+        """
+
+        self.assertNotIn('error', datastore_mkdir(self.datastore, '/a', self.privkey_hex))
+        self.assertNotIn('error', datastore_putfile(self.datastore, '/a/f1', 'hello', self.privkey_hex))
+
+        res = datastore_listdir(self.datastore, '/a')
+        self.assertEqual(res['dir']['idata'].keys(), ['f1'])
+
+        # remember what this device knows about /a
+        a_uuid = datastore_listdir(self.datastore, '/')['dir']['idata']['a']['uuid']
+        inode_id = '{}.{}'.format(self.datastore_id, a_uuid)
+        hdr_id = '{}.{}.hdr'.format(self.datastore_id, a_uuid)
+
+        version = data._get_inode_local_version(self.datastore_id, a_uuid, self.device_ids)['version']
+        inode_version = data._get_mutable_data_versions(inode_id, self.device_ids)['version']
+        hdr_version = data._get_mutable_data_versions(hdr_id, self.device_ids)['version']
+
+        stale_inode, stale_hdr = data.DIR_CACHE.get(self.datastore_id, a_uuid, version)
+        self.assertIsNotNone(stale_inode)
+
+        # "another device" adds a file to /a
+        self.assertNotIn('error', datastore_putfile(self.datastore, '/a/f2', 'world', self.privkey_hex))
+
+        # ...which this device did not see
+        conf = get_config()
+        for device_id in self.device_ids:
+            data.store_mutable_data_version(conf, device_id, inode_id, inode_version)
+            data.store_mutable_data_version(conf, device_id, hdr_id, hdr_version)
+
+        data.DIR_CACHE.put(self.datastore_id, a_uuid, version, stale_inode, stale_hdr)
+
+        res = datastore_getfile(self.datastore, '/a/f2')
+        self.assertNotIn('error', res)
+        self.assertEqual(res['file']['idata'], 'world')
+
+        res = datastore_listdir(self.datastore, '/a')
+        self.assertEqual(sorted(res['dir']['idata'].keys()), ['f1', 'f2'])
+
+
+class VerifiedSignatureCacheTest(unittest.TestCase):
+
+    def test_get_put(self):
+        """ Check that the least recently used signatures are evicted
+        """
+
+        cache = VerifiedSignatureCache(capacity=2)
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a')
+        cache.put('b', 'value')
+        cache.get('a')
+        cache.put('c')
+
+        self.assertTrue(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertTrue(cache.get('c'))
+
+        cache.put('c', 'value')
+        self.assertEqual(cache.get('c'), 'value')
+        self.assertEqual(len(cache.cache), 2)
+
+    def test_verify(self):
+        """ Check that only valid signatures are remembered
+        """
+
+        privkey_hex = ECPrivateKey().to_hex()
+        pubkey_hex = get_pubkey_hex(privkey_hex)
+        sigb64 = sign_raw_data('hello world', privkey_hex)
+
+        cache = get_verified_signature_cache()
+        num_verified = len(cache.cache)
+
+        self.assertFalse(verify_raw_data('hello world!', pubkey_hex, sigb64))
+        self.assertEqual(len(cache.cache), num_verified)
+
+        self.assertTrue(verify_raw_data('hello world', pubkey_hex, sigb64))
+        self.assertEqual(len(cache.cache), num_verified + 1)
+
+        # cached
+        self.assertTrue(verify_raw_data('hello world', pubkey_hex, sigb64))
+        self.assertFalse(verify_raw_data('hello world!', pubkey_hex, sigb64))
+
+    def test_profile_tokens(self):
+        """ Check that verified profiles are remembered by token position, not by content
+        """
+
+        privkey_hex = ECPrivateKey().to_hex()
+        pubkey_hex = get_pubkey_hex(privkey_hex)
+        profile = {'name': 'test', 'bio': 'x' * 10000}
+        profile_txt = serialize_mutable_data(profile, privkey_hex, pubkey_hex, profile=True)
+
+        cache = get_verified_signature_cache()
+        num_verified = len(cache.cache)
+
+        self.assertEqual(parse_mutable_data(profile_txt, pubkey_hex), profile)
+        self.assertEqual(len(cache.cache), num_verified + 1)
+        self.assertIn((0,), cache.cache.values())
+
+        # cached, and callers get their own copies
+        parsed = parse_mutable_data(profile_txt, pubkey_hex)
+        self.assertEqual(parsed, profile)
+        parsed['name'] = 'modified'
+        self.assertEqual(parse_mutable_data(profile_txt, pubkey_hex), profile)
+
+        # wrong key
+        other_pubkey_hex = get_pubkey_hex(ECPrivateKey().to_hex())
+        self.assertIsNone(parse_mutable_data(profile_txt, other_pubkey_hex))
+
+
 if __name__ == '__main__':
 
     unittest.main()